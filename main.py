@@ -3,9 +3,13 @@
 
 import argparse
 import signal
+import sys
 import time
 
+from src import latency
+from src.exchange.websocket_runtime import WebsocketRuntime
 from src.factory import BotFactory
+from src.supervisor import Supervisor
 from src.config import config as conf
 
 if __name__ == "__main__":
@@ -22,6 +26,9 @@ if __name__ == "__main__":
     parser.add_argument("--strategy", type=str, default="Doten", help="Trading strategy.")
     parser.add_argument("--session", type=str, default=None, help="Session ID.")
     parser.add_argument("--profile", type=str, default=None, help="Configuration profile name.")
+    parser.add_argument("--supervisor", default=False, action="store_true", help="Run the bots of the config in one process.")
+    parser.add_argument("--latency", type=int, default=0, nargs="?", const=60,
+                        help="Record the latency of the trading stages, dumped on SIGUSR1 and exported every N seconds.")
     args = parser.parse_args()
 
     if args.profile and args.profile in conf["args_profile"]:
@@ -32,6 +39,24 @@ if __name__ == "__main__":
 
     conf["args"] = args
 
+    if args.latency and not args.test:
+        latency.enabled = True
+        signal.signal(signal.SIGUSR1, lambda signum, frame: latency.dump())
+        WebsocketRuntime.shared().call_every(args.latency, lambda: latency.export({"account": args.account}),
+                                             blocking=True)
+
+    if args.supervisor:
+        # run every bot of the config, missing bot args take the command line values
+        supervisor = Supervisor(conf["bots"], defaults=args)
+        supervisor.start()
+
+        def term(signum, frame):
+            supervisor.stop()
+            sys.exit(0)
+        signal.signal(signal.SIGINT, term)
+        while True:
+            time.sleep(1)
+
     # create the bot instance
     bot = BotFactory.create(args)
     # run the instance
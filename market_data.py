@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# coding: UTF-8
+
+import argparse
+import signal
+import sys
+import time
+
+from src import logger
+from src.exchange.binance_futures.binance_futures_market_data import BinanceFuturesMarketData
+
+if __name__ == "__main__":
+    # Parse command line arguments.
+    parser = argparse.ArgumentParser(description="Publishes market data to the bots of this machine "
+                                                 "(enable market_data_bus in exchange_config.py)")
+    parser.add_argument("--demo", default=False, action="store_true", help="Use testnet streams.")
+    parser.add_argument("--exchange", type=str, default="binance", help="Exchange name.")
+    parser.add_argument("--pairs", type=str, default="BTCUSDT", help="Comma separated trading pairs.")
+    parser.add_argument("--timeframes", type=str, default="1m", help="Comma separated kline timeframes.")
+    parser.add_argument("--capacity", type=int, default=1440, help="Candles kept by timeframe.")
+    args = parser.parse_args()
+
+    if args.exchange != "binance":
+        logger.info(f"Market data is only published for binance")
+        sys.exit(1)
+
+    publishers = [BinanceFuturesMarketData(pair, args.timeframes.split(","), testnet=args.demo, capacity=args.capacity)
+                  for pair in args.pairs.split(",")]
+    logger.info(f"Publishing market data : {args.pairs} {args.timeframes}")
+
+    # the shared memory is removed on stop
+    def term(signum, frame):
+        for publisher in publishers:
+            publisher.close()
+        time.sleep(1)
+        sys.exit(0)
+    signal.signal(signal.SIGINT, term)
+    signal.signal(signal.SIGTERM, term)
+    while True:
+        time.sleep(1)
@@ -1,17 +1,26 @@
 # coding: UTF-8
 
+import atexit
 import base64
+import copy
+import json
 import logging
 import os, tempfile
+import random
 import time
 import uuid
+from collections import deque, namedtuple, OrderedDict
 import threading
+import datetime
+import itertools
 from datetime import timedelta
 
 import numpy as np
 import pandas as pd
 from pandas import Series
 import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
 from bravado.exception import HTTPError
 #Install discord_webhook module 
 from discord_webhook import DiscordWebhook, DiscordEmbed
@@ -29,6 +38,13 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# orjson parses websocket frames several times faster than the standard library when installed
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
 
 status_codes = [400, 401, 402, 403, 404, 429]
 
@@ -119,6 +135,185 @@ class RepeatedTimer(object):
     self.is_running = False
 
 
+class Heartbeat:
+    """
+    Sends healthchecks.io pings from its own daemon thread.
+    Websocket and listen key threads only signal liveness through beat(),
+    which never does network I/O; the worker pings a check every interval (+- jitter) seconds
+    if it got a beat since the previous ping, so a silent stream makes the check go down.
+    """
+
+    def __init__(self, urls, interval=60, timeout=10, jitter=5):
+        """
+        :param urls: healthchecks.io ping url of every check, checks without url are ignored
+        :param interval: seconds between two pings of a check
+        :param timeout: seconds a ping may take
+        :param jitter: random seconds added or removed from the interval
+        """
+        self.urls = {name: url for name, url in urls.items() if url}
+        self.interval = interval
+        self.timeout = timeout
+        self.jitter = jitter
+        # Number of pings sent and failed
+        self.pings = 0
+        self.failures = 0
+        self.__beats = {}
+        self.__pinged = {}
+        self.__stop = threading.Event()
+        self.__lock = threading.Lock()
+        self.__thread = None
+
+    def beat(self, name):
+        """
+        signal that the check is alive, cheap enough for every websocket message
+        :param name: name of the check
+        """
+        self.__beats[name] = time.time()
+        if self.__thread is None and name in self.urls and not self.__stop.is_set():
+            self.start()
+
+    def start(self):
+        with self.__lock:
+            if self.__thread is not None:
+                return
+            self.__stop.clear()
+            self.__thread = threading.Thread(target=self.__run, name="heartbeat")
+            self.__thread.daemon = True
+            self.__thread.start()
+
+    def stop(self):
+        self.__stop.set()
+        with self.__lock:
+            self.__thread = None
+
+    def __run(self):
+        stop = self.__stop
+        while True:
+            self.ping()
+            if stop.wait(max(self.interval + random.uniform(-self.jitter, self.jitter), 0)):
+                return
+
+    def ping(self):
+        """
+        ping every check that got a beat since its previous ping
+        """
+        for name, url in self.urls.items():
+            beat = self.__beats.get(name)
+            if beat is None or beat <= self.__pinged.get(name, 0):
+                continue
+            try:
+                requests.get(url, timeout=self.timeout)
+                self.__pinged[name] = beat
+                self.pings += 1
+            except Exception as e:
+                self.failures += 1
+                logger.warning(f"Heartbeat {name} failed: {e}")
+
+
+class StrategyExecutor:
+    """
+    Runs strategy evaluations on a dedicated worker thread, so a slow strategy never delays
+    the websocket thread that applies order, position and price updates.
+    Jobs are keyed (by timeframe), a job that is submitted while an older job of the same key
+    is still waiting replaces it, so the strategy skips stale candles instead of falling behind.
+    """
+
+    def __init__(self, name="strategy"):
+        self.name = name
+        # Seconds the last job waited in the queue, the longest wait, and job counts
+        self.lag = 0
+        self.max_lag = 0
+        self.executed = 0
+        self.coalesced = 0
+        self.__pending = {}
+        # keys of the jobs that are never replaced
+        self.__calls = itertools.count()
+        self.__condition = threading.Condition()
+        self.__thread = None
+        self.__running = False
+        self.__stopped = False
+
+    def submit(self, key, func, *args):
+        """
+        queue func(*args), replacing a waiting job with the same key
+        """
+        with self.__condition:
+            if self.__stopped:
+                return
+            if self.__pending.pop(key, None) is not None:
+                self.coalesced += 1
+                logger.warning(f"Strategy is falling behind, skipped a stale {key} evaluation")
+            self.__pending[key] = (time.time(), func, args)
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run, name=self.name)
+                self.__thread.daemon = True
+                self.__thread.start()
+            self.__condition.notify()
+
+    def call(self, func, *args):
+        """
+        queue func(*args) behind the waiting jobs, it is never replaced, e.g. an order callback
+        """
+        self.submit(("call", next(self.__calls)), func, *args)
+
+    def metrics(self):
+        """
+        queue lag in seconds and job counts
+        """
+        with self.__condition:
+            return {
+                "lag": self.lag,
+                "max_lag": self.max_lag,
+                "pending": len(self.__pending),
+                "running": self.__running,
+                "executed": self.executed,
+                "coalesced": self.coalesced
+            }
+
+    def join(self, timeout=None):
+        """
+        wait until every queued job ran
+        :return: True if the queue is empty
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.__condition:
+            while self.__pending or self.__running:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.__condition.wait(remaining)
+        return True
+
+    def stop(self):
+        with self.__condition:
+            self.__stopped = True
+            self.__pending.clear()
+            self.__condition.notify_all()
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                while not self.__pending and not self.__stopped:
+                    self.__condition.wait()
+                if self.__stopped:
+                    return
+                # oldest job first
+                key = next(iter(self.__pending))
+                submitted, func, args = self.__pending.pop(key)
+                self.lag = time.time() - submitted
+                self.max_lag = max(self.max_lag, self.lag)
+                self.__running = True
+            try:
+                func(*args)
+            except Exception as e:
+                logger.error(f"Strategy executor error. {e}")
+            finally:
+                with self.__condition:
+                    self.executed += 1
+                    self.__running = False
+                    self.__condition.notify_all()
+
+
 # https://stackoverflow.com/questions/3041986/apt-command-line-interface-like-yes-no-input
 def query_yes_no(question, default="yes"):
     """Ask a yes/no question via raw_input() and return their answer.
@@ -194,6 +389,239 @@ class FatalError(Exception):
     pass
 
 
+# REST clients of the process, see shared_client
+shared_clients = {}
+shared_clients_lock = threading.Lock()
+
+
+def shared_client(key, create):
+    """
+    REST client shared by every exchange instance of the process with the same key,
+    so bots trading several pairs of one account reuse one client and its connection pool
+    :param key: hashable client key (e.g. exchange, api key and testnet)
+    :param create: function creating the client on first use
+    :return: client
+    """
+    with shared_clients_lock:
+        if key not in shared_clients:
+            shared_clients[key] = create()
+        return shared_clients[key]
+
+
+class RateLimiter:
+    """
+    Request weight budget of an account over a window, shared by every client and bot using the account.
+    Order placement and cancels may use a larger share of the limit than queries,
+    so near the limit the queries wait (or give up after a timeout) while the orders still go through,
+    instead of every call sleeping for minutes on the caller's thread.
+    The used weight follows the count the server reports (e.g. X-MBX-USED-WEIGHT-1M),
+    which also includes the other processes using the same key.
+    """
+
+    # Priorities, lower first
+    ORDER = 0
+    QUERY = 1
+
+    def __init__(self, limit, window=60, shares=None):
+        """
+        :param limit: weight allowed per window
+        :param window: seconds
+        :param shares: share of the limit usable by priority, {ORDER: 0.95, QUERY: 0.8} by default
+        """
+        self.limit = limit
+        self.window = window
+        self.shares = shares or {self.ORDER: 0.95, self.QUERY: 0.8}
+        self.condition = threading.Condition()
+        # (time, weight) of the requests of the window
+        self.history = deque()
+        self.local_used = 0
+        # Weight reported by the server and weight sent since the report
+        self.server_used = 0
+        self.server_time = 0
+        self.sent_since_report = 0
+        # No request before this time (e.g. after HTTP 429)
+        self.blocked_until = 0
+        self.waiting = {priority: 0 for priority in self.shares}
+        # Number of requests that waited and that gave up
+        self.waits = 0
+        self.rejected = 0
+
+    def __expire(self, now):
+        while self.history and self.history[0][0] <= now - self.window:
+            self.local_used -= self.history.popleft()[1]
+
+    def used(self, now=None):
+        """
+        weight used in the current window
+        """
+        now = time.time() if now is None else now
+        self.__expire(now)
+        if int(self.server_time // self.window) == int(now // self.window):
+            return max(self.local_used, self.server_used + self.sent_since_report)
+        return self.local_used
+
+    def __wait_time(self, now):
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        # until the oldest request leaves the window or the server window restarts
+        oldest = self.history[0][0] + self.window - now if self.history else self.window
+        return max(min(oldest, self.window - now % self.window, 1), 0.01)
+
+    def __fits(self, now, weight, priority):
+        higher_waiting = any(n > 0 for p, n in self.waiting.items() if p < priority)
+        budget = self.limit * self.shares[priority]
+        return now >= self.blocked_until and not higher_waiting and self.used(now) + min(weight, budget) <= budget
+
+    def available(self, weight=1, priority=QUERY):
+        """
+        whether a request would go through now without waiting
+        """
+        with self.condition:
+            return self.__fits(time.time(), weight, priority)
+
+    def acquire(self, weight=1, priority=QUERY, timeout=None):
+        """
+        wait until the request fits in the budget of its priority
+        :param weight: request weight
+        :param priority: RateLimiter.ORDER or RateLimiter.QUERY
+        :param timeout: seconds to wait at most, None waits as long as needed
+        :return: False if the timeout expired, at once when blocked for longer than the timeout
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        weight = min(weight, self.limit * self.shares[priority])
+        waited = False
+        with self.condition:
+            self.waiting[priority] += 1
+            try:
+                while True:
+                    now = time.time()
+                    if self.__fits(now, weight, priority):
+                        self.history.append((now, weight))
+                        self.local_used += weight
+                        self.sent_since_report += weight
+                        return True
+                    if deadline is not None and (now >= deadline or self.blocked_until > deadline):
+                        self.rejected += 1
+                        return False
+                    if not waited:
+                        waited = True
+                        self.waits += 1
+                    wait = self.__wait_time(now)
+                    self.condition.wait(wait if deadline is None else min(wait, deadline - now))
+            finally:
+                self.waiting[priority] -= 1
+                self.condition.notify_all()
+
+    def update(self, used):
+        """
+        weight used in the current window according to the server
+        """
+        with self.condition:
+            self.server_used = used
+            self.server_time = time.time()
+            self.sent_since_report = 0
+            self.condition.notify_all()
+
+    def block(self, seconds):
+        """
+        no request for some seconds, e.g. after HTTP 429 or 418 with Retry-After
+        """
+        with self.condition:
+            self.blocked_until = max(self.blocked_until, time.time() + seconds)
+            logger.warning(f"Rate limit exceeded, requests blocked for {seconds}s")
+
+    def metrics(self):
+        with self.condition:
+            return {"used": self.used(), "limit": self.limit, "waits": self.waits, "rejected": self.rejected}
+
+
+def order_request_weight(request):
+    """
+    weight 1, order placement, amends and cancels first
+    :param request: requests.PreparedRequest
+    :return: (weight, priority)
+    """
+    is_order = request.method != "GET" and "order" in urlparse(request.url).path.lower()
+    return 1, RateLimiter.ORDER if is_order else RateLimiter.QUERY
+
+
+class RateLimitTimeout(requests.exceptions.ConnectTimeout):
+    """
+    a request that was not sent because the rate limit budget did not free up in time,
+    retryable as the server never saw it
+    """
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    """
+    requests transport adapter taking every request through a RateLimiter
+    and blocking it for Retry-After when the server answers 429 or 418.
+    A request waits for the budget at most as long as its own timeout,
+    the Retry-After wait is the limiter's, urllib3 does not sleep it on the caller's thread.
+    """
+
+    def __init__(self, limiter, weight=order_request_weight, usage=None, max_wait=30, **kwargs):
+        """
+        :param limiter: RateLimiter
+        :param weight: function(request) returning (weight, priority)
+        :param usage: function(limiter, response) updating the limiter from the response headers
+        :param max_wait: seconds a request without a timeout waits for the budget at most
+        """
+        super().__init__(**kwargs)
+        self.max_retries = self.max_retries.new(respect_retry_after_header=False)
+        self.limiter = limiter
+        self.weight = weight
+        self.usage = usage
+        self.max_wait = max_wait
+
+    def wait_timeout(self, timeout):
+        """
+        seconds a request may wait for the budget, the connect timeout of a (connect, read) timeout
+        """
+        if isinstance(timeout, tuple):
+            timeout = timeout[0]
+        return self.max_wait if timeout is None else min(timeout, self.max_wait)
+
+    def send(self, request, **kwargs):
+        weight, priority = self.weight(request)
+        from src.exchange.websocket_runtime import WebsocketRuntime
+        runtime = WebsocketRuntime.instance
+        if runtime is not None and runtime.in_loop() and not self.limiter.available(weight, priority):
+            logger.warning(f"Rate limited request {request.method} {request.url} waits on the websocket loop")
+        timeout = self.wait_timeout(kwargs.get("timeout"))
+        if not self.limiter.acquire(weight, priority, timeout=timeout):
+            raise RateLimitTimeout(f"Rate limit budget not available within {timeout}s", request=request)
+        response = super().send(request, **kwargs)
+        if self.usage is not None:
+            self.usage(self.limiter, response)
+        if response.status_code in (418, 429):
+            self.limiter.block(float(response.headers.get("Retry-After", 60)))
+        return response
+
+
+def rate_limited(session, limiter, **kwargs):
+    """
+    send the requests of a requests.Session through a RateLimiter
+    :param kwargs: RateLimitedAdapter arguments
+    :return: session
+    """
+    adapter = RateLimitedAdapter(limiter, **kwargs)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def default_account():
+    """
+    account of the command line, None without one or with --supervisor as every bot has its own
+    """
+    try:
+        args = conf["args"]
+        return None if getattr(args, "supervisor", False) else args.account
+    except Exception:
+        return None
+
+
 def sync_obj_with_config(config, obj, instance=None):
     """
     Synchronizes the attributes of an object with a dictionary of configuration values.
@@ -279,6 +707,32 @@ def to_data_frame(data):
     return data_frame
 
 
+# Candle decoded from a websocket kline frame, the fields after the timestamp are in OhlcvBuffer.columns order
+Kline = namedtuple("Kline", ["timestamp", "open", "high", "low", "close", "volume"])
+
+
+def kline_timestamp(milliseconds, ceil=False):
+    """
+    UTC timestamp of an epoch in milliseconds
+    :param milliseconds: epoch in milliseconds
+    :param ceil: round up to the next full minute, e.g. kline close times like 16:04:59.999
+    """
+    value = int(milliseconds) * 1000000
+    if ceil:
+        value = -(-value // 60000000000) * 60000000000
+    return pd.Timestamp(value, tz='UTC')
+
+
+def klines_to_data_frame(klines):
+    """
+    convert Kline records to the same DataFrame to_data_frame() builds,
+    only meant for consumers that really need a DataFrame
+    """
+    data_frame = pd.DataFrame.from_records(klines, columns=Kline._fields, index="timestamp")
+    data_frame.index = pd.DatetimeIndex(data_frame.index, tz='UTC', name="timestamp")
+    return data_frame[["high", "low", "open", "close", "volume"]]
+
+
 def resample(data_frame, bin_size, minute_granularity=False, label="right", closed="right"):      
     resample_time = allowed_range_minute_granularity[bin_size][1] \
                     if minute_granularity else allowed_range[bin_size][1]
@@ -291,27 +745,460 @@ def resample(data_frame, bin_size, minute_granularity=False, label="right", clos
     })   
 
 
-def retry(func, count=5):
+class CandleAggregator:
+    """
+    Builds the candles of a timeframe incrementally from a feed of lower timeframe candles.
+    Feeding the rows of a DataFrame one by one gives the same candles as
+    resample(data_frame, bin_size, minute_granularity) (label="right", closed="right"),
+    except that candles without any data are skipped instead of being NaN.
+    Every update is O(1).
+    """
+
+    def __init__(self, bin_size, minute_granularity=False, origin=None):
+        """
+        :param bin_size: time frame of the candles
+        :param minute_granularity: use the minute granularity resample rule
+        :param origin: any timestamp on the candle grid, by default midnight of the first day fed like resample does
+        """
+        resample_time = allowed_range_minute_granularity[bin_size][1] \
+                        if minute_granularity else allowed_range[bin_size][1]
+        self.period = pd.Timedelta(resample_time).value
+        self.origin = None if origin is None else pd.Timestamp(origin).value
+        # Incomplete candle [open, high, low, close, volume] and its timestamp
+        self.partial = None
+        self.partial_time = None
+        self.__partial_label = None
+        # The partial candle without the feed candle that is still being updated
+        self.__base = None
+        self.__sub_time = None
+        # Feed candles up to this candle are ignored after a reset
+        self.__closed_label = None
+
+    def label(self, timestamp):
+        """
+        timestamp of the candle the given time belongs to (right edge, right closed)
+        """
+        return pd.Timestamp(self.__label(pd.Timestamp(timestamp).value), tz='UTC')
+
+    def __label(self, value):
+        if self.origin is None:
+            self.origin = value - value % (24 * 60 * 60 * 10**9)
+        # ceil((value - origin) / period) periods after the origin
+        return self.origin - (self.origin - value) // self.period * self.period
+
+    def seed(self, timestamp, candle):
+        """
+        start from an incomplete candle, e.g. the last one fetched through REST
+        :param timestamp: timestamp of the candle
+        :param candle: [open, high, low, close, volume]
+        """
+        self.partial_time = pd.Timestamp(timestamp)
+        self.__partial_label = self.partial_time.value
+        self.partial = np.array(candle, dtype=float)
+        self.__base = self.partial.copy()
+        self.__sub_time = None
+        if self.origin is None:
+            self.origin = self.__partial_label
+
+    def reset(self, closed_time):
+        """
+        drop the partial candle, e.g. when it was replaced by a closed candle fetched through REST
+        :param closed_time: timestamp of the last closed candle, older feed candles are ignored
+        """
+        self.partial = self.partial_time = self.__partial_label = None
+        self.__base = self.__sub_time = None
+        self.__closed_label = pd.Timestamp(closed_time).value
+
+    def update(self, timestamp, candle):
+        """
+        fold a candle of the feed into the partial candle,
+        updates of the same feed candle (same timestamp) replace each other
+        :param timestamp: timestamp of the feed candle
+        :param candle: [open, high, low, close, volume]
+        :return: (timestamp, candle) of the candle closed by this update, or None
+        """
+        sub_time = pd.Timestamp(timestamp).value
+        label = self.__label(sub_time)
+        closed = None
+
+        if self.__partial_label is None and self.__closed_label is not None and label <= self.__closed_label:
+            return closed
+        if self.__partial_label is not None:
+            if label < self.__partial_label:
+                return closed
+            if label > self.__partial_label:
+                if not np.isnan(self.partial).all():
+                    closed = (self.partial_time, self.partial)
+                self.__partial_label, self.__base = None, None
+            elif sub_time != self.__sub_time:
+                self.__base = self.partial.copy()
+
+        if self.__partial_label is None:
+            self.__partial_label = label
+            self.partial_time = pd.Timestamp(label, tz='UTC')
+
+        self.__sub_time = sub_time
+        if self.__base is None:
+            self.partial = np.array(candle, dtype=float)
+        else:
+            self.partial = self.__combine(self.__base, candle)
+        return closed
+
+    @staticmethod
+    def __combine(base, candle):
+        """
+        aggregate two consecutive candles, skipping NaN the way resample does
+        """
+        open, high, low, close, volume = candle
+        return np.array([
+            base[0] if base[0] == base[0] else open,
+            base[1] if high != high or high <= base[1] else high,
+            base[2] if low != low or low >= base[2] else low,
+            close if close == close else base[3],
+            (base[4] if base[4] == base[4] else 0) + (volume if volume == volume else 0)
+        ])
+
+
+class OhlcvBuffer:
+    """
+    Fixed-capacity ring buffer of the closed candles of one timeframe, 
+    fed through a CandleAggregator that keeps the partial candle.
+    Every value is written twice (at i and i + capacity), so the latest candles are always
+    one contiguous slice and the strategy gets read-only views instead of copies.
+    The views are only valid until the next candle closes.
+    """
+    columns = ["open", "high", "low", "close", "volume"]
+
+    def __init__(self, capacity, aggregator):
+        self.capacity = capacity
+        # Number of closed candles appended so far
+        self.count = 0
+        self.__timestamps = np.zeros(2 * capacity, dtype="int64")
+        self.__data = np.zeros((len(self.columns), 2 * capacity))
+        # Builds the candles of this timeframe from the feed
+        self.aggregator = aggregator
+        # Identity of the buffer, shared by its snapshots
+        self.key = object()
+
+    @classmethod
+    def from_data_frame(cls, data_frame, capacity, bin_size, minute_granularity=False, partial=True):
+        """
+        create a buffer from resampled OHLCV data
+        :param data_frame: candles indexed by timestamp
+        :param capacity: number of closed candles to keep
+        :param bin_size: time frame of the candles
+        :param minute_granularity: the feed consists of minute candles
+        :param partial: whether the last candle is incomplete
+        """
+        buffer = cls(capacity, CandleAggregator(bin_size, minute_granularity, origin=data_frame.index[-1]))
+        data = data_frame[cls.columns].to_numpy(dtype=float)
+        closed = len(data) - 1 if partial else len(data)
+        for timestamp, candle in zip(data_frame.index[max(closed - capacity, 0):closed], data[max(closed - capacity, 0):closed]):
+            buffer.append(timestamp, candle)
+        if partial and len(data) > 0:
+            buffer.aggregator.seed(data_frame.index[-1], data[-1])
+        return buffer
+
+    def merge(self, data_frame, partial=True):
+        """
+        merge resampled OHLCV data fetched through REST, e.g. the candles missed while the websocket
+        was disconnected: the candles after the last closed one are appended in order,
+        the ones already in the buffer are skipped and the partial candle is replaced
+        :param data_frame: candles indexed by timestamp
+        :param partial: whether the last candle is incomplete
+        :return: number of candles appended
+        """
+        last = self.last_timestamp
+        data = data_frame[self.columns].to_numpy(dtype=float)
+        closed = len(data) - 1 if partial else len(data)
+        appended = 0
+        for timestamp, candle in zip(data_frame.index[:closed], data[:closed]):
+            if last is None or timestamp > last:
+                self.append(timestamp, candle)
+                last = timestamp
+                appended += 1
+        if partial and len(data) > 0 and (last is None or data_frame.index[-1] > last):
+            self.aggregator.seed(data_frame.index[-1], data[-1])
+        elif self.aggregator.partial_time is not None and last is not None and self.aggregator.partial_time <= last:
+            self.aggregator.reset(last)
+        return appended
+
+    def snapshot(self):
+        """
+        copy of the buffer the feed does not change, for a reader on another thread
+        """
+        key, self.key = self.key, None
+        try:
+            snapshot = copy.deepcopy(self)
+        finally:
+            self.key = key
+        snapshot.key = key
+        return snapshot
+
+    @property
+    def partial(self):
+        """
+        incomplete candle [open, high, low, close, volume]
+        """
+        return self.aggregator.partial
+
+    @property
+    def partial_time(self):
+        return self.aggregator.partial_time
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, timestamp, candle):
+        """
+        append a closed candle
+        :param timestamp: timestamp of the candle
+        :param candle: [open, high, low, close, volume]
+        """
+        i = self.count % self.capacity
+        self.__timestamps[i] = self.__timestamps[i + self.capacity] = pd.Timestamp(timestamp).value
+        self.__data[:, i] = self.__data[:, i + self.capacity] = candle
+        self.count += 1
+
+    def update(self, timestamp, candle):
+        """
+        feed a candle, the partial candle is moved to the closed candles once the feed reaches the next candle
+        :param timestamp: timestamp of the feed candle
+        :param candle: [open, high, low, close, volume], updates of the same feed candle replace each other
+        :return: True if a candle was closed
+        """
+        closed = self.aggregator.update(timestamp, candle)
+        if closed is not None:
+            self.append(*closed)
+        return closed is not None
+
+    def __view(self, data):
+        n = len(self)
+        start = (self.count - n) % self.capacity if self.count > self.capacity else 0
+        view = data[start:start + n]
+        view.flags.writeable = False
+        return view
+
+    @property
+    def open(self):
+        return self.__view(self.__data[0])
+
+    @property
+    def high(self):
+        return self.__view(self.__data[1])
+
+    @property
+    def low(self):
+        return self.__view(self.__data[2])
+
+    @property
+    def close(self):
+        return self.__view(self.__data[3])
+
+    @property
+    def volume(self):
+        return self.__view(self.__data[4])
+
+    @property
+    def timestamps(self):
+        return pd.DatetimeIndex(self.__view(self.__timestamps)).tz_localize('UTC')
+
+    @property
+    def last_timestamp(self):
+        """
+        timestamp of the last closed candle
+        """
+        if self.count == 0:
+            return None
+        return pd.Timestamp(self.__timestamps[(self.count - 1) % self.capacity], tz='UTC')
+
+    @property
+    def last_candle(self):
+        """
+        last closed candle [open, high, low, close, volume]
+        """
+        if self.count == 0:
+            return None
+        return self.__data[:, (self.count - 1) % self.capacity].copy()
+
+    def to_data_frame(self, partial=False):
+        """
+        closed candles, and the partial candle if requested, as a DataFrame
+        """
+        data_frame = pd.DataFrame({c: self.__view(self.__data[i]) for i, c in enumerate(self.columns)},
+                                  index=self.timestamps)
+        if partial and self.partial is not None:
+            data_frame.loc[self.partial_time] = self.partial
+        data_frame.index.name = "timestamp"
+        return data_frame
+
+
+class ResampleCache:
+    """
+    Candles of a higher timeframe kept up to date from the OhlcvBuffer of a lower timeframe,
+    so repeated security() calls only fold in the candles closed since the previous call
+    instead of resampling the whole buffer every time.
+    Like resample(buffer.to_data_frame(partial=True), bin_size)[:-1], the candle
+    the partial candle of the feed belongs to is never returned.
+    """
+
+    def __init__(self, bin_size, capacity, minute_granularity=False):
+        """
+        :param bin_size: time frame of the candles
+        :param capacity: number of closed candles to keep
+        :param minute_granularity: use the minute granularity resample rule
+        """
+        self.bin_size = bin_size
+        self.capacity = capacity
+        self.minute_granularity = minute_granularity
+        self.buffer = None
+        # key of the source buffer
+        self.__source = None
+        # Closed candles of the source that were already folded in
+        self.__fed = 0
+        self.__data_frame = None
+        self.__data_frame_count = None
+
+    def __reset(self, source):
+        self.buffer = OhlcvBuffer(self.capacity, CandleAggregator(self.bin_size, self.minute_granularity))
+        self.__source = source.key
+        self.__fed = source.count - len(source)
+        self.__data_frame = None
+
+    def update(self, source):
+        """
+        fold the candles of the source that arrived since the last call
+        :param source: OhlcvBuffer of the lower timeframe or a snapshot of it
+        """
+        if self.__source is not source.key or not 0 <= source.count - self.__fed <= len(source):
+            self.__reset(source)
+
+        new = source.count - self.__fed
+        if new > 0:
+            timestamps = source.timestamps[-new:]
+            candles = np.column_stack([source.open[-new:], source.high[-new:], source.low[-new:],
+                                       source.close[-new:], source.volume[-new:]])
+            for timestamp, candle in zip(timestamps, candles):
+                self.buffer.update(timestamp, candle)
+            self.__fed = source.count
+        if source.partial is not None:
+            self.buffer.update(source.partial_time, source.partial)
+
+    def data_frame(self, source):
+        """
+        closed candles of the higher timeframe as a DataFrame, rebuilt only when a candle closes
+        :param source: OhlcvBuffer of the lower timeframe
+        """
+        self.update(source)
+        if self.__data_frame is None or self.__data_frame_count != self.buffer.count:
+            self.__data_frame = self.buffer.to_data_frame()
+            self.__data_frame_count = self.buffer.count
+        return self.__data_frame
+
+
+class RetryableError(Exception):
+    """
+    a transient failure of one attempt, the call is tried again
+    """
+
+    def __init__(self, error, backoff=True):
+        """
+        :param error: the failure, raised if no attempt is left
+        :param backoff: wait before the next attempt
+        """
+        super().__init__(error)
+        self.error = error
+        self.backoff = backoff
+
+
+def backoff_delay(attempt, base=2, cap=60):
+    """
+    exponential backoff with jitter: between half and all of min(cap, base * 2^attempt) seconds,
+    so the bots sharing a key don't retry in lockstep
+    """
+    delay = min(cap, base * pow(2, attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def retry_with(attempt, func, count=5, deadline=None):
+    """
+    call func until an attempt succeeds, sleeping between the attempts on the caller's thread
+    :param attempt: function(func) making one attempt, e.g. attempt_binance_futures
+    :param count: number of attempts
+    :param deadline: time.time() after which no attempt is started
+    :return: the result
+    """
     err = None
     for i in range(count):
-        try:           
-            ret, res = func()            
-            rate_limit = int(res.headers['X-RateLimit-Limit'])
-            rate_remain = int(res.headers['X-RateLimit-Remaining'])
-            if rate_remain < 10:
-                time.sleep(5 * 60 * (1 + rate_limit - rate_remain) / rate_limit)
-            return ret
-        except HTTPError as error:
-            status_code = error.status_code
-            err = error
-            if status_code >= 500:
-                time.sleep(pow(2, i + 1))
-                continue
-            elif status_code in status_codes:
-                raise FatalError(error)
+        try:
+            return attempt(func)
+        except RetryableError as error:
+            err = error.error
+            delay = backoff_delay(i) if error.backoff else 0
+            if i == count - 1 or (deadline is not None and time.time() + delay >= deadline):
+                break
+            time.sleep(delay)
     raise err
 
 
+def retry_async(attempt, func, count=5, deadline=None, runtime=None):
+    """
+    call func until an attempt succeeds without blocking the caller,
+    the attempts run on the thread pool of the websocket runtime and the backoff is a timer of its loop
+    :param attempt: function(func) making one attempt, e.g. attempt_binance_futures
+    :param count: number of attempts
+    :param deadline: time.time() after which the call fails with TimeoutError
+    :param runtime: WebsocketRuntime, the shared one by default
+    :return: concurrent.futures.Future of the result, cancel() stops the retries
+    """
+    import asyncio
+    from src.exchange.websocket_runtime import WebsocketRuntime
+
+    runtime = runtime or WebsocketRuntime.shared()
+
+    async def run():
+        err = None
+        for i in range(count):
+            try:
+                return await runtime.loop.run_in_executor(None, attempt, func)
+            except RetryableError as error:
+                err = error.error
+                delay = backoff_delay(i) if error.backoff else 0
+                if i == count - 1 or (deadline is not None and time.time() + delay >= deadline):
+                    break
+                await asyncio.sleep(delay)
+        raise err
+
+    if deadline is None:
+        return runtime.submit(run())
+
+    async def run_until_deadline():
+        return await asyncio.wait_for(run(), max(deadline - time.time(), 0))
+    return runtime.submit(run_until_deadline())
+
+
+def attempt_bitmex(func):
+    """
+    one attempt of a bravado call returning (result, response)
+    """
+    try:
+        # X-RateLimit-Remaining is followed by the client's RateLimiter before the requests
+        ret, res = func()
+        return ret
+    except RateLimitTimeout as error:
+        raise RetryableError(error)
+    except HTTPError as error:
+        if error.status_code >= 500:
+            raise RetryableError(error)
+        elif error.status_code in status_codes:
+            raise FatalError(error)
+        raise RetryableError(error, backoff=False)
+
+
+def retry(func, count=5, deadline=None):
+    return retry_with(attempt_bitmex, func, count, deadline)
+
+
 binance_errors_to_actions = {
     # APIError(code=-1021): Timestamp for this request is outside of the recvWindow.
     1021: "retry",
@@ -338,103 +1225,83 @@ def check_binance_error(code):
         return None
 
 
-def retry_binance_futures(func, count=5):
-    err = None
-    for i in range(count):
-        try:            
-            ret, res = func()
-
-            #res_header = res.headers['X-MBX-USED-WEIGHT-1M']                   
-            rate_limit = int(res.headers['X-MBX-USED-WEIGHT-1M'])
-            #todo finish retry limit and status codes
-            
-            # rate_remain = None
-            # try:                
-            #     rate_remain = int(res.headers['X-MBX-ORDER-COUNT-1M'])
-            # except KeyError:             #             
-            #     #return ret
-            #     pass
-            # if rate_remain is not None and rate_remain < 10:
-            #     time.sleep(5 * 60 * (1 + rate_limit - rate_remain) / rate_limit)
-            return ret
-        except BinanceAPIException as error:
-            logger.info(error)
-            status_code = error.status_code
-            err = error
-            if status_code >= 500 or \
-                check_binance_error(error.code) == "retry":
-                time.sleep(pow(2, i + 1))
-                logger.info(f"Retrying Request - Count: {i+1} - Status: {status_code} - Error: {error.code}")
-                continue
-            elif check_binance_error(error.code) == "return":
-                break 
-            elif status_code in status_codes or check_binance_error(error.code) == "error":
-                raise FatalError(error)
-        except BinanceRequestException as reqErr:
-            logger.info(reqErr)
-            time.sleep(pow(2, i + 1))
-            logger.info(f"Retrying Request - Count: {i+1}")
-            continue
-
-    raise err
+def attempt_binance_futures(func):
+    """
+    one attempt of a Client call returning (result, response)
+    """
+    try:
+        # X-MBX-USED-WEIGHT-1M is followed by the client's RateLimiter before the requests
+        ret, res = func()
+        return ret
+    except RateLimitTimeout as error:
+        raise RetryableError(error)
+    except BinanceAPIException as error:
+        logger.info(error)
+        action = check_binance_error(error.code)
+        if error.status_code >= 500 or action == "retry":
+            logger.info(f"Retrying Request - Status: {error.status_code} - Error: {error.code}")
+            raise RetryableError(error)
+        elif action == "return":
+            raise error
+        elif error.status_code in status_codes or action == "error":
+            raise FatalError(error)
+        raise RetryableError(error, backoff=False)
+    except BinanceRequestException as error:
+        logger.info(error)
+        logger.info(f"Retrying Request")
+        raise RetryableError(error)
+
+
+def retry_binance_futures(func, count=5, deadline=None):
+    return retry_with(attempt_binance_futures, func, count, deadline)
+
+
+def attempt_bybit(func):
+    """
+    one attempt of a pybit call
+    """
+    try:
+        ret = func()
+        if 'result' in ret:
+            ret = ret['result']
+        return ret
+    except RateLimitTimeout as error:
+        raise RetryableError(error)
+    except HTTPError as error:
+        if error.status_code >= 500:
+            raise RetryableError(error)
+        elif error.status_code in status_codes:
+            raise FatalError(error)
+        raise RetryableError(error, backoff=False)
 
 
-def retry_bybit(func, count=5):
-    err = None
-    for i in range(count):
-        try:
-            #logger.info(f"{func()}")
-            ret = func()
-            if 'result' in ret:
-                ret = ret['result']
-
-            #res_header = res.headers['X-MBX-USED-WEIGHT-1M']                   
-            #rate_limit = int(res.headers['X-MBX-USED-WEIGHT-1M'])
-            #todo finish retry limit and status codes
-            
-            # rate_remain = None
-            # try:                
-            #     rate_remain = int(res.headers['X-MBX-ORDER-COUNT-1M'])
-            # except KeyError:             #             
-            #     #return ret
-            #     pass
-            # if rate_remain is not None and rate_remain < 10:
-            #     time.sleep(5 * 60 * (1 + rate_limit - rate_remain) / rate_limit)
-            return ret
-        except HTTPError as error:
-            status_code = error.status_code
-            err = error
-            if status_code >= 500:
-                time.sleep(pow(2, i + 1))
-                continue
-            elif status_code in status_codes:
-                raise FatalError(error)
-    raise err
+def retry_bybit(func, count=5, deadline=None):
+    return retry_with(attempt_bybit, func, count, deadline)
 
 
-def retry_ftx(func, count=5):
-    err = None
-    for i in range(count):
-        try:        
-            ret = func()
-          
-            if 'error' in ret:
-                if ret['error'] == "Please retry request":
-                    time.sleep(pow(2, i + 1))
-                    continue
-            return ret['result']
-        except ConnectionError as error:            
-            time.sleep(pow(2, i + 1))               
-            continue
-        except HTTPError as error:
-            status_code = error.status_code
-            err = error
-            if status_code >= 500:
-                time.sleep(pow(2, i + 1))
-                continue               
-            elif status_code in status_codes:
-                raise FatalError(error)
-    raise err
+def attempt_ftx(func):
+    """
+    one attempt of a FtxClient call
+    """
+    try:
+        ret = func()
+        if 'error' in ret and ret['error'] == "Please retry request":
+            raise RetryableError(Exception(ret['error']))
+        return ret['result']
+    except RateLimitTimeout as error:
+        raise RetryableError(error)
+    except ConnectionError as error:
+        raise RetryableError(error)
+    except HTTPError as error:
+        if error.status_code >= 500:
+            raise RetryableError(error)
+        elif error.status_code in status_codes:
+            raise FatalError(error)
+        raise RetryableError(error, backoff=False)
+
+
+def retry_ftx(func, count=5, deadline=None):
+    return retry_with(attempt_ftx, func, count, deadline)
 
 
 class Side:
@@ -444,58 +1311,383 @@ class Side:
     Unknown = "Unknown"
 
 
-def notify(message: object, fileName: object = None) -> object:
+class Notifier:
+    """
+    Queue-backed notification dispatcher for Discord and LINE.
+    send() only queues the message and returns, a daemon worker thread posts it with a timeout.
+    Every channel is rate limited; messages queued while a channel waits are coalesced
+    into one message, and at most max_pending messages are kept per channel.
+    When the queue is full the oldest message is dropped and counted,
+    the next message that goes out reports how many were dropped.
+    """
+    line_url = 'https://notify-api.line.me/api/notify'
+
+    # The instances used by notify() by account
+    instances = {}
+    instance_lock = threading.Lock()
+    # Seconds the queued messages may take to be posted when the process exits
+    exit_timeout = 10
+
+    def __init__(self, discord_url=None, line_api_key=None, line_url=None,
+                 discord_interval=2, line_interval=4, max_pending=500, timeout=10):
+        """
+        :param discord_url: Discord webhook url
+        :param line_api_key: LINE Notify token
+        :param line_url: LINE Notify endpoint
+        :param discord_interval: minimum seconds between two Discord messages
+        :param line_interval: minimum seconds between two LINE messages
+        :param max_pending: maximum number of queued messages per channel
+        :param timeout: seconds a request may take
+        """
+        self.timeout = timeout
+        self.channels = {}
+        if discord_url:
+            self.channels["discord"] = self.__channel(lambda message, file_name: self.__send_discord(discord_url, message),
+                                                      discord_interval, 2000, max_pending)
+        if line_api_key:
+            line_url = line_url or self.line_url
+            self.channels["line"] = self.__channel(lambda message, file_name: self.__send_line(line_url, line_api_key,
+                                                                                                message, file_name),
+                                                   line_interval, 1000, max_pending)
+        self.__condition = threading.Condition()
+        self.__thread = None
+        self.__stopped = False
+        # Messages being posted right now
+        self.__sending = 0
+        if self.channels:
+            # the worker is a daemon thread, the last messages (e.g. the stop of the bot) are posted before exiting
+            atexit.register(self.flush, timeout=self.exit_timeout)
+
+    @classmethod
+    def from_config(cls, account=None):
+        """
+        notifier for the discord webhook of an account and the LINE token
+        :param account: account of the bot, the one of the command line by default
+        """
+        try:
+            discord_url = conf["discord_webhooks"][account or default_account()]
+        except Exception:
+            discord_url = None
+        try:
+            line_api_key = conf['line_apikey']['API_KEY']
+        except Exception:
+            line_api_key = None
+        return cls(discord_url=discord_url, line_api_key=line_api_key)
+
+    @staticmethod
+    def __channel(send, interval, max_length, max_pending):
+        return {
+            "send": send,
+            "interval": interval,
+            "max_length": max_length,
+            "pending": deque(maxlen=max_pending),
+            "last_sent": 0,
+            # Messages dropped, reported and failed so far
+            "dropped": 0,
+            "reported": 0,
+            "failed": 0,
+            "sent": 0
+        }
+
+    def send(self, message, file_name=None):
+        """
+        queue a message for every channel, never blocks
+        :param message: text of the message
+        :param file_name: image to attach (LINE only)
+        """
+        if not self.channels:
+            return
+        with self.__condition:
+            for channel in self.channels.values():
+                if len(channel["pending"]) == channel["pending"].maxlen:
+                    channel["dropped"] += 1
+                channel["pending"].append((str(message), file_name))
+            if self.__thread is None and not self.__stopped:
+                self.__thread = threading.Thread(target=self.__run, name="notifier")
+                self.__thread.daemon = True
+                self.__thread.start()
+            self.__condition.notify()
+
+    def flush(self, timeout=None):
+        """
+        wait until every queued message was posted
+        :return: True if the queues are empty
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.__condition:
+            while self.__sending or any(c["pending"] for c in self.channels.values()):
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.__condition.wait(remaining)
+        return True
+
+    def stop(self):
+        with self.__condition:
+            self.__stopped = True
+            self.__condition.notify_all()
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                batches = self.__next_batches()
+                while not batches:
+                    if self.__stopped:
+                        return
+                    self.__condition.wait(self.__wait_time())
+                    batches = self.__next_batches()
+                self.__sending += len(batches)
+
+            for channel, message, file_name in batches:
+                try:
+                    channel["send"](message, file_name)
+                    channel["sent"] += 1
+                except Exception as e:
+                    channel["failed"] += 1
+                    logger.warning(f"Notification failed: {e}")
+
+            with self.__condition:
+                self.__sending -= len(batches)
+                self.__condition.notify_all()
+
+    def __wait_time(self):
+        """
+        seconds until the next channel with pending messages may send again
+        """
+        now = time.time()
+        waits = [c["last_sent"] + c["interval"] - now for c in self.channels.values() if c["pending"]]
+        return max(min(waits), 0.01) if waits else None
+
+    def __next_batches(self):
+        """
+        take one coalesced message from every channel that is not rate limited
+        """
+        now = time.time()
+        batches = []
+        for channel in self.channels.values():
+            pending = channel["pending"]
+            if not pending or now - channel["last_sent"] < channel["interval"]:
+                continue
+            channel["last_sent"] = now
+
+            lines = []
+            if channel["dropped"] > channel["reported"]:
+                lines.append(f"({channel['dropped'] - channel['reported']} notifications dropped)")
+                channel["reported"] = channel["dropped"]
+            message, file_name = pending.popleft()
+            lines.append(message)
+            # messages with an attachment are sent on their own
+            length = sum(len(line) + 1 for line in lines)
+            while file_name is None and pending and pending[0][1] is None \
+                    and length + len(pending[0][0]) + 1 <= channel["max_length"]:
+                length += len(pending[0][0]) + 1
+                lines.append(pending.popleft()[0])
+            batches.append((channel, "\n".join(lines)[:channel["max_length"]], file_name))
+        return batches
+
+    def __send_discord(self, url, message):
+        webhook = DiscordWebhook(url=url, timeout=self.timeout)
+        embed = DiscordEmbed()
+        embed.set_footer(text=message)
+        embed.set_timestamp()
+        webhook.add_embed(embed)
+        webhook.execute()
+
+    def __send_line(self, url, api_key, message, file_name):
+        payload = {'message': message}
+        headers = {'Authorization': 'Bearer ' + api_key}
+        if file_name is None:
+            requests.post(url, data=payload, headers=headers, timeout=self.timeout)
+        else:
+            with open(file_name, "rb") as file:
+                requests.post(url, data=payload, headers=headers, files={"imageFile": file}, timeout=self.timeout)
+
 
-    try:
-        webhook_url = conf["discord_webhooks"][conf["args"].account]
-
-        if webhook_url is not None:       
-            webhook = DiscordWebhook(url=webhook_url)
-            embed = DiscordEmbed()
-            embed.set_footer(text=message)
-            embed.set_timestamp()
-            webhook.add_embed(embed)
-            response = webhook.execute()     
-    except:
-        pass   
+def notify(message: object, fileName: object = None, account: object = None) -> object:
+    """
+    queue a notification for Discord and LINE, returns immediately
+    :param account: account of the bot whose discord webhook is used, the one of the command line by default
+    """
+    account = account or default_account()
+    notifier = Notifier.instances.get(account)
+    if notifier is None:
+        with Notifier.instance_lock:
+            notifier = Notifier.instances.get(account)
+            if notifier is None:
+                notifier = Notifier.instances[account] = Notifier.from_config(account)
+    notifier.send(message, fileName)
 
-    url = 'https://notify-api.line.me/api/notify'
-    #api_key = os.environ.get('LINE_APIKEY')
-    api_key = conf['line_apikey']['API_KEY']
-    if api_key is None or len(api_key) == 0:
-        return
 
-    payload = {'message': message}
-    headers = {'Authorization': 'Bearer ' + api_key}
-    if fileName is None:
-        try:
-            requests.post(url, data=payload, headers=headers)
-        except:
-            pass
-    else:
+class MetricsWriter:
+    """
+    Buffers metric records in memory and writes them in batches from a daemon thread,
+    so add() never waits on the database.
+    A batch is written once batch_size records are buffered or every flush_interval seconds.
+    Failed writes are retried with exponential backoff; when the database stays unreachable
+    the batch is appended to spill_file and written back after the next successful write.
+    At most max_buffer records are kept in memory, the oldest are dropped and counted beyond that.
+    """
+
+    def __init__(self, write, batch_size=500, flush_interval=5, max_buffer=10000,
+                 max_retries=3, backoff=1, spill_file=None):
+        """
+        :param write: function that writes a list of records, raises on failure
+        :param batch_size: records per write
+        :param flush_interval: maximum seconds a record stays in the buffer
+        :param max_buffer: maximum number of buffered records
+        :param max_retries: retries of a failed write before it is spilled to disk
+        :param backoff: seconds before the first retry, doubled on every retry
+        :param spill_file: json lines file for batches that could not be written, None to drop them
+        """
+        self.write = write
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.spill_file = spill_file
+        # Records dropped from the full buffer, written and spilled
+        self.dropped = 0
+        self.written = 0
+        self.spilled = 0
+        self.__buffer = deque(maxlen=max_buffer)
+        self.__lock = threading.Lock()
+        # one flush at a time, e.g. close() while the worker is flushing
+        self.__flush_lock = threading.Lock()
+        self.__wakeup = threading.Event()
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def add(self, record):
+        """
+        buffer a record, never blocks on I/O
+        """
+        with self.__lock:
+            if len(self.__buffer) == self.__buffer.maxlen:
+                self.dropped += 1
+            self.__buffer.append(record)
+            if self.__thread is None and not self.__stop.is_set():
+                self.__thread = threading.Thread(target=self.__run, name="metrics")
+                self.__thread.daemon = True
+                self.__thread.start()
+        if len(self.__buffer) >= self.batch_size:
+            self.__wakeup.set()
+
+    def __len__(self):
+        return len(self.__buffer)
+
+    def __run(self):
+        while not self.__stop.is_set():
+            self.__wakeup.wait(self.flush_interval)
+            self.__wakeup.clear()
+            self.flush()
+
+    def close(self, timeout=None):
+        """
+        stop the worker and write what is left in the buffer
+        """
+        self.__stop.set()
+        self.__wakeup.set()
+        if self.__thread is not None and self.__thread is not threading.current_thread():
+            self.__thread.join(timeout)
+        self.flush()
+
+    def flush(self):
+        """
+        write every buffered record, retrying and spilling to disk on failure
+        """
+        with self.__flush_lock:
+            while True:
+                with self.__lock:
+                    batch = [self.__buffer.popleft() for _ in range(min(self.batch_size, len(self.__buffer)))]
+                if not batch:
+                    return
+                if not self.__write(batch):
+                    self.__spill(batch)
+                    return
+                self.__replay()
+
+    def __write(self, batch):
+        for i in range(self.max_retries + 1):
+            try:
+                self.write(batch)
+                self.written += len(batch)
+                return True
+            except Exception as e:
+                logger.warning(f"Metrics write failed: {e}")
+                if i < self.max_retries:
+                    # does not wait while closing
+                    self.__stop.wait(self.backoff * 2 ** i * random.uniform(0.5, 1.5))
+        return False
+
+    def __spill(self, batch):
+        if self.spill_file is None:
+            self.dropped += len(batch)
+            return
         try:
-            files = {"imageFile": open(fileName, "rb")}
-            requests.post(url, data=payload, headers=headers, files=files)
-        except:
-            pass
+            with open(self.spill_file, "a") as file:
+                for record in batch:
+                    file.write(json.dumps(record, default=lambda o: o.isoformat() if hasattr(o, "isoformat") else str(o)) + "\n")
+            self.spilled += len(batch)
+        except Exception as e:
+            self.dropped += len(batch)
+            logger.warning(f"Metrics spill failed: {e}")
+
+    def __replay(self):
+        """
+        write the spilled records back once the database is reachable again
+        """
+        if self.spill_file is None:
+            return
+        replay_file = self.spill_file + ".replay"
+        if os.path.exists(self.spill_file):
+            if os.path.exists(replay_file):
+                # left by a process that stopped while replaying, the records spilled since are added to it
+                with open(self.spill_file) as spilled, open(replay_file, "a") as file:
+                    file.write(spilled.read())
+                os.remove(self.spill_file)
+            else:
+                os.replace(self.spill_file, replay_file)
+        elif not os.path.exists(replay_file):
+            return
+        with open(replay_file) as file:
+            records = [json.loads(line) for line in file if line.strip()]
+        for i in range(0, len(records), self.batch_size):
+            if not self.__write(records[i:i + self.batch_size]):
+                self.__spill(records[i:])
+                break
+        os.remove(replay_file)
+
 
 class InfluxDB():
 
     client = None #will be False if not configured
     writer = None #will be False if not configured
-
-    def __new__(cls):
-        if not hasattr(cls, 'instance'):
-            cls.instance = super(InfluxDB, cls).__new__(cls)
-        return cls.instance
-
-    def __init__(self):
+    metrics = None
+    # One instance by account
+    instances = {}
+    instance_lock = threading.Lock()
+
+    def __new__(cls, account=None):
+        account = account or default_account()
+        with cls.instance_lock:
+            if account not in cls.instances:
+                instance = super(InfluxDB, cls).__new__(cls)
+                instance.__setup(account)
+                cls.instances[account] = instance
+            return cls.instances[account]
+
+    def __setup(self, account):
         try: 
-            url = conf["influx_db"][conf["args"].account]["url"]
-            token = conf["influx_db"][conf["args"].account]["token"]
-            org = conf["influx_db"][conf["args"].account]["org"]
+            url = conf["influx_db"][account]["url"]
+            token = conf["influx_db"][account]["token"]
+            org = conf["influx_db"][account]["org"]
+            self.bucket = conf["influx_db"][account]["bucket"]
             self.client = InfluxDBClient(url=url, token=token, org=org)
             self.writer = self.client.write_api(write_options=SYNCHRONOUS)
+            # written in batches from a background thread, spilled to disk while the database is unreachable
+            self.metrics = MetricsWriter(lambda records: self.writer.write(bucket=self.bucket, record=records),
+                                         spill_file=os.path.join(tempfile.gettempdir(), f"influx_db_{account}.jsonl"))
+            atexit.register(self.metrics.close, timeout=10)
         except Exception as e:
             self.client = False
             self.writer = False
@@ -505,19 +1697,12 @@ class InfluxDB():
     def log(self, timestamp, measurement, fields, tags):
 
         if self.writer is not False:
-            try:
-                self.writer.write(bucket=conf["influx_db"][conf["args"].account]["bucket"],
-                                record=[
-                                    {
-                                        "time": timestamp, #"2009-11-10T23:00:00Z"
-                                        "measurement": measurement, #"my-type"
-                                        "fields": fields, #kv pairs
-                                        "tags": tags #kv pairs
-                                    }
-                                ])
-            except Exception as e:
-                logger.info(e)
-                pass
+            self.metrics.add({
+                "time": timestamp, #"2009-11-10T23:00:00Z"
+                "measurement": measurement, #"my-type"
+                "fields": fields, #kv pairs
+                "tags": tags #kv pairs
+            })
 
         return
 
@@ -542,7 +1727,169 @@ class InfluxDB():
 # 3. tags -> tags
 ###############################################
 
-def log_metrics(timestamp, collection, metrics={}, tags = {}):
-    influx_db = InfluxDB()
+def log_metrics(timestamp, collection, metrics={}, tags = {}, account=None):
+    """
+    :param account: account whose database is used, the account tag or the one of the command line by default
+    """
+    influx_db = InfluxDB(account or tags.get("account"))
     influx_db.log(timestamp, collection, metrics, tags)
-    return
\ No newline at end of file
+    return
+
+
+class LatencyHistogram:
+    """
+    Latency distribution with logarithmic buckets, four per power of two (at most 25% wide),
+    so recording is a few integer operations and the memory does not grow with the samples.
+    """
+
+    # a duration in ns is bucketed by its highest bit and the two bits after it
+    buckets = 64 * 4
+
+    def __init__(self):
+        self.counts = [0] * self.buckets
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def bucket(ns):
+        bits = ns.bit_length()
+        if bits <= 3:
+            return ns
+        return bits * 4 + ((ns >> (bits - 3)) & 3) - 8
+
+    @staticmethod
+    def upper_bound(bucket):
+        """
+        largest duration in ns of a bucket
+        """
+        if bucket < 8:
+            return bucket
+        bits, sub = (bucket + 8) // 4, (bucket + 8) % 4
+        return ((5 + sub) << (bits - 3)) - 1
+
+    def record(self, ns):
+        ns = max(int(ns), 0)
+        with self.lock:
+            self.counts[self.bucket(ns)] += 1
+            self.count += 1
+            self.total += ns
+            if ns > self.max:
+                self.max = ns
+
+    def percentile(self, percent):
+        """
+        upper bound in ns of the bucket of a percentile
+        """
+        with self.lock:
+            rank = self.count * percent / 100
+            seen = 0
+            for bucket, n in enumerate(self.counts):
+                seen += n
+                if n > 0 and seen >= rank:
+                    return min(self.upper_bound(bucket), self.max)
+            return 0
+
+    def summary(self):
+        """
+        count, mean, p50, p90, p99 and max in milliseconds
+        """
+        return {
+            "count": self.count,
+            "mean": self.total / self.count / 1e6 if self.count > 0 else 0,
+            "p50": self.percentile(50) / 1e6,
+            "p90": self.percentile(90) / 1e6,
+            "p99": self.percentile(99) / 1e6,
+            "max": self.max / 1e6
+        }
+
+
+class LatencyRecorder:
+    """
+    Histograms of the stages of the live trading path by name
+    (receive, decode, ohlcv, strategy, sign, rest, ack), dumped to the log on demand
+    and exported through log_metrics().
+    Disabled by default, the probes check `latency.enabled` before taking any time, e.g.
+        start = latency.now() if latency.enabled else 0
+        ...
+        if latency.enabled:
+            latency.record("decode", start)
+    """
+
+    # Started stages waiting to be resolved (e.g. orders waiting for their ACK) at most
+    max_pending = 1000
+
+    def __init__(self):
+        self.enabled = False
+        self.histograms = {}
+        self.pending = OrderedDict()
+        self.lock = threading.Lock()
+
+    now = staticmethod(time.perf_counter_ns)
+
+    def histogram(self, stage):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(stage, LatencyHistogram())
+        return histogram
+
+    def record(self, stage, start):
+        """
+        record the time since start
+        :param start: latency.now() when the stage started
+        """
+        self.histogram(stage).record(time.perf_counter_ns() - start)
+
+    def record_since(self, stage, event_time):
+        """
+        record the time since an exchange event, includes the clock difference with the exchange
+        :param event_time: event time in ms since epoch
+        """
+        self.histogram(stage).record(time.time_ns() - int(event_time) * 1000000)
+
+    def start(self, key):
+        """
+        start a stage that ends on another thread, e.g. an order until its ACK
+        """
+        with self.lock:
+            self.pending[key] = time.perf_counter_ns()
+            if len(self.pending) > self.max_pending:
+                self.pending.popitem(last=False)
+
+    def end(self, stage, key):
+        """
+        record a stage started with start(key), once
+        """
+        with self.lock:
+            start = self.pending.pop(key, None)
+        if start is not None:
+            self.record(stage, start)
+
+    def snapshot(self):
+        """
+        summary of every stage in milliseconds
+        """
+        return {stage: histogram.summary() for stage, histogram in list(self.histograms.items())}
+
+    def dump(self):
+        """
+        log the summary of every stage
+        """
+        logger.info(f"{'stage':<10} {'count':>8} {'mean':>9} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9} (ms)")
+        for stage, s in self.snapshot().items():
+            logger.info(f"{stage:<10} {s['count']:>8} {s['mean']:>9.3f} {s['p50']:>9.3f} {s['p90']:>9.3f} "
+                        f"{s['p99']:>9.3f} {s['max']:>9.3f}")
+
+    def export(self, tags={}):
+        """
+        write the summary of every stage through log_metrics, one "latency" record per stage
+        """
+        timestamp = datetime.datetime.utcnow()
+        for stage, summary in self.snapshot().items():
+            log_metrics(timestamp, "latency", summary, {**tags, "stage": stage})
+
+
+# Latency probes of the process
+latency = LatencyRecorder()
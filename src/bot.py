@@ -37,6 +37,8 @@ class Bot:
     account = None
     # Exchange
     exchange_arg = None
+    # Exchange instance, created by run()
+    exchange = None
     # Time Frame
     bin_size = '1h'
     # Pair
@@ -60,6 +62,8 @@ class Bot:
     # session = type("Session", (object,), {})()
     session_file = None
     session_file_name = None
+    # Stopped by shutdown()
+    stopped = False
 
     def __init__(self, bin_size):
         """
@@ -68,9 +72,11 @@ class Bot:
         :param periods: period
         """
         self.bin_size = bin_size
+        # own session, bots of one process must not share it
+        self.session = Session()
 
     def __del__(self):
-        self.stop()
+        self.shutdown()
 
     def get_session(self):
         return self.session
@@ -230,6 +236,7 @@ class Bot:
                 logger.info(f"--exchange argument missing or invalid")
                 return
         self.exchange.ohlcv_len = self.ohlcv_len()
+        self.exchange.strategy_name = type(self).__name__
         self.exchange.on_update(self.bin_size, self.strategy)
 
         logger.info(f"Starting Bot")
@@ -238,17 +245,28 @@ class Bot:
 
         notify(f"Starting Bot\n"
                f"Strategy : {type(self).__name__}\n"
-               f"Balance : {self.exchange.get_balance()}")
+               f"Balance : {self.exchange.get_balance()}", account=self.account)
         
         self.exchange.show_result()
 
     def stop(self):
         """
-˜       Function that stops the bot and cancel all trades.
+˜       Function that stops the bot, cancel all trades and exits.
         """
         if self.exchange is None:
             return
 
+        self.shutdown()
+        sys.exit(0)
+
+    def shutdown(self):
+        """
+        stop the bot and cancel all trades without exiting the process, e.g. one bot of the supervisor
+        """
+        if self.exchange is None or self.stopped:
+            return
+        self.stopped = True
+
         logger.info(f"Stopping Bot")
 
         if self.session_file != None:
@@ -263,5 +281,3 @@ class Bot:
         self.exchange.stop()
         if self.cancel_all_orders_at_stop:
             self.exchange.cancel_all()
-
-        sys.exit(0)
@@ -74,5 +74,9 @@ config = {
                                                         "--exchange": "binance",
                                                         "--pair": "ETHUSDT",
                                                         "--strategy": "Sample",
-                                                        "--session": None}}                                              
+                                                        "--session": None}},
+    # Bots run together in one process by the flag --supervisor,
+    # either the name of an args profile or the args of the bot (missing args take the command line defaults)
+    "bots": ["binanceaccount1_Sample_ethusdt",
+             {"account": "binanceaccount1", "exchange": "binance", "pair": "BTCUSDT", "strategy": "Sample"}]
 }
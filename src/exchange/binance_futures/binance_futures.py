@@ -4,23 +4,35 @@
 import math
 #import os
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
+from functools import partial
 from inspect import signature
 import time
 import threading
+from threading import Lock
 
 import pandas as pd
 from bravado.exception import HTTPNotFound
 from pytz import UTC
 
 from src import (logger, allowed_range, allowed_range_minute_granularity,
-                 find_timeframe_string, to_data_frame, resample, delta,
-                 FatalError, notify, log_metrics, ord_suffix, sync_obj_with_config)
+                 find_timeframe_string, to_data_frame, resample, delta, OhlcvBuffer, ResampleCache, StrategyExecutor,
+                 FatalError, notify, log_metrics, ord_suffix, sync_obj_with_config, shared_client,
+                 retry_async, attempt_binance_futures, latency)
 from src import retry_binance_futures as retry
 from src.config import config as conf
 from src.exchange_config import exchange_config
+from src.indicators import indicator_cache
 from src.exchange.binance_futures.binance_futures_api import Client
 from src.exchange.binance_futures.binance_futures_websocket import BinanceFuturesWs
+from src.exchange.binance_futures.binance_futures_account_state import BinanceFuturesAccountState
+from src.exchange.binance_futures.binance_futures_order_registry import BinanceFuturesOrderRegistry
+from src.exchange.candle_backfill import CandleBackfill
+from src.exchange.candle_store import CandleStore
+from src.exchange.market_data_bus import MarketDataBus
+from src.exchange.order_gateway import OrderGateway
+from src.exchange.websocket_runtime import WebsocketRuntime
 from src.exchange.binance_futures.exceptions import BinanceAPIException, BinanceRequestException
 
 
@@ -43,6 +55,25 @@ class BinanceFutures:
     # candle data that is no longer relevant. Be aware of these potential issues and make sure to handle them
     # appropriately in your strategy implementation.
     call_strat_on_start = False
+    # Read the klines and best bid/ask from the market data daemon (market_data.py) when it publishes the pair,
+    # instead of opening the streams in every bot process
+    market_data_bus = False
+    # Seconds between two REST reconciliations of the account state and open orders kept from the websocket,
+    # 0 to turn them off
+    account_reconcile_interval = 300
+    # Seconds the REST snapshots requested after a websocket reconnect may take with their retries
+    reconcile_deadline = 30
+    # Fill the candle buffers at startup from the backtester's candle store (src/ohlc) and keep it up to date,
+    # only the candles that closed since the last run are fetched
+    warmup_from_store = True
+    # Order requests sent in parallel, e.g. the cancels and replacements of the take profit and stop loss
+    order_workers = 4
+    # Orders placed and canceled by one batch request at most (exchange limits)
+    batch_order_limit = 5
+    batch_cancel_limit = 10
+
+    # --exchange of the bot, tags its metrics
+    exchange_name = "binance"
 
     def __init__(self, account, pair, demo=False, threading=True):
         """
@@ -54,6 +85,8 @@ class BinanceFutures:
         """
         # Account
         self.account = account
+        # Strategy of the bot, tags its metrics
+        self.strategy_name = None
         # Pair
         self.pair = pair
         # Base Asset
@@ -80,6 +113,14 @@ class BinanceFutures:
         self.margin = None
         # Account information
         self.account_information = None
+        # Positions and balances from the user data stream
+        self.account_state = BinanceFuturesAccountState()
+        # Open orders from the order responses and the user data stream
+        self.order_registry = BinanceFuturesOrderRegistry(pair)
+        # Scheduled reconciliation of the account state and open orders
+        self.reconcile_job = None
+        # REST snapshots requested after a reconnect
+        self.reconcile_futures = []
         # Timeframe
         self.bin_size = ['1h'] 
         # Binance futures client     
@@ -92,10 +133,26 @@ class BinanceFutures:
         self.crawler = None
         # Strategy
         self.strategy = None
+        # Market data daemon reader
+        self.bus = None
         # OHLCV data
         self.timeframe_data = None    
+        # Candles on disk, shared with the backtester
+        self.candle_store = CandleStore("binance_futures", pair)
+        # Recovers the candles missed while the websocket was disconnected
+        self.candle_backfill = None
         # Timeframe data info like partial candle data values, last candle values, last action etc.
         self.timeframe_info = {}
+        # Higher timeframe candles kept up to date for security()
+        self.resample_data = {}
+        # Runs the strategy off the websocket thread
+        self.strategy_executor = StrategyExecutor()
+        # Snapshot of the candles security() reads, taken with the candle the strategy runs on
+        self.security_source = None
+        # Runs the order and best bid/ask callbacks (e.g. the chaser's REST calls) in order, off the websocket thread
+        self.callback_executor = StrategyExecutor("callbacks")
+        # Sends independent order requests in parallel
+        self.order_gateway = None
         # Profit target long and short for a simple limit exit strategy
         self.sltp_values = {
             'profit_long': 0,
@@ -143,9 +200,14 @@ class BinanceFutures:
         self.ask_quantity_L1 = None
         # callback
         self.best_bid_ask_change_callback = {}
+        # Best bid/ask changes not seen by the callbacks yet, None when no callback run is queued
+        self.best_bid_ask_changes = None
+        self.best_bid_ask_lock = Lock()
 
         sync_obj_with_config(exchange_config['binance_f'], BinanceFutures, self)
 
+        self.order_gateway = OrderGateway(self.order_workers)
+
     def __init_client(self):
         """
         initialization of client
@@ -157,7 +219,9 @@ class BinanceFutures:
         api_secret = conf['binance_test_keys'][self.account]['SECRET_KEY'] \
                     if self.demo else conf['binance_keys'][self.account]['SECRET_KEY']
         
-        self.client = Client(api_key=api_key, api_secret=api_secret, testnet=self.demo)
+        # one client per account, shared by the bots trading other pairs with it
+        self.client = shared_client((Client, api_key, self.demo),
+                                    lambda: Client(api_key=api_key, api_secret=api_secret, testnet=self.demo))
 
         if self.base_asset == None or self.asset_rounding == None or \
             self.quote_asset == None or self.quote_rounding == None:
@@ -181,7 +245,7 @@ class BinanceFutures:
         
     def sync(self):
         # Position
-        self.position = self.get_position()
+        self.position = [self.get_position()]
         # Position size
         self.position_size = self.get_position_size()
         # Entry price
@@ -268,12 +332,10 @@ class BinanceFutures:
         :return:
         """
         self.__init_client()
-        if self.margin is not None:
-            return self.margin
-        else:  # when the WebSocket cant get it
-            self.margin = retry(lambda: self.client
-                                .futures_account_balance_v2())            
-            return self.margin       
+        if self.account_state.needs_reconcile():
+            self.__reconcile_account()
+        self.margin = self.account_state.balance_list()
+        return self.margin
 
     def get_leverage(self):
         """
@@ -293,6 +355,7 @@ class BinanceFutures:
 
         symbol = self.pair if symbol is None else symbol
         leverage = retry(lambda: self.client.futures_change_leverage(symbol=symbol, leverage=leverage)) 
+        self.account_state.on_leverage(symbol, leverage['leverage'])
         logger.info(f"Setting Leverage: {leverage}")
         #return self.get_leverage(symbol)
 
@@ -312,21 +375,75 @@ class BinanceFutures:
         """
         self.__init_client()
 
-        # Unfortunately we cannot rely just on the WebSocket updates
-        # (for instance PnL) since binance is not pushing updates for the ACCOUNT_UPDATE stream often enough
-        #read more here https://binance-docs.github.io/apidocs/futures/en/#event-balance-and-position-update
+        # ACCOUNT_UPDATE keeps the position, amount and entry price are exact
+        # but the unrealized PnL is only as recent as the last event, see get_profit() for a live one
+        # read more here https://binance-docs.github.io/apidocs/futures/en/#event-balance-and-position-update
+        if not self.is_running or self.account_state.needs_reconcile(self.pair):
+            self.__reconcile_account()
+
+        position = self.account_state.position(self.pair)
+        if position is not None:
+            self.position = [position]
+        return position
+
+    def __reconcile_account(self):
+        """
+        replace the websocket account state with REST snapshots, differences are logged as drift
+        """
+        version = self.account_state.version
+        positions = retry(lambda: self.client.futures_position_information())
+        balances = retry(lambda: self.client.futures_account_balance_v2())
+        self.account_state.reconcile(positions, balances, version)
+
+    def __reconcile(self):
+        """
+        scheduled reconciliation of the account state and open orders
+        """
+        self.__reconcile_account()
+        self.__reconcile_orders()
+
+    def __on_reconnect(self, action, value):
+        """
+        account, order and kline events sent while the websocket was disconnected are lost
+        """
+        if self.account_state.synced:
+            self.account_state.invalidate("websocket reconnected")
+        if self.order_registry.synced:
+            self.order_registry.invalidate("websocket reconnected")
+        if self.account_state.synced or self.order_registry.synced:
+            self.__reconcile_in_background()
+        if self.candle_backfill is not None:
+            self.candle_backfill.invalidate()
 
-        # if self.position is not None:
+    def __reconcile_in_background(self):
+        """
+        request the REST snapshots without blocking the websocket thread,
+        a read before they arrive reconciles by itself
+        """
+        for future in self.reconcile_futures:
+            future.cancel()
+        account_version, orders_version = self.account_state.version, self.order_registry.version
+        deadline = time.time() + self.reconcile_deadline
+        self.reconcile_futures = futures = [
+            retry_async(attempt_binance_futures, call, deadline=deadline) for call in [
+                lambda: self.client.futures_position_information(),
+                lambda: self.client.futures_account_balance_v2(),
+                lambda: self.client.futures_get_open_orders(symbol=self.pair)]]
 
-        #     return self.position[0]
-        # else:  # when the WebSocket cant get it
+        def reconcile(future):
+            # the callbacks run one after the other on the loop thread, the last one reconciles
+            if not all(f.done() for f in futures) or any(f.cancelled() for f in futures):
+                return
+            errors = [f.exception() for f in futures if f.exception() is not None]
+            if len(errors) > 0:
+                logger.error(f"Reconciliation after reconnect failed - {errors[0]}")
+                return
+            positions, balances, open_orders = [f.result() for f in futures]
+            self.account_state.reconcile(positions, balances, account_version)
+            self.order_registry.reconcile(open_orders, orders_version)
 
-        ret = retry(lambda: self.client
-                              .futures_position_information())
-        if len(ret) > 0:
-            self.position = [p for p in ret if p["symbol"] == self.pair]            
-            return self.position[0]
-        else: return None
+        for future in futures:
+            future.add_done_callback(reconcile)
 
     def get_position_size(self):
         """
@@ -373,6 +490,22 @@ class BinanceFutures:
         pnl = self.get_profit()* 100/self.get_balance()
         return pnl   
 
+    def __state_profit(self):
+        """
+        balance, position size, profit and PnL in % from the account state as the user data stream left it,
+        for the websocket handlers, a stale state is reconciled in the background and never here
+        :return: (balance, position_size, profit, pnl), balance and pnl are None without a balance
+        """
+        balances = [b for b in self.account_state.balance_list() if b["asset"] == self.quote_asset]
+        balance = float(balances[0]["balance"]) if len(balances) > 0 else None
+        position = self.account_state.position(self.pair)
+        position_size = float(position["positionAmt"]) if position is not None else 0
+        entry_price = float(position["entryPrice"]) if position is not None else 0
+        profit = self.get_profit(close=self.market_price, avg_entry_price=entry_price,
+                                 position_size=position_size) if position_size != 0 else 0
+        pnl = profit * 100 / balance if balance else None
+        return balance, position_size, profit, pnl
+
     def get_profit(self, close=None, avg_entry_price=None, position_size=None, commission=None):
         """
         get profit 
@@ -431,6 +564,7 @@ class BinanceFutures:
         """
         self.__init_client()
         res = retry(lambda: self.client.futures_cancel_all_open_orders(symbol=self.pair))
+        self.order_registry.on_cancel_all()
         #for order in orders:
         logger.info(f"Cancel all open orders: {res}")    
         #self.callbacks = {}
@@ -469,8 +603,9 @@ class BinanceFutures:
             return False
 
         try:
-            retry(lambda: self.client.futures_cancel_order(symbol=self.pair,
-                                                           origClientOrderId=order['clientOrderId']))
+            canceled = retry(lambda: self.client.futures_cancel_order(symbol=self.pair,
+                                                                      origClientOrderId=order['clientOrderId']))
+            self.order_registry.update(canceled)
         except HTTPNotFound:
             return False
         logger.info(f"Cancel Order : (clientOrderId, type, side, quantity, price, stop) = "
@@ -479,7 +614,7 @@ class BinanceFutures:
         #self.callbacks.pop(order['clientOrderId'])
         return True
 
-    def __new_order(
+    def __order_params(
         self,
         ord_id,
         side,
@@ -493,72 +628,191 @@ class BinanceFutures:
         workingType="CONTRACT_PRICE"
     ):
         """
-        create an order (do not use directly)
+        parameters of futures_create_order() for an order, also used for the orders of a batch (do not use directly)
         """
         #removes "+" from order suffix, because of the new regular expression rule for newClientOrderId updated as ^[\.A-Z\:/a-z0-9_-]{1,36}$ (2021-01-26)
         ord_id = ord_id.replace("+", "k") 
 
         reduce_only = "true" if reduce_only else "false"
+        params = {"symbol": self.pair, "newClientOrderId": ord_id, "side": side, "quantity": ord_qty}
         
         if  trailing_stop > 0 and activationPrice > 0:
-            ord_type = "TRAILING_STOP_MARKET"
-            retry(lambda: self.client.futures_create_order(symbol=self.pair, type=ord_type, newClientOrderId=ord_id,
-                                                           side=side, quantity=ord_qty, activationPrice=activationPrice,
-                                                           callbackRate=trailing_stop, reduceOnly=reduce_only,
-                                                           workingType=workingType))
+            params.update(type="TRAILING_STOP_MARKET", activationPrice=activationPrice, callbackRate=trailing_stop,
+                          reduceOnly=reduce_only, workingType=workingType)
         elif trailing_stop > 0:
-            ord_type = "TRAILING_STOP_MARKET"
-            retry(lambda: self.client.futures_create_order(symbol=self.pair, type=ord_type, newClientOrderId=ord_id,
-                                                            side=side, quantity=ord_qty, callbackRate=trailing_stop,
-                                                            reduceOnly=reduce_only, workingType=workingType))
+            params.update(type="TRAILING_STOP_MARKET", callbackRate=trailing_stop, reduceOnly=reduce_only,
+                          workingType=workingType)
         elif limit > 0 and post_only:
-            ord_type = "LIMIT"
-            retry(lambda: self.client.futures_create_order(symbol=self.pair, type=ord_type, newClientOrderId=ord_id,
-                                                           side=side, quantity=ord_qty, price=limit,
-                                                           timeInForce="GTX", reduceOnly=reduce_only))
+            params.update(type="LIMIT", price=limit, timeInForce="GTX", reduceOnly=reduce_only)
         elif limit > 0 and stop > 0:
-            ord_type = "STOP"
-            retry(lambda: self.client.futures_create_order(symbol=self.pair, type=ord_type, newClientOrderId=ord_id,
-                                                           side=side, quantity=ord_qty, price=limit,
-                                                           stopPrice=stop, reduceOnly=reduce_only,
-                                                           workingType=workingType))
+            params.update(type="STOP", price=limit, stopPrice=stop, reduceOnly=reduce_only, workingType=workingType)
         elif limit > 0:   
-            ord_type = "LIMIT"
-            retry(lambda: self.client.futures_create_order(symbol=self.pair, type=ord_type, newClientOrderId=ord_id,
-                                                           side=side, quantity=ord_qty, price=limit, timeInForce="GTC",
-                                                           reduceOnly=reduce_only))   
+            params.update(type="LIMIT", price=limit, timeInForce="GTC", reduceOnly=reduce_only)
         elif stop > 0:
-            ord_type = "STOP_MARKET"
-            retry(lambda: self.client.futures_create_order(symbol=self.pair, type=ord_type, newClientOrderId=ord_id,
-                                                           side=side, quantity=ord_qty, stopPrice=stop,
-                                                           reduceOnly=reduce_only, workingType=workingType))        
+            params.update(type="STOP_MARKET", stopPrice=stop, reduceOnly=reduce_only, workingType=workingType)
         elif post_only: # limit order with post only
-            ord_type = "LIMIT"
-                             
             limit = self.best_bid_price if side == "Buy" else self.best_ask_price                
             # New change coming. GTX and FOK orders will return
             # an error instead of EXPIRED update on WS when they dont
             # meet execution criteria. Release Date: Unknown
-            retry(lambda: self.client.futures_create_order(symbol=self.pair, type=ord_type, newClientOrderId=ord_id,
-                                                            side=side, quantity=ord_qty, price=limit,
-                                                            timeInForce="GTX", reduceOnly=reduce_only))
+            params.update(type="LIMIT", price=limit, timeInForce="GTX", reduceOnly=reduce_only)
         else:
-            ord_type = "MARKET"
-            retry(lambda: self.client.futures_create_order(symbol=self.pair, type=ord_type, newClientOrderId=ord_id,
-                                                           side=side, quantity=ord_qty, reduceOnly=reduce_only))
-
-        if self.enable_trade_log:
-            logger.info(f"========= New Order ==============")
-            logger.info(f"ID        : {ord_id}")
-            logger.info(f"Type      : {ord_type}")
-            logger.info(f"Side      : {side}")
-            logger.info(f"Qty       : {ord_qty}")
-            logger.info(f"Limit     : {limit}")
-            logger.info(f"Stop      : {stop}")
-            logger.info(f"Red. Only : {reduce_only}")
-            logger.info(f"======================================")
+            params.update(type="MARKET", reduceOnly=reduce_only)
+        return params
 
-            notify(f"New Order\nType: {ord_type}\nSide: {side}\nQty: {ord_qty}\nLimit: {limit}\nStop: {stop}\nRed. Only: {reduce_only}")
+    def __log_new_order(self, params):
+        """
+        trade log of a placed order
+        """
+        if not self.enable_trade_log:
+            return
+        logger.info(f"========= New Order ==============")
+        logger.info(f"ID        : {params['newClientOrderId']}")
+        logger.info(f"Type      : {params['type']}")
+        logger.info(f"Side      : {params['side']}")
+        logger.info(f"Qty       : {params['quantity']}")
+        logger.info(f"Limit     : {params.get('price', 0)}")
+        logger.info(f"Stop      : {params.get('stopPrice', 0)}")
+        logger.info(f"Red. Only : {params['reduceOnly']}")
+        logger.info(f"======================================")
+
+        notify(f"New Order\nType: {params['type']}\nSide: {params['side']}\nQty: {params['quantity']}\n"
+               f"Limit: {params.get('price', 0)}\nStop: {params.get('stopPrice', 0)}\nRed. Only: {params['reduceOnly']}",
+               account=self.account)
+
+    def __new_order(
+        self,
+        ord_id,
+        side,
+        ord_qty,
+        limit=0,
+        stop=0,
+        post_only=False,
+        reduce_only=False,
+        trailing_stop=0,
+        activationPrice=0,
+        workingType="CONTRACT_PRICE"
+    ):
+        """
+        create an order (do not use directly)
+        """
+        params = self.__order_params(ord_id, side, ord_qty, limit, stop, post_only, reduce_only,
+                                     trailing_stop, activationPrice, workingType)
+
+        # until the ORDER_TRADE_UPDATE of the order
+        if latency.enabled:
+            latency.start(params['newClientOrderId'])
+
+        order = retry(lambda: self.client.futures_create_order(**params))
+
+        # seen by get_open_order() before the websocket update arrives
+        self.order_registry.update(order)
+
+        self.__log_new_order(params)
+
+    def __place_batch(self, batch):
+        """
+        place up to batch_order_limit orders in one request (do not use directly)
+        """
+        if latency.enabled:
+            for params in batch:
+                latency.start(params['newClientOrderId'])
+
+        responses = retry(lambda: self.client.futures_place_batch_order(batchOrders=batch))
+
+        # one response by order, in the order of the batch
+        for params, response in zip(batch, responses):
+            if 'code' in response:
+                logger.info(f"Order Rejected : {params['newClientOrderId']} - {response['code']} {response['msg']}")
+                self.callbacks.pop(params['newClientOrderId'], None)
+                continue
+            self.order_registry.update(response)
+            self.__log_new_order(params)
+        return responses
+
+    def __cancel_batch(self, orders):
+        """
+        cancel up to batch_cancel_limit open orders in one request (do not use directly)
+        """
+        responses = retry(lambda: self.client.futures_cancel_orders(
+            symbol=self.pair, origClientOrderIdList=[order['clientOrderId'] for order in orders]))
+
+        canceled = 0
+        for order, response in zip(orders, responses):
+            if 'code' in response:
+                # filled or canceled in the meantime
+                logger.info(f"Cancel Order Failed : {order['clientOrderId']} - {response['code']} {response['msg']}")
+                continue
+            self.order_registry.update(response)
+            canceled += 1
+            logger.info(f"Cancel Order : (clientOrderId, type, side, quantity, price, stop) = "
+                        f"({order['clientOrderId']}, {order['type']}, {order['side']}, {order['origQty']}, "
+                        f"{order['price']}, {order['stopPrice']})")
+        return canceled
+
+    def batch_order(self, orders):
+        """
+        places orders with one request for every batch_order_limit orders, e.g. a bracket or a ladder,
+        the batches are sent in parallel
+        :param orders: list of dicts with the arguments of order(), e.g.
+                       {"id": "TP", "long": False, "qty": 1, "limit": 30000, "reduce_only": True, "callback": on_tp}
+                       split and chaser orders take several requests and are placed with order()
+        :return: list of the order responses of the batches, {"code", "msg"} for a rejected order
+        """
+        self.__init_client()
+
+        batch = []
+        calls = []
+        for o in orders:
+            if not o.get('when', True):
+                continue
+            if o.get('split', 1) > 1 or o.get('chaser', False):
+                calls.append(partial(self.order, **o))
+                continue
+            round_decimals = o.get('round_decimals')
+            ord_qty = abs(round(o['qty'], round_decimals if round_decimals != None else self.asset_rounding))
+            ord_id = o['id'] + ord_suffix()
+            self.callbacks[ord_id] = o.get('callback')
+            batch.append(self.__order_params(ord_id, "BUY" if o['long'] else "SELL", ord_qty,
+                                             o.get('limit', 0), o.get('stop', 0), o.get('post_only', False),
+                                             o.get('reduce_only', False), o.get('trailing_stop', 0),
+                                             o.get('activationPrice', 0), o.get('workingType', "CONTRACT_PRICE")))
+
+        for i in range(0, len(batch), self.batch_order_limit):
+            calls.append(partial(self.__place_batch, batch[i:i + self.batch_order_limit]))
+
+        return [response for responses in self.__gather(*calls) if isinstance(responses, list)
+                for response in responses]
+
+    def batch_cancel(self, ids):
+        """
+        cancel orders with one request for every batch_cancel_limit orders, the batches are sent in parallel
+        :param ids: ids of the orders, the first open order starting with each of them is canceled like with cancel()
+        :return: number of canceled orders
+        """
+        self.__init_client()
+
+        orders = {}
+        for id in ids:
+            order = self.get_open_order(id)
+            if order is not None:
+                orders[order['clientOrderId']] = order
+        orders = list(orders.values())
+
+        return sum(self.__gather(*[partial(self.__cancel_batch, orders[i:i + self.batch_cancel_limit])
+                                   for i in range(0, len(orders), self.batch_cancel_limit)]))
+
+    def __gather(self, *calls):
+        """
+        send order requests in parallel through the order gateway,
+        when one fails or times out the open orders are read again from REST before the next use,
+        so an order placed without its answer (e.g. a take profit) is not placed twice
+        """
+        try:
+            return self.order_gateway.gather(*calls)
+        except Exception:
+            self.order_registry.invalidate("order requests failed")
+            raise
 
     # def __amend_order(self, ord_id, side, ord_qty, limit=0, stop=0, post_only=False):
     #     """
@@ -954,12 +1208,12 @@ class BinanceFutures:
                         "slippage": round(slippage*100, 3)                        
                     },
                     {
-                        "exchange": conf["args"].exchange,
+                        "exchange": exchange.exchange_name,
                         "account": exchange.account,
                         "pair": exchange.pair,
                         "base_asset": exchange.base_asset,
                         "quote_asset": exchange.quote_asset,
-                        "strategy": conf["args"].strategy
+                        "strategy": exchange.strategy_name
                     })
 
                 def cancel(self):
@@ -1132,10 +1386,7 @@ class BinanceFutures:
         :param id: Order id for this pair
         :return: if multiple found starting with given id return only the first one
         """
-        self.__init_client()
-        open_orders = retry(lambda: self.client
-                            .futures_get_open_orders(symbol=self.pair))                                   
-        filtered_orders = [o for o in open_orders if o["clientOrderId"].startswith(id)]
+        filtered_orders = self.get_open_orders(id)
         if not filtered_orders:
             return None
         if len(filtered_orders) > 1:
@@ -1149,11 +1400,20 @@ class BinanceFutures:
         :return: list of open orders or None
         """
         self.__init_client()
-        open_orders = retry(lambda: self.client
-                            .futures_get_open_orders(symbol=self.pair))                                   
-        filtered_orders = [o for o in open_orders if o["clientOrderId"].startswith(id)] if id else open_orders 
+        # REST only to reconcile the registry
+        if not self.is_running or self.order_registry.needs_reconcile():
+            self.__reconcile_orders()
+        filtered_orders = self.order_registry.find(id or "")
         return filtered_orders if filtered_orders else None
 
+    def __reconcile_orders(self):
+        """
+        replace the registry open orders with a REST snapshot, differences are logged as drift
+        """
+        version = self.order_registry.version
+        open_orders = retry(lambda: self.client.futures_get_open_orders(symbol=self.pair))
+        self.order_registry.reconcile(open_orders, version)
+
     def get_orderbook_ticker(self):
         orderbook_ticker = retry(lambda: self.client.futures_orderbook_ticker(symbol=self.pair))
         return orderbook_ticker
@@ -1325,6 +1585,11 @@ class BinanceFutures:
         pos_size = float(self.get_position()['positionAmt'])
         if pos_size == 0:
             return
+
+        # the orders to replace are canceled by one request and the new ones placed by another,
+        # they are independent since a new order gets a new clientOrderId
+        cancels = []
+        orders = []
             
         # tp
         tp_order = self.get_open_order('TP')   
@@ -1347,45 +1612,26 @@ class BinanceFutures:
             if pos_size > 0:                
                 tp_price_long = round(avg_entry +(avg_entry*tp_percent_long), self.quote_rounding) 
                 if tp_order is not None:
-                    time.sleep(1)                                         
-                    self.cancel(id=tp_order['clientOrderId'])
-                    time.sleep(1)
-                    self.order("TP", False, abs(pos_size), limit=tp_price_long, reduce_only=True, 
-                               callback=self.get_sltp_values()['profit_long_callback'], 
-                               workingType=self.get_sltp_values()['sltp_working_type'],
-                               split=self.get_sltp_values()['split'], 
-                               interval=self.get_sltp_values()['interval'],
-                               chaser=self.get_sltp_values()['chaser'],
-                               retry_maker=self.get_sltp_values()['retry_maker'])
-                else:               
-                    self.order("TP", False, abs(pos_size), limit=tp_price_long, reduce_only=True, 
-                               callback=self.get_sltp_values()['profit_long_callback'], 
-                               workingType=self.get_sltp_values()['sltp_working_type'],
-                               split=self.get_sltp_values()['split'], 
-                               interval=self.get_sltp_values()['interval'],
-                               chaser=self.get_sltp_values()['chaser'],
-                               retry_maker=self.get_sltp_values()['retry_maker'])
+                    cancels.append(tp_order['clientOrderId'])
+                orders.append({"id": "TP", "long": False, "qty": abs(pos_size), "limit": tp_price_long, "reduce_only": True,
+                               "callback": self.get_sltp_values()['profit_long_callback'],
+                               "workingType": self.get_sltp_values()['sltp_working_type'],
+                               "split": self.get_sltp_values()['split'],
+                               "interval": self.get_sltp_values()['interval'],
+                               "chaser": self.get_sltp_values()['chaser'],
+                               "retry_maker": self.get_sltp_values()['retry_maker']})
         if tp_percent_short > 0 and is_tp_full_size == False:
             if pos_size < 0:                
                 tp_price_short = round(avg_entry -(avg_entry*tp_percent_short), self.quote_rounding)
                 if tp_order is not None:
-                    time.sleep(1)                                                        
-                    self.cancel(id=tp_order['clientOrderId'])
-                    time.sleep(1)
-                    self.order("TP", True, abs(pos_size), limit=tp_price_short, reduce_only=True, 
-                               callback=self.get_sltp_values()['profit_short_callback'], 
-                               workingType=self.get_sltp_values()['sltp_working_type'],
-                               split=self.get_sltp_values()['split'], interval=self.get_sltp_values()['interval'],
-                               chaser=self.get_sltp_values()['chaser'],
-                               retry_maker=self.get_sltp_values()['retry_maker'])
-                else:
-                    self.order("TP", True, abs(pos_size), limit=tp_price_short, reduce_only=True, 
-                               callback=self.get_sltp_values()['profit_short_callback'], 
-                               workingType=self.get_sltp_values()['sltp_working_type'],
-                               split=self.get_sltp_values()['split'], 
-                               interval=self.get_sltp_values()['interval'],
-                               chaser=self.get_sltp_values()['chaser'],
-                               retry_maker=self.get_sltp_values()['retry_maker'])
+                    cancels.append(tp_order['clientOrderId'])
+                orders.append({"id": "TP", "long": True, "qty": abs(pos_size), "limit": tp_price_short, "reduce_only": True,
+                               "callback": self.get_sltp_values()['profit_short_callback'],
+                               "workingType": self.get_sltp_values()['sltp_working_type'],
+                               "split": self.get_sltp_values()['split'],
+                               "interval": self.get_sltp_values()['interval'],
+                               "chaser": self.get_sltp_values()['chaser'],
+                               "retry_maker": self.get_sltp_values()['retry_maker']})
         #sl
         sl_order = self.get_open_order('SL')
         if sl_order is not None:
@@ -1403,46 +1649,34 @@ class BinanceFutures:
             if pos_size > 0:
                 sl_price_long = round(avg_entry - (avg_entry*sl_percent_long), self.quote_rounding)
                 if sl_order is not None:
-                    time.sleep(1)                                    
-                    self.cancel(id=sl_order['clientOrderId'])
-                    time.sleep(1)
-                    self.order("SL", False, abs(pos_size), stop=sl_price_long, reduce_only=True, 
-                               callback=self.get_sltp_values()['stop_long_callback'], 
-                               workingType=self.get_sltp_values()['sltp_working_type'], 
-                               split=self.get_sltp_values()['split'], 
-                               interval=self.get_sltp_values()['interval'],
-                               chaser=self.get_sltp_values()['chaser'],
-                               retry_maker=self.get_sltp_values()['retry_maker'])
-                else:  
-                    self.order("SL", False, abs(pos_size), stop=sl_price_long, reduce_only=True, 
-                               callback=self.get_sltp_values()['stop_long_callback'], 
-                               workingType=self.get_sltp_values()['sltp_working_type'],
-                               split=self.get_sltp_values()['split'], 
-                               interval=self.get_sltp_values()['interval'],
-                               chaser=self.get_sltp_values()['chaser'],
-                               retry_maker=self.get_sltp_values()['retry_maker'])
+                    cancels.append(sl_order['clientOrderId'])
+                orders.append({"id": "SL", "long": False, "qty": abs(pos_size), "stop": sl_price_long, "reduce_only": True,
+                               "callback": self.get_sltp_values()['stop_long_callback'],
+                               "workingType": self.get_sltp_values()['sltp_working_type'],
+                               "split": self.get_sltp_values()['split'],
+                               "interval": self.get_sltp_values()['interval'],
+                               "chaser": self.get_sltp_values()['chaser'],
+                               "retry_maker": self.get_sltp_values()['retry_maker']})
         if sl_percent_short > 0 and is_sl_full_size == False:
             if pos_size < 0:
                 sl_price_short = round(avg_entry + (avg_entry*sl_percent_short), self.quote_rounding)
                 if sl_order is not None: 
-                    time.sleep(1)                                         
-                    self.cancel(id=sl_order['clientOrderId'])
-                    time.sleep(1)
-                    self.order("SL", True, abs(pos_size), stop=sl_price_short, reduce_only=True, 
-                               callback=self.get_sltp_values()['stop_short_callback'], 
-                               workingType=self.get_sltp_values()['sltp_working_type'], 
-                               split=self.get_sltp_values()['split'], 
-                               interval=self.get_sltp_values()['interval'],
-                               chaser=self.get_sltp_values()['chaser'],
-                               retry_maker=self.get_sltp_values()['retry_maker']) 
-                else:  
-                    self.order("SL", True, abs(pos_size), stop=sl_price_short, reduce_only=True, 
-                               callback=self.get_sltp_values()['stop_short_callback'], 
-                               workingType=self.get_sltp_values()['sltp_working_type'],
-                               split=self.get_sltp_values()['split'], 
-                               interval=self.get_sltp_values()['interval'],
-                               chaser=self.get_sltp_values()['chaser'],
-                               retry_maker=self.get_sltp_values()['retry_maker'])                         
+                    cancels.append(sl_order['clientOrderId'])
+                orders.append({"id": "SL", "long": True, "qty": abs(pos_size), "stop": sl_price_short, "reduce_only": True,
+                               "callback": self.get_sltp_values()['stop_short_callback'],
+                               "workingType": self.get_sltp_values()['sltp_working_type'],
+                               "split": self.get_sltp_values()['split'],
+                               "interval": self.get_sltp_values()['interval'],
+                               "chaser": self.get_sltp_values()['chaser'],
+                               "retry_maker": self.get_sltp_values()['retry_maker']})
+
+        # sent in parallel, a replacement does not wait for the cancel of the order it replaces
+        calls = []
+        if len(cancels) > 0:
+            calls.append(partial(self.batch_cancel, cancels))
+        if len(orders) > 0:
+            calls.append(partial(self.batch_order, orders))
+        self.__gather(*calls)
         
     def fetch_ohlcv(self, bin_size, start_time, end_time):
         """
@@ -1492,14 +1726,20 @@ class BinanceFutures:
 
             data = pd.concat([data, source])
                        
+            # the pages are paced by the client's RateLimiter
             if right_time > source.iloc[-1].name + delta(fetch_bin_size):
                 left_time = source.iloc[-1].name + delta(fetch_bin_size)
-                time.sleep(2)                
             else:                
                 break
         
         return resample(data, bin_size)        
 
+    def __security_timeframe(self):
+        """
+        lowest timeframe, security() resamples its candles
+        """
+        return find_timeframe_string(min(allowed_range_minute_granularity[t][3] for t in self.bin_size))
+
     def security(self, bin_size, data=None):
         """
         Recalculate and obtain data of a timeframe higher than the current timeframe
@@ -1507,47 +1747,79 @@ class BinanceFutures:
         :param bin_size: time frame of the OHLCV data
         :param data:
         """     
-        if data == None:  # minute count of a timeframe for sorting when sorting is needed   
-            timeframe_list = [allowed_range_minute_granularity[t][3] for t in self.bin_size]
-            timeframe_list.sort(reverse=True)
-            t = find_timeframe_string(timeframe_list[-1])     
-            data = self.timeframe_data[t]      
-            
+        if data is None:
+            t = self.__security_timeframe()
+            if bin_size not in self.resample_data:
+                self.resample_data[bin_size] = ResampleCache(bin_size, self.ohlcv_len)
+            # the buffer moves on while the strategy runs on the executor thread
+            source = self.timeframe_data[t] if self.security_source is None else self.security_source
+            return self.resample_data[bin_size].data_frame(source)
+
         return resample(data, bin_size)[:-1]      
 
+    def __fill_ohlcv(self):
+        """
+        fill the candle buffers of every timeframe, the timeframes are fetched concurrently
+        """
+        end_time = datetime.now(timezone.utc)
+        with ThreadPoolExecutor(max_workers=max(len(self.bin_size), 1)) as executor:
+            fills = {t: executor.submit(self.__warmup_data, t, end_time) for t in self.bin_size}
+        timeframe_data = {}
+        for t in self.bin_size:
+            data = fills[t].result()
+
+            # The last candle is an incomplete candle with timestamp in future                
+            timeframe_data[t] = OhlcvBuffer.from_data_frame(data, self.ohlcv_len, t, self.minute_granularity,
+                                                            partial=data.iloc[-1].name > end_time)
+            self.timeframe_info[t] = {
+                "allowed_range": allowed_range_minute_granularity[t][0] 
+                                if self.minute_granularity else allowed_range[t][0], 
+                "ohlcv": data[:-1], # Dataframe with closed candles                                                   
+                "last_action_time": None,#self.timeframe_data[t].iloc[-1].name, # Last strategy execution time
+                "last_candle": data.iloc[-2].values,  # Store last complete candle
+                "partial_candle": data.iloc[-1].values  # Store incomplete candle
+            }
+
+            logger.info(f"Initial Buffer Fill - Last Candle: {data.iloc[-1].name}")   
+        self.timeframe_data = timeframe_data
+
+    def __warmup_data(self, t, end_time):
+        """
+        ohlcv_len candles of a timeframe up to the incomplete one,
+        only those missing from the candle store are fetched
+        """
+        start_time = end_time - self.ohlcv_len * delta(t)
+        stored = self.candle_store.load(t, start_time) if self.warmup_from_store else None
+        # the last stored candle may have been incomplete when it was stored, like the backtester it is fetched again
+        if stored is not None and len(stored) > 1 and self.candle_store.continuous(t, stored) \
+                and stored.index[0] <= start_time + delta(t):
+            stored = stored[:-1]
+            data = self.fetch_ohlcv(t, stored.index[-1].to_pydatetime(), end_time)
+            data = pd.concat([stored[data.columns], data])
+            data = data[~data.index.duplicated(keep="last")].sort_index()
+            logger.info(f"Candle store {t}: {len(stored)} candles, fetched {len(data) - len(stored)}")
+        else:
+            data = self.fetch_ohlcv(t, start_time, end_time)
+        if self.warmup_from_store:
+            self.candle_store.save(t, data[data.index <= end_time])
+        return data.iloc[-(self.ohlcv_len + 1):]
+
     def __update_ohlcv(self, action, new_data):
         """
         get and update OHLCV data and execute the strategy
+        :param action: timeframe of the klines
+        :param new_data: list of Kline records from the websocket
         """        
-        # Binance can output wierd timestamps - Eg. 2021-05-25 16:04:59.999000+00:00
-        # We need to round up to the nearest second for further processing
-        new_data = new_data.rename(index={new_data.iloc[0].name: new_data.iloc[0].name.ceil(freq='1T')})               
 
         if self.timeframe_data is None:
-            self.timeframe_data = {}            
-            for t in self.bin_size:                              
-                end_time = datetime.now(timezone.utc)
-                start_time = end_time - self.ohlcv_len * delta(t)
-                self.timeframe_data[t] = self.fetch_ohlcv(t, start_time, end_time)
-                #logger.info(f"timeframe_data: {self.timeframe_data}") 
-
-                self.timeframe_info[t] = {
-                    "allowed_range": allowed_range_minute_granularity[t][0] 
-                                    if self.minute_granularity else allowed_range[t][0], 
-                    "ohlcv": self.timeframe_data[t][:-1], # Dataframe with closed candles                                                   
-                    "last_action_time": None,#self.timeframe_data[t].iloc[-1].name, # Last strategy execution time
-                    "last_candle": self.timeframe_data[t].iloc[-2].values,  # Store last complete candle
-                    "partial_candle": self.timeframe_data[t].iloc[-1].values  # Store incomplete candle
-                }
-                # The last candle is an incomplete candle with timestamp in future                
-                if self.timeframe_data[t].iloc[-1].name > end_time:
-                    
-                    last_candle = self.timeframe_data[t].iloc[-1].values # Store last candle
-                    self.timeframe_data[t] = self.timeframe_data[t][:-1] # Exclude last candle
-                    self.timeframe_data[t].loc[end_time.replace(microsecond=0)] = last_candle #set last candle to end_time
+            self.__fill_ohlcv()
+
+        # after a reconnect the klines wait until the missed candles are merged
+        if self.candle_backfill is not None and \
+                self.candle_backfill.hold(action, new_data, self.timeframe_data, self.__update_ohlcv):
+            return
 
-                logger.info(f"Initial Buffer Fill - Last Candle: {self.timeframe_data[t].iloc[-1].name}")   
-        #logger.info(f"timeframe_data: {self.timeframe_data}") 
+        start = latency.now() if latency.enabled else 0
 
         # Timeframes to be updated
         timeframes_to_update = [allowed_range_minute_granularity[t][3] if self.timeframes_sorted != None 
@@ -1562,71 +1834,101 @@ class BinanceFutures:
 
         #logger.info(f"timefeames to update: {timeframes_to_update}")        
 
+        # the timeframes of this update, run in order by one strategy job
+        jobs = []
         for t in timeframes_to_update:
             # Find timeframe string based on its minute count value
             if self.timeframes_sorted != None:             
                 t = find_timeframe_string(t)               
                     
-            # replace latest candle if timestamp is same or append
-            if self.timeframe_data[t].iloc[-1].name == new_data.iloc[0].name:
-                self.timeframe_data[t] = pd.concat([self.timeframe_data[t][:-1], new_data])
-            else:
-                self.timeframe_data[t] = pd.concat([self.timeframe_data[t], new_data])      
+            # update the partial candle in place, it is moved to the closed candles 
+            # once the new data belongs to the next candle
+            ohlcv = self.timeframe_data[t]
+            for kline in new_data:
+                ohlcv.update(kline.timestamp, kline[1:])
+            self.timeframe_info[t]['partial_candle'] = ohlcv.partial # store partial candle data
 
-            # exclude current candle data and store partial candle data
-            re_sample_data = resample(self.timeframe_data[t], 
-                                      t, 
-                                      minute_granularity=True if self.minute_granularity else False)
-            self.timeframe_info[t]['partial_candle'] = re_sample_data.iloc[-1].values # store partial candle data
-            re_sample_data =re_sample_data[:-1] # exclude current candle data
+            last_candle_time = ohlcv.last_timestamp
+            if last_candle_time is None:
+                continue
 
-            #logger.info(f"{self.timeframe_info[t]['last_action_time']} : {self.timeframe_data[t].iloc[-1].name} : {re_sample_data.iloc[-1].name}")  
+            #logger.info(f"{self.timeframe_info[t]['last_action_time']} : {ohlcv.partial_time} : {last_candle_time}")  
 
             if self.call_strat_on_start:
                 if self.timeframe_info[t]["last_action_time"] is not None and \
-                self.timeframe_info[t]["last_action_time"] == re_sample_data.iloc[-1].name:
+                self.timeframe_info[t]["last_action_time"] == last_candle_time:
                     continue
             else:   
                 if self.timeframe_info[t]["last_action_time"] is None:
-                    self.timeframe_info[t]["last_action_time"] = re_sample_data.iloc[-1].name
+                    self.timeframe_info[t]["last_action_time"] = last_candle_time
                     
-                if self.timeframe_info[t]["last_action_time"] == re_sample_data.iloc[-1].name:
+                if self.timeframe_info[t]["last_action_time"] == last_candle_time:
                     continue
 
-            # The last candle in the buffer needs to be preserved 
-            # while resetting the buffer as it may be incomlete
-            # or contains latest data from WS
-            self.timeframe_data[t] = pd.concat([re_sample_data.iloc[-1 * self.ohlcv_len:, :], 
-                                                self.timeframe_data[t].iloc[[-1]]]) 
             #store ohlcv dataframe to timeframe_info dictionary
-            self.timeframe_info[t]["ohlcv"] = re_sample_data
-            #logger.info(f"Buffer Right Edge: {self.data.iloc[-1]}")
+            self.timeframe_info[t]["ohlcv"] = ohlcv.to_data_frame()
+            self.timeframe_info[t]["last_candle"] = ohlcv.last_candle
             
-            open = re_sample_data['open'].values
-            close = re_sample_data['close'].values
-            high = re_sample_data['high'].values
-            low = re_sample_data['low'].values
-            volume = re_sample_data['volume'].values 
-                                    
-            try:
-                if self.strategy is not None:   
-                    self.timestamp = re_sample_data.iloc[-1].name.isoformat()           
-                    self.strategy(t, open, close, high, low, volume)              
-                self.timeframe_info[t]['last_action_time'] = re_sample_data.iloc[-1].name
-            except FatalError as e:
-                # Fatal error
-                logger.error(f"Fatal error. {e}")
-                logger.error(traceback.format_exc())
-
-                notify(f"Fatal error occurred. Stopping Bot. {e}")
-                notify(traceback.format_exc())
-                self.stop()
-            except Exception as e:
-                logger.error(f"An error occurred. {e}")
-                logger.error(traceback.format_exc())    
-                notify(f"An error occurred. {e}")
-                notify(traceback.format_exc())
-   
+            # copies, the buffer moves on while the strategy runs on the executor thread
+            open = ohlcv.open.copy()
+            close = ohlcv.close.copy()
+            high = ohlcv.high.copy()
+            low = ohlcv.low.copy()
+            volume = ohlcv.volume.copy()
+
+            previous_action_time = self.timeframe_info[t]['last_action_time']
+            self.timeframe_info[t]['last_action_time'] = last_candle_time
+            jobs.append((t, last_candle_time, previous_action_time, open, close, high, low, volume))
+
+        if self.strategy is not None and len(jobs) > 0:
+            # a stale update of the same timeframes that did not run yet is replaced
+            self.strategy_executor.submit(",".join(job[0] for job in jobs), self.__run_strategies, jobs,
+                                          self.timeframe_data[self.__security_timeframe()].snapshot())
+
+        if latency.enabled:
+            latency.record("ohlcv", start)
+
+    def __run_strategies(self, jobs, security_source):
+        """
+        execute the strategy for every timeframe of an update on the strategy executor thread
+        :param jobs: arguments of __run_strategy by timeframe, in the order the timeframes run
+        :param security_source: snapshot of the candles security() resamples
+        """
+        self.security_source = security_source
+        try:
+            for job in jobs:
+                self.__run_strategy(*job)
+        finally:
+            self.security_source = None
+
+    def __run_strategy(self, t, last_candle_time, previous_action_time, open, close, high, low, volume):
+        """
+        execute the strategy on the strategy executor thread
+        """
+        try:
+            self.timestamp = last_candle_time.isoformat()
+            indicator_cache.next_bar(last_candle_time)
+            start = latency.now() if latency.enabled else 0
+            self.strategy(t, open, close, high, low, volume)
+            if latency.enabled:
+                latency.record("strategy", start)
+        except FatalError as e:
+            # Fatal error
+            logger.error(f"Fatal error. {e}")
+            logger.error(traceback.format_exc())
+
+            notify(f"Fatal error occurred. Stopping Bot. {e}", account=self.account)
+            notify(traceback.format_exc(), account=self.account)
+            self.stop()
+        except Exception as e:
+            logger.error(f"An error occurred. {e}")
+            logger.error(traceback.format_exc())    
+            notify(f"An error occurred. {e}", account=self.account)
+            notify(traceback.format_exc(), account=self.account)
+            # retried with the next update like when the strategy ran on the websocket thread
+            if self.timeframe_info[t]['last_action_time'] == last_candle_time:
+                self.timeframe_info[t]['last_action_time'] = previous_action_time
+
     def __on_update_instrument(self, action, instrument):
         """
         Update instrument price
@@ -1650,7 +1952,9 @@ class BinanceFutures:
                     self.market_price < self.get_trail_price():
                 self.set_trail_price(self.market_price)
             #Get PnL calculation in %
-            self.pnl = self.get_pnl() 
+            pnl = self.__state_profit()[3]
+            if pnl is not None:
+                self.pnl = pnl
 
     def __on_update_wallet(self, action, wallet):
         """
@@ -1663,6 +1967,9 @@ class BinanceFutures:
         Update order status
         https://binance-docs.github.io/apidocs/futures/en/#event-order-update
         """
+        self.account_state.on_order_update(order)
+        self.order_registry.on_order_update(order)
+
         order_info = {}
 
         # Normalize Order Info to canonical names
@@ -1770,57 +2077,63 @@ class BinanceFutures:
             return         
             
         # Was the position size changed?
-        is_update_pos_size = self.get_position_size() != float(position[0]['pa'])        
+        is_update_pos_size = self.position_size is not None and self.position is not None and \
+            self.position_size != float(position[0]['pa'])
 
         # Reset trail to current price if position size changes
         if is_update_pos_size and float(position[0]['pa']) != 0:
             self.set_trail_price(self.market_price)
         
         if is_update_pos_size:
+            balance = self.__state_profit()[0]
             logger.info(f"Updated Position\n"
                         f"Price: {self.position[0]['entryPrice']} => {position[0]['ep']}\n"
                         f"Qty: {self.position[0]['positionAmt']} => {position[0]['pa']}\n"
-                        f"Balance: {self.get_balance()} {self.quote_asset}")
+                        f"Balance: {balance} {self.quote_asset}")
             notify(f"Updated Position\n"
                    f"Price: {self.position[0]['entryPrice']} => {position[0]['ep']}\n"
                    f"Qty: {self.position[0]['positionAmt']} => {position[0]['pa']}\n"
-                   f"Balance: {self.get_balance()} {self.quote_asset}")
+                   f"Balance: {balance} {self.quote_asset}", account=self.account)
        
-        self.position[0] = {
-                            "entryPrice": position[0]['ep'],
-                            "marginType": position[0]['mt'],                            
-                            "positionAmt":  position[0]['pa'], 
-                            "symbol": position[0]['s'], 
-                            "unRealizedProfit":  position[0]['up'], 
-                            "positionSide": position[0]['ps'],
-                            } if self.position is not None else self.position[0]
+        # the account state got the event first
+        self.position = [self.account_state.position(self.pair)]
 
         self.position_size = float(self.position[0]['positionAmt'])
         self.entry_price = float(self.position[0]['entryPrice'])        
     
-        # Evaluation of profit and loss
+        # Evaluation of profit and loss, its REST calls (and their retries) don't hold up the websocket thread
+        if self.is_exit_order_active or self.is_sltp_active:
+            self.strategy_executor.submit("eval_position", self.__eval_position)
+
+    def __eval_position(self):
+        """
+        evaluate the exit and sltp orders on the strategy executor thread
+        """
         if self.is_exit_order_active:
             self.eval_exit()
         if self.is_sltp_active:
             self.eval_sltp()
 
+    def __on_update_account_config(self, action, config):
+        """
+        Update leverage
+        https://binance-docs.github.io/apidocs/futures/en/#event-account-configuration-update-previous-leverage-update
+        """
+        if 'ac' in config:
+            self.account_state.on_leverage(config['ac']['s'], config['ac']['l'])
+
     def __on_update_margin(self, action, margin):
         """
          Update margin 
         """
-        if self.margin is not None:
-            self.margin[0] = {
-                                "asset": self.quote_asset,
-                                "balance": float(margin['wb']),
-                                "crossWalletBalance": float(margin['cw'])
-                             }             
-        else: self.get_margin() 
+        # the account state got the event first
+        self.margin = self.account_state.balance_list()
 
-        balance = float(self.margin[0]['balance'])
-        position_size = self.get_position_size()
-        pnl = round(self.get_pnl())
-        profit = self.get_profit()
-        notify(f"Balance: {balance}\nPosition Size: {position_size}\nPnL: {profit:.2f}({pnl}%)")
+        balance, position_size, profit, pnl = self.__state_profit()
+        if balance is None:
+            return
+        pnl = round(pnl)
+        notify(f"Balance: {balance}\nPosition Size: {position_size}\nPnL: {profit:.2f}({pnl}%)", account=self.account)
         logger.info(f"Balance: {balance} Position Size: {position_size} PnL: {profit:.2f}({pnl}%)")     
 
         log_metrics(datetime.utcnow(), "margin", {
@@ -1830,12 +2143,12 @@ class BinanceFutures:
             "pnl": pnl
         },
         {
-            "exchange": conf["args"].exchange,
+            "exchange": self.exchange_name,
             "account": self.account,
             "pair": self.pair,
             "base_asset": self.base_asset,
             "quote_asset": self.quote_asset,
-            "strategy": conf["args"].strategy
+            "strategy": self.strategy_name
         })
 
     def add_ob_callback(self, id, callback):
@@ -1844,6 +2157,17 @@ class BinanceFutures:
     def remove_ob_callback(self, id):
         return self.best_bid_ask_change_callback.pop(id, None)
 
+    def __on_best_bid_ask_change(self):
+        """
+        call the best bid/ask callbacks on the callback executor thread
+        """
+        with self.best_bid_ask_lock:
+            best_bid_changed, best_ask_changed = self.best_bid_ask_changes
+            self.best_bid_ask_changes = None
+        for callback in self.best_bid_ask_change_callback.copy().values():
+            if callable(callback):
+                callback(best_bid_changed, best_ask_changed)
+
     def __on_update_bookticker(self, action, bookticker):
         """
         best bid and best ask price 
@@ -1861,10 +2185,14 @@ class BinanceFutures:
             self.best_ask_price = float(bookticker['a']) 
             best_ask_changed = True
             
-        if best_bid_changed or best_ask_changed:
-            for callback in self.best_bid_ask_change_callback.copy().values():
-                if callable(callback):
-                    callback(best_bid_changed, best_ask_changed)  
+        if (best_bid_changed or best_ask_changed) and len(self.best_bid_ask_change_callback) > 0:
+            # changes are merged while a callback run is queued, the callbacks only need the latest prices
+            with self.best_bid_ask_lock:
+                queued = self.best_bid_ask_changes is not None
+                bid_changed, ask_changed = self.best_bid_ask_changes or (False, False)
+                self.best_bid_ask_changes = (bid_changed or best_bid_changed, ask_changed or best_ask_changed)
+            if not queued:
+                self.callback_executor.call(self.__on_best_bid_ask_change)
 
         self.bid_quantity_L1 = float(bookticker['B'])         
         self.ask_quantity_L1 = float(bookticker['A']) 
@@ -1886,7 +2214,22 @@ class BinanceFutures:
             if len(self.bin_size) > 0: 
                 for t in self.bin_size: 
                     klines.add(allowed_range_minute_granularity[t][0]) if self.minute_granularity else klines.add(allowed_range[t][0])
-            self.ws = BinanceFuturesWs(account=self.account, pair=self.pair, bin_size=sorted(klines), test=self.demo)
+            # the buffers are filled before the streams start, the first kline can trigger the strategy at once
+            if self.timeframe_data is None and len(self.bin_size) > 0:
+                self.__fill_ohlcv()
+            self.candle_backfill = CandleBackfill(self.fetch_ohlcv)
+            if self.market_data_bus:
+                try:
+                    self.bus = MarketDataBus('binance', self.pair, sorted(klines), testnet=self.demo)
+                except FileNotFoundError:
+                    logger.info(f"Market data daemon does not publish {self.pair}, using own streams")
+            # market streams come from the daemon when it publishes the pair
+            self.ws = BinanceFuturesWs(account=self.account, pair=self.pair,
+                                       bin_size=sorted(klines) if self.bus is None else [], test=self.demo,
+                                       book_ticker=self.bus is None)
+            if self.bus is not None:
+                self.bus.heartbeat = self.ws.heartbeat
+                self.bus.bind('stale', lambda: self.__on_market_data_stale(sorted(klines)))
 
             #if len(self.bin_size) > 1:   
                 #self.minute_granularity=True  
@@ -1897,28 +2240,74 @@ class BinanceFutures:
             #self.ws.bind('1m' if self.minute_granularity else allowed_range[bin_size[0]][0] \
                         #, self.__update_ohlcv)     
 
-            if len(self.bin_size) > 0: 
-                for t in self.bin_size:                                        
-                    self.ws.bind(
-                        allowed_range_minute_granularity[t][0] if self.minute_granularity else allowed_range[t][0],
-                        self.__update_ohlcv
-                        )                              
+            self.__bind_market_data(self.ws if self.bus is None else self.bus)
             self.ws.bind('instrument', self.__on_update_instrument)
-            self.ws.bind('wallet', self.__on_update_wallet)
-            self.ws.bind('position', self.__on_update_position)
-            self.ws.bind('order', self.__on_update_order)
-            self.ws.bind('margin', self.__on_update_margin)
-            self.ws.bind('bookticker', self.__on_update_bookticker)            
+            self.ws.bind('open', self.__on_reconnect)
+            self.__bind_user_data(self.ws)
+            if self.account_reconcile_interval > 0:
+                # the REST calls run on the runtime's thread pool
+                self.reconcile_job = WebsocketRuntime.shared().call_every(self.account_reconcile_interval,
+                                                                          self.__reconcile, blocking=True)            
             #todo orderbook
             #self.ob = OrderBook(self.ws)
 
+    def __bind_user_data(self, ws):
+        """
+        bind the user data stream handlers, the events are applied in order on the callback executor thread
+        as their handlers notify and run the order callbacks, the loop thread only records the order ack latency
+        """
+        def on_order(action, order):
+            if latency.enabled:
+                latency.end("ack", order['c'])
+            self.callback_executor.call(self.__on_update_order, action, order)
+        ws.bind('wallet', partial(self.callback_executor.call, self.__on_update_wallet))
+        ws.bind('account', partial(self.callback_executor.call,
+                                   lambda action, data: self.account_state.on_account_update(data)))
+        ws.bind('account_config', partial(self.callback_executor.call, self.__on_update_account_config))
+        ws.bind('position', partial(self.callback_executor.call, self.__on_update_position))
+        ws.bind('order', on_order)
+        ws.bind('margin', partial(self.callback_executor.call, self.__on_update_margin))
+
+    def __bind_market_data(self, market_data):
+        """
+        bind the kline and bookTicker handlers to the websocket or the market data bus
+        """
+        if len(self.bin_size) > 0: 
+            for t in self.bin_size:                                        
+                market_data.bind(
+                    allowed_range_minute_granularity[t][0] if self.minute_granularity else allowed_range[t][0],
+                    self.__update_ohlcv
+                    )                              
+        market_data.bind('bookticker', self.__on_update_bookticker)
+
+    def __on_market_data_stale(self, klines):
+        """
+        the market data daemon stopped publishing, the own streams are used instead
+        :param klines: timeframes of the kline streams
+        """
+        logger.info(f"Market data daemon is silent, using own streams for {self.pair}")
+        notify(f"Market data daemon is silent, using own streams for {self.pair}", account=self.account)
+        self.bus.close()
+        self.bus = None
+        self.__bind_market_data(self.ws)
+        self.ws.subscribe(klines)
+
     def stop(self):
         """
         Stop the crawler
         """
         if self.is_running:
             self.is_running = False
+            self.strategy_executor.stop()
+            self.callback_executor.stop()
+            self.order_gateway.stop()
             self.ws.close()
+            if self.reconcile_job is not None:
+                self.reconcile_job.cancel()
+            for future in self.reconcile_futures:
+                future.cancel()
+            if self.bus is not None:
+                self.bus.close()
 
     def show_result(self):
         """
@@ -0,0 +1,170 @@
+# coding: UTF-8
+import threading
+import time
+
+from src import logger
+
+
+class BinanceFuturesAccountState:
+    """
+    Positions and balances of an account kept up to date from the user data stream
+    (ACCOUNT_UPDATE, ORDER_TRADE_UPDATE and ACCOUNT_CONFIG_UPDATE) in the format of the REST endpoints,
+    so reading them costs no request weight.
+    REST snapshots reconcile it on a schedule, after a websocket reconnect (events may be lost in between)
+    and when a fill is not followed by its ACCOUNT_UPDATE, differences are logged as drift.
+    """
+
+    # ACCOUNT_UPDATE fields by REST field
+    position_fields = {"positionAmt": "pa", "entryPrice": "ep", "breakEvenPrice": "bep", "unRealizedProfit": "up",
+                       "marginType": "mt", "isolatedWallet": "iw", "positionSide": "ps"}
+    balance_fields = {"balance": "wb", "crossWalletBalance": "cw"}
+
+    def __init__(self, fill_timeout=5):
+        """
+        :param fill_timeout: seconds after a fill before its missing ACCOUNT_UPDATE is considered lost
+        """
+        self.fill_timeout = fill_timeout
+        self.lock = threading.RLock()
+        # Positions by symbol, a list by position side like futures_position_information()
+        self.positions = {}
+        # Balances by asset like futures_account_balance_v2()
+        self.balances = {}
+        # Got a REST snapshot
+        self.synced = False
+        # Reason to reconcile before the next read, None when the stream is complete
+        self.stale = None
+        # Time of the fills waiting for their ACCOUNT_UPDATE by symbol
+        self.pending_fills = {}
+        # Event time of the last ACCOUNT_UPDATE in ms
+        self.last_event_time = 0
+        # Changes on every applied event
+        self.version = 0
+        self.last_reconcile = None
+        # Number of reconciliations that found differences
+        self.drifts = 0
+
+    def needs_reconcile(self, symbol=None):
+        """
+        whether the state can't be trusted without a REST snapshot
+        :param symbol: also check the fills of this symbol
+        """
+        with self.lock:
+            if not self.synced or self.stale is not None:
+                return True
+            fill_time = self.pending_fills.get(symbol)
+            return fill_time is not None and time.time() - fill_time > self.fill_timeout
+
+    def invalidate(self, reason):
+        """
+        reconcile before the next read
+        """
+        with self.lock:
+            self.stale = reason
+
+    def position(self, symbol):
+        """
+        position of a symbol as futures_position_information() returns it, None if unknown
+        """
+        with self.lock:
+            positions = self.positions.get(symbol)
+            return dict(positions[0]) if positions else None
+
+    def balance_list(self):
+        """
+        balances as futures_account_balance_v2() returns them
+        """
+        with self.lock:
+            return [dict(b) for b in self.balances.values()]
+
+    def on_account_update(self, data):
+        """
+        apply an ACCOUNT_UPDATE event, it only has the changed positions and balances
+        """
+        with self.lock:
+            event_time = data.get('E', 0)
+            if event_time < self.last_event_time:
+                self.invalidate(f"ACCOUNT_UPDATE out of order ({event_time} < {self.last_event_time})")
+                return
+            self.last_event_time = event_time
+            for p in data['a'].get('P', []):
+                positions = self.positions.setdefault(p['s'], [])
+                position = next((x for x in positions if x.get('positionSide') == p.get('ps')), None)
+                if position is None:
+                    position = {"symbol": p['s']}
+                    positions.append(position)
+                position.update({k: p[f] for k, f in self.position_fields.items() if f in p})
+                self.pending_fills.pop(p['s'], None)
+            for b in data['a'].get('B', []):
+                balance = self.balances.setdefault(b['a'], {"asset": b['a']})
+                balance.update({k: b[f] for k, f in self.balance_fields.items() if f in b})
+            self.version += 1
+
+    def on_order_update(self, order):
+        """
+        note the fills of an ORDER_TRADE_UPDATE order, their ACCOUNT_UPDATE is expected shortly
+        """
+        if order.get('x') == 'TRADE':
+            with self.lock:
+                self.pending_fills.setdefault(order['s'], time.time())
+                self.version += 1
+
+    def on_leverage(self, symbol, leverage):
+        """
+        leverage changed (ACCOUNT_CONFIG_UPDATE or futures_change_leverage())
+        """
+        with self.lock:
+            for position in self.positions.get(symbol, []):
+                position["leverage"] = str(leverage)
+            self.version += 1
+
+    def reconcile(self, positions, balances, version=None):
+        """
+        replace the state with REST snapshots and log the differences
+        :param positions: futures_position_information()
+        :param balances: futures_account_balance_v2()
+        :param version: version when the snapshots were requested, they are older than the events applied since
+        :return: list of differences
+        """
+        with self.lock:
+            if self.synced and version is not None and version != self.version:
+                # retried on the next read, the state is not trusted until then
+                self.stale = self.stale or "events during reconciliation"
+                return []
+            snapshot = {}
+            for p in positions:
+                snapshot.setdefault(p['symbol'], []).append(dict(p))
+            balance_snapshot = {b['asset']: dict(b) for b in balances}
+            drift = self.__drift(snapshot, balance_snapshot) if self.synced else []
+            if len(drift) > 0:
+                self.drifts += 1
+                logger.warning(f"Account state drift ({self.stale or 'scheduled'}): {'; '.join(drift)}")
+            self.positions = snapshot
+            self.balances = balance_snapshot
+            self.synced = True
+            self.stale = None
+            self.pending_fills = {}
+            self.last_reconcile = time.time()
+            self.version += 1
+            return drift
+
+    def __drift(self, positions, balances):
+        drift = []
+        for symbol in set(positions) | set(self.positions):
+            for side in {p.get('positionSide') for p in positions.get(symbol, []) + self.positions.get(symbol, [])}:
+                new = next((p for p in positions.get(symbol, []) if p.get('positionSide') == side), {})
+                old = next((p for p in self.positions.get(symbol, []) if p.get('positionSide') == side), {})
+                for field in ["positionAmt", "entryPrice", "leverage"]:
+                    if not self.__equal(old.get(field), new.get(field)):
+                        drift.append(f"{symbol} {side} {field} {old.get(field)} => {new.get(field)}")
+        for asset in set(balances) | set(self.balances):
+            old, new = self.balances.get(asset, {}).get("balance"), balances.get(asset, {}).get("balance")
+            if not self.__equal(old, new):
+                drift.append(f"{asset} balance {old} => {new}")
+        return drift
+
+    @staticmethod
+    def __equal(a, b):
+        try:
+            return abs(float(a or 0) - float(b or 0)) <= 1e-8 * max(1, abs(float(b or 0)))
+        except (TypeError, ValueError):
+            return a == b
@@ -22,7 +22,8 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from urllib.parse import urlparse
+from urllib.parse import urlparse, quote
+import json
 import time, hashlib, hmac
 import requests
 from requests.adapters import HTTPAdapter
@@ -30,9 +31,58 @@ from requests.packages.urllib3.util.retry import Retry
 import logging
 from operator import itemgetter
 
+from src import RateLimiter, rate_limited, latency
 from .exceptions import BinanceAPIException, BinanceRequestException, BinanceWithdrawException
 
 
+# Request weights of the futures endpoints (https://binance-docs.github.io/apidocs/futures/en/)
+# by path, and by path without symbol
+futures_weights = {
+    "depth": 2, "trades": 5, "historicalTrades": 20, "aggTrades": 20, "allOrders": 5, "balance": 5, "account": 5,
+    "positionRisk": 5, "userTrades": 5, "income": 30, "batchOrders": 5, "ticker/price": 1, "ticker/bookTicker": 1,
+    "ticker/24hr": 1, "openOrders": 1, "premiumIndex": 1
+}
+futures_weights_without_symbol = {
+    "ticker/price": 2, "ticker/bookTicker": 2, "ticker/24hr": 40, "openOrders": 40, "premiumIndex": 10
+}
+# Order placement, cancels and the listen key go first
+futures_order_paths = ["order", "batchOrders", "allOpenOrders", "listenKey"]
+
+
+def _json_param(value):
+    """
+    list parameter of the batch endpoints, url encoded before it is signed so that the signature
+    is computed on the query string that is sent
+    """
+    return quote(json.dumps(value, separators=(',', ':')), safe='')
+
+
+def futures_request_weight(request):
+    """
+    weight and priority of a futures request
+    :param request: requests.PreparedRequest
+    :return: (weight, priority)
+    """
+    url = urlparse(request.url)
+    path = url.path.split('/fapi/', 1)[-1].split('/', 1)[-1]
+    query = url.query or ''
+    if path == "klines" or path.endswith("PriceKlines"):
+        limit = next((int(q[len("limit="):]) for q in query.split('&') if q.startswith("limit=")), 500)
+        weight = 1 if limit < 100 else 2 if limit < 500 else 5 if limit <= 1000 else 10
+    elif "symbol=" not in query and request.method == "GET" and path in futures_weights_without_symbol:
+        weight = futures_weights_without_symbol[path]
+    else:
+        weight = futures_weights.get(path, 1)
+    priority = RateLimiter.ORDER if request.method != "GET" and path in futures_order_paths else RateLimiter.QUERY
+    return weight, priority
+
+
+def futures_used_weight(limiter, response):
+    used = response.headers.get('X-MBX-USED-WEIGHT-1M')
+    if used is not None:
+        limiter.update(int(used))
+
+
 class Client(object):
 
     API_URL = 'https://api.binance.{}/api'
@@ -104,7 +154,8 @@ class Client(object):
     AGG_BUYER_MAKES = 'm'
     AGG_BEST_MATCH = 'M'
 
-    def __init__(self, api_key=None, api_secret=None, testnet=False, requests_params=None, tld='com'):
+    def __init__(self, api_key=None, api_secret=None, testnet=False, requests_params=None, tld='com', rate_limiter=None,
+                 pool_size=10, timeout=(3.05, 10), retries=3):
         """Binance API Client constructor
         :param api_key: Api Key
         :type api_key: str.
@@ -112,7 +163,16 @@ class Client(object):
         :type api_secret: str.
         :param requests_params: optional - Dictionary of requests params to use for all calls
         :type requests_params: dict.
+        :param rate_limiter: optional - RateLimiter shared with other clients, 2400 weight per minute by default
+        :param pool_size: optional - kept-alive connections, requests sent in parallel at most without reconnecting
+        :param timeout: optional - seconds to connect and to read a response of every request
+        :param retries: optional - connection errors and 5xx responses retried by the transport,
+                        the retry() helpers retry with backoff on top of it
         """
+        self.rate_limiter = rate_limiter or RateLimiter(2400)
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
 
         self.API_URL = self.API_URL.format(tld)
         self.WITHDRAW_API_URL = self.WITHDRAW_API_URL.format(tld)
@@ -124,6 +184,8 @@ class Client(object):
             self.FUTURES_URL = self.FUTURES_URL.format(tld)
         self.API_KEY = api_key
         self.API_SECRET = api_secret
+        # keyed once, every signature copies it
+        self._signer = hmac.new(api_secret.encode('utf-8'), digestmod=hashlib.sha256) if api_secret else None
         self.session = self._init_session()
         self._requests_params = requests_params
         self.response = None
@@ -138,12 +200,13 @@ class Client(object):
                                 'User-Agent': 'binance/python',
                                 'X-MBX-APIKEY': self.API_KEY})
         
-        retry = Retry(total=730, #retry for more than 24 hours
-                backoff_factor=1, #0.5, 1, 2, 4, 8, 16, 32, 64, 128 intervals
+        # a few quick retries, a request must not block its caller for longer than its deadline
+        retry = Retry(total=self.retries,
+                backoff_factor=0.1, #0.1, 0.2, 0.4 intervals
                 status_forcelist=[ 500, 502, 503, 504 ])
-        adapter = HTTPAdapter(max_retries=retry)
-        session.mount('http://', adapter)
-        session.mount('https://', adapter)
+        # weight aware, orders and cancels before queries near the limit
+        rate_limited(session, self.rate_limiter, weight=futures_request_weight, usage=futures_used_weight,
+                     max_retries=retry, pool_maxsize=self.pool_size)
         logging.getLogger("urllib3").setLevel(logging.ERROR)
 
         return session
@@ -171,7 +234,8 @@ class Client(object):
 
         ordered_data = self._order_params(data)
         query_string = '&'.join(["{}={}".format(d[0], d[1]) for d in ordered_data])
-        m = hmac.new(self.API_SECRET.encode('utf-8'), query_string.encode('utf-8'), hashlib.sha256)
+        m = self._signer.copy()
+        m.update(query_string.encode('utf-8'))
         return m.hexdigest()
 
     def _order_params(self, data):
@@ -195,7 +259,7 @@ class Client(object):
     def _request(self, method, uri, signed, force_params=False, **kwargs):
 
         # set default requests timeout
-        kwargs['timeout'] = 10
+        kwargs['timeout'] = self.timeout
 
         # add our global requests params
         if self._requests_params:
@@ -211,6 +275,7 @@ class Client(object):
                 kwargs.update(kwargs['data']['requests_params'])
                 del(kwargs['data']['requests_params'])
 
+        start = latency.now() if latency.enabled and signed else 0
         if signed:
             # generate signature
             kwargs['data']['timestamp'] = int(time.time() * 1000)
@@ -230,8 +295,14 @@ class Client(object):
             kwargs['params'] = '&'.join('%s=%s' % (data[0], data[1]) for data in kwargs['data'])
             del(kwargs['data'])
 
-        self.response = getattr(self.session, method)(uri, **kwargs)
-        return self._handle_response()
+        if start:
+            latency.record("sign", start)
+            start = latency.now()
+        # the client is shared between threads, keep the response of this request
+        response = self.response = getattr(self.session, method)(uri, **kwargs)
+        if start:
+            latency.record("rest", start)
+        return self._handle_response(response)
 
     def _request_api(self, method, path, signed=False, version=PUBLIC_API_VERSION, **kwargs):
         uri = self._create_api_uri(path, signed, version)
@@ -258,19 +329,19 @@ class Client(object):
 
         return self._request(method, uri, signed, True, **kwargs)
 
-    def _handle_response(self):
+    def _handle_response(self, response=None):
             """Internal helper for handling API responses from the Binance server.
             Raises the appropriate exceptions when necessary; otherwise, returns the
             response.
             """
-            
-            if not str(self.response.status_code).startswith('2'):
-                raise BinanceAPIException(self.response)
+            response = response if response is not None else self.response
+            if not str(response.status_code).startswith('2'):
+                raise BinanceAPIException(response)
             try:
-                return self.response.json(),self.response
+                return response.json(),response
                 
             except ValueError:
-                raise BinanceRequestException('Invalid Response: %s' % self.response.text)
+                raise BinanceRequestException('Invalid Response: %s' % response.text)
 
     def _get(self, path, signed=False, version=PUBLIC_API_VERSION, **kwargs):
         return self._request_futures_api('get', path, signed, **kwargs)
@@ -473,10 +544,24 @@ class Client(object):
         """
         return self._request_futures_api('delete', 'allOpenOrders', True, data=params)
 
+    def futures_place_batch_order(self, **params):
+        """Send in up to 5 new orders
+        https://binance-docs.github.io/apidocs/futures/en/#place-multiple-orders-trade
+        :param batchOrders: list of futures_create_order() params
+        :return: list of the orders, {"code", "msg"} for a rejected order
+        """
+        params['batchOrders'] = _json_param([{k: str(v) for k, v in order.items()} for order in params['batchOrders']])
+        return self._request_futures_api('post', 'batchOrders', True, data=params)
+
     def futures_cancel_orders(self, **params):
         """Cancel multiple futures orders
         https://binance-docs.github.io/apidocs/futures/en/#cancel-multiple-orders-trade
+        :param orderIdList or origClientOrderIdList: list of up to 10 ids
+        :return: list of the orders, {"code", "msg"} for an order that could not be canceled
         """
+        for key in ['orderIdList', 'origClientOrderIdList']:
+            if isinstance(params.get(key), list):
+                params[key] = _json_param(params[key])
         return self._request_futures_api('delete', 'batchOrders', True, data=params)
 
     def futures_account_balance(self, **params):
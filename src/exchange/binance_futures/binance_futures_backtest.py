@@ -14,7 +14,7 @@ from src import (logger, allowed_range,
                  allowed_range_minute_granularity, 
                  retry, delta, load_data, resample, symlink,
                 find_timeframe_string, sync_obj_with_config)
-from src.indicators import sharpe_ratio
+from src.indicators import sharpe_ratio, indicator_cache
 from src.exchange_config import exchange_config
 from src.exchange.binance_futures.binance_futures_stub import BinanceFuturesStub
 
@@ -148,6 +148,8 @@ class BinanceFuturesBackTest(BinanceFuturesStub):
         self.df_ohlcv.index = pd.to_datetime(self.df_ohlcv.index, errors='coerce')
         
         start = time.time()
+        indicator_cache.clear()
+        self.resample_data = {}
 
         # load and resample warmup data
         self.warmup_len = (allowed_range_minute_granularity[self.warmup_tf][3] * self.ohlcv_len) \
@@ -227,6 +229,7 @@ class BinanceFuturesBackTest(BinanceFuturesStub):
 
                 #self.eval_sltp()
                 self.timestamp = tf_ohlcv_data.iloc[-1].name.isoformat().replace("T"," ")
+                indicator_cache.next_bar(tf_ohlcv_data.iloc[-1].name)
                 self.strategy(t, open, close, high, low, volume)      
                 self.timeframe_info[t]['last_action_index'] += 1           
 
@@ -251,15 +254,21 @@ class BinanceFuturesBackTest(BinanceFuturesStub):
         """
         Recalculate and obtain data of a timeframe higher than the current timeframe
         without looking into the future that would cause undesired effects.
+        The whole dataset is resampled once per timeframe and only sliced up to the current bar.
         """
-        if data == None and bin_size not in self.bin_size:           
-            timeframe_list = [allowed_range_minute_granularity[t][3] for t in self.bin_size] # minute count of a timeframe for sorting when sorting is needed 
-            timeframe_list.sort(reverse=True)
-            t = find_timeframe_string(timeframe_list[-1])   
-            data = self.timeframe_data[t]
-          
-        self.resample_data[bin_size] = resample(data, bin_size)
-        return self.resample_data[bin_size][:self.data.iloc[-1].name].iloc[-1 * self.ohlcv_len:, :]
+        if data is None:
+            if bin_size not in self.resample_data:
+                timeframe_list = [allowed_range_minute_granularity[t][3] for t in self.bin_size] # minute count of a timeframe for sorting when sorting is needed 
+                timeframe_list.sort(reverse=True)
+                t = find_timeframe_string(timeframe_list[-1])   
+                self.resample_data[bin_size] = resample(self.timeframe_data[t], bin_size)
+            data = self.resample_data[bin_size]
+        else:
+            data = resample(data, bin_size)
+
+        # Only the candles closed up to the current bar
+        end = data.index.searchsorted(self.data.iloc[-1].name, side="right")
+        return data.iloc[max(end - self.ohlcv_len, 0):end]
  
     def check_candles(self, df):
         """
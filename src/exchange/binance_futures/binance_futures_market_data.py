@@ -0,0 +1,64 @@
+# coding: UTF-8
+import traceback
+
+from src import logger, json_loads
+from src.exchange.binance_futures.binance_futures_websocket import to_kline
+from src.exchange.market_data_bus import MarketDataBus, SharedRing, ring_name
+from src.exchange.websocket_runtime import WebSocketApp
+
+
+class BinanceFuturesMarketData:
+    """
+    Publishes the klines and best bid/ask of one pair from one public websocket into shared memory rings,
+    read by the bots of every process through MarketDataBus.
+    """
+
+    def __init__(self, pair, bin_size, testnet=False, capacity=1440):
+        """
+        :param pair: pair
+        :param bin_size: timeframes of the kline streams, e.g. ['1m']
+        :param testnet: use the testnet streams
+        :param capacity: number of candles kept by timeframe
+        """
+        self.pair = pair.lower()
+        self.bin_size = bin_size
+        self.domain = 'stream.binancefuture.com' if testnet else 'fstream.binance.com'
+        self.rings = {t: SharedRing(ring_name('binance', pair, t, testnet), len(MarketDataBus.kline_fields),
+                                    capacity, create=True) for t in bin_size}
+        self.rings['bookticker'] = SharedRing(ring_name('binance', pair, 'bookticker', testnet),
+                                              len(MarketDataBus.bookticker_fields), 1024, create=True)
+        streams = [self.pair + '@bookTicker'] + [self.pair + '@kline_' + t for t in bin_size]
+        self.ws = WebSocketApp('wss://' + self.domain + '/stream?streams=' + '/'.join(streams),
+                               on_message=self.__on_message,
+                               on_error=lambda ws, e: logger.error(f"Market data {self.pair} error - {e}")).start()
+
+    def __on_message(self, ws, message):
+        try:
+            data = json_loads(message)['data']
+            e = data.get('e')
+            if e == 'kline':
+                ring = self.rings.get(data['k']['i'])
+                if ring is None:
+                    return
+                kline = to_kline(data['k'])
+                row = [kline.timestamp.value // 10**6, *kline[1:]]
+                last = ring.last()
+                if last is not None and row[0] < last[0]:
+                    return
+                # updates of the open candle overwrite each other
+                ring.write(row, replace_last=last is not None and row[0] == last[0])
+            elif e == 'bookTicker':
+                self.rings['bookticker'].write([data['T'], float(data['b']), float(data['B']),
+                                                float(data['a']), float(data['A'])])
+        except Exception as e:
+            logger.error(e)
+            logger.error(traceback.format_exc())
+
+    def close(self):
+        self.ws.close()
+        # on the loop thread, after a message being written
+        self.ws.runtime.call_soon(self.__close_rings)
+
+    def __close_rings(self):
+        for ring in self.rings.values():
+            ring.close()
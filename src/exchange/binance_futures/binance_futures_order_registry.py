@@ -0,0 +1,134 @@
+# coding: UTF-8
+import threading
+import time
+from collections import OrderedDict
+
+from src import logger
+
+
+class BinanceFuturesOrderRegistry:
+    """
+    Open orders of one pair by clientOrderId, kept in the format of futures_get_open_orders()
+    from the order responses and the ORDER_TRADE_UPDATE events, so looking orders up costs no request weight.
+    Seeded from REST and reconciled like BinanceFuturesAccountState, differences are logged as drift.
+    """
+
+    # ORDER_TRADE_UPDATE fields by REST field
+    order_fields = {"clientOrderId": "c", "orderId": "i", "symbol": "s", "type": "o", "origType": "ot", "side": "S",
+                    "positionSide": "ps", "status": "X", "timeInForce": "f", "origQty": "q", "executedQty": "z",
+                    "price": "p", "avgPrice": "ap", "stopPrice": "sp", "reduceOnly": "R", "closePosition": "cp",
+                    "workingType": "wt", "priceProtect": "pP", "updateTime": "T"}
+    open_statuses = ["NEW", "PARTIALLY_FILLED"]
+    # Closed order ids remembered to ignore late updates
+    max_closed = 1000
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.lock = threading.RLock()
+        # Open orders by clientOrderId, oldest first
+        self.orders = OrderedDict()
+        # Update time of the recently closed orders by clientOrderId
+        self.closed = OrderedDict()
+        # Got a REST snapshot
+        self.synced = False
+        # Reason to reconcile before the next read, None when the stream is complete
+        self.stale = None
+        # Changes on every applied update
+        self.version = 0
+        self.last_reconcile = None
+        # Number of reconciliations that found differences
+        self.drifts = 0
+
+    def needs_reconcile(self):
+        with self.lock:
+            return not self.synced or self.stale is not None
+
+    def invalidate(self, reason):
+        """
+        reconcile before the next read
+        """
+        with self.lock:
+            self.stale = reason
+
+    def find(self, prefix=""):
+        """
+        open orders whose clientOrderId starts with prefix, oldest first
+        """
+        with self.lock:
+            return [dict(o) for id, o in self.orders.items() if id.startswith(prefix)]
+
+    def update(self, order):
+        """
+        apply an order in the REST format (order response or converted event)
+        :return: False if it is older than what is known
+        """
+        with self.lock:
+            id = order["clientOrderId"]
+            update_time = int(order.get("updateTime") or 0)
+            known = self.orders.get(id)
+            if known is not None and update_time < int(known.get("updateTime") or 0):
+                return False
+            if known is None and update_time <= self.closed.get(id, -1):
+                # late update of an order that is already closed
+                return False
+            if order.get("status") in self.open_statuses:
+                self.orders[id] = {**known, **order} if known is not None else dict(order)
+                self.closed.pop(id, None)
+            else:
+                self.orders.pop(id, None)
+                self.closed[id] = update_time
+                self.closed.move_to_end(id)
+                while len(self.closed) > self.max_closed:
+                    self.closed.popitem(last=False)
+            self.version += 1
+            return True
+
+    def on_order_update(self, order):
+        """
+        apply an ORDER_TRADE_UPDATE order
+        """
+        if order.get('s') != self.symbol:
+            return
+        self.update({k: order[f] for k, f in self.order_fields.items() if f in order})
+
+    def on_cancel_all(self):
+        """
+        every open order was canceled
+        """
+        with self.lock:
+            now = int(time.time() * 1000)
+            for id in list(self.orders):
+                self.update({**self.orders[id], "status": "CANCELED", "updateTime": now})
+
+    def reconcile(self, open_orders, version=None):
+        """
+        replace the open orders with a REST snapshot and log the differences
+        :param open_orders: futures_get_open_orders()
+        :param version: version when the snapshot was requested, it is older than the updates applied since
+        :return: list of differences
+        """
+        with self.lock:
+            if self.synced and version is not None and version != self.version:
+                self.stale = self.stale or "order updates during reconciliation"
+                return []
+            snapshot = OrderedDict((o["clientOrderId"], dict(o)) for o in open_orders)
+            drift = []
+            if self.synced:
+                for id in set(snapshot) | set(self.orders):
+                    if id not in snapshot:
+                        drift.append(f"{id} closed")
+                    elif id not in self.orders:
+                        drift.append(f"{id} open")
+                    elif float(snapshot[id]["executedQty"]) != float(self.orders[id].get("executedQty", 0)):
+                        drift.append(f"{id} executedQty {self.orders[id].get('executedQty')} => "
+                                     f"{snapshot[id]['executedQty']}")
+            drift.sort()
+            if len(drift) > 0:
+                self.drifts += 1
+                logger.warning(f"Open orders drift ({self.stale or 'scheduled'}): {'; '.join(drift)}")
+            self.orders = snapshot
+            self.synced = True
+            self.stale = None
+            self.last_reconcile = time.time()
+            self.version += 1
+            return drift
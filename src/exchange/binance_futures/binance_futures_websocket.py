@@ -9,13 +9,13 @@ import traceback
 import urllib
 import requests
 
-import websocket
 from datetime import datetime
 from pytz import UTC
 
-from src import logger, to_data_frame, notify
+from src import logger, notify, json_loads, Kline, kline_timestamp, Heartbeat, shared_client, latency
 from src.config import config as conf
 from src.exchange.binance_futures.binance_futures_api import Client
+from src.exchange.websocket_runtime import WebSocketApp
 
 
 def generate_nonce():
@@ -23,35 +23,50 @@ def generate_nonce():
 
 
 def get_listenkey(api_key, api_secret, testnet): 
-    client = Client(api_key=api_key, api_secret=api_secret, testnet=testnet)
+    client = shared_client((Client, api_key, testnet), lambda: Client(api_key=api_key, api_secret=api_secret, testnet=testnet))
     listenKey = client.stream_get_listen_key()
     return listenKey
 
 
-class BinanceFuturesWs:    
+def to_kline(k):
+    """
+    Kline of the "k" object of a kline stream message
+    """
+    # Binance can output wierd timestamps - Eg. 2021-05-25 16:04:59.999000+00:00
+    # We need to round up to the nearest minute for further processing
+    return Kline(kline_timestamp(k['T'], ceil=True), float(k['o']), float(k['h']),
+                 float(k['l']), float(k['c']), float(k['v']))
 
-    def __init__(self, account, pair, bin_size, test=False):
-        """
-        constructor
-        """
+
+class BinanceFuturesStream:
+    """
+    The websocket of an account, shared by the BinanceFuturesWs of every bot of the process trading with it:
+    one listen key, keep alive and user data stream per account and testnet,
+    plus the ticker, kline and bookTicker streams of the pairs of its bots.
+    Market data events go to the bots of their pair, user data events to every bot of the account.
+    Streams of a bot joining or leaving are (un)subscribed on the open connection.
+    """
+
+    # The connections of the process by (account, testnet)
+    instances = {}
+    instance_lock = threading.Lock()
+
+    def __init__(self, account, testnet=False):
         # Account
         self.account = account
-        # Pair
-        self.pair = pair.lower()
-		# TFs Array
-        self.bin_size = bin_size
         # testnet
-        self.testnet = test
-        # domain
-        domain = None
+        self.testnet = testnet
         # Use healthchecks.io
         self.use_healthcecks = True
-        # Last Heartbeat
-        self.last_heartbeat = 0
-        # condition that the bot runs on.
+        # Pings healthchecks.io from its own thread
+        self.heartbeat = Heartbeat(conf.get('healthchecks.io', {}).get(self.account, {}) if self.use_healthcecks else {})
+        # condition that the connection runs on.
         self.is_running = True
-        # Notification destination listener
-        self.handlers = {}
+        # BinanceFuturesWs of the bots, replaced on change so the loop thread reads it without the lock
+        self.subscribers = ()
+        # Market streams of the open connection
+        self.connected_streams = set()
+        self.request_id = 0
         # listen key
         self.listenKey = None
         # API keys
@@ -59,27 +74,79 @@ class BinanceFuturesWs:
                             if self.testnet else conf['binance_keys'][self.account]['API_KEY']
         self.api_secret = conf['binance_test_keys'][self.account]['SECRET_KEY'] \
                             if self.testnet else conf['binance_keys'][self.account]['SECRET_KEY']        
-        if test:
+        if testnet:
             self.domain = 'stream.binancefuture.com'
         else:
             self.domain = 'fstream.binance.com'
         self.__get_auth_user_data_streams()
-        self.ws = websocket.WebSocketApp(self.__get_wss_endpoint(),
-                             on_message=self.__on_message,
-                             on_error=self.__on_error,
-                             on_close=self.__on_close)                             
-                             
-        self.wst = threading.Thread(target=self.__start)
-        self.wst.daemon = True
-        self.wst.start()
+        # Runs on the shared asyncio websocket runtime, reconnects itself
+        # and gets the endpoint again on every reconnect as the listen key can change
+        self.ws = WebSocketApp(self.__get_wss_endpoint,
+                               on_open=self.__on_open,
+                               on_message=self.__on_message,
+                               on_error=self.__on_error,
+                               on_close=self.__on_close)
+        self.keep_alive = None
         self.__keep_alive_user_datastream(self.listenKey)
 
+    @classmethod
+    def attach(cls, subscriber):
+        """
+        the connection of the account of a BinanceFuturesWs, opened for its first subscriber
+        :return: BinanceFuturesStream
+        """
+        with cls.instance_lock:
+            key = (subscriber.account, subscriber.testnet)
+            stream = cls.instances.get(key)
+            if stream is None:
+                stream = cls.instances[key] = cls(subscriber.account, subscriber.testnet)
+                stream.subscribers = (subscriber,)
+                stream.ws.start()
+            else:
+                stream.subscribers = stream.subscribers + (subscriber,)
+                stream.update()
+            return stream
+
+    def detach(self, subscriber):
+        """
+        remove a BinanceFuturesWs, the connection is closed with its last subscriber
+        """
+        with self.instance_lock:
+            self.subscribers = tuple(s for s in self.subscribers if s is not subscriber)
+            if len(self.subscribers) > 0:
+                self.update()
+                return
+            if self.instances.get((self.account, self.testnet)) is self:
+                del self.instances[(self.account, self.testnet)]
+        self.close()
+
+    def streams(self):
+        """
+        market streams of every subscriber
+        """
+        return set(stream for subscriber in self.subscribers for stream in subscriber.streams())
+
+    def update(self):
+        """
+        (un)subscribe the market streams that changed on the open connection,
+        a connection opening meanwhile subscribes them on open
+        """
+        self.ws.runtime.call_soon(self.__sync_streams)
+
+    def __sync_streams(self):
+        if self.ws.connection is None:
+            return
+        streams = self.streams()
+        for method, params in [("SUBSCRIBE", streams - self.connected_streams),
+                               ("UNSUBSCRIBE", self.connected_streams - streams)]:
+            if len(params) > 0:
+                self.request_id += 1
+                self.ws.send(json.dumps({"method": method, "params": sorted(params), "id": self.request_id}))
+        self.connected_streams = streams
+
     def __get_wss_endpoint(self):
-        klines = ""
-        if len(self.bin_size) > 0: 
-            for t in self.bin_size: 
-                klines += self.pair + '@kline_' + t + '/'
-        return 'wss://' + self.domain + '/stream?streams=' + self.listenKey + '/' + self.pair + '@ticker/' + self.pair + '@bookTicker/' + klines
+        self.connected_streams = self.streams()
+        return 'wss://' + self.domain + '/stream?streams=' + '/'.join([self.listenKey] + sorted(self.connected_streams))
    
     def __get_auth_user_data_streams(self):
         """
@@ -90,57 +157,47 @@ class BinanceFuturesWs:
         else:
             logger.info("WebSocket is not able to get listenKey for user data streams") 
 
-    def __start(self):
+    def __renew_listen_key(self):
         """
-        start the websocket.
+        get a new listen key and reconnect with it
         """
-        self.ws.run_forever()
-    
+        self.__get_auth_user_data_streams()
+        self.ws.reconnect()
+
     def __keep_alive_user_datastream(self, listenKey):
         """
         keep alive user data stream, needs to ping every 60m
         """              
-        client = Client(self.api_key, self.api_secret, self.testnet)
-        def loop_function():
-            while self.is_running:
-                try:
-                    # retries 10 times over 486secs
-                    # before raising error/exception
-                    # check binance_futures_api.py line 113
-                    # for implementation details
-
-                    #client.stream_keepalive()
-                    listenKey = client.stream_get_listen_key() 
-                    
-                    if self.listenKey != listenKey:
-                        logger.info("listenKey Changed!")
-                        notify("listenKey Changed!")
-                        self.listenKey = listenKey
-                        self.ws.close()
-
-                    # Send a heartbeat to Healthchecks.io
-                    if self.use_healthcecks:
-                        try:
-                            requests.get(conf['healthchecks.io'][self.account]['listenkey_heartbeat'])
-                            #logger.info("Listen Key Heart Beat sent!") 
-                        except Exception as e:
-                            pass
-
-                    time.sleep(600)
-                except Exception as e:
-                    logger.error(f"Keep Alive Error - {str(e)}")
-                    #logger.error(traceback.format_exc())
-
-                    notify(f"Keep Alive Error - {str(e)}")
-                    #notify(traceback.format_exc())
-
-        timer = threading.Timer(10, loop_function)
-        timer.daemon = True
-        if listenKey is not None:  
-            timer.start()            
-        else: 
+        client = shared_client((Client, self.api_key, self.testnet), lambda: Client(self.api_key, self.api_secret, self.testnet))
+        def keep_alive():
+            try:
+                # retries 10 times over 486secs
+                # before raising error/exception
+                # check binance_futures_api.py line 113
+                # for implementation details
+
+                #client.stream_keepalive()
+                listenKey = client.stream_get_listen_key() 
+                
+                if self.listenKey != listenKey:
+                    logger.info("listenKey Changed!")
+                    notify("listenKey Changed!", account=self.account)
+                    self.listenKey = listenKey
+                    self.ws.reconnect()
+
+                # Signal the heartbeat worker that the listen key is alive
+                self.heartbeat.beat('listenkey_heartbeat')
+            except Exception as e:
+                logger.error(f"Keep Alive Error - {str(e)}")
+                #logger.error(traceback.format_exc())
+
+                notify(f"Keep Alive Error - {str(e)}", account=self.account)
+                #notify(traceback.format_exc())
+
+        if listenKey is None:  
             self.__get_auth_user_data_streams()
-            timer.start() 
+        # blocking REST calls run on the runtime's thread pool, not on the event loop
+        self.keep_alive = self.ws.runtime.call_every(600, keep_alive, delay=10, blocking=True)
           
     def __on_error(self, ws, message):
         """
@@ -151,8 +208,16 @@ class BinanceFuturesWs:
         logger.error(message)
         logger.error(traceback.format_exc())
 
-        notify(f"Error occurred. {message}")
-        notify(traceback.format_exc())
+        notify(f"Error occurred. {message}", account=self.account)
+        notify(traceback.format_exc(), account=self.account)
+
+    def __on_open(self, ws):
+        """
+        On Open listener, events sent while disconnected are lost
+        """
+        # subscribers that joined while the endpoint was being connected
+        self.__sync_streams()
+        self.__emit('open', '', None)
 
     def __on_message(self, ws, message):
         """
@@ -162,39 +227,32 @@ class BinanceFuturesWs:
         :return:
         """        
         try:
-            obj = json.loads(message)
-            
-            
+            start = latency.now() if latency.enabled else 0
+            obj = json_loads(message)
+            if 'data' not in obj:
+                # answer to a (un)subscription
+                return
+            if latency.enabled:
+                latency.record("decode", start)
+                if 'E' in obj['data']:
+                    latency.record_since("receive", obj['data']['E'])
+
             if 'e' in obj['data']:                
                 e = obj['data']['e']
                 action = ""                
                 datas = obj['data']                
                 
                 if e.startswith("kline"):
-                    if self.use_healthcecks:
-                        current_minute = datetime.now().time().minute
-                        if self.last_heartbeat != current_minute:
-                            # Send a heartbeat to Healthchecks.io
-                            try:
-                                requests.get(conf['healthchecks.io'][self.account]['websocket_heartbeat'])
-                                #logger.info("WS Heart Beat sent!") 
-                                self.last_heartbeat = current_minute
-                            except Exception as e:
-                                pass
-                    data = [{
-                        "timestamp" : datas['k']['T'],
-                        "high" : float(datas['k']['h']),
-                        "low" : float(datas['k']['l']),
-                        "open" : float(datas['k']['o']),
-                        "close" : float(datas['k']['c']),
-                        "volume" : float(datas['k']['v'])
-                    }]                     
-                    data[0]['timestamp'] = datetime.fromtimestamp(data[0]['timestamp']/1000).astimezone(UTC)                                        
-                    self.__emit(obj['data']['k']['i'], obj['data']['k']['i'], to_data_frame([data[0]]))                    
+                    # Healthchecks.io is pinged by the heartbeat worker, never from this thread
+                    self.heartbeat.beat('websocket_heartbeat')
+                    k = datas['k']
+                    self.__emit(k['i'], k['i'], [to_kline(k)], datas['s'])
                 elif e.startswith("24hrTicker"):
-                    self.__emit('instrument', action, datas)               
+                    self.__emit('instrument', action, datas, datas['s'])               
 
                 elif e.startswith("ACCOUNT_UPDATE"):
+                    # the whole event first, for the account state
+                    self.__emit('account', action, datas)
                     self.__emit('position', action, datas['a']['P'])
                     self.__emit('wallet', action, datas['a']['B'][0])
                     self.__emit('margin', action, datas['a']['B'][0])                  
@@ -202,53 +260,106 @@ class BinanceFuturesWs:
                 # ORDER_TRADE_UPDATE
                 elif e.startswith("ORDER_TRADE_UPDATE"):
                     self.__emit('order', action, datas['o'])
+                elif e.startswith("ACCOUNT_CONFIG_UPDATE"):
+                    self.__emit('account_config', action, datas)
                 #todo orderbook stream
                 # elif table.startswith(""):
                 #     self.__emit(e, action, data)
                 elif e.startswith("listenKeyExpired"):
                     self.__emit('close', action, datas)                    
-                    self.__get_auth_user_data_streams()
                     logger.info(f"listenKeyExpired!!!")
                     #self.__on_close(ws)
-                    self.ws.close()
+                    # the REST call must not block the event loop
+                    self.ws.runtime.loop.run_in_executor(None, self.__renew_listen_key)
 
                 elif e.startswith("bookTicker"):
                     #logger.info(f"bookticker: {obj['data']}")                   
-                    self.__emit('bookticker', action, obj['data'])
+                    self.__emit('bookticker', action, obj['data'], datas['s'])
 
         except Exception as e:
             logger.error(e)
             logger.error(traceback.format_exc())
        
-    def __emit(self, key, action, value):       
+    def __emit(self, key, action, value, pair=None):       
         """
-        send data
+        send data to every subscriber, or to the subscribers of the pair of a market event
         """
-        if key in self.handlers:
-            self.handlers[key](action, value)
+        for subscriber in self.subscribers:
+            if pair is None or subscriber.pair == pair.lower():
+                subscriber.emit(key, action, value)
 
     def __on_close(self, ws):
         """
         On Close Listener
         :param ws:
         """
-        if 'close' in self.handlers:
-            self.handlers['close']()
+        for subscriber in self.subscribers:
+            subscriber.emit('close')
 
         if self.is_running:
+            # the websocket runtime reconnects, the listen key can change after disconnects
+            # so the url is built again then
             logger.info(f"Websocket On Close: Restart")
-            notify(f"Websocket On Close: Restart")
-
-            time.sleep(1)
-            # Listen Key can change after disconnects, so the url can change too
-            self.ws = websocket.WebSocketApp(self.__get_wss_endpoint(),
-                                 on_message=self.__on_message,
-                                 on_error=self.__on_error,
-                                 on_close=self.__on_close)                                 
-                                 
-            self.wst = threading.Thread(target=self.__start)
-            self.wst.daemon = True
-            self.wst.start()
+            notify(f"Websocket On Close: Restart", account=self.account)
+
+    def close(self):
+        """
+        close websocket
+        """
+        self.is_running = False
+        self.heartbeat.stop()
+        if self.keep_alive is not None:
+            self.keep_alive.cancel()
+        self.ws.close()
+
+
+class BinanceFuturesWs:
+    """
+    The streams of one bot, on the connection of its account shared with the other bots of the process
+    """
+
+    def __init__(self, account, pair, bin_size, test=False, book_ticker=True):
+        """
+        constructor
+        :param bin_size: timeframes of the kline streams
+        :param book_ticker: subscribe to the bookTicker stream
+        """
+        # Account
+        self.account = account
+        # Pair
+        self.pair = pair.lower()
+		# TFs Array
+        self.bin_size = bin_size
+        # testnet
+        self.testnet = test
+        # bookTicker stream
+        self.book_ticker = book_ticker
+        # condition that the bot runs on.
+        self.is_running = True
+        # Notification destination listener
+        self.handlers = {}
+        self.stream = BinanceFuturesStream.attach(self)
+
+    @property
+    def heartbeat(self):
+        return self.stream.heartbeat
+
+    def streams(self):
+        """
+        names of the market streams of the bot
+        """
+        streams = [self.pair + '@ticker'] + [self.pair + '@kline_' + t for t in self.bin_size]
+        return streams + [self.pair + '@bookTicker'] if self.book_ticker else streams
+
+    def emit(self, key, action=None, value=None):
+        """
+        send data
+        """
+        if key == 'close':
+            if 'close' in self.handlers:
+                self.handlers['close']()
+        elif key in self.handlers:
+            self.handlers[key](action, value)
 
     def on_close(self, func):
         """
@@ -265,9 +376,20 @@ class BinanceFuturesWs:
         """
         self.handlers[key] = func
 
+    def subscribe(self, bin_size, book_ticker=True):
+        """
+        add the kline and bookTicker streams, subscribed on the open connection
+        :param bin_size: timeframes of the kline streams
+        :param book_ticker: subscribe to the bookTicker stream
+        """
+        self.bin_size = bin_size
+        self.book_ticker = book_ticker
+        self.stream.update()
+
     def close(self):
         """
-        close websocket
+        leave the connection of the account, closed with its last bot
         """
-        self.is_running = False
-        self.ws.close()
+        if self.is_running:
+            self.is_running = False
+            self.stream.detach(self)
@@ -15,11 +15,12 @@ from pytz import UTC
 from src import (logger, retry, allowed_range,
                  allowed_range_minute_granularity,
                  find_timeframe_string, sync_obj_with_config,
-                 to_data_frame, resample, delta,
-                 FatalError, notify, ord_suffix)
+                 to_data_frame, resample, delta, OhlcvBuffer, ResampleCache, StrategyExecutor,
+                 FatalError, notify, ord_suffix, shared_client)
 from src.exchange.bitmex.bitmex_api import bitmex_api
 from src.config import config as conf
 from src.exchange_config import exchange_config
+from src.indicators import indicator_cache
 from src.exchange.bitmex.bitmex_websocket import BitMexWs
 
 
@@ -91,6 +92,14 @@ class BitMex:
         self.timeframe_data = None
         # Timeframe data info like partial candle data values, last candle values, last action etc.
         self.timeframe_info = {}
+        # Higher timeframe candles kept up to date for security()
+        self.resample_data = {}
+        # Runs the strategy off the websocket thread
+        self.strategy_executor = StrategyExecutor()
+        # Snapshot of the candles security() reads, taken with the candle the strategy runs on
+        self.security_source = None
+        # Runs the order callbacks in order, off the websocket thread
+        self.callback_executor = StrategyExecutor("callbacks")
         # Profit target long and short for a simple limit exit strategy
         self.sltp_values = {
             'profit_long': 0,
@@ -141,8 +150,9 @@ class BitMex:
         api_secret = conf['bitmex_test_keys'][self.account]['SECRET_KEY'] \
                     if self.demo else conf['bitmex_keys'][self.account]['SECRET_KEY']
 
-        self.private_client = bitmex_api(test=self.demo, api_key=api_key, api_secret=api_secret)
-        self.public_client = bitmex_api(test=self.demo)
+        self.private_client = shared_client((bitmex_api, api_key, self.demo),
+                                            lambda: bitmex_api(test=self.demo, api_key=api_key, api_secret=api_secret))
+        self.public_client = shared_client((bitmex_api, self.demo), lambda: bitmex_api(test=self.demo))
 
         if self.quote_rounding == None or self.asset_rounding == None:
             symbol = self.get_symbol_information()
@@ -426,7 +436,7 @@ class BitMex:
                 time.sleep(2)
                 i += 1
                 if i > 10:
-                    notify(f"Order retry count exceed")
+                    notify(f"Order retry count exceed", account=self.account)
                     break
             self.cancel_all()
         else:
@@ -444,7 +454,7 @@ class BitMex:
             logger.info(f"Stop   : {stop}")
             logger.info(f"======================================")
 
-            notify(f"New Order\nType: {ord_type}\nSide: {side}\nQty: {ord_qty}\nLimit: {limit}\nStop: {stop}")
+            notify(f"New Order\nType: {ord_type}\nSide: {side}\nQty: {ord_qty}\nLimit: {limit}\nStop: {stop}", account=self.account)
     
     def amend_order(
             self, 
@@ -513,7 +523,7 @@ class BitMex:
             logger.info(f"Stop   : {stop}")
             logger.info(f"======================================")
 
-            notify(f"Amend Order\nType: {ord_type}\nSide: {side}\nQty: {ord_qty}\nLimit: {limit}\nStop: {stop}")
+            notify(f"Amend Order\nType: {ord_type}\nSide: {side}\nQty: {ord_qty}\nLimit: {limit}\nStop: {stop}", account=self.account)
 
     def entry(
             self,
@@ -891,7 +901,6 @@ class BitMex:
                 sl_price_long = round(avg_entry - (avg_entry*sl_percent_long), self.quote_rounding)
                 if sl_order is not None:                             
                     self.cancel(id=sl_order['clOrdID'])
-                    time.sleep(2)
                     self.order("SL", False, abs(pos_size), stop=sl_price_long, reduce_only=True,
                                 allow_amend=False, callback=self.get_sltp_values()['stop_long_callback'])
                     #self.__amend_order(sl_order['clOrdID'], False, abs(pos_size), stop=sl_price_long)
@@ -903,7 +912,6 @@ class BitMex:
                 sl_price_short = round(avg_entry + (avg_entry*sl_percent_short), self.quote_rounding)
                 if sl_order is not None:                                  
                     self.cancel(id=sl_order['clOrdID'])
-                    time.sleep(2)
                     self.order("SL", True, abs(pos_size), stop=sl_price_short, reduce_only=True,
                                 allow_amend=False, callback=self.get_sltp_values()['stop_short_callback'])
                     #self.__amend_order(sl_order['clOrdID'], True, abs(pos_size), stop=sl_price_short)
@@ -942,52 +950,63 @@ class BitMex:
                 break        
         return resample(data, bin_size)        
 
+    def __security_timeframe(self):
+        """
+        lowest timeframe, security() resamples its candles
+        """
+        return find_timeframe_string(min(allowed_range_minute_granularity[t][3] for t in self.bin_size))
+
     def security(self, bin_size, data=None):
         """
         Recalculate and obtain data of a timeframe higher than the current timeframe
         without looking into the future that would cause undesired effects.
         """     
-        if data == None:  # minute count of a timeframe for sorting when sorting is needed   
-            timeframe_list = [allowed_range_minute_granularity[t][3] for t in self.bin_size]
-            timeframe_list.sort(reverse=True)
-            t = find_timeframe_string(timeframe_list[-1])     
-            data = self.timeframe_data[t]      
-            
+        if data is None:
+            t = self.__security_timeframe()
+            if bin_size not in self.resample_data:
+                self.resample_data[bin_size] = ResampleCache(bin_size, self.ohlcv_len)
+            # the buffer moves on while the strategy runs on the executor thread
+            source = self.timeframe_data[t] if self.security_source is None else self.security_source
+            return self.resample_data[bin_size].data_frame(source)
+
         return resample(data, bin_size)[:-1]    
     
+    def __fill_ohlcv(self):
+        """
+        fill the candle buffers of every timeframe
+        """
+        timeframe_data = {}
+        for t in self.bin_size:                
+            end_time = datetime.now(timezone.utc)
+            start_time = end_time - self.ohlcv_len * delta(t)
+            data = self.fetch_ohlcv(t, start_time, end_time)
+            # The last candle is an incomplete candle with timestamp in future                
+            timeframe_data[t] = OhlcvBuffer.from_data_frame(data, self.ohlcv_len, t, self.minute_granularity,
+                                                            partial=data.iloc[-1].name > end_time)
+            self.timeframe_info[t] = {
+                        "allowed_range": allowed_range_minute_granularity[t][0] 
+                                            if self.minute_granularity else allowed_range[t][0], 
+                        "ohlcv": data[:-1], # Dataframe with closed candles                                                   
+                        "last_action_time": None,#self.timeframe_data[t].iloc[-1].name, # Last strategy execution time
+                        "last_candle": data.iloc[-2].values,  # Store last complete candle
+                        "partial_candle": data.iloc[-1].values  # Store incomplete candle
+                        }
+            #d1 = self.timeframe_data[t]
+            # if len(d1) > 0:
+            #     d2 = self.fetch_ohlcv(allowed_range[t][0],
+            #                         d1.iloc[-1].name + delta(allowed_range[t][0]), end_time)
+
+            #     self.timeframe_data[t] = pd.concat([d1, d2])               
+            # else:
+            #     self.timeframe_data[t] = d1                
+
+            logger.info(f"Initial Buffer Fill - Last Candle: {data.iloc[-1].name}")   
+        self.timeframe_data = timeframe_data
+
     def __update_ohlcv(self, action, new_data):
         """
         get and update OHLCV data and execute the strategy
         """           
-        if self.timeframe_data is None:
-            self.timeframe_data = {}
-            for t in self.bin_size:                
-                end_time = datetime.now(timezone.utc)
-                start_time = end_time - self.ohlcv_len * delta(t)
-                self.timeframe_data[t] = self.fetch_ohlcv(t, start_time, end_time)
-                self.timeframe_info[t] = {
-                            "allowed_range": allowed_range_minute_granularity[t][0]
-                                            if self.minute_granularity else allowed_range[t][0], 
-                            "ohlcv": self.timeframe_data[t][:-1], # Dataframe with closed candles                                                   
-                            "last_action_time": None,#self.timeframe_data[t].iloc[-1].name, # Last strategy execution time
-                            "last_candle": self.timeframe_data[t].iloc[-2].values,  # Store last complete candle
-                            "partial_candle": self.timeframe_data[t].iloc[-1].values  # Store incomplete candle
-                            }
-                # The last candle is an incomplete candle with timestamp in future                
-                if self.timeframe_data[t].iloc[-1].name > end_time:
-                    last_candle = self.timeframe_data[t].iloc[-1].values # Store last candle
-                    self.timeframe_data[t] = self.timeframe_data[t][:-1] # Exclude last candle
-                    self.timeframe_data[t].loc[end_time.replace(microsecond=0)] = last_candle #set last candle to end_time
-                #d1 = self.timeframe_data[t]
-                # if len(d1) > 0:
-                #     d2 = self.fetch_ohlcv(allowed_range[t][0],
-                #                         d1.iloc[-1].name + delta(allowed_range[t][0]), end_time)
-
-                #     self.timeframe_data[t] = pd.concat([d1, d2])               
-                # else:
-                #     self.timeframe_data[t] = d1                
-
-                logger.info(f"Initial Buffer Fill - Last Candle: {self.timeframe_data[t].iloc[-1].name}")   
         #logger.info(f"{self.timeframe_data}") 
 
         # Timeframes to be updated
@@ -1003,69 +1022,95 @@ class BitMex:
 
         #logger.info(f"timefeames to update: {timeframes_to_update}")        
 
+        new_candles = new_data[OhlcvBuffer.columns].to_numpy(dtype=float)
+
+        # the timeframes of this update, run in order by one strategy job
+        jobs = []
         for t in timeframes_to_update:
             # Find timeframe string based on its minute count value
             if self.timeframes_sorted != None:             
                 t = find_timeframe_string(t)               
                     
-            # replace latest candle if timestamp is same or append
-            if self.timeframe_data[t].iloc[-1].name == new_data.iloc[0].name:
-                self.timeframe_data[t] = pd.concat([self.timeframe_data[t][:-1], new_data])
-            else:
-                self.timeframe_data[t] = pd.concat([self.timeframe_data[t], new_data])      
+            # update the partial candle in place, it is moved to the closed candles 
+            # once the new data belongs to the next candle
+            ohlcv = self.timeframe_data[t]
+            for timestamp, candle in zip(new_data.index, new_candles):
+                ohlcv.update(timestamp, candle)
+            self.timeframe_info[t]['partial_candle'] = ohlcv.partial # store partial candle data
 
-            # exclude current candle data and store partial candle data
-            re_sample_data = resample(self.timeframe_data[t], 
-                                      t, 
-                                      minute_granularity=True if self.minute_granularity else False)
-            self.timeframe_info[t]['partial_candle'] = re_sample_data.iloc[-1].values # store partial candle data
-            re_sample_data =re_sample_data[:-1] # exclude current candle data
+            last_candle_time = ohlcv.last_timestamp
+            if last_candle_time is None:
+                continue
 
-            #logger.info(f"{self.timeframe_info[t]['last_action_time']} : {self.timeframe_data[t].iloc[-1].name} : {re_sample_data.iloc[-1].name}")  
+            #logger.info(f"{self.timeframe_info[t]['last_action_time']} : {ohlcv.partial_time} : {last_candle_time}")  
 
             if self.call_strat_on_start:
                 if self.timeframe_info[t]["last_action_time"] is not None and \
-                self.timeframe_info[t]["last_action_time"] == re_sample_data.iloc[-1].name:
+                self.timeframe_info[t]["last_action_time"] == last_candle_time:
                     continue
             else:   
                 if self.timeframe_info[t]["last_action_time"] is None:
-                    self.timeframe_info[t]["last_action_time"] = re_sample_data.iloc[-1].name
+                    self.timeframe_info[t]["last_action_time"] = last_candle_time
                     
-                if self.timeframe_info[t]["last_action_time"] == re_sample_data.iloc[-1].name:
+                if self.timeframe_info[t]["last_action_time"] == last_candle_time:
                     continue
 
-            # The last candle in the buffer needs to be preserved 
-            # while resetting the buffer as it may be incomlete
-            # or contains latest data from WS
-            self.timeframe_data[t] = pd.concat([re_sample_data.iloc[-1 * self.ohlcv_len:, :], 
-                                                self.timeframe_data[t].iloc[[-1]]]) 
             #store ohlcv dataframe to timeframe_info dictionary
-            self.timeframe_info[t]["ohlcv"] = re_sample_data
-            #logger.info(f"Buffer Right Edge: {self.data.iloc[-1]}")
+            self.timeframe_info[t]["ohlcv"] = ohlcv.to_data_frame()
+            self.timeframe_info[t]["last_candle"] = ohlcv.last_candle
             
-            open = re_sample_data['open'].values
-            close = re_sample_data['close'].values
-            high = re_sample_data['high'].values
-            low = re_sample_data['low'].values
-            volume = re_sample_data['volume'].values 
-                                        
-            try:
-                if self.strategy is not None:   
-                    self.timestamp = re_sample_data.iloc[-1].name.isoformat()           
-                    self.strategy(t, open, close, high, low, volume)              
-                self.timeframe_info[t]['last_action_time'] = re_sample_data.iloc[-1].name
-            except FatalError as e:
-                # Fatal error
-                logger.error(f"Fatal error. {e}")
-                logger.error(traceback.format_exc())
-
-                notify(f"Fatal error occurred. Stopping Bot. {e}")
-                notify(traceback.format_exc())
-                self.stop()
-            except Exception as e:
-                logger.error(f"An error occurred. {e}")
-                logger.error(traceback.format_exc())    
-        
+            # copies, the buffer moves on while the strategy runs on the executor thread
+            open = ohlcv.open.copy()
+            close = ohlcv.close.copy()
+            high = ohlcv.high.copy()
+            low = ohlcv.low.copy()
+            volume = ohlcv.volume.copy()
+
+            previous_action_time = self.timeframe_info[t]['last_action_time']
+            self.timeframe_info[t]['last_action_time'] = last_candle_time
+            jobs.append((t, last_candle_time, previous_action_time, open, close, high, low, volume))
+
+        if self.strategy is not None and len(jobs) > 0:
+            # a stale update of the same timeframes that did not run yet is replaced
+            self.strategy_executor.submit(",".join(job[0] for job in jobs), self.__run_strategies, jobs,
+                                          self.timeframe_data[self.__security_timeframe()].snapshot())
+
+    def __run_strategies(self, jobs, security_source):
+        """
+        execute the strategy for every timeframe of an update on the strategy executor thread
+        :param jobs: arguments of __run_strategy by timeframe, in the order the timeframes run
+        :param security_source: snapshot of the candles security() resamples
+        """
+        self.security_source = security_source
+        try:
+            for job in jobs:
+                self.__run_strategy(*job)
+        finally:
+            self.security_source = None
+
+    def __run_strategy(self, t, last_candle_time, previous_action_time, open, close, high, low, volume):
+        """
+        execute the strategy on the strategy executor thread
+        """
+        try:
+            self.timestamp = last_candle_time.isoformat()
+            indicator_cache.next_bar(last_candle_time)
+            self.strategy(t, open, close, high, low, volume)
+        except FatalError as e:
+            # Fatal error
+            logger.error(f"Fatal error. {e}")
+            logger.error(traceback.format_exc())
+
+            notify(f"Fatal error occurred. Stopping Bot. {e}", account=self.account)
+            notify(traceback.format_exc(), account=self.account)
+            self.stop()
+        except Exception as e:
+            logger.error(f"An error occurred. {e}")
+            logger.error(traceback.format_exc())
+            # retried with the next update like when the strategy ran on the websocket thread
+            if self.timeframe_info[t]['last_action_time'] == last_candle_time:
+                self.timeframe_info[t]['last_action_time'] = previous_action_time
+
     def __on_update_instrument(self, action, instrument):
         """
         Update instrument
@@ -1114,14 +1159,21 @@ class BitMex:
             # Call the respective order callback
             callback = self.callbacks.pop(order['clOrdID'], None)  # Removes the respective order callback and returns it
             if callback != None:
-                callback()
+                self.callback_executor.call(callback)
 
-        # Evaluation of profit and loss
+        # Evaluation of profit and loss, its REST calls (and their retries) don't hold up the websocket thread
+        if self.is_exit_order_active or self.is_sltp_active:
+            self.strategy_executor.submit("eval_position", self.__eval_position)
+
+    def __eval_position(self):
+        """
+        evaluate the exit and sltp orders on the strategy executor thread
+        """
         if self.is_exit_order_active:
             self.eval_exit()
         if self.is_sltp_active:
             self.eval_sltp()
-        
+
     def __on_update_position(self, action, position):
         """
         Update position
@@ -1144,7 +1196,7 @@ class BitMex:
             notify(f"Updated Position\n"
                    f"Price: {self.get_position()['avgEntryPrice']} => {position['avgEntryPrice']}\n"
                    f"Qty: {self.get_position()['currentQty']} => {position['currentQty']}\n"
-                   f"Balance: {self.get_balance()/100000000} XBT")
+                   f"Balance: {self.get_balance()/100000000} XBT", account=self.account)
 
         self.position = {**self.position, **position} if self.position is not None else self.position
 
@@ -1170,6 +1222,9 @@ class BitMex:
         self.strategy = strategy       
 
         if self.is_running:
+            # the buffers are filled before the streams start, the first kline can trigger the strategy at once
+            if self.timeframe_data is None and len(self.bin_size) > 0:
+                self.__fill_ohlcv()
             self.ws = BitMexWs(account=self.account, pair=self.pair, test=self.demo)
             
             #if len(self.bin_size) > 1:   
@@ -1200,6 +1255,8 @@ class BitMex:
         """
         if self.is_running:
             self.is_running = False
+            self.strategy_executor.stop()
+            self.callback_executor.stop()
             self.ws.close()
 
     def show_result(self):
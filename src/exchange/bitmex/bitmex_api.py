@@ -8,6 +8,8 @@ from bravado.client import SwaggerClient
 from bravado.requests_client import RequestsClient, Authenticator
 from bravado.swagger_model import Loader
 
+from src import RateLimiter, rate_limited, shared_client
+
 # swagger spec's formats to exclude. this help to avoid warning in your console.
 EXCLUDE_SWG_FORMATS = ['JSON', 'guid']
 
@@ -73,12 +75,21 @@ def bitmex_api(test=True, config=None, api_key=None, api_secret=None):
     spec_uri = host + '/api/explorer/swagger.json'
     spec_dict = get_swagger_json(spec_uri, exclude_formats=EXCLUDE_SWG_FORMATS)
 
+    # 120 requests per minute with a key, 30 without, shared by the clients of the key
+    request_client = RequestsClient()
     if api_key and api_secret:
-        request_client = RequestsClient()
         request_client.authenticator = APIKeyAuthenticator(host, api_key, api_secret)
-        return SwaggerClient.from_spec(spec_dict, origin_url=spec_uri, http_client=request_client, config=config)
+        limiter = shared_client((RateLimiter, host, api_key), lambda: RateLimiter(120))
     else:
-        return SwaggerClient.from_spec(spec_dict, origin_url=spec_uri, http_client=None, config=config)
+        limiter = shared_client((RateLimiter, host), lambda: RateLimiter(30))
+    rate_limited(request_client.session, limiter, usage=used_requests)
+    return SwaggerClient.from_spec(spec_dict, origin_url=spec_uri, http_client=request_client, config=config)
+
+
+def used_requests(limiter, response):
+    limit, remaining = response.headers.get('X-RateLimit-Limit'), response.headers.get('X-RateLimit-Remaining')
+    if limit is not None and remaining is not None:
+        limiter.update(int(limit) - int(remaining))
 
 
 # exclude some format from swagger json to avoid warning in API execution.
@@ -8,11 +8,11 @@ import time
 import traceback
 import urllib
 
-import websocket
 from datetime import datetime, timedelta
 
 from src import logger, to_data_frame, notify
 from src.config import config as conf
+from src.exchange.websocket_runtime import WebSocketApp
 
 
 def generate_nonce():
@@ -58,14 +58,15 @@ class BitMexWs:
         self.endpoint = 'wss://' + domain + '/realtime?subscribe=tradeBin1m:' + self.pair + ',' \
                         'tradeBin5m:' + self.pair + ',tradeBin1h:' + self.pair + ',tradeBin1d:' + self.pair + ',instrument:' + self.pair + ',' \
                         'margin,position,order,execution:' + self.pair + ',wallet,orderBookL2:' + self.pair #+ ',order:' + self.pair + ',execution:' + self.pair 
-        self.ws = websocket.WebSocketApp(self.endpoint,
-                             on_message=self.__on_message,
-                             on_error=self.__on_error,
-                             on_close=self.__on_close,
-                             header=self.__get_auth())
-        self.wst = threading.Thread(target=self.__start)
-        self.wst.daemon = True
-        self.wst.start()
+        # fails early when the account has no keys configured
+        self.__get_auth()
+        # Runs on the shared asyncio websocket runtime, which reconnects it
+        # with a fresh auth header every time
+        self.ws = WebSocketApp(self.endpoint,
+                               on_message=self.__on_message,
+                               on_error=self.__on_error,
+                               on_close=self.__on_close,
+                               header=self.__get_auth).start()
 
     def __get_auth(self):
         """
@@ -87,13 +88,6 @@ class BitMexWs:
             logger.info("WebSocket is not authenticating.")
             return []
 
-    def __start(self):
-        """
-        start the websocket.
-        """
-        while self.is_running:
-            self.ws.run_forever()
-
     def __on_error(self, ws, message):
         """
         On Error listener
@@ -103,8 +97,8 @@ class BitMexWs:
         logger.error(message)
         logger.error(traceback.format_exc())
 
-        notify(f"Error occurred. {message}")
-        notify(traceback.format_exc())
+        notify(f"Error occurred. {message}", account=self.account)
+        notify(traceback.format_exc(), account=self.account)
 
     def __on_message(self, ws, message):
         """
@@ -180,16 +174,7 @@ class BitMexWs:
 
         if self.is_running:
             logger.info("Websocket restart")
-            notify(f"Websocket restart")
-
-            self.ws = websocket.WebSocketApp(self.endpoint,
-                                 on_message=self.__on_message,
-                                 on_error=self.__on_error,
-                                 on_close=self.__on_close,
-                                 header=self.__get_auth())
-            self.wst = threading.Thread(target=self.__start)
-            self.wst.daemon = True
-            self.wst.start()
+            notify(f"Websocket restart", account=self.account)
 
     def on_close(self, func):
         """
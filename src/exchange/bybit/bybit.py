@@ -15,13 +15,16 @@ from pytz import UTC
 
 from src import (logger, bin_size_converter, find_timeframe_string,
                  allowed_range_minute_granularity, allowed_range, sync_obj_with_config,
-                 to_data_frame, resample, delta, FatalError, notify, ord_suffix)
+                 to_data_frame, resample, delta, OhlcvBuffer, ResampleCache, StrategyExecutor, FatalError, notify, ord_suffix,
+                 shared_client, RateLimiter, rate_limited)
 from src import retry_bybit as retry
 from pybit import inverse_futures, inverse_perpetual, usdc_perpetual, usdt_perpetual, spot
 #from pybit import spot as spot_http
 from src.config import config as conf
 from src.exchange_config import exchange_config
+from src.indicators import indicator_cache
 from src.exchange.bybit.bybit_websocket import BybitWs
+from src.exchange.candle_backfill import CandleBackfill
 
 #TODO
 # orderbook class
@@ -106,8 +109,18 @@ class Bybit:
         self.strategy = None
         # OHLCV data
         self.timeframe_data = None    
+        # Recovers the candles missed while the websocket was disconnected
+        self.candle_backfill = None
         # Timeframe data info like partial candle data values, last candle values, last action etc.
         self.timeframe_info = {}
+        # Higher timeframe candles kept up to date for security()
+        self.resample_data = {}
+        # Runs the strategy off the websocket thread
+        self.strategy_executor = StrategyExecutor()
+        # Snapshot of the candles security() reads, taken with the candle the strategy runs on
+        self.security_source = None
+        # Runs the order callbacks in order, off the websocket thread
+        self.callback_executor = StrategyExecutor("callbacks")
         # Profit target long and short for a simple limit exit strategy
         self.sltp_values = {
             'profit_long': 0,
@@ -171,8 +184,8 @@ class Bybit:
         # spot 
         if self.spot: 
             HTTP = spot.HTTP
-            self.private_client = HTTP(endpoint, api_key=api_key, api_secret=api_secret)
-            self.public_client = HTTP(endpoint)
+            self.private_client = self.__http_client(HTTP, endpoint, api_key, api_secret)
+            self.public_client = self.__http_client(HTTP, endpoint)
 
             if self.quote_rounding == None or self.asset_rounding == None:
                 markets_list = retry(lambda: self.public_client.query_symbol())   
@@ -186,8 +199,8 @@ class Bybit:
         # USDC perps
         elif self.pair.endswith('PERP'): 
             HTTP = usdc_perpetual.HTTP
-            self.private_client = HTTP(endpoint, api_key=api_key, api_secret=api_secret)
-            self.public_client = HTTP(endpoint)
+            self.private_client = self.__http_client(HTTP, endpoint, api_key, api_secret)
+            self.public_client = self.__http_client(HTTP, endpoint)
 
             if self.quote_rounding == None or self.asset_rounding == None:      
                 markets_list = retry(lambda: self.public_client.query_symbol())   
@@ -201,8 +214,8 @@ class Bybit:
         # USDT linear perps or inverse perps
         elif self.pair.endswith('USDT') or self.pair.endswith('USD'): 
             HTTP = usdt_perpetual.HTTP if self.pair.endswith('USDT') else inverse_perpetual.HTTP
-            self.private_client = HTTP(endpoint, api_key=api_key, api_secret=api_secret)
-            self.public_client = HTTP(endpoint)
+            self.private_client = self.__http_client(HTTP, endpoint, api_key, api_secret)
+            self.public_client = self.__http_client(HTTP, endpoint)
 
             if self.quote_rounding == None or self.asset_rounding == None:      
                 markets_list = retry(lambda: self.public_client.query_symbol())    
@@ -217,8 +230,8 @@ class Bybit:
         else:
             HTTP = inverse_futures.HTTP
         
-        self.private_client = HTTP(endpoint, api_key=api_key, api_secret=api_secret)
-        self.public_client = HTTP(endpoint)
+        self.private_client = self.__http_client(HTTP, endpoint, api_key, api_secret)
+        self.public_client = self.__http_client(HTTP, endpoint)
 
         self.sync()
 
@@ -227,6 +240,22 @@ class Bybit:
          
         logger.info(f"Position Size: {self.position_size:.3f} Entry Price: {self.entry_price:.2f}")
 
+    @staticmethod
+    def __http_client(HTTP, endpoint, api_key=None, api_secret=None):
+        """
+        pybit client shared by the bots of the key, its requests limited per key (per IP when public)
+        """
+        def create():
+            if api_key is None:
+                client = HTTP(endpoint)
+                limiter = shared_client((RateLimiter, 'bybit', endpoint), lambda: RateLimiter(50, window=1))
+            else:
+                client = HTTP(endpoint, api_key=api_key, api_secret=api_secret)
+                limiter = shared_client((RateLimiter, 'bybit', endpoint, api_key), lambda: RateLimiter(120))
+            rate_limited(client.client, limiter)
+            return client
+        return shared_client((HTTP, endpoint, api_key), create)
+
     def sync(self):
         # Position
         if not self.spot:
@@ -932,7 +961,7 @@ class Bybit:
             logger.info(f"Stop   : {stop}")
             logger.info(f"======================================")
 
-            notify(f"New Order\nType: {ord_type}\nSide: {side}\nQty: {ord_qty}\nLimit: {limit}\nStop: {stop}")
+            notify(f"New Order\nType: {ord_type}\nSide: {side}\nQty: {ord_qty}\nLimit: {limit}\nStop: {stop}", account=self.account)
 
     def amend_order(self, ord_id, ord_qty=0, limit=0, stop=0):
         """
@@ -998,7 +1027,7 @@ class Bybit:
             logger.info(f"========= Amend Order ==============")
             logger.info(f"ID       : {ord_id}")            
             logger.info(f"======================================")
-            notify(f"Amend Order\n ID       : {ord_id}")      
+            notify(f"Amend Order\n ID       : {ord_id}", account=self.account)      
 
         if res:                
             logger.info(f"Modified Order with user_id: {ord_id}, response: {res}")
@@ -1704,46 +1733,64 @@ class Bybit:
         
         return resample(data, bin_size)    
     
+    def __security_timeframe(self):
+        """
+        lowest timeframe, security() resamples its candles
+        """
+        return find_timeframe_string(min(allowed_range_minute_granularity[t][3] for t in self.bin_size))
+
     def security(self, bin_size, data=None):
         """
         Recalculate and obtain data of a timeframe higher than the current timeframe
         without looking into the future that would cause undesired effects.
         """     
-        if data == None: # minute count of a timeframe for sorting when sorting is needed   
-            timeframe_list = [allowed_range_minute_granularity[t][3] for t in self.bin_size] 
-            timeframe_list.sort(reverse=True)
-            t = find_timeframe_string(timeframe_list[-1])     
-            data = self.timeframe_data[t]      
-            
+        if data is None:
+            t = self.__security_timeframe()
+            if bin_size not in self.resample_data:
+                self.resample_data[bin_size] = ResampleCache(bin_size, self.ohlcv_len)
+            # the buffer moves on while the strategy runs on the executor thread
+            source = self.timeframe_data[t] if self.security_source is None else self.security_source
+            return self.resample_data[bin_size].data_frame(source)
+
         return resample(data, bin_size)[:-1]
     
+    def __fill_ohlcv(self):
+        """
+        fill the candle buffers of every timeframe
+        """
+        timeframe_data = {}
+        for t in self.bin_size:                              
+            end_time = datetime.now(timezone.utc)
+            start_time = end_time - self.ohlcv_len * delta(t)
+            data = self.fetch_ohlcv(t, start_time, end_time)
+            # The last candle is an incomplete candle with timestamp in future                
+            timeframe_data[t] = OhlcvBuffer.from_data_frame(data, self.ohlcv_len, t, self.minute_granularity,
+                                                            partial=data.iloc[-1].name > end_time)
+            self.timeframe_info[t] = {
+                        "allowed_range": allowed_range_minute_granularity[t][0] 
+                                            if self.minute_granularity else allowed_range[t][0], 
+                        "ohlcv": data[:-1], # Dataframe with closed candles                                                   
+                        "last_action_time": None,#self.timeframe_data[t].iloc[-1].name, # Last strategy execution time
+                        "last_candle": data.iloc[-2].values,  # Store last complete candle
+                        "partial_candle": data.iloc[-1].values  # Store incomplete candle
+                        }
+
+            logger.info(f"Initial Buffer Fill - Last Candle: {data.iloc[-1].name}")   
+        self.timeframe_data = timeframe_data
+
     def __update_ohlcv(self, action, new_data):
         """
         get and update OHLCV data and execute the strategy
+        :param action: timeframe of the klines
+        :param new_data: list of Kline records from the websocket
         """         
-        if self.timeframe_data is None:
-            self.timeframe_data = {}            
-            for t in self.bin_size:                              
-                end_time = datetime.now(timezone.utc)
-                start_time = end_time - self.ohlcv_len * delta(t)
-                self.timeframe_data[t] = self.fetch_ohlcv(t, start_time, end_time)
-                self.timeframe_info[t] = {
-                            "allowed_range": allowed_range_minute_granularity[t][0] 
-                                                if self.minute_granularity else allowed_range[t][0], 
-                            "ohlcv": self.timeframe_data[t][:-1], # Dataframe with closed candles                                                   
-                            "last_action_time": None,#self.timeframe_data[t].iloc[-1].name, # Last strategy execution time
-                            "last_candle": self.timeframe_data[t].iloc[-2].values,  # Store last complete candle
-                            "partial_candle": self.timeframe_data[t].iloc[-1].values  # Store incomplete candle
-                            }
-                # The last candle is an incomplete candle with timestamp in future                
-                if self.timeframe_data[t].iloc[-1].name > end_time:                    
-                    last_candle = self.timeframe_data[t].iloc[-1].values # Store last candle
-                    self.timeframe_data[t] = self.timeframe_data[t][:-1] # Exclude last candle
-                    self.timeframe_data[t].loc[end_time.replace(microsecond=0)] = last_candle #set last candle to end_time
-
-                logger.info(f"Initial Buffer Fill - Last Candle: {self.timeframe_data[t].iloc[-1].name}")   
         #logger.info(f"timeframe_data: {self.timeframe_data}") 
 
+        # after a reconnect the klines wait until the missed candles are merged
+        if self.candle_backfill is not None and \
+                self.candle_backfill.hold(action, new_data, self.timeframe_data, self.__update_ohlcv):
+            return
+
         # Timeframes to be updated
         timeframes_to_update = [allowed_range_minute_granularity[t][3] if self.timeframes_sorted != None 
                                 else t for t in self.timeframe_info if self.timeframe_info[t]['allowed_range'] == action]
@@ -1754,69 +1801,92 @@ class Bybit:
             timeframes_to_update.sort(reverse=False)
         #logger.info(f"timefeames to update: {timeframes_to_update}")        
 
+        # the timeframes of this update, run in order by one strategy job
+        jobs = []
         for t in timeframes_to_update:
             # Find timeframe string based on its minute count value
             if self.timeframes_sorted != None:             
                 t = find_timeframe_string(t)               
                     
-            # replace latest candle if timestamp is same or append
-            if self.timeframe_data[t].iloc[-1].name == new_data.iloc[0].name:
-                self.timeframe_data[t] = pd.concat([self.timeframe_data[t][:-1], new_data])
-            else:
-                self.timeframe_data[t] = pd.concat([self.timeframe_data[t], new_data])      
-            #self.timeframe_data[t] = pd.concat([self.timeframe_data[t], new_data]) 
+            # update the partial candle in place, it is moved to the closed candles 
+            # once the new data belongs to the next candle
+            ohlcv = self.timeframe_data[t]
+            for kline in new_data:
+                ohlcv.update(kline.timestamp, kline[1:])
+            self.timeframe_info[t]['partial_candle'] = ohlcv.partial # store partial candle data
 
-            # exclude current candle data and store partial candle data
-            re_sample_data = resample(self.timeframe_data[t], 
-                                      t, 
-                                      minute_granularity=True if self.minute_granularity else False)
-            self.timeframe_info[t]['partial_candle'] = re_sample_data.iloc[-1].values # store partial candle data
-            re_sample_data =re_sample_data[:-1].dropna()  # exclude current candle data
+            last_candle_time = ohlcv.last_timestamp
+            if last_candle_time is None:
+                continue
 
-            #logger.info(f"{self.timeframe_info[t]['last_action_time']} : {self.timeframe_data[t].iloc[-1].name} : {re_sample_data.iloc[-1].name}")  
+            #logger.info(f"{self.timeframe_info[t]['last_action_time']} : {ohlcv.partial_time} : {last_candle_time}")  
 
             if self.call_strat_on_start:
                 if self.timeframe_info[t]["last_action_time"] is not None and \
-                self.timeframe_info[t]["last_action_time"] == re_sample_data.iloc[-1].name:
+                self.timeframe_info[t]["last_action_time"] == last_candle_time:
                     continue
             else:   
                 if self.timeframe_info[t]["last_action_time"] is None:
-                    self.timeframe_info[t]["last_action_time"] = re_sample_data.iloc[-1].name
+                    self.timeframe_info[t]["last_action_time"] = last_candle_time
                     
-                if self.timeframe_info[t]["last_action_time"] == re_sample_data.iloc[-1].name:
+                if self.timeframe_info[t]["last_action_time"] == last_candle_time:
                     continue
 
-            # The last candle in the buffer needs to be preserved 
-            # while resetting the buffer as it may be incomlete
-            # or contains latest data from WS
-            self.timeframe_data[t] = pd.concat([re_sample_data.iloc[-1 * self.ohlcv_len:, :], 
-                                                self.timeframe_data[t].iloc[[-1]]])
             #store ohlcv dataframe to timeframe_info dictionary
-            self.timeframe_info[t]["ohlcv"] = re_sample_data
-            #logger.info(f"Buffer Right Edge: {self.data.iloc[-1]}")
+            self.timeframe_info[t]["ohlcv"] = ohlcv.to_data_frame()
+            self.timeframe_info[t]["last_candle"] = ohlcv.last_candle
             
-            open = re_sample_data['open'].values
-            close = re_sample_data['close'].values
-            high = re_sample_data['high'].values
-            low = re_sample_data['low'].values
-            volume = re_sample_data['volume'].values 
-                                        
-            try:
-                if self.strategy is not None:   
-                    self.timestamp = re_sample_data.iloc[-1].name.isoformat()           
-                    self.strategy(t, open, close, high, low, volume)              
-                self.timeframe_info[t]['last_action_time'] = re_sample_data.iloc[-1].name
-            except FatalError as e:
-                # Fatal error
-                logger.error(f"Fatal error. {e}")
-                logger.error(traceback.format_exc())
-
-                notify(f"Fatal error occurred. Stopping Bot. {e}")
-                notify(traceback.format_exc())
-                self.stop()
-            except Exception as e:
-                logger.error(f"An error occurred. {e}")
-                logger.error(traceback.format_exc())
+            # copies, the buffer moves on while the strategy runs on the executor thread
+            open = ohlcv.open.copy()
+            close = ohlcv.close.copy()
+            high = ohlcv.high.copy()
+            low = ohlcv.low.copy()
+            volume = ohlcv.volume.copy()
+
+            previous_action_time = self.timeframe_info[t]['last_action_time']
+            self.timeframe_info[t]['last_action_time'] = last_candle_time
+            jobs.append((t, last_candle_time, previous_action_time, open, close, high, low, volume))
+
+        if self.strategy is not None and len(jobs) > 0:
+            # a stale update of the same timeframes that did not run yet is replaced
+            self.strategy_executor.submit(",".join(job[0] for job in jobs), self.__run_strategies, jobs,
+                                          self.timeframe_data[self.__security_timeframe()].snapshot())
+
+    def __run_strategies(self, jobs, security_source):
+        """
+        execute the strategy for every timeframe of an update on the strategy executor thread
+        :param jobs: arguments of __run_strategy by timeframe, in the order the timeframes run
+        :param security_source: snapshot of the candles security() resamples
+        """
+        self.security_source = security_source
+        try:
+            for job in jobs:
+                self.__run_strategy(*job)
+        finally:
+            self.security_source = None
+
+    def __run_strategy(self, t, last_candle_time, previous_action_time, open, close, high, low, volume):
+        """
+        execute the strategy on the strategy executor thread
+        """
+        try:
+            self.timestamp = last_candle_time.isoformat()
+            indicator_cache.next_bar(last_candle_time)
+            self.strategy(t, open, close, high, low, volume)
+        except FatalError as e:
+            # Fatal error
+            logger.error(f"Fatal error. {e}")
+            logger.error(traceback.format_exc())
+
+            notify(f"Fatal error occurred. Stopping Bot. {e}", account=self.account)
+            notify(traceback.format_exc(), account=self.account)
+            self.stop()
+        except Exception as e:
+            logger.error(f"An error occurred. {e}")
+            logger.error(traceback.format_exc())
+            # retried with the next update like when the strategy ran on the websocket thread
+            if self.timeframe_info[t]['last_action_time'] == last_candle_time:
+                self.timeframe_info[t]['last_action_time'] = previous_action_time
 
     def __on_update_wallet(self, action, wallet):
         """
@@ -1865,7 +1935,7 @@ class Bybit:
                            {fills} 
                       ============================="""
         #logger.info(f"{message}")
-        notify(message)
+        notify(message, account=self.account)
     
     def __on_update_order(self, action, orders):
         """
@@ -1933,7 +2003,7 @@ class Bybit:
                 else:
                     callback = self.callbacks.pop(o['c' if self.spot else 'orderLinkId'], None)  # Removes the respective order callback and returns it
                 if callable(callback):
-                    callback()
+                    self.callback_executor.call(callback)
             else:
                 logger.info(f"========= Order Update ===============")           
                 logger.info(f"Status : {status}\n{shared_msg}")                  
@@ -1959,12 +2029,19 @@ class Bybit:
                 self.limit_chaser_ord[side]['chase_counter'] += 1 
             self.limit_chaser_ord[side].update(limit_chaser_ord) # Updating chaser order dict
 
-        # Evaluation of profit and loss
+        # Evaluation of profit and loss, its REST calls (and their retries) don't hold up the websocket thread
+        if self.is_exit_order_active or self.is_sltp_active:
+            self.strategy_executor.submit("eval_position", self.__eval_position)
+
+    def __eval_position(self):
+        """
+        evaluate the exit and sltp orders on the strategy executor thread
+        """
         if self.is_exit_order_active:
             self.eval_exit()
         if self.is_sltp_active:
-            self.eval_sltp()    
-        
+            self.eval_sltp()
+
     def __on_update_position(self, action, position):
         """
         Update position
@@ -1996,7 +2073,7 @@ class Bybit:
                         f"Price(entryPrice): {self.position[0]['entryPrice']} => {position[0]['entryPrice']}\n"
                         f"Qty(size): {self.position[0]['size']} => {position[0]['size']}\n"
                         f"liqPrice: {self.position[0]['liqPrice']} => {position[0]['liqPrice']}\n"
-                        f"Balance: {self.get_balance()} {quote_asset_str}")       
+                        f"Balance: {self.get_balance()} {quote_asset_str}", account=self.account)       
         
         self.position[0].update(position[0])
        
@@ -2036,7 +2113,13 @@ class Bybit:
         logger.info(f"timeframes: {bin_size}")    
 
         if self.is_running:
+            # the buffers are filled before the streams start, the first kline can trigger the strategy at once
+            if self.timeframe_data is None and len(self.bin_size) > 0:
+                self.__fill_ohlcv()
             self.ws = BybitWs(account=self.account, pair=self.pair, spot=self.spot, test=self.demo)
+            self.candle_backfill = CandleBackfill(self.fetch_ohlcv)
+            # klines sent while the public websocket was disconnected are lost
+            self.ws.bind('open', lambda action, value: self.candle_backfill.invalidate())
 
             #if len(self.bin_size) > 1:   
                 #self.minute_granularity=True  
@@ -2068,6 +2151,8 @@ class Bybit:
         Stop the crawler
         """
         self.is_running = False
+        self.strategy_executor.stop()
+        self.callback_executor.stop()
         self.ws.close()
 
     def show_result(self):
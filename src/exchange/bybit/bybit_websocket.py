@@ -8,14 +8,14 @@ import time
 import traceback
 import urllib
 
-import websocket
 import requests
 from pytz import UTC
 from datetime import datetime, timedelta, timezone
 import numpy as np
 
-from src import logger, to_data_frame, find_timeframe_string, allowed_range, bin_size_converter, notify
+from src import logger, json_loads, Kline, kline_timestamp, Heartbeat, find_timeframe_string, allowed_range, bin_size_converter, notify
 from src.config import config as conf
+from src.exchange.websocket_runtime import WebSocketApp
 
 
 def generate_nonce():
@@ -42,8 +42,8 @@ class BybitWs:
         self.wsp = None      
         # Use healthchecks.io
         self.use_healthcecks = True
-        # Last Heartbeat
-        self.last_heartbeat = 0
+        # Pings healthchecks.io from its own thread
+        self.heartbeat = Heartbeat(conf.get('healthchecks.io', {}).get(self.account, {}) if self.use_healthcecks else {})
         # condition that the bot runs on.
         self.is_running = True
         # Notification destination listener
@@ -83,25 +83,22 @@ class BybitWs:
                     self.endpoint_private = 'wss://stream-testnet.bybit.com/contract/private/v3' \
                                     if self.testnet else 'wss://stream.bybit.com/contract/private/v3'           
         
-        # public ws 
-        self.ws = websocket.WebSocketApp(self.endpoint,
-                            on_message=self.__on_message,
-                            on_error=self.__on_error,
-                            on_close=self.__on_close_public)                             
-        self.wst = threading.Thread(target=self.__start_public)
-        self.wst.daemon = True
-        self.wst.start()
-        self.ws.on_open = self.__on_open_public
-        # private ws 
-        self.wsp = websocket.WebSocketApp(self.endpoint_private,
-                            on_message=self.__on_message,
-                            on_error=self.__on_error,
-                            on_close=self.__on_close_private)                             
-        self.wspt = threading.Thread(target=self.__start_private)
-        self.wspt.daemon = True
-        self.wspt.start()                       
-        self.wsp.on_open = self.__on_open_private
-        self.__repeated_ping()
+        # public and private ws run on the shared asyncio websocket runtime,
+        # which reconnects them and sends the keep alive pings
+        self.ws = WebSocketApp(self.endpoint,
+                               on_message=self.__on_message,
+                               on_error=self.__on_error,
+                               on_close=self.__on_close_public,
+                               on_open=self.__on_open_public,
+                               ping_interval=19,
+                               ping_payload=json.dumps({'op': 'ping'})).start()
+        self.wsp = WebSocketApp(self.endpoint_private,
+                                on_message=self.__on_message,
+                                on_error=self.__on_error,
+                                on_close=self.__on_close_private,
+                                on_open=self.__on_open_private,
+                                ping_interval=19,
+                                ping_payload=json.dumps({'op': 'ping'})).start()
 
     def __auth(self, ws):
         """
@@ -141,42 +138,9 @@ class BybitWs:
         if self.wsp is not None:
             self.wsp.send(json.dumps({'op': 'ping'}))
     
-    def __repeated_ping(self):
-        """
-        keep pinging so we minimize the chance of getting our connections closed
-        """                      
-        def loop_function():
-            while self.is_running:
-                try:          
-                    self.ping()
-                    time.sleep(19)
-                except Exception as e:
-                    logger.error(f"Keep Alive Error - {str(e)}")
-                    #logger.error(traceback.format_exc())
-                    notify(f"Keep Alive Error - {str(e)}")
-                    time.sleep(5)
-                    #notify(traceback.format_exc())
-
-        timer = threading.Timer(10, loop_function)
-        timer.daemon = True        
-        timer.start()        
-    
-
-    def __start_public(self):
-        """
-        start the public websocket.
-        """
-        while self.is_running:        
-            self.ws.run_forever()            
-    
-    def __start_private(self):
-        """
-        start the private websocket.
-        """
-        while self.is_running:                    
-            self.wsp.run_forever()      
-
     def __on_open_public(self, ws):        
+        # klines sent while disconnected are lost
+        self.__emit('open', '', None)
         if self.spot:  
             ws.send(
                 json.dumps({
@@ -248,8 +212,8 @@ class BybitWs:
         logger.error(message)
         logger.error(traceback.format_exc())
 
-        notify(f"Error occurred. {message}")
-        notify(traceback.format_exc())
+        notify(f"Error occurred. {message}", account=self.account)
+        notify(traceback.format_exc(), account=self.account)
 
     def __on_message(self, ws, message):
         """
@@ -259,7 +223,7 @@ class BybitWs:
         :return:
         """                
         try:
-            obj = json.loads(message)      
+            obj = json_loads(message)
      
             if 'topic' in obj:
                 if len(obj['data']) <= 0:
@@ -283,15 +247,8 @@ class BybitWs:
                     if not self.spot and not final_candle_data:                      
                         return
                     
-                    current_minute = datetime.now().time().minute
-                    if self.last_heartbeat != current_minute:
-                        # Send a heartbeat to Healthchecks.io
-                        try:
-                            requests.get(conf['healthchecks.io'][self.account]['websocket_heartbeat'])
-                            #logger.info("WS Heart Beat sent!") 
-                            self.last_heartbeat = current_minute
-                        except Exception as e:
-                            pass          
+                    # Healthchecks.io is pinged by the heartbeat worker, never from this thread
+                    self.heartbeat.beat('websocket_heartbeat')
 
                 
                     timeframe = table[len(kline):-len('.'+self.pair)] 
@@ -304,32 +261,22 @@ class BybitWs:
                     if self.spot:                                      
                         action = table[len(kline):-len('.' + self.pair)]                            
                         #bin_size_converted = timedelta(seconds=bin_size_converter(allowed_range[action][0])['seconds'])                    
-                    data = [{
-                        "timestamp" : data[0]['t' if self.spot else 'end'],
-                        "high" : float(data[0]['h' if self.spot else 'high']),
-                        "low" : float(data[0]['l' if self.spot else 'low']),
-                        "open" : float(data[0]['o' if self.spot else 'open']),
-                        "close" : float(data[0]['c' if self.spot else 'close']),
-                        "volume" : float(data[0]['v' if self.spot else 'volume'])
-                        }]
-                   
-                    if len(str(data[0]['timestamp'])) == 13:
-                        data[0]['timestamp'] = data[0]['timestamp']  / 1000
-          
-                    data[0]['timestamp'] = datetime.fromtimestamp(data[0]['timestamp'], tz=timezone.utc) \
-                                        + (timedelta(seconds=0.01) if self.spot else timedelta(seconds=0))   
-                    
+                    candle = data[0]
+                    timestamp = candle['t' if self.spot else 'end']
+                    # seconds or milliseconds
+                    timestamp = kline_timestamp(timestamp if len(str(timestamp)) == 13 else timestamp * 1000) \
+                                + (timedelta(seconds=0.01) if self.spot else timedelta(seconds=0))
+                    klines = [Kline(timestamp,
+                                    float(candle['o' if self.spot else 'open']),
+                                    float(candle['h' if self.spot else 'high']),
+                                    float(candle['l' if self.spot else 'low']),
+                                    float(candle['c' if self.spot else 'close']),
+                                    float(candle['v' if self.spot else 'volume']))]
+
                     if final_candle_data:
-                        data.append({
-                            "timestamp": data[0]['timestamp'] + timedelta(seconds=0.1),
-                            "open": np.nan,
-                            "high": np.nan,
-                            "low" : np.nan,
-                            "close" : np.nan,
-                            "volume": np.nan
-                            })   
-
-                    self.__emit(action, action, to_data_frame(data))
+                        klines.append(Kline(timestamp + timedelta(seconds=0.1), np.nan, np.nan, np.nan, np.nan, np.nan))
+
+                    self.__emit(action, action, klines)
                                            
                 elif table.startswith("tickers"):
                     self.__emit('instrument', table, data)  
@@ -374,18 +321,7 @@ class BybitWs:
 
         if self.is_running:
             logger.info(f"Public Websocket On Close: Restart")
-            notify(f"Public Websocket On Close: Restart")
-
-            time.sleep(1)
-            # public ws 
-            self.ws = websocket.WebSocketApp(self.endpoint,
-                                on_message=self.__on_message,
-                                on_error=self.__on_error,
-                                on_close=self.__on_close_public)                             
-            self.wst = threading.Thread(target=self.__start_public)
-            self.wst.daemon = True
-            self.wst.start()
-            self.ws.on_open = self.__on_open_public
+            notify(f"Public Websocket On Close: Restart", account=self.account)
 
     def __on_close_private(self, ws):
         """
@@ -397,18 +333,7 @@ class BybitWs:
 
         if self.is_running:
             logger.info(f"Private Websocket On Close: Restart")
-            notify(f"Private Websocket On Close: Restart")
-
-            time.sleep(1)
-            # private ws 
-            self.wsp = websocket.WebSocketApp(self.endpoint_private,
-                                on_message=self.__on_message,
-                                on_error=self.__on_error,
-                                on_close=self.__on_close_private)                             
-            self.wspt = threading.Thread(target=self.__start_private)
-            self.wspt.daemon = True
-            self.wspt.start()                       
-            self.wsp.on_open = self.__on_open_private
+            notify(f"Private Websocket On Close: Restart", account=self.account)
 
     def on_close(self, func):
         """
@@ -430,4 +355,6 @@ class BybitWs:
         close websocket
         """
         self.is_running = False
-        self.ws.close()
\ No newline at end of file
+        self.heartbeat.stop()
+        self.ws.close()
+        self.wsp.close()
\ No newline at end of file
@@ -0,0 +1,92 @@
+# coding: UTF-8
+import asyncio
+from datetime import datetime, timezone
+
+from src import logger, delta
+from src.exchange.websocket_runtime import WebsocketRuntime
+
+
+class CandleBackfill:
+    """
+    Recovers the candles that closed while a websocket was disconnected.
+    After a reconnect, or when the kline feed skips a candle, the klines are held back while the range
+    since the last closed candle of every buffer is fetched through REST on the runtime's thread pool,
+    the fetched candles are merged into the buffers in order and without duplicates,
+    then the held klines are replayed, so the strategy never runs on a buffer with a hole.
+    Used from the websocket callbacks, on the loop thread.
+    """
+
+    def __init__(self, fetch, runtime=None):
+        """
+        :param fetch: function(bin_size, start_time, end_time) returning resampled candles, e.g. fetch_ohlcv
+        :param runtime: WebsocketRuntime, the shared one by default
+        """
+        self.fetch = fetch
+        self.runtime = runtime or WebsocketRuntime.shared()
+        # Backfill before the next klines are applied
+        self.stale = False
+        # Future of the running backfill
+        self.running = None
+        # (action, klines) received during the backfill
+        self.held = []
+        # Timestamp of the last kline by feed
+        self.feed_times = {}
+        # Number of backfills and of candles they recovered
+        self.backfills = 0
+        self.recovered = 0
+
+    def invalidate(self):
+        """
+        the websocket reconnected, klines may have been lost
+        """
+        self.stale = True
+
+    def hold(self, action, klines, buffers, replay):
+        """
+        hold the klines back if a backfill is needed or running
+        :param action: feed of the klines, e.g. '1m'
+        :param klines: list of Kline
+        :param buffers: OhlcvBuffer by timeframe, None before the initial fill
+        :param replay: function(action, klines) applying the held klines after the backfill
+        :return: True if the klines are held back
+        """
+        if self.running is not None:
+            self.held.append((action, klines))
+            return True
+        last = self.feed_times.get(action)
+        gap = last is not None and len(klines) > 0 and klines[0].timestamp - last > 1.5 * delta(action)
+        if len(klines) > 0:
+            self.feed_times[action] = klines[-1].timestamp if last is None else max(last, klines[-1].timestamp)
+        if not (self.stale or gap) or not buffers:
+            return False
+        self.stale = False
+        if gap:
+            logger.info(f"Kline feed {action} skipped from {last} to {klines[0].timestamp}, backfilling")
+        self.held.append((action, klines))
+        since = {t: buffer.last_timestamp for t, buffer in buffers.items() if buffer.last_timestamp is not None}
+        self.running = self.runtime.submit(self.__fetch(since, datetime.now(timezone.utc)))
+        self.running.add_done_callback(lambda future: self.runtime.call_soon(self.__merge, future, buffers, replay))
+        return True
+
+    async def __fetch(self, since, end_time):
+        # the timeframes are fetched concurrently
+        loop = asyncio.get_running_loop()
+        fetches = {t: loop.run_in_executor(None, self.fetch, t, start_time.to_pydatetime(), end_time)
+                   for t, start_time in since.items()}
+        return {t: await fetch for t, fetch in fetches.items()}, end_time
+
+    def __merge(self, future, buffers, replay):
+        self.running = None
+        held, self.held = self.held, []
+        try:
+            fetched, end_time = future.result()
+            for t, data in fetched.items():
+                if len(data) > 0:
+                    self.recovered += buffers[t].merge(data, partial=data.index[-1] > end_time)
+            self.backfills += 1
+        except Exception as e:
+            logger.error(f"Candle backfill failed - {e}")
+            # tried again with the next klines
+            self.stale = True
+        for action, klines in held:
+            replay(action, klines)
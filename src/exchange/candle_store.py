@@ -0,0 +1,173 @@
+# coding: UTF-8
+import io
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # no file locks between the processes, e.g. on Windows
+    fcntl = None
+
+import pandas as pd
+
+from src import delta, logger
+
+# Same layout as the backtesters, the directory of a timeframe is named after the timeframe list
+# of a single timeframe backtest, e.g. src/ohlc/binance_futures/BTCUSDT/['1h']/data.csv
+OHLC_FILENAME = os.path.join(os.path.dirname(__file__), "../ohlc/{}/{}/{}/data.csv")
+
+
+class CandleStore:
+    """
+    Candles of a pair on disk, shared by the backtester and the live bots,
+    so a restarting bot only fetches the candles that closed since it last ran.
+    Writes to a file are serialized between the threads of a process by a lock
+    and between the processes by a file lock on a ".lock" file next to it.
+    """
+
+    # Locks of the files by path
+    locks = {}
+    locks_lock = threading.Lock()
+    # Bytes read at once from the end of a file
+    chunk_size = 1 << 16
+
+    def __init__(self, exchange, pair, filename=OHLC_FILENAME):
+        """
+        :param exchange: directory of the exchange, e.g. binance_futures
+        :param pair: pair
+        :param filename: format of the file path with the exchange, pair and timeframe list
+        """
+        self.exchange = exchange
+        self.pair = pair
+        self.filename = filename
+
+    def path(self, bin_size):
+        return self.filename.format(self.exchange, self.pair, [bin_size])
+
+    def load(self, bin_size, start_time=None):
+        """
+        stored candles of a timeframe
+        :param start_time: only the candles after it, UTC if naive, read from the end of the file
+        :return: DataFrame indexed by candle close time, None when nothing is stored
+        """
+        file = self.path(bin_size)
+        if not os.path.exists(file):
+            return None
+        start_time = None if start_time is None else self.__utc(start_time)
+        data = pd.read_csv(file if start_time is None else self.__tail(file, start_time), index_col=0)
+        data.index = pd.to_datetime(data.index, utc=True)
+        data.index.name = "timestamp"
+        if start_time is not None:
+            data = data[data.index > start_time]
+        return data
+
+    def __tail(self, file, start_time):
+        """
+        the header and the rows of the file from the last one at or before start_time
+        """
+        with open(file, "rb") as f:
+            header = f.readline()
+            begin = f.tell()
+            position = f.seek(0, os.SEEK_END)
+            rows = b""
+            chunk = self.chunk_size
+            while position > begin:
+                size = min(chunk, position - begin)
+                position -= size
+                f.seek(position)
+                rows = f.read(size) + rows
+                chunk *= 2
+                if position > begin:
+                    # the first line of a chunk is partial
+                    if b"\n" not in rows:
+                        continue
+                    first = rows.split(b"\n", 1)[1]
+                else:
+                    first = rows
+                if first.strip() and self.__utc(first.split(b",", 1)[0].decode()) <= start_time:
+                    rows = first
+                    break
+        return io.BytesIO(header + rows)
+
+    @staticmethod
+    def __utc(time):
+        time = pd.Timestamp(time)
+        return time.tz_localize("UTC") if time.tzinfo is None else time
+
+    @contextmanager
+    def lock(self, bin_size):
+        """
+        hold the write lock of a timeframe's file
+        """
+        file = self.path(bin_size)
+        with self.locks_lock:
+            lock = self.locks.setdefault(os.path.abspath(file), threading.Lock())
+        with lock:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(os.path.dirname(file), exist_ok=True)
+            with open(file + ".lock", "a") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def continuous(self, bin_size, data):
+        """
+        whether the candles have no gaps
+        """
+        return len(data) < 2 or bool((data.index[1:] - data.index[:-1] == delta(bin_size)).all())
+
+    def spacing(self, data):
+        """
+        smallest interval between the candles, None for less than two candles
+        """
+        return None if len(data) < 2 else (data.index[1:] - data.index[:-1]).min()
+
+    def save(self, bin_size, data):
+        """
+        merge closed candles into the stored ones, a candle that is stored already is replaced,
+        the backtester resumes its downloads from the last stored candle so nothing is written
+        that would leave a gap behind it
+        :return: whether the candles were written
+        """
+        if len(data) == 0:
+            return False
+        if not self.continuous(bin_size, data):
+            logger.info(f"Candles not stored, the {bin_size} candles have gaps")
+            return False
+        with self.lock(bin_size):
+            # read under the lock, another bot or backtest may have written meanwhile
+            return self.__merge(bin_size, data)
+
+    def __merge(self, bin_size, data):
+        file = self.path(bin_size)
+        stored = self.load(bin_size)
+        if stored is not None and len(stored) > 0:
+            spacing = self.spacing(stored)
+            if spacing is not None and spacing != delta(bin_size):
+                # e.g. the 1m candles of a backtest with minute granularity
+                logger.info(f"Candles not stored, {file} holds candles {spacing} apart")
+                return False
+            if data.index[0] > stored.index[-1] + delta(bin_size):
+                logger.info(f"Candles not stored, {file} ends at {stored.index[-1]} "
+                            f"before the candles from {data.index[0]}")
+                return False
+            data = pd.concat([stored, data])
+            data = data[~data.index.duplicated(keep="last")].sort_index()
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        # readers never see a half written file
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(file), suffix=".csv")
+        try:
+            with os.fdopen(fd, "w") as f:
+                data.to_csv(f, index_label="time")
+            os.replace(temp, file)
+        except BaseException:
+            os.remove(temp)
+            raise
+        return True
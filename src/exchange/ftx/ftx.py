@@ -13,11 +13,13 @@ from bravado.exception import HTTPNotFound
 from pytz import UTC
 
 from src import logger, bin_size_converter, allowed_range, allowed_range_minute_granularity, to_data_frame, \
-    resample, find_timeframe_string, delta, FatalError, notify, ord_suffix, RepeatedTimer, sync_obj_with_config
+    resample, find_timeframe_string, delta, OhlcvBuffer, ResampleCache, StrategyExecutor, FatalError, notify, ord_suffix, RepeatedTimer, sync_obj_with_config, \
+    shared_client, RateLimiter
 from src import retry_ftx as retry
 from src.exchange.ftx.ftx_api import FtxClient
 from src.config import config as conf
 from src.exchange_config import exchange_config
+from src.indicators import indicator_cache
 from src.exchange.ftx.ftx_websocket import FtxWs
 
 
@@ -93,6 +95,12 @@ class Ftx:
         self.timeframe_data = None    
         # Timeframe data info like partial candle data values, last candle values, last action etc.
         self.timeframe_info = {}
+        # Higher timeframe candles kept up to date for security()
+        self.resample_data = {}
+        # Runs the strategy off the websocket thread
+        self.strategy_executor = StrategyExecutor()
+        # Snapshot of the candles security() reads, taken with the candle the strategy runs on
+        self.security_source = None
         # New data timestamp after fetching
         self.last_new_data_timestamp = None
         # Profit target long and short for a simple limit exit strategy
@@ -147,7 +155,10 @@ class Ftx:
         
         if self.account == "None":
             self.account = None
-        self.client = FtxClient(api_key=api_key, api_secret=api_secret, subaccount_name=self.account)
+        self.client = shared_client((FtxClient, api_key, self.account),
+                                    lambda: FtxClient(api_key=api_key, api_secret=api_secret, subaccount_name=self.account,
+                                                      rate_limiter=shared_client((RateLimiter, 'ftx', api_key),
+                                                                                 lambda: RateLimiter(30, window=0.2))))
         
         if self.asset_rounding == None or self.quote_rounding == None:
             markets_list = retry(lambda: self.client.list_markets())   
@@ -402,7 +413,7 @@ class Ftx:
                 time.sleep(2)
                 i += 1
                 if i > 10:
-                    notify(f"Order retry count exceed")
+                    notify(f"Order retry count exceed", account=self.account)
                     break
             self.cancel_all(limit_orders=True)   
         else:
@@ -420,7 +431,7 @@ class Ftx:
             logger.info(f"Stop   : {stop}")
             logger.info(f"======================================")
 
-            notify(f"New Order\nType: {ord_type}\nSide: {side}\nQty: {ord_qty}\nLimit: {limit}\nStop: {stop}")
+            notify(f"New Order\nType: {ord_type}\nSide: {side}\nQty: {ord_qty}\nLimit: {limit}\nStop: {stop}", account=self.account)
 
     def __amend_order(self, side, ord_qty, ord_id=None, client_ord_id=None, limit=0, stop=0):
         """
@@ -460,7 +471,7 @@ class Ftx:
             logger.info(f"Stop   : {stop}")
             logger.info(f"======================================")
 
-            notify(f"Amend Order\nType: {ord_type}\nSide: {side}\nQty: {ord_qty}\nLimit: {limit}\nStop: {stop}")
+            notify(f"Amend Order\nType: {ord_type}\nSide: {side}\nQty: {ord_qty}\nLimit: {limit}\nStop: {stop}", account=self.account)
 
     def entry(self, id, long, qty, limit=0, stop=0, trailValue= 0, post_only=False, reduce_only=False, ioc=False, allow_amend=False, cancel_all=False,
                  when=True, round_decimals=None, callback=None):
@@ -787,7 +798,6 @@ class Ftx:
                 sl_price_long = round(avg_entry - (avg_entry*sl_percent_long), self.quote_rounding) if use_perc else  round(sl_percent_long * 100 , self.quote_rounding)
                 if sl_order is not None:                             
                     self.cancel_all_conditional()
-                    time.sleep(2)
                     self.order("SL", False, abs(pos_size), stop=sl_price_long, reduce_only=True, allow_amend=False, callback=self.get_sltp_values()['stop_long_callback'])
                     #self.__amend_order(sl_order['clOrdID'], False, abs(pos_size), stop=sl_price_long)
                 else:  
@@ -797,7 +807,6 @@ class Ftx:
                 sl_price_short = round(avg_entry + (avg_entry*sl_percent_short), self.quote_rounding) if use_perc else round(sl_percent_short * 100, self.quote_rounding)
                 if sl_order is not None:                                  
                     self.cancel_all_conditional()
-                    time.sleep(2)
                     self.order("SL", True, abs(pos_size), stop=sl_price_short, reduce_only=True, allow_amend=False, callback=self.get_sltp_values()['stop_short_callback'])
                     #self.__amend_order(sl_order['clOrdID'], True, abs(pos_size), stop=sl_price_short)
                 else:  
@@ -891,16 +900,24 @@ class Ftx:
         
         return resample(data, bin_size, minute_granularity)        
 
+    def __security_timeframe(self):
+        """
+        lowest timeframe, security() resamples its candles
+        """
+        return find_timeframe_string(min(allowed_range_minute_granularity[t][3] for t in self.bin_size))
+
     def security(self, bin_size, data=None):
         """
         Recalculate and obtain data of a timeframe higher than the current chart timeframe without looking into the furute that would cause undesired effects.
         """     
-        if data == None:   
-            timeframe_list = [allowed_range_minute_granularity[t][3] for t in self.bin_size] # minute count of a timeframe for sorting when sorting is needed 
-            timeframe_list.sort(reverse=True)
-            t = find_timeframe_string(timeframe_list[-1])     
-            data = self.timeframe_data[t]      
-            
+        if data is None:   
+            t = self.__security_timeframe()
+            if bin_size not in self.resample_data:
+                self.resample_data[bin_size] = ResampleCache(bin_size, self.ohlcv_len)
+            # the buffer moves on while the strategy runs on the executor thread
+            source = self.timeframe_data[t] if self.security_source is None else self.security_source
+            return self.resample_data[bin_size].data_frame(source)
+
         return resample(data, bin_size)[:-1]    
 
     def __update_ohlcv(self, action=None, new_data=None):
@@ -941,19 +958,18 @@ class Ftx:
             for t in self.bin_size:              
                 end_time = datetime.now(timezone.utc)
                 start_time = end_time - self.ohlcv_len * delta(t)
-                self.timeframe_data[t] = self.fetch_ohlcv(t, start_time, end_time)
-                self.timeframe_info[t] = {
-                                                    "allowed_range": allowed_range_minute_granularity[t][0] if self.minute_granularity else allowed_range[t][0], 
-                                                    "ohlcv": self.timeframe_data[t][:-1], # Dataframe with closed candles                                                   
-                                                    "last_action_time": None,#self.timeframe_data[t].iloc[-1].name, # Last strategy execution time
-                                                    "last_candle": self.timeframe_data[t].iloc[-2].values,  # Store last complete candle
-                                                    "partial_candle": self.timeframe_data[t].iloc[-1].values  # Store incomplete candle
-                                                }
+                data = self.fetch_ohlcv(t, start_time, end_time)
                 # The last candle is an incomplete candle with timestamp in future                
-                if self.timeframe_data[t].iloc[-1].name > end_time:
-                    last_candle = self.timeframe_data[t].iloc[-1].values # Store last candle
-                    self.timeframe_data[t] = self.timeframe_data[t][:-1] # Exclude last candle
-                    self.timeframe_data[t].loc[end_time.replace(microsecond=0)] = last_candle #set last candle to end_time   
+                self.timeframe_data[t] = OhlcvBuffer.from_data_frame(data, self.ohlcv_len, t, self.minute_granularity,
+                                                                     partial=data.iloc[-1].name > end_time)
+                self.timeframe_info[t] = {
+                            "allowed_range": allowed_range_minute_granularity[t][0] 
+                                                if self.minute_granularity else allowed_range[t][0], 
+                            "ohlcv": data[:-1], # Dataframe with closed candles                                                   
+                            "last_action_time": None,#self.timeframe_data[t].iloc[-1].name, # Last strategy execution time
+                            "last_candle": data.iloc[-2].values,  # Store last complete candle
+                            "partial_candle": data.iloc[-1].values  # Store incomplete candle
+                            }
 
         # Timeframes to be updated
         timeframes_to_update = [allowed_range_minute_granularity[t][3] if self.timeframes_sorted != None else 
@@ -968,65 +984,94 @@ class Ftx:
 
         #logger.info(f"timefeames to update: {timeframes_to_update}")        
 
+        new_candles = new_data[OhlcvBuffer.columns].to_numpy(dtype=float)
+
+        # the timeframes of this update, run in order by one strategy job
+        jobs = []
         for t in timeframes_to_update:
             # Find timeframe string based on its minute count value
             if self.timeframes_sorted != None:             
                 t = find_timeframe_string(t)               
                     
-            # replace latest candle if timestamp is same or append
-            if self.timeframe_data[t].iloc[-1].name == new_data.iloc[0].name:
-                self.timeframe_data[t] = pd.concat([self.timeframe_data[t][:-1], new_data])
-            else:
-                self.timeframe_data[t] = pd.concat([self.timeframe_data[t], new_data])      
+            # update the partial candle in place, it is moved to the closed candles 
+            # once the new data belongs to the next candle
+            ohlcv = self.timeframe_data[t]
+            for timestamp, candle in zip(new_data.index, new_candles):
+                ohlcv.update(timestamp, candle)
+            self.timeframe_info[t]['partial_candle'] = ohlcv.partial # store partial candle data
 
-            # exclude current candle data and store partial candle data
-            re_sample_data = resample(self.timeframe_data[t], t, minute_granularity=True if self.minute_granularity else False)
-            self.timeframe_info[t]['partial_candle'] = re_sample_data.iloc[-1].values # store partial candle data
-            re_sample_data =re_sample_data[:-1] # exclude current candle data
+            last_candle_time = ohlcv.last_timestamp
+            if last_candle_time is None:
+                continue
 
-            #logger.info(f"{self.timeframe_info[t]['last_action_time']} : {self.timeframe_data[t].iloc[-1].name} : {re_sample_data.iloc[-1].name}")  
+            #logger.info(f"{self.timeframe_info[t]['last_action_time']} : {ohlcv.partial_time} : {last_candle_time}")  
 
             if self.call_strat_on_start:
                 if self.timeframe_info[t]["last_action_time"] is not None and \
-                self.timeframe_info[t]["last_action_time"] == re_sample_data.iloc[-1].name:
+                self.timeframe_info[t]["last_action_time"] == last_candle_time:
                     continue
             else:   
                 if self.timeframe_info[t]["last_action_time"] is None:
-                    self.timeframe_info[t]["last_action_time"] = re_sample_data.iloc[-1].name
+                    self.timeframe_info[t]["last_action_time"] = last_candle_time
                     
-                if self.timeframe_info[t]["last_action_time"] == re_sample_data.iloc[-1].name:
+                if self.timeframe_info[t]["last_action_time"] == last_candle_time:
                     continue
 
-            # The last candle in the buffer needs to be preserved 
-            # while resetting the buffer as it may be incomlete
-            # or contains latest data from WS
-            self.timeframe_data[t] = pd.concat([re_sample_data.iloc[-1 * self.ohlcv_len:, :], self.timeframe_data[t].iloc[[-1]]]) 
             #store ohlcv dataframe to timeframe_info dictionary
-            self.timeframe_info[t]["ohlcv"] = re_sample_data
-            #logger.info(f"Buffer Right Edge: {self.data.iloc[-1]}")
+            self.timeframe_info[t]["ohlcv"] = ohlcv.to_data_frame()
+            self.timeframe_info[t]["last_candle"] = ohlcv.last_candle
             
-            open = re_sample_data['open'].values
-            close = re_sample_data['close'].values
-            high = re_sample_data['high'].values
-            low = re_sample_data['low'].values
-            volume = re_sample_data['volume'].values 
-            #logger.info(f"{self.timeframe_info['5m']['partial_candle']}")                            
-            try:
-                if self.strategy is not None:   
-                    self.timestamp = re_sample_data.iloc[-1].name.isoformat()           
-                    self.strategy(t, open, close, high, low, volume)              
-                self.timeframe_info[t]['last_action_time'] = re_sample_data.iloc[-1].name
-            except FatalError as e:
-                # Fatal error
-                logger.error(f"Fatal error. {e}")
-                logger.error(traceback.format_exc())
-
-                notify(f"Fatal error occurred. Stopping Bot. {e}")
-                notify(traceback.format_exc())
-                self.stop()
-            except Exception as e:
-                logger.error(f"An error occurred. {e}")
-                logger.error(traceback.format_exc())      
+            # copies, the buffer moves on while the strategy runs on the executor thread
+            open = ohlcv.open.copy()
+            close = ohlcv.close.copy()
+            high = ohlcv.high.copy()
+            low = ohlcv.low.copy()
+            volume = ohlcv.volume.copy()
+
+            previous_action_time = self.timeframe_info[t]['last_action_time']
+            self.timeframe_info[t]['last_action_time'] = last_candle_time
+            jobs.append((t, last_candle_time, previous_action_time, open, close, high, low, volume))
+
+        if self.strategy is not None and len(jobs) > 0:
+            # a stale update of the same timeframes that did not run yet is replaced
+            self.strategy_executor.submit(",".join(job[0] for job in jobs), self.__run_strategies, jobs,
+                                          self.timeframe_data[self.__security_timeframe()].snapshot())
+
+    def __run_strategies(self, jobs, security_source):
+        """
+        execute the strategy for every timeframe of an update on the strategy executor thread
+        :param jobs: arguments of __run_strategy by timeframe, in the order the timeframes run
+        :param security_source: snapshot of the candles security() resamples
+        """
+        self.security_source = security_source
+        try:
+            for job in jobs:
+                self.__run_strategy(*job)
+        finally:
+            self.security_source = None
+
+    def __run_strategy(self, t, last_candle_time, previous_action_time, open, close, high, low, volume):
+        """
+        execute the strategy on the strategy executor thread
+        """
+        try:
+            self.timestamp = last_candle_time.isoformat()
+            indicator_cache.next_bar(last_candle_time)
+            self.strategy(t, open, close, high, low, volume)
+        except FatalError as e:
+            # Fatal error
+            logger.error(f"Fatal error. {e}")
+            logger.error(traceback.format_exc())
+
+            notify(f"Fatal error occurred. Stopping Bot. {e}", account=self.account)
+            notify(traceback.format_exc(), account=self.account)
+            self.stop()
+        except Exception as e:
+            logger.error(f"An error occurred. {e}")
+            logger.error(traceback.format_exc())
+            # retried with the next update like when the strategy ran on the websocket thread
+            if self.timeframe_info[t]['last_action_time'] == last_candle_time:
+                self.timeframe_info[t]['last_action_time'] = previous_action_time
 
     def __on_update_ticker(self, action, ticker):
         """
@@ -1069,7 +1114,7 @@ class Ftx:
         message = f"""========= FILLS =============
                            {fills} 
                       ============================="""
-        notify(message)
+        notify(message, account=self.account)
 
     def __on_update_order(self, action, order):
         """
@@ -1080,6 +1125,14 @@ class Ftx:
        
         logger.info(f"on update order:{self.order_update}")
 
+        # Evaluation of profit and loss, its REST calls (and their retries) don't hold up the websocket thread
+        if self.is_exit_order_active or self.is_sltp_active:
+            self.strategy_executor.submit("eval_position", self.__eval_position)
+
+    def __eval_position(self):
+        """
+        evaluate the exit and sltp orders on the strategy executor thread
+        """
         if self.is_sltp_active:
             self.eval_sltp()
         if self.is_exit_order_active:
@@ -1120,6 +1173,7 @@ class Ftx:
         Stop the crawler
         """
         self.is_running = False
+        self.strategy_executor.stop()
         self.ws.close()
         self.update_ohlcv_timer.stop()
 
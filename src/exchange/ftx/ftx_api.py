@@ -6,13 +6,16 @@ from requests import Request, Session, Response
 import hmac
 from ciso8601 import parse_datetime
 
+from src import RateLimiter, rate_limited
+
 
 
 class FtxClient:
     _ENDPOINT = 'https://ftx.com/api/'
 
-    def __init__(self, api_key=None, api_secret=None, subaccount_name=None) -> None:
-        self._session = Session()
+    def __init__(self, api_key=None, api_secret=None, subaccount_name=None, rate_limiter=None) -> None:
+        # 30 requests per 200ms by default
+        self._session = rate_limited(Session(), rate_limiter or RateLimiter(30, window=0.2))
         self._api_key = api_key
         self._api_secret = api_secret
         self._subaccount_name = subaccount_name
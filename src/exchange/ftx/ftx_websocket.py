@@ -8,12 +8,12 @@ import time
 import traceback
 import urllib
 
-import websocket
 from datetime import datetime
 import pandas as pd
 
 from src import logger, to_data_frame, notify
 from src.config import config as conf
+from src.exchange.websocket_runtime import WebSocketApp
 
 
 def generate_nonce():
@@ -46,14 +46,12 @@ class FtxWs:
             domain = 'wss://ftx.com/ws/'               
   
         self.endpoint = domain
-        self.ws = websocket.WebSocketApp(self.endpoint,
-                            on_message=self.__on_message,
-                            on_error=self.__on_error,
-                            on_close=self.__on_close)                             
-        self.wst = threading.Thread(target=self.__start)
-        self.wst.daemon = True
-        self.wst.start()            
-        self.ws.on_open = self.subscribe_all 
+        # Runs on the shared asyncio websocket runtime, which reconnects it
+        self.ws = WebSocketApp(self.endpoint,
+                               on_message=self.__on_message,
+                               on_error=self.__on_error,
+                               on_close=self.__on_close,
+                               on_open=self.subscribe_all).start()
 
     def __auth(self, ws):
         """
@@ -67,7 +65,7 @@ class FtxWs:
         ts = int(time.time() * 1000)        
 
         # Authenticate with API.
-        self.ws.send(
+        ws.send(
             json.dumps({
                 'op': 'login',
                 'args': {
@@ -80,16 +78,9 @@ class FtxWs:
             })
         )        
 
-    def __start(self):
-        """
-        start the websocket.
-        """
-        while self.is_running:           
-            self.ws.run_forever()   
-
     #public channels   
     def subscribe_all(self, ws):
-        self.__auth(self.ws) 
+        self.__auth(ws) 
         ws.send(
            json.dumps({
                 'op': 'subscribe',                
@@ -184,8 +175,8 @@ class FtxWs:
         logger.error(message)
         logger.error(traceback.format_exc())
 
-        notify(f"Error occurred. {message}")
-        notify(traceback.format_exc())
+        notify(f"Error occurred. {message}", account=self.account)
+        notify(traceback.format_exc(), account=self.account)
 
     def __on_message(self, ws, message):
         """
@@ -254,16 +245,7 @@ class FtxWs:
 
         if self.is_running:
             logger.info("Websocket restart")
-            notify(f"Websocket restart")
-
-            self.ws = websocket.WebSocketApp(self.endpoint,
-                            on_message=self.__on_message,
-                            on_error=self.__on_error,
-                            on_close=self.__on_close)                             
-            self.wst = threading.Thread(target=self.__start)
-            self.wst.daemon = True
-            self.wst.start()            
-            self.ws.on_open = self.subscribe_all 
+            notify(f"Websocket restart", account=self.account)
 
     def on_close(self, func):
         """
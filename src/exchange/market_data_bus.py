@@ -0,0 +1,252 @@
+# coding: UTF-8
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+import pandas as pd
+
+from src import logger, Kline, delta
+from src.exchange.websocket_runtime import WebsocketRuntime
+
+
+def ring_name(exchange, pair, stream, testnet=False):
+    """
+    shared memory name of a stream, e.g. rptr_binance_btcusdt_1m
+    """
+    return f"rptr_{exchange}{'_test' if testnet else ''}_{pair.lower()}_{stream}"
+
+
+class SharedRing:
+    """
+    Ring buffer of float64 rows in shared memory with one writer process and any number of reader processes.
+    A header [sequence, count, capacity, fields] precedes the rows, the sequence is odd while the writer
+    changes the rows (seqlock), so readers retry instead of locking and never block the writer.
+    """
+
+    header_size = 4
+    # Names of the rings created by this process
+    created = set()
+
+    def __init__(self, name, fields=None, capacity=None, create=False):
+        """
+        :param name: shared memory name
+        :param fields: number of values of a row, when creating
+        :param capacity: number of rows kept, when creating
+        :param create: create the ring (writer) or attach to an existing one (reader)
+        """
+        self.name = name
+        self.writer = create
+        if create:
+            size = 8 * (self.header_size + capacity * fields)
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            except FileExistsError:
+                # left over by a daemon that did not exit cleanly
+                shared_memory.SharedMemory(name=name).unlink()
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            self.created.add(name)
+            self.header = np.ndarray((self.header_size,), dtype="int64", buffer=self.shm.buf)
+            self.header[:] = [0, 0, capacity, fields]
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            # only the writer removes the memory, the resource tracker of a reader would unlink it at exit
+            if name not in self.created:
+                resource_tracker.unregister(self.shm._name, "shared_memory")
+            self.header = np.ndarray((self.header_size,), dtype="int64", buffer=self.shm.buf)
+            capacity, fields = int(self.header[2]), int(self.header[3])
+        self.capacity = capacity
+        self.fields = fields
+        self.rows = np.ndarray((capacity, fields), dtype="float64", buffer=self.shm.buf, offset=8 * self.header_size)
+        if not create:
+            self.header.flags.writeable = False
+            self.rows.flags.writeable = False
+
+    @property
+    def sequence(self):
+        """
+        changes on every write
+        """
+        return int(self.header[0])
+
+    @property
+    def count(self):
+        """
+        number of rows appended so far
+        """
+        return int(self.header[1])
+
+    def last(self):
+        """
+        last row, None when empty
+        """
+        count, rows = self.read(-1)
+        return rows[-1] if len(rows) > 0 else None
+
+    def write(self, row, replace_last=False):
+        """
+        append a row, or overwrite the last one
+        """
+        count = int(self.header[1])
+        i = (count - 1 if replace_last and count > 0 else count) % self.capacity
+        self.header[0] += 1
+        self.rows[i] = row
+        if not (replace_last and count > 0):
+            self.header[1] = count + 1
+        self.header[0] += 1
+
+    def read(self, since):
+        """
+        consistent copy of the rows appended since a count
+        :param since: count of the first row, negative for the last rows (e.g. -1 for the last one)
+        :return: (count, rows), only the last capacity rows are still available
+        """
+        while True:
+            sequence = int(self.header[0])
+            if sequence % 2 == 1:
+                time.sleep(0)
+                continue
+            count = int(self.header[1])
+            start = count + since if since < 0 else since
+            start = min(max(start, count - self.capacity, 0), count)
+            rows = self.rows.take(np.arange(start, count) % self.capacity, axis=0)
+            if int(self.header[0]) == sequence:
+                return count, rows
+
+    def close(self):
+        self.header = self.rows = None
+        self.shm.close()
+        if self.writer:
+            self.shm.unlink()
+            self.created.discard(self.name)
+
+
+class MarketDataBus:
+    """
+    Reader of the candles and best bid/ask published by the market data daemon (market_data.py).
+    Has the bind/close interface of the exchange websockets: the rings are polled on the websocket runtime
+    and the kline handlers get lists of Kline, the 'bookticker' handler a bookTicker like dict.
+    A kline ring that does not change for stale_after candles is attached again, as a restarted daemon
+    creates new rings, and the 'stale' handler is called when that did not help.
+    """
+
+    # Row layouts
+    kline_fields = ["timestamp", "open", "high", "low", "close", "volume"]
+    bookticker_fields = ["timestamp", "b", "B", "a", "A"]
+
+    def __init__(self, exchange, pair, bin_size, testnet=False, interval=0.05, runtime=None, heartbeat=None,
+                 stale_after=3):
+        """
+        :param bin_size: timeframes of the kline streams
+        :param interval: seconds between two polls
+        :param heartbeat: Heartbeat that gets a 'websocket_heartbeat' beat when a kline ring changes
+        :param stale_after: number of candles of a timeframe after which an unchanged kline ring is stale
+        :raises FileNotFoundError: the daemon does not publish the pair
+        """
+        self.exchange = exchange
+        self.pair = pair
+        self.testnet = testnet
+        self.heartbeat = heartbeat
+        self.stale_after = stale_after
+        self.handlers = {}
+        self.rings = {}
+        self.__attach(list(bin_size) + ['bookticker'])
+        # whether the rings were attached again since a kline ring last changed
+        self.reattached = False
+        self.runtime = runtime or WebsocketRuntime.shared()
+        self.poller = self.runtime.call_every(interval, self.poll, delay=0)
+
+    def __attach(self, keys):
+        rings = {}
+        try:
+            for key in keys:
+                rings[key] = SharedRing(ring_name(self.exchange, self.pair, key, self.testnet))
+        except FileNotFoundError:
+            self.__close_rings(rings)
+            raise
+        self.__close_rings(self.rings)
+        self.rings = rings
+        # Count and last row emitted by ring
+        self.seen = {key: (ring.count, None) for key, ring in self.rings.items()}
+        self.sequences = {key: None for key in self.rings}
+        # time of the last change by ring
+        self.changed = {key: time.time() for key in self.rings}
+
+    def poll(self):
+        if self.rings is None:
+            return
+        now = time.time()
+        for key, ring in self.rings.items():
+            sequence = ring.sequence
+            if sequence == self.sequences[key]:
+                if key != 'bookticker' and now - self.changed[key] > self.stale_after * delta(key).total_seconds():
+                    self.__on_stale(key)
+                    return
+                continue
+            self.changed[key] = now
+            if key not in self.handlers:
+                continue
+            self.sequences[key] = sequence
+            if key == 'bookticker':
+                row = ring.last()
+                if row is not None:
+                    self.handlers[key]('', dict(zip(self.bookticker_fields[1:], row[1:])))
+                continue
+            self.reattached = False
+            if self.heartbeat is not None:
+                # Healthchecks.io is pinged by the heartbeat worker, never from this thread
+                self.heartbeat.beat('websocket_heartbeat')
+            seen, last = self.seen[key]
+            # the last emitted row is re-read, it is overwritten while its candle is open
+            count, rows = ring.read(max(seen - 1, 0))
+            if count == 0:
+                continue
+            self.seen[key] = (count, rows[-1])
+            if last is not None and count - len(rows) == seen - 1 and np.array_equal(rows[0], last):
+                rows = rows[1:]
+            if len(rows) > 0:
+                self.handlers[key](key, [self.to_kline(row) for row in rows])
+
+    def __on_stale(self, key):
+        """
+        attach the rings again, a restarted daemon unlinked the old ones,
+        the 'stale' handler is called when the daemon is gone or still silent
+        """
+        logger.info(f"Market data {self.pair} {key} did not change for {self.stale_after} candles")
+        if not self.reattached:
+            try:
+                self.__attach(list(self.rings))
+                self.reattached = True
+                logger.info(f"Market data {self.pair} rings attached again")
+                return
+            except FileNotFoundError:
+                logger.info(f"Market data daemon does not publish {self.pair} anymore")
+        self.poller.cancel()
+        self.__close_rings(self.rings)
+        self.rings = None
+        if 'stale' in self.handlers:
+            self.handlers['stale']()
+
+    @staticmethod
+    def to_kline(row):
+        return Kline(pd.Timestamp(int(row[0]), unit="ms", tz="UTC"), *row[1:].tolist())
+
+    def bind(self, key, func):
+        """
+        bind fn
+        :param key: timeframe, 'bookticker' or 'stale'
+        :param func:
+        """
+        self.handlers[key] = func
+
+    def close(self):
+        self.poller.cancel()
+        # on the loop thread, after a running poll
+        self.runtime.call_soon(lambda: self.__close_rings(self.rings))
+
+    @staticmethod
+    def __close_rings(rings):
+        for ring in (rings or {}).values():
+            try:
+                ring.close()
+            except Exception as e:
+                logger.error(f"Market data bus close error - {e}")
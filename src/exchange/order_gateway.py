@@ -0,0 +1,95 @@
+# coding: UTF-8
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from src import logger
+
+
+class OrderGateway:
+    """
+    Sends independent order requests in parallel, e.g. the cancel of a take profit and the placement
+    of the new one, on a pool of threads no larger than the client's connection pool,
+    so every request in flight has a kept-alive connection.
+    """
+
+    def __init__(self, workers=4, timeout=60):
+        """
+        :param workers: requests in flight at most
+        :param timeout: seconds gather() waits by default, the requests have their own deadlines
+        """
+        self.workers = workers
+        self.timeout = timeout
+        # threads are started on the first request, stubs and backtests never send any
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="order-gateway")
+
+    def submit(self, func, *args, **kwargs):
+        """
+        send a request without waiting for it
+        :return: concurrent.futures.Future
+        """
+        return self.executor.submit(func, *args, **kwargs)
+
+    def gather(self, *calls, timeout=None):
+        """
+        send the requests in parallel and wait for all of them,
+        the first one is sent from the calling thread
+        :param calls: functions without arguments
+        :param timeout: seconds to wait for the requests sent from the pool, the gateway's timeout by default
+        :return: list of the results in the order of the calls,
+                 the first exception is raised once every request finished
+        :raises TimeoutError: after the deadline, the requests not sent yet are dropped
+                              and the outcome of those still in flight is logged when they finish
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.time() + timeout
+        futures = [self.executor.submit(call) for call in calls[1:]]
+        outcomes = [self.__outcome(calls[0])] if len(calls) > 0 else []
+        timed_out = False
+        for call, future in zip(calls[1:], futures):
+            if timed_out:
+                self.__abandon(future)
+            elif future.cancel():
+                # every worker is busy, e.g. with the gather that called this one
+                if time.time() >= deadline:
+                    timed_out = True
+                else:
+                    outcomes.append(self.__outcome(call))
+            elif len(wait([future], timeout=max(deadline - time.time(), 0)).not_done) > 0:
+                timed_out = True
+                self.__abandon(future)
+            else:
+                outcomes.append(self.__outcome(future.result))
+        if timed_out:
+            for result, error in outcomes:
+                if error is not None:
+                    logger.error(f"Order request failed - {error}")
+            raise TimeoutError(f"order request did not finish within {timeout}s")
+        for result, error in outcomes:
+            if error is not None:
+                raise error
+        return [result for result, error in outcomes]
+
+    @staticmethod
+    def __abandon(future):
+        """
+        drop a request of a gather that timed out, or log its outcome if it was sent already
+        """
+        def done(future):
+            if future.cancelled():
+                return
+            if future.exception() is not None:
+                logger.error(f"Order request failed after its gather timed out - {future.exception()}")
+            else:
+                logger.info(f"Order request finished after its gather timed out - {future.result()}")
+        if not future.cancel():
+            future.add_done_callback(done)
+
+    @staticmethod
+    def __outcome(call):
+        try:
+            return call(), None
+        except Exception as e:
+            return None, e
+
+    def stop(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
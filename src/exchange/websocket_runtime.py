@@ -0,0 +1,244 @@
+# coding: UTF-8
+import asyncio
+import concurrent.futures
+import random
+import threading
+import traceback
+
+from websockets.asyncio.client import connect
+
+from src import logger
+
+
+class WebsocketRuntime:
+    """
+    One asyncio event loop on one daemon thread that hosts the websocket connections
+    of every exchange, pair and account of the process, instead of a thread per connection,
+    ping loop and keep alive loop.
+    Callbacks run on the loop thread, so they must not block for long,
+    blocking periodic jobs (e.g. REST keep alives) go through call_every(..., blocking=True).
+    """
+
+    # The runtime shared by every websocket of the process
+    instance = None
+    instance_lock = threading.Lock()
+
+    def __init__(self, name="websocket-runtime"):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.__run, name=name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    @classmethod
+    def shared(cls):
+        """
+        the runtime shared by every websocket of the process
+        """
+        with cls.instance_lock:
+            if cls.instance is None:
+                cls.instance = cls()
+            return cls.instance
+
+    def __run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def in_loop(self):
+        """
+        whether the caller runs on the loop thread
+        """
+        return threading.current_thread() is self.thread
+
+    def submit(self, coroutine):
+        """
+        schedule a coroutine on the loop from any thread
+        :return: concurrent.futures.Future of its result
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def call_soon(self, func, *args):
+        """
+        call func(*args) on the loop thread
+        """
+        if self.in_loop():
+            self.loop.call_soon(func, *args)
+        else:
+            self.loop.call_soon_threadsafe(func, *args)
+
+    def call_every(self, interval, func, delay=None, blocking=False):
+        """
+        call func every interval seconds
+        :param interval: seconds between two calls
+        :param func: function without arguments, exceptions are logged
+        :param delay: seconds before the first call, interval by default
+        :param blocking: run func on the default thread pool instead of the loop thread
+        :return: concurrent.futures.Future, cancel() stops the calls
+        """
+        async def repeat():
+            await asyncio.sleep(interval if delay is None else delay)
+            while True:
+                try:
+                    if blocking:
+                        await self.loop.run_in_executor(None, func)
+                    else:
+                        func()
+                except Exception as e:
+                    logger.error(f"Periodic {getattr(func, '__name__', 'job')} error - {e}")
+                await asyncio.sleep(interval)
+
+        return self.submit(repeat())
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+class WebSocketApp:
+    """
+    websocket.WebSocketApp look-alike running on a WebsocketRuntime.
+    The callbacks keep their signatures: on_open(ws), on_message(ws, message), on_error(ws, error), on_close(ws).
+    The connection is reopened with an exponential backoff until close() is called,
+    on_close is called after every disconnect and on_open after every reconnect.
+    """
+
+    def __init__(self, url, on_message=None, on_error=None, on_close=None, on_open=None, header=None,
+                 ping_interval=20, ping_payload=None, reconnect_delay=1, max_reconnect_delay=60, runtime=None):
+        """
+        :param url: endpoint, or a function returning it that is called before every connect
+        :param header: list of "name: value" headers, or a function returning them called before every connect
+        :param ping_interval: seconds between two pings
+        :param ping_payload: text message sent as ping (e.g. '{"op": "ping"}'), protocol pings if None
+        :param reconnect_delay: seconds before the first reconnect, doubled up to max_reconnect_delay
+        :param runtime: WebsocketRuntime, the shared one by default
+        """
+        self.url = url
+        self.on_message = on_message
+        self.on_error = on_error
+        self.on_close = on_close
+        self.on_open = on_open
+        self.header = header
+        self.ping_interval = ping_interval
+        self.ping_payload = ping_payload
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.runtime = runtime or WebsocketRuntime.shared()
+        # Number of established connections
+        self.connections = 0
+        self.connection = None
+        self.__outbox = None
+        self.__task = None
+        self.__closed = False
+
+    def start(self):
+        """
+        connect in the background, returns immediately
+        """
+        self.__closed = False
+        self.__task = self.runtime.submit(self.__run())
+        return self
+
+    def run_forever(self):
+        """
+        connect and block until close() is called
+        """
+        if self.__task is None:
+            self.start()
+        try:
+            self.__task.result()
+        except (Exception, concurrent.futures.CancelledError):
+            pass
+
+    def send(self, message):
+        """
+        queue a message for the current connection, from any thread
+        """
+        self.runtime.call_soon(self.__put, message)
+
+    def __put(self, message):
+        if self.__outbox is not None:
+            self.__outbox.put_nowait(message)
+
+    def close(self):
+        """
+        close the connection and stop reconnecting
+        """
+        self.__closed = True
+        self.runtime.call_soon(self.__close)
+
+    def reconnect(self):
+        """
+        drop the current connection, it is reopened after reconnect_delay
+        """
+        self.runtime.call_soon(self.__drop)
+
+    def __drop(self):
+        if self.connection is not None:
+            asyncio.ensure_future(self.connection.close())
+
+    def __close(self):
+        if self.connection is not None:
+            # ends the receive loop after the closing handshake
+            asyncio.ensure_future(self.connection.close())
+        elif self.__task is not None:
+            self.__task.cancel()
+
+    def __callback(self, callback, *args):
+        if callback is None:
+            return
+        try:
+            callback(self, *args)
+        except Exception as e:
+            logger.error(f"Websocket callback error - {e}")
+            logger.error(traceback.format_exc())
+
+    def __headers(self):
+        header = self.header() if callable(self.header) else self.header
+        return [tuple(h.strip() for h in line.split(":", 1)) for line in header or []]
+
+    async def __run(self):
+        delay = self.reconnect_delay
+        while not self.__closed:
+            url = self.url() if callable(self.url) else self.url
+            connected = False
+            tasks = []
+            try:
+                async with connect(url, additional_headers=self.__headers(), max_size=2**24,
+                                   ping_interval=None if self.ping_payload else self.ping_interval) as connection:
+                    connected = True
+                    self.connection = connection
+                    self.connections += 1
+                    self.__outbox = asyncio.Queue()
+                    delay = self.reconnect_delay
+                    tasks.append(asyncio.ensure_future(self.__write(connection, self.__outbox)))
+                    if self.ping_payload is not None:
+                        tasks.append(asyncio.ensure_future(self.__ping()))
+                    self.__callback(self.on_open)
+                    async for message in connection:
+                        self.__callback(self.on_message, message)
+            except asyncio.CancelledError:
+                self.__closed = True
+            except Exception as e:
+                self.__callback(self.on_error, e)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                self.connection = None
+                self.__outbox = None
+            if connected:
+                self.__callback(self.on_close)
+            if self.__closed:
+                break
+            try:
+                await asyncio.sleep(delay * random.uniform(0.8, 1.2))
+            except asyncio.CancelledError:
+                break
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    @staticmethod
+    async def __write(connection, outbox):
+        while True:
+            await connection.send(await outbox.get())
+
+    async def __ping(self):
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            self.__put(self.ping_payload)
@@ -20,7 +20,17 @@ exchange_config = {
                  "search_oldest": 10, # Search for the oldest historical data, integer for increments in days, False or 0 to turn it off
                  # Warmup timeframe - used for loading warmup candles for indicators when minute granularity is need
                  # highest tf, if None its going to find it automatically based on highest tf and ohlcv_len
-                 "warmup_tf": None}, 
+                 "warmup_tf": None,
+                 # Read klines and best bid/ask from the market data daemon (market_data.py) if it publishes the pair
+                 "market_data_bus": False,
+                 # Seconds between two REST reconciliations of the websocket account state and open orders, 0 to turn them off
+                 "account_reconcile_interval": 300,
+                 # Seconds the REST snapshots after a websocket reconnect may take with their retries
+                 "reconcile_deadline": 30,
+                 # Fill the candle buffers at startup from the backtester's candle store and keep it up to date
+                 "warmup_from_store": True,
+                 # Order requests sent in parallel, e.g. the cancels and replacements of the take profit and stop loss
+                 "order_workers": 4}, 
     "bybit": {"qty_in_usdt": False,
               "minute_granularity": False,
               "timeframes_sorted": True, # True for higher first, False for lower first and None when off 
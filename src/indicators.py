@@ -1,18 +1,160 @@
 # coding: UTF-8
 
 import math
-from collections.abc import Iterable
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial, wraps
 
 import numpy as np
 from numpy import nan as npNaN
 import scipy 
+import scipy.signal
 from scipy import stats
 import pandas as pd
 import matplotlib.pyplot as plt
 from pandas import Series
 import talib
 
-from src import verify_series
+from src import verify_series, resample, delta
+
+
+class IndicatorCache:
+    """
+    Per-bar memoization of indicator results.
+    Results are keyed by the function, its parameters and the identity of the input arrays,
+    so calling the same indicator on the same data several times within a bar computes it once.
+    The exchanges call `next_bar` with the timestamp of the candle they pass to the strategy,
+    the cache is dropped as soon as that timestamp moves forward.
+    Every thread (bot) has its own cache and counters.
+    Cached arrays are read-only and Series and DataFrames are copied for every caller,
+    so a caller can not change the result the others get.
+    """
+
+    def __init__(self, maxsize=4096):
+        # Enable memoization
+        self.enabled = True
+        # Maximum number of results kept for one bar
+        self.maxsize = maxsize
+        self.__local = threading.local()
+
+    def __state(self):
+        state = self.__local
+        if not hasattr(state, "results"):
+            state.results = {}
+            state.bar = None
+            state.hits = 0
+            state.misses = 0
+        return state
+
+    @property
+    def hits(self):
+        """
+        results found in the cache by the calling thread
+        """
+        return self.__state().hits
+
+    @property
+    def misses(self):
+        """
+        results computed by the calling thread
+        """
+        return self.__state().misses
+
+    def next_bar(self, timestamp):
+        """
+        invalidate the cache when the candle advances.
+        Inputs are only known by identity, an array changed in place within a bar
+        gets the results of its former values until the next bar (or clear())
+        :param timestamp: time of the latest candle
+        """
+        state = self.__state()
+        if state.bar is None or timestamp > state.bar:
+            state.results.clear()
+            state.bar = timestamp
+
+    def clear(self):
+        """
+        drop all cached results
+        """
+        state = self.__state()
+        state.results.clear()
+        state.bar = None
+
+    def __len__(self):
+        return len(self.__state().results)
+
+    def call(self, func, args, kwargs):
+        """
+        return the cached result of func(*args, **kwargs) or compute and store it
+        """
+        if not self.enabled:
+            return func(*args, **kwargs)
+
+        inputs = []
+        key = [func]
+        for name, value in list(enumerate(args)) + sorted(kwargs.items()):
+            key.append(name)
+            if isinstance(value, (np.ndarray, pd.Series, pd.DataFrame)):
+                # The cache keeps a reference to the input until the bar ends,
+                # so its id can not be reused by another array in the meantime
+                inputs.append(value)
+                key.append(("id", id(value)))
+            elif isinstance(value, (int, float, str, bool, type(None), np.number)):
+                key.append(value)
+            else:
+                # lists etc. are built anew on every call, nothing to gain
+                return func(*args, **kwargs)
+        key = tuple(key)
+
+        state = self.__state()
+        results = state.results
+        if key in results:
+            state.hits += 1
+            return self.__shared(results[key][0])
+
+        state.misses += 1
+        result = self.__read_only(func(*args, **kwargs), inputs)
+        if len(results) >= self.maxsize:
+            results.clear()
+        results[key] = (result, inputs)
+        return self.__shared(result)
+
+    def __read_only(self, result, inputs):
+        """
+        the result to cache, arrays read-only, an input returned as is is copied first
+        """
+        if isinstance(result, tuple):
+            return tuple(self.__read_only(r, inputs) for r in result)
+        if isinstance(result, np.ndarray):
+            if any(np.may_share_memory(result, getattr(i, "values", i))
+                   for i in inputs if isinstance(i, (np.ndarray, pd.Series))):
+                result = result.copy()
+            result.flags.writeable = False
+        return result
+
+    def __shared(self, result):
+        """
+        the cached result for one caller
+        """
+        if isinstance(result, tuple):
+            return tuple(self.__shared(r) for r in result)
+        if isinstance(result, (pd.Series, pd.DataFrame)):
+            return result.copy()
+        return result
+
+
+indicator_cache = IndicatorCache()
+
+
+def cached_indicator(func):
+    """
+    decorator, memoizes an indicator for the duration of a bar through `indicator_cache`.
+    Array results are shared between callers and read-only, copy one to modify it.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        return indicator_cache.call(func, args, kwargs)
+    return wrapper
 
 
 def first(l=[]):
@@ -23,14 +165,17 @@ def last(l=[]):
     return l[-1]
 
 
+@cached_indicator
 def highest(source, period):
     return pd.Series(source).rolling(period).max().values
 
 
+@cached_indicator
 def lowest(source, period):
     return pd.Series(source).rolling(period).min().values
 
 
+@cached_indicator
 def med_price(high, low):
     """
     also found in tradingview as hl2 source
@@ -38,12 +183,14 @@ def med_price(high, low):
     return talib.MEDPRICE(high, low)
 
 
+@cached_indicator
 def avg_price(open, high, low, close):
     """
     also found in tradingview as ohlc4 source
     """
     return talib.AVGPRICE(open, high, low, close)
 
+@cached_indicator
 def typ_price(high,low,close):
     """
     typical price, also found in tradingview as hlc3 source
@@ -51,6 +198,7 @@ def typ_price(high,low,close):
     return talib.TYPPRICE(high, low, close)
 
 
+@cached_indicator
 def MAX(close, period):
     return talib.MAX(close, period)
 
@@ -77,6 +225,7 @@ def lowestbars(source, length):
     return offset
 
 
+@cached_indicator
 def tr(high, low, close):
     """
     true range
@@ -84,6 +233,7 @@ def tr(high, low, close):
     return talib.TRANGE(high, low, close)
 
 
+@cached_indicator
 def atr(high, low, close, period):
     """
     average true range
@@ -91,6 +241,7 @@ def atr(high, low, close, period):
     return talib.ATR(high, low, close, period)
 
 
+@cached_indicator
 def natr(high, low, close, period):
     """
     Calculate Normalized Average True Range (NATR) using TA-Lib.
@@ -105,10 +256,12 @@ def natr(high, low, close, period):
     return talib.NATR(high, low, close, timeperiod=period)
 
 
+@cached_indicator
 def stdev(source, period):
     return pd.Series(source).rolling(period).std().values
 
 
+@cached_indicator
 def stddev(source, period, nbdev=1):
     """
     talib stdev
@@ -116,24 +269,29 @@ def stddev(source, period, nbdev=1):
     return talib.STDDEV(source, timeperiod=period, nbdev=nbdev)
 
 
+@cached_indicator
 def sma(source, period):
     return pd.Series(source).rolling(period).mean().values
 
 
+@cached_indicator
 def ema(source, period):
     return talib.EMA(np.array(source), period)
 
 
+@cached_indicator
 def double_ema(src, length):
     ema_val = ema(src, length)
     return 2 * ema_val - ema(ema_val, length)
 
 
+@cached_indicator
 def triple_ema(src, length):
     ema_val = ema(src, length)
     return 3 * (ema_val - ema(ema_val, length)) + ema(ema(ema_val, length), length)
 
 
+@cached_indicator
 def wma(src, length):
     return talib.WMA(src, length)
 
@@ -157,34 +315,42 @@ def vwap(high, low, volume):
     return average_price.sum() / volume.sum()
 
 
+@cached_indicator
 def ssma(src, length):
     return pd.Series(src).ewm(alpha=1.0 / length).mean().values.flatten()
 
 
+@cached_indicator
 def hull(src, length):
     return wma(2 * wma(src, length / 2) - wma(src, length), round(np.sqrt(length)))
 
 
+@cached_indicator
 def bbands(source, timeperiod=5, nbdevup=2, nbdevdn=2, matype=0):
     return talib.BBANDS(source, timeperiod, nbdevup, nbdevdn, matype)
 
 
+@cached_indicator
 def macd(close, fastperiod=12, slowperiod=26, signalperiod=9):
     return talib.MACD(close, fastperiod, slowperiod, signalperiod)
 
 
+@cached_indicator
 def adx(high, low, close, period=14):
     return talib.ADX(high, low, close, period)
 
 
+@cached_indicator
 def di_plus(high, low, close, period=14):
     return talib.PLUS_DI(high, low, close, period)
 
 
+@cached_indicator
 def di_minus(high, low, close, period=14):
     return talib.MINUS_DI(high, low, close, period)
 
 
+@cached_indicator
 def obv(close, volume):
     """
     Calculates the On-Balance Volume (OBV) indicator using the ta-lib library.
@@ -198,6 +364,7 @@ def obv(close, volume):
     return obv
 
 
+@cached_indicator
 def mfi(high, low, close, volume, period=14):
     """
     Calculates the Money Flow Index (MFI) using the ta-lib library.
@@ -214,6 +381,7 @@ def mfi(high, low, close, volume, period=14):
     return mfi
 
 
+@cached_indicator
 def stochastic(high, low, close, fastK_period=14, slowk_period=5, d_period=3):
     """
     Calculate the Stochastic indicator.
@@ -232,6 +400,7 @@ def stochastic(high, low, close, fastK_period=14, slowk_period=5, d_period=3):
     return slowk, slowd
 
 
+@cached_indicator
 def rsi(close, period=14):
     return talib.RSI(close, period)
 
@@ -321,14 +490,17 @@ def rsx(source, length=None, drift=None, offset=None):
     return rsx
 
 
+@cached_indicator
 def cci(high, low, close, period):
     return talib.CCI(high,low, close, period)
 
 
+@cached_indicator
 def sar(high, low, acceleration=0, maximum=0):
     return talib.SAR(high, low, acceleration, maximum)
 
 
+@cached_indicator
 def sarext(high, low, startvalue=0, offsetonreverse=0,
            accelerationinitlong=0.02, accelerationlong=0.02, accelerationmaxlong=0.2,
            accelerationinitshort=0.02, accelerationshort=0.02, accelerationmaxshort=0.2):
@@ -387,6 +559,7 @@ def vix(close, low, pd=23, bbl=23, mult=1.9, lb=88, ph=0.85, pl=1.01):
     return green_hist, red_hist
 
 
+@cached_indicator
 def supertrend(high, low, close, length=None, multiplier=None, offset=None):
     """
     Indicator: Supertrend
@@ -450,6 +623,7 @@ def supertrend(high, low, close, length=None, multiplier=None, offset=None):
     return df
 
 
+@cached_indicator
 def tv_supertrend(high, low, close, length=14, multiplier=3):
     
     high = pd.Series(high)
@@ -611,6 +785,7 @@ class Supertrend:
         self.upperband = np.append(self.upperband, [upperbandd])
 
 
+@cached_indicator
 def donchian(high, low, lower_length=None, upper_length=None, offset=None, **kwargs):
     """
     Indicator: Donchian Channels (DC)
@@ -656,6 +831,7 @@ def donchian(high, low, lower_length=None, upper_length=None, offset=None, **kwa
     return dcdf
 
 
+@cached_indicator
 def linreg(close, period):
     """
     Calculate Linear Regression (LINEARREG) using TA-Lib.
@@ -670,6 +846,7 @@ def linreg(close, period):
     return talib.LINEARREG(close, timeperiod=period)
 
 
+@cached_indicator
 def linreg_slope(close, period):
     """
     Calculate Linear Regression Slope (LINEARREG_SLOPE) using TA-Lib.
@@ -684,6 +861,225 @@ def linreg_slope(close, period):
     return talib.LINEARREG_SLOPE(close, timeperiod=period)
 
 
+def _batch_inputs(source, periods):
+    """
+    Bring the source to shape (symbols, time) and the periods to a 1-D array.
+    Returns the arrays and a function restoring the output shape of the caller's inputs.
+    """
+    source = np.asarray(source, dtype=float)
+    periods = np.asarray(periods)
+    single_row = source.ndim == 1
+    single_period = periods.ndim == 0
+    source = np.atleast_2d(source)
+    periods = np.atleast_1d(periods).astype(int)
+
+    def shape_output(output):
+        # output is (symbols, periods, time)
+        if single_period:
+            output = output[:, 0]
+        if single_row:
+            output = output[0]
+        return output
+
+    return source, periods, shape_output
+
+
+def _rolling_sum(values, periods):
+    """
+    Trailing window sums of every row of values for every period.
+    Parameters:
+        values: 2-D array (symbols, time).
+        periods: 1-D integer array of window lengths.
+    Returns:
+        numpy.ndarray: Array of shape (symbols, periods, time), NaN where the window is incomplete or contains NaN.
+    """
+    valid = ~np.isnan(values)
+    zero = np.zeros((values.shape[0], 1))
+    sums = np.concatenate([zero, np.cumsum(np.where(valid, values, 0), axis=-1)], axis=-1)
+    nans = np.concatenate([zero, np.cumsum(~valid, axis=-1)], axis=-1) if not valid.all() else None
+
+    length = values.shape[-1]
+    output = np.full((values.shape[0], len(periods), length), np.nan)
+
+    for k, period in enumerate(periods):
+        if period < 1 or period > length:
+            continue
+        # windows ending at period - 1, ..., length - 1
+        window = sums[:, period:] - sums[:, :-period]
+        if nans is not None:
+            window[nans[:, period:] - nans[:, :-period] > 0] = np.nan
+        output[:, k, period - 1:] = window
+
+    return output
+
+
+def _batch_ema(values, periods, alpha):
+    """
+    Exponential smoothing seeded with the simple average of the first window, the way ta-lib does it.
+    Parameters:
+        values: 2-D array (symbols, time).
+        periods: 1-D integer array of window lengths.
+        alpha: 1-D array of smoothing factors, one per period.
+    Returns:
+        numpy.ndarray: Array of shape (symbols, periods, time).
+    """
+    length = values.shape[-1]
+    output = np.full((values.shape[0], len(periods), length), np.nan)
+
+    # The first window starts at the first value of every symbol (shorter series are NaN padded)
+    valid = ~np.isnan(values)
+    first_valid = np.where(valid.any(axis=-1), np.argmax(valid, axis=-1), length)[:, None]
+    zero = np.zeros((values.shape[0], 1))
+    sums = np.concatenate([zero, np.cumsum(np.where(valid, values, 0), axis=-1)], axis=-1)
+    nans = np.concatenate([zero, np.cumsum(~valid, axis=-1)], axis=-1)
+
+    first = first_valid + periods[None, :] - 1
+    end = np.minimum(first + 1, length)
+    start = np.minimum(first_valid, length)
+    seed = (np.take_along_axis(sums, end, axis=-1) - np.take_along_axis(sums, start, axis=-1)) / periods[None, :]
+    seed[np.take_along_axis(nans, end, axis=-1) - np.take_along_axis(nans, start, axis=-1) > 0] = np.nan
+
+    # y[t] = alpha * x[t] + (1 - alpha) * y[t - 1] starting from the seed,
+    # symbols sharing the seed position are filtered in one call
+    for k, a in enumerate(alpha):
+        for position in np.unique(first[:, k]):
+            if position >= length:
+                continue
+            rows = first[:, k] == position
+            output[rows, k, position] = seed[rows, k]
+            output[rows, k, position + 1:], _ = scipy.signal.lfilter([a], [1.0, a - 1.0], values[rows, position + 1:],
+                                                                     axis=-1, zi=(1 - a) * seed[rows, k, None])
+
+    return output
+
+
+def batch_sma(source, periods):
+    """
+    Simple moving average of many series and/or periods at once.
+    Parameters:
+        source: 1-D array (time) or 2-D array (symbols, time), leading NaNs pad shorter series.
+        periods: Period or 1-D array of periods.
+    Returns:
+        numpy.ndarray: Shape (symbols, periods, time), without the symbols axis for 1-D source
+            and without the periods axis for a single period, equal to sma() row by row.
+    """
+    source, periods, shape_output = _batch_inputs(source, periods)
+    return shape_output(_rolling_sum(source, periods) / periods[:, None])
+
+
+def batch_ema(source, periods):
+    """
+    Exponential moving average of many series and/or periods at once, same values as ema().
+    Parameters:
+        source: 1-D array (time) or 2-D array (symbols, time), leading NaNs pad shorter series.
+        periods: Period or 1-D array of periods.
+    Returns:
+        numpy.ndarray: Shape (symbols, periods, time), without the symbols axis for 1-D source
+            and without the periods axis for a single period.
+    """
+    source, periods, shape_output = _batch_inputs(source, periods)
+    return shape_output(_batch_ema(source, periods, 2.0 / (periods + 1)))
+
+
+def batch_wma(source, periods):
+    """
+    Weighted moving average of many series and/or periods at once, same values as wma().
+    Parameters:
+        source: 1-D array (time) or 2-D array (symbols, time), leading NaNs pad shorter series.
+        periods: Period or 1-D array of periods.
+    Returns:
+        numpy.ndarray: Shape (symbols, periods, time), without the symbols axis for 1-D source
+            and without the periods axis for a single period.
+    """
+    source, periods, shape_output = _batch_inputs(source, periods)
+
+    # Center the rows to keep the running sums small
+    mean = np.nanmean(source, axis=-1, keepdims=True)
+    centered = source - mean
+    index = np.arange(source.shape[-1], dtype=float)
+
+    # sum of (j - (t - p)) * x[j] over the window ending at t
+    sums = _rolling_sum(centered, periods)
+    weighted_sums = _rolling_sum(index * centered, periods)
+    offset = index[None, :] - periods[:, None]
+    weights = periods * (periods + 1) / 2.0
+
+    output = (weighted_sums - offset * sums) / weights[:, None] + mean[:, None]
+    return shape_output(output)
+
+
+def batch_stdev(source, periods):
+    """
+    Rolling sample standard deviation of many series and/or periods at once, same values as stdev().
+    Parameters:
+        source: 1-D array (time) or 2-D array (symbols, time), leading NaNs pad shorter series.
+        periods: Period or 1-D array of periods.
+    Returns:
+        numpy.ndarray: Shape (symbols, periods, time), without the symbols axis for 1-D source
+            and without the periods axis for a single period.
+    """
+    source, periods, shape_output = _batch_inputs(source, periods)
+
+    # Center the rows to limit cancellation in the sum of squares
+    centered = source - np.nanmean(source, axis=-1, keepdims=True)
+    sums = _rolling_sum(centered, periods)
+    squares = _rolling_sum(centered**2, periods)
+
+    n = periods[:, None].astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        variance = (squares - sums**2 / n) / (n - 1)
+
+    return shape_output(np.sqrt(np.maximum(variance, 0)))
+
+
+def batch_atr(high, low, close, periods):
+    """
+    Average true range of many series and/or periods at once, same values as atr().
+    Parameters:
+        high: 1-D array (time) or 2-D array (symbols, time) of high prices.
+        low: Array of low prices, same shape as high.
+        close: Array of close prices, same shape as high.
+        periods: Period or 1-D array of periods.
+    Returns:
+        numpy.ndarray: Shape (symbols, periods, time), without the symbols axis for 1-D input
+            and without the periods axis for a single period.
+    """
+    high, periods, shape_output = _batch_inputs(high, periods)
+    low = np.atleast_2d(np.asarray(low, dtype=float))
+    close = np.atleast_2d(np.asarray(close, dtype=float))
+
+    previous_close = np.roll(close, 1, axis=-1)
+    true_range = np.maximum(high - low, np.maximum(np.abs(high - previous_close), np.abs(low - previous_close)))
+    true_range[:, 0] = np.nan
+
+    return shape_output(_batch_ema(true_range, periods, 1.0 / periods))
+
+
+def batch_rsi(close, periods):
+    """
+    Relative strength index of many series and/or periods at once, same values as rsi().
+    Parameters:
+        close: 1-D array (time) or 2-D array (symbols, time) of close prices.
+        periods: Period or 1-D array of periods.
+    Returns:
+        numpy.ndarray: Shape (symbols, periods, time), without the symbols axis for 1-D input
+            and without the periods axis for a single period.
+    """
+    close, periods, shape_output = _batch_inputs(close, periods)
+
+    change = np.diff(close, axis=-1, prepend=np.nan)
+    gain = _batch_ema(np.where(change < 0, 0, change), periods, 1.0 / periods)
+    loss = _batch_ema(np.where(change > 0, 0, -change), periods, 1.0 / periods)
+
+    total = gain + loss
+    with np.errstate(invalid='ignore', divide='ignore'):
+        output = 100 * gain / total
+    # no movement at all over the window
+    output[total == 0] = 0
+
+    return shape_output(output)
+
+
 def hurst_exponent(data):
     """Calculate the Hurst exponent using the R/S method.    
     Args: 
@@ -705,55 +1101,123 @@ def hurst_exponent(data):
     return np.log2(avg_rs)
 
 
-def lyapunov_exponent(data, dt):  
+def delay_embedding(data, dimension, delay=1):
     """
-    Calculate the Lyapunov exponent for a given time series data.
+    Build the delay (Takens) embedding of a 1-D time series.
     Parameters:
-        data: Time series data of the dynamical system.
+        data: 1-D array or list containing the time series.
+        dimension (int): Embedding dimension (number of lagged values per vector).
+        delay (int): Lag between the coordinates of a vector. Default is 1.
+    Returns:
+        numpy.ndarray: Array of shape (len(data) - (dimension - 1) * delay, dimension),
+            row i being [data[i], data[i + delay], ..., data[i + (dimension - 1) * delay]].
+    """
+    data = np.asarray(data, dtype=float)
+    span = (dimension - 1) * delay + 1
+    if len(data) < span:
+        return np.empty((0, dimension))
+    return np.lib.stride_tricks.sliding_window_view(data, span)[:, ::delay]
+
+
+def _lyapunov_exponents(states, dt, chunk_size=2**22):
+    """
+    Vectorized core of lyapunov_exponent.
+    Parameters:
+        states (numpy.ndarray): Array of shape (..., n, d) holding one or more sets of n state vectors.
         dt (float): Time step between consecutive state vectors.
-    Returns: 
-        float: The Lyapunov exponent.
+        chunk_size (int): Upper bound of array elements materialized at once.
+    Returns:
+        numpy.ndarray: Lyapunov exponent for every set of state vectors, shape (...).
     """
-    data = data if isinstance(data[0], Iterable) else [data]
-    #n = np.shape(data)[0]  # Length of data
-    #d = np.shape(data)[1] if len(np.shape(data)) > 1 else 1  # Dimensionality of data 
-    n = len(data)
-    d = len(data[0])   
     epsilon = 1e-8  # small constant to avoid division by zero
 
-    # Initialize the Lyapunov sum
-    sum_lyapunov = 0.0
+    batch_shape = states.shape[:-2]
+    n, d = states.shape[-2:]
+    states = states.reshape((-1, n, d))
+
+    # Every state vector x_i is compared to its neighbours x_(i+j) and x_(i-j), j < d
+    offsets = np.arange(d)
+    forward_idx = (np.arange(n)[:, None] + offsets) % n
+    backward_idx = (np.arange(n)[:, None] - offsets) % n
+
+    # Integrating the tangent vector and projecting it orthogonally to x after each step
+    # collapses into a single projection of e_0 + sum(log(|f_j| / |b_j|) * b_j / |b_j|)
+    # since the projection is linear and idempotent.
+    e0 = np.zeros(d)
+    e0[0] = 1.0
+
+    result = np.empty(len(states))
+    step = max(1, chunk_size // max(1, n * d * d))
+
+    for start in range(0, len(states), step):
+        x = states[start:start + step]
+        if n == 1:
+            # every neighbour is the state itself, all differences vanish
+            v = np.broadcast_to(e0, x.shape).copy()
+        else:
+            forward_difference = x[:, forward_idx] - x[:, :, None, :]
+            backward_difference = x[:, :, None, :] - x[:, backward_idx]
 
-    for i in range(n):
-        x = data[i]
+            norm_forward = np.linalg.norm(forward_difference, axis=-1) + epsilon
+            norm_backward = np.linalg.norm(backward_difference, axis=-1) + epsilon
 
-        # Initialize the tangent vector
-        v = np.zeros(d)
-        v[0] = 1.0
+            weights = np.log(norm_forward / norm_backward) / norm_backward
+            v = e0 + np.einsum('bij,bijk->bik', weights, backward_difference)
 
-        # Integrate the tangent vector
-        for j in range(d):
-            x_forward = data[(i + j) % n]
-            x_backward = data[(i - j) % n]
+        # Orthogonalize the tangent vector
+        v -= (np.einsum('bik,bik->bi', v, x) / np.einsum('bik,bik->bi', x, x))[..., None] * x
 
-            forward_difference = x_forward - x
-            backward_difference = x - x_backward
+        # Average of the local Lyapunov exponents
+        result[start:start + step] = np.mean(np.log(np.linalg.norm(v, axis=-1) + epsilon) / dt, axis=-1)
 
-            norm_forward = np.linalg.norm(forward_difference) + epsilon
-            norm_backward = np.linalg.norm(backward_difference) + epsilon
+    return result.reshape(batch_shape)
 
-            v += np.log(norm_forward / norm_backward) * backward_difference / norm_backward
 
-            # Orthogonalize the tangent vector
-            v -= np.dot(v, x) * x / np.dot(x, x)
+def lyapunov_exponent(data, dt):  
+    """
+    Calculate the Lyapunov exponent for a given time series data.
+    Parameters:
+        data: Time series data of the dynamical system.
+            Either a sequence of state vectors (n x d) or a single 1-D series,
+            use delay_embedding() to turn a price series into state vectors.
+        dt (float): Time step between consecutive state vectors.
+    Returns: 
+        float: The Lyapunov exponent.
+    """
+    data = np.asarray(data, dtype=float)
+    data = data if data.ndim > 1 else data[None, :]
+
+    return float(_lyapunov_exponents(data, dt))
 
-        # Calculate the local Lyapunov exponent
-        sum_lyapunov += np.log(np.linalg.norm(v) + epsilon) / dt
 
-    # Calculate the average Lyapunov exponent
-    average_lyapunov = sum_lyapunov / n
+def rolling_lyapunov_exponent(data, window, dt=1, dimension=3, delay=1):
+    """
+    Calculate the Lyapunov exponent over a rolling window of a 1-D series.
+    Each window is delay embedded and evaluated exactly as lyapunov_exponent() would do,
+    all windows are computed at once.
+    Parameters:
+        data: 1-D array or list containing the time series (e.g. close prices).
+        window (int): Number of bars in each window.
+        dt (float): Time step between consecutive state vectors. Default is 1.
+        dimension (int): Embedding dimension. Default is 3.
+        delay (int): Embedding delay. Default is 1.
+    Returns:
+        numpy.ndarray: Per-bar Lyapunov exponent, NaN for the first window - 1 bars.
+    """
+    data = np.asarray(data, dtype=float)
+    result = np.full(len(data), np.nan)
 
-    return average_lyapunov
+    if window > len(data) or window < (dimension - 1) * delay + 1:
+        return result
+
+    # (bars, window) -> (bars, window - (dimension - 1) * delay, dimension)
+    windows = np.lib.stride_tricks.sliding_window_view(data, window)
+    span = (dimension - 1) * delay + 1
+    states = np.lib.stride_tricks.sliding_window_view(windows, span, axis=-1)[..., ::delay]
+
+    result[window - 1:] = _lyapunov_exponents(states, dt)
+
+    return result
 
 
 def detrended_fluctuation_analysis(data, window_sizes):
@@ -852,33 +1316,31 @@ def shannon_entropy(probabilities):
     return entropy
 
 
-def brownian_motion(timesteps, dt, initial_position=0, drift=0, volatility=1):
-    """Simulates a Brownian motion path.
+def brownian_motion(timesteps, dt, initial_position=0, drift=0, volatility=1, n_paths=1, seed=None):
+    """Simulates Brownian motion paths.
     Args:
         timesteps (int): Number of time steps to simulate.
         dt (float): Time step size.
         initial_position (float, optional): Initial position of the Brownian motion. Defaults to 0.
         drift (float, optional): Drift parameter. Defaults to 0.
         volatility (float, optional): Volatility parameter. Defaults to 1.
+        n_paths (int, optional): Number of paths to simulate. Defaults to 1.
+        seed (int or numpy.random.Generator, optional): Seed of the random number stream. Defaults to None.
     Returns:
-        numpy.ndarray: Array of simulated positions.
+        numpy.ndarray: Array of shape (n_paths, num_increments + 1) of simulated positions.
     """
-    num_dimensions = 1  # We simulate a 1-dimensional Brownian motion
+    rng = np.random.default_rng(seed)
 
     # Calculate the number of increments
     num_increments = int(timesteps / dt)
 
-    # Generate random normal increments
-    increments = np.random.normal(loc=0, scale=np.sqrt(dt), size=(num_increments, num_dimensions))
-
-    # Calculate the cumulative sum of the increments
-    path = np.cumsum(increments, axis=0)
+    # Generate random normal increments with drift and volatility
+    increments = drift * dt + volatility * rng.normal(loc=0, scale=np.sqrt(dt), size=(n_paths, num_increments))
 
-    # Add drift and volatility
-    path = drift * dt + volatility * path
-
-    # Add initial position
-    path = initial_position + path
+    # Calculate the cumulative sum of the increments and add initial position
+    path = np.empty((n_paths, num_increments + 1))
+    path[:, 0] = initial_position
+    path[:, 1:] = initial_position + np.cumsum(increments, axis=1)
 
     return path
 
@@ -910,28 +1372,31 @@ def brownian_bridge(timesteps, dt, initial_value, final_value):
     return path    
 
 
-def bessel_process(timesteps, dt, initial_value):
-    """Simulates a Bessel process path.
+def bessel_process(timesteps, dt, initial_value, dimension=2, n_paths=1, seed=None):
+    """Simulates Bessel process paths.
+    The Bessel process of integer dimension d is the euclidean norm of a d-dimensional Brownian motion.
     Args:
         timesteps (int): Number of time steps to simulate.
         dt (float): Time step size.
         initial_value (float): Initial value of the process.
+        dimension (int, optional): Dimension of the process. Defaults to 2.
+        n_paths (int, optional): Number of paths to simulate. Defaults to 1.
+        seed (int or numpy.random.Generator, optional): Seed of the random number stream. Defaults to None.
     Returns:
-        numpy.ndarray: Array of simulated values.
+        numpy.ndarray: Array of shape (n_paths, num_increments + 1) of simulated values.
     """
-    num_dimensions = 1  # We simulate a 1-dimensional process
+    rng = np.random.default_rng(seed)
 
     # Calculate the number of increments
     num_increments = int(timesteps / dt)
 
-    # Generate random normal increments
-    increments = np.random.normal(loc=0, scale=np.sqrt(dt), size=(num_increments, num_dimensions))
-
-    # Calculate the cumulative sum of the increments
-    path = np.cumsum(increments, axis=0)
+    # Brownian motion in `dimension` dimensions started at (initial_value, 0, ..., 0)
+    increments = rng.normal(loc=0, scale=np.sqrt(dt), size=(n_paths, num_increments + 1, dimension))
+    increments[:, 0, :] = 0
+    increments[:, 0, 0] = initial_value
 
     # Apply the Bessel process transformation
-    path = np.sqrt(initial_value**2 + 2 * np.cumsum(path, axis=0))
+    path = np.linalg.norm(np.cumsum(increments, axis=1), axis=-1)
 
     return path
 
@@ -960,36 +1425,47 @@ def bessel_process_euler_maruyama(T, dt, x0, n_paths):
     return paths, t
 
 
-def ornstein_uhlenbeck_process(timesteps, dt, mean_reversion, volatility, initial_value):
-    """Simulates an Ornstein-Uhlenbeck process.
+def ornstein_uhlenbeck_process(timesteps, dt, mean_reversion, volatility, initial_value, long_term_mean=0, n_paths=1, seed=None):
+    """Simulates Ornstein-Uhlenbeck process paths.
+    Uses the exact discretization X(t+dt) = mu + (X(t) - mu) * exp(-theta*dt) + sigma * sqrt((1 - exp(-2*theta*dt)) / (2*theta)) * Z,
+    the linear recursion is solved for all steps and paths at once.
     Args:
         timesteps (int): Number of time steps to simulate.
         dt (float): Time step size.
         mean_reversion (float): Mean reversion rate.
         volatility (float): Volatility parameter.
         initial_value (float): Initial value of the process.
+        long_term_mean (float, optional): Long-term mean value of the process. Defaults to 0.
+        n_paths (int, optional): Number of paths to simulate. Defaults to 1.
+        seed (int or numpy.random.Generator, optional): Seed of the random number stream. Defaults to None.
     Returns:
-        numpy.ndarray: Array of simulated values.
+        numpy.ndarray: Array of shape (n_paths, num_increments + 1) of simulated values.
     """
-    num_dimensions = 1  # We simulate a 1-dimensional process
+    rng = np.random.default_rng(seed)
 
     # Calculate the number of increments
     num_increments = int(timesteps / dt)
 
+    decay = np.exp(-mean_reversion * dt)
+    scale = volatility * (np.sqrt((1 - decay**2) / (2 * mean_reversion)) if mean_reversion > 0 else np.sqrt(dt))
+
     # Generate random normal increments
-    increments = np.random.normal(loc=0, scale=np.sqrt(dt), size=(num_increments, num_dimensions))
+    increments = rng.normal(loc=0, scale=1, size=(n_paths, num_increments))
 
-    # Calculate the cumulative sum of the increments
-    path = np.cumsum(increments, axis=0)
+    # Deviation from the mean: y[n] = decay * y[n - 1] + scale * z[n]
+    initial_deviation = np.full((n_paths, 1), decay * (initial_value - long_term_mean))
+    deviation, _ = scipy.signal.lfilter([scale], [1, -decay], increments, axis=1, zi=initial_deviation)
 
-    # Apply the Ornstein-Uhlenbeck process transformation
-    path = initial_value + mean_reversion * path + volatility * np.sqrt(dt) * np.random.normal(loc=0, scale=1, size=(num_increments, num_dimensions))
+    path = np.empty((n_paths, num_increments + 1))
+    path[:, 0] = initial_value
+    path[:, 1:] = long_term_mean + deviation
 
     return path
 
 
-def cir_process(timesteps, dt, mean_reversion, volatility, long_term_mean, initial_value):
-    """Simulates a Cox-Ingersoll-Ross (CIR) process.
+def cir_process(timesteps, dt, mean_reversion, volatility, long_term_mean, initial_value, n_paths=1, seed=None):
+    """Simulates Cox-Ingersoll-Ross (CIR) process paths.
+    Euler-Maruyama scheme with full truncation, every step is applied to all paths at once.
     Args:
         timesteps (int): Number of time steps to simulate.
         dt (float): Time step size.
@@ -997,71 +1473,86 @@ def cir_process(timesteps, dt, mean_reversion, volatility, long_term_mean, initi
         volatility (float): Volatility parameter.
         long_term_mean (float): Long-term mean value of the process.
         initial_value (float): Initial value of the process.
+        n_paths (int, optional): Number of paths to simulate. Defaults to 1.
+        seed (int or numpy.random.Generator, optional): Seed of the random number stream. Defaults to None.
     Returns:
-        numpy.ndarray: Array of simulated values.
+        numpy.ndarray: Array of shape (n_paths, num_increments + 1) of simulated values.
     """
-    num_dimensions = 1  # We simulate a 1-dimensional process
+    rng = np.random.default_rng(seed)
 
     # Calculate the number of increments
     num_increments = int(timesteps / dt)
 
     # Generate random normal increments
-    increments = np.random.normal(loc=0, scale=np.sqrt(dt), size=(num_increments, num_dimensions))
+    increments = rng.normal(loc=0, scale=np.sqrt(dt), size=(num_increments, n_paths))
 
-    # Calculate the cumulative sum of the increments
-    path = np.cumsum(increments, axis=0)
+    path = np.empty((num_increments + 1, n_paths))
+    path[0] = initial_value
 
-    # Apply the CIR process transformation
-    path = initial_value + mean_reversion * (long_term_mean - path) * dt + volatility * np.sqrt(np.abs(path) * dt) * np.random.normal(loc=0, scale=1, size=(num_increments, num_dimensions))
+    for i in range(num_increments):
+        positive = np.maximum(path[i], 0)
+        path[i + 1] = path[i] + mean_reversion * (long_term_mean - positive) * dt + \
+                      volatility * np.sqrt(positive) * increments[i]
 
-    return path
+    return np.maximum(path, 0).T
 
 
-def heston_model(timesteps, dt, initial_price, mean_reversion, long_term_volatility, volatility_of_volatility, correlation, initial_volatility):
-    """Simulates a stock price path using the Heston model.
+def heston_model(timesteps, dt, initial_price, mean_reversion, long_term_volatility, volatility_of_volatility, correlation, 
+                 initial_volatility, drift=0, n_paths=1, seed=None, return_volatility=False):
+    """Simulates stock price paths using the Heston model.
+    Log-Euler scheme for the price and full truncation for the variance, every step is applied to all paths at once.
     Args:
         timesteps (int): Number of time steps to simulate.
         dt (float): Time step size.
         initial_price (float): Initial price of the stock.
         mean_reversion (float): Mean reversion rate of the volatility.
-        long_term_volatility (float): Long-term volatility of the stock.
+        long_term_volatility (float): Long-term volatility (variance) of the stock.
         volatility_of_volatility (float): Volatility of the volatility.
         correlation (float): Correlation between the stock and volatility.
-        initial_volatility (float): Initial volatility value.
+        initial_volatility (float): Initial volatility (variance) value.
+        drift (float, optional): Drift of the stock price. Defaults to 0.
+        n_paths (int, optional): Number of paths to simulate. Defaults to 1.
+        seed (int or numpy.random.Generator, optional): Seed of the random number stream. Defaults to None.
+        return_volatility (bool, optional): Also return the volatility paths. Defaults to False.
     Returns:
-        numpy.ndarray: Array of simulated stock prices.
+        numpy.ndarray: Array of shape (n_paths, num_increments + 1) of simulated stock prices,
+            a tuple (prices, volatilities) if return_volatility is True.
     """
-    num_dimensions = 2  # We simulate a 2-dimensional process (stock price and volatility)
+    rng = np.random.default_rng(seed)
 
     # Calculate the number of increments
     num_increments = int(timesteps / dt)
 
-    # Generate random normal increments
-    increments = np.random.normal(loc=0, scale=np.sqrt(dt), size=(num_increments, num_dimensions))
+    # Generate correlated random normal increments for the stock price and volatility
+    increments = rng.normal(loc=0, scale=np.sqrt(dt), size=(2, num_increments, n_paths))
+    stock_increments = correlation * increments[1] + np.sqrt(1 - correlation**2) * increments[0]
 
     # Initialize arrays to store the paths
-    stock_path = np.zeros(num_increments + 1)
-    volatility_path = np.zeros(num_increments + 1)
-    stock_path[0] = initial_price
+    log_price = np.empty((num_increments + 1, n_paths))
+    volatility_path = np.empty((num_increments + 1, n_paths))
+    log_price[0] = np.log(initial_price)
     volatility_path[0] = initial_volatility
 
     for i in range(num_increments):
-        # Calculate the volatility at time step i
-        volatility = volatility_path[i] + mean_reversion * (long_term_volatility - volatility_path[i]) * dt + \
-                     volatility_of_volatility * np.sqrt(volatility_path[i]) * increments[i, 1]
+        volatility = np.maximum(volatility_path[i], 0)
 
         # Calculate the stock price at time step i+1
-        stock_path[i+1] = stock_path[i] + correlation * volatility_path[i] * increments[i, 0] + \
-                          np.sqrt(1 - correlation**2) * np.sqrt(volatility_path[i]) * increments[i, 1]
+        log_price[i + 1] = log_price[i] + (drift - 0.5 * volatility) * dt + np.sqrt(volatility) * stock_increments[i]
 
         # Update the volatility path
-        volatility_path[i+1] = volatility
+        volatility_path[i + 1] = volatility_path[i] + mean_reversion * (long_term_volatility - volatility) * dt + \
+                                 volatility_of_volatility * np.sqrt(volatility) * increments[1, i]
+
+    stock_path = np.exp(log_price).T
+
+    if return_volatility:
+        return stock_path, np.maximum(volatility_path, 0).T
 
     return stock_path
 
 
-def jump_diffusion_model(timesteps, dt, initial_price, mean_return, volatility, jump_intensity, jump_mean, jump_std):
-    """Simulates a stock price path using the Jump Diffusion model.
+def jump_diffusion_model(timesteps, dt, initial_price, mean_return, volatility, jump_intensity, jump_mean, jump_std, n_paths=1, seed=None):
+    """Simulates stock price paths using the Jump Diffusion model.
     Args:
         timesteps (int): Number of time steps to simulate.
         dt (float): Time step size.
@@ -1071,43 +1562,173 @@ def jump_diffusion_model(timesteps, dt, initial_price, mean_return, volatility,
         jump_intensity (float): Intensity of the jumps.
         jump_mean (float): Mean of the jump sizes.
         jump_std (float): Standard deviation of the jump sizes.
+        n_paths (int, optional): Number of paths to simulate. Defaults to 1.
+        seed (int or numpy.random.Generator, optional): Seed of the random number stream. Defaults to None.
     Returns:
-        numpy.ndarray: Array of simulated stock prices.
+        numpy.ndarray: Array of shape (n_paths, num_increments + 1) of simulated stock prices.
     """
-    num_dimensions = 1  # We simulate a 1-dimensional process
+    rng = np.random.default_rng(seed)
 
     # Calculate the number of increments
     num_increments = int(timesteps / dt)
+    size = (n_paths, num_increments)
 
-    # Generate random normal increments
-    increments = np.random.normal(loc=0, scale=np.sqrt(dt), size=(num_increments, num_dimensions))
+    # Calculate the drift and diffusion components
+    diffusion = mean_return * dt + volatility * rng.normal(loc=0, scale=np.sqrt(dt), size=size)
 
-    # Generate Poisson-distributed jump occurrences
-    jump_occurrences = np.random.poisson(lam=jump_intensity * dt, size=num_increments)
+    # Generate Poisson-distributed jump occurrences, the sum of k normal jumps is normal with k times the mean and variance
+    jump_occurrences = rng.poisson(lam=jump_intensity * dt, size=size)
+    jumps = jump_occurrences * jump_mean + np.sqrt(jump_occurrences) * jump_std * rng.normal(size=size)
 
     # Initialize array to store the paths
-    path = np.zeros(num_increments + 1)
-    path[0] = initial_price
+    path = np.empty((n_paths, num_increments + 1))
+    path[:, 0] = initial_price
+    path[:, 1:] = initial_price + np.cumsum(diffusion + jumps, axis=1)
 
-    for i in range(num_increments):
-        # Calculate the drift component
-        drift = mean_return * dt
+    return path
 
-        # Calculate the diffusion component
-        diffusion = volatility * increments[i]
 
-        # Calculate the jump component
-        jump = jump_occurrences[i] * np.random.normal(loc=jump_mean, scale=jump_std)
+def path_to_ohlcv(path, bin_size='1h', tick_interval='1m', start_time=None, volume=None):
+    """
+    Turn a simulated price path into OHLCV candles, e.g. to backtest a strategy on synthetic data.
+    The returned DataFrame has the same layout as the downloaded data, saving it with
+    `data.to_csv(file, index_label="time")` as the backtest data file lets the backtest run without network data.
+    Args:
+        path (numpy.ndarray): 1-D price path (or a single row of a batch of paths).
+        bin_size (str, optional): Timeframe of the candles. Defaults to '1h'.
+        tick_interval (str, optional): Time between consecutive path values. Defaults to '1m'.
+        start_time (datetime, optional): Start time of the path, every value closes one tick after it. Defaults to 2020-01-01 UTC.
+        volume (numpy.ndarray, optional): Volume of every path value. Defaults to 1.
+    Returns:
+        pandas.DataFrame: OHLCV candles indexed by candle close time.
+    """
+    path = np.asarray(path, dtype=float).ravel()
+    start_time = start_time if start_time is not None else pd.Timestamp("2020-01-01", tz="UTC")
+    index = pd.date_range(start=start_time + delta(tick_interval), periods=len(path), freq=delta(tick_interval), name="timestamp")
 
-        # Calculate the stock price at time step i+1
-        path[i+1] = path[i] + drift + diffusion + jump
+    ticks = pd.DataFrame({
+        "high": path,
+        "low": path,
+        "open": path,
+        "close": path,
+        "volume": np.ones(len(path)) if volume is None else np.asarray(volume, dtype=float)
+    }, index=index)
 
-    return path
+    return resample(ticks, bin_size, minute_granularity=tick_interval.endswith('m'))[["high", "low", "open", "close", "volume"]]
 
 
-def monte_carlo_simulation(start_equity, profit_to_loss_ratio, num_simulations, win_rate, num_steps, risk_per_trade_input, randomize_winrate=0, compounding=False):
+def _draw_fixed_odds(rng, num_simulations, num_steps, win_rate, randomize_winrate, win, loss):
+    """
+    Draw a (num_simulations x num_steps) matrix of trade outcomes with a fixed win/loss payoff.
+    """
+    size = (num_simulations, num_steps)
+    win_rates = win_rate * rng.uniform(1 - randomize_winrate, 1 + randomize_winrate, size=size) \
+                if randomize_winrate else win_rate
+    return np.where(rng.random(size) < win_rates, win, loss)
+
+
+def _draw_bootstrap(rng, num_simulations, num_steps, outcomes):
+    """
+    Draw a (num_simulations x num_steps) matrix of trade outcomes by resampling the given ones with replacement.
+    """
+    return outcomes[rng.integers(0, len(outcomes), size=(num_simulations, num_steps))]
+
+
+def _monte_carlo_chunk(draw, num_simulations, seed_sequence, start_equity, compounding):
+    """
+    Simulate one chunk of equity curves, runs in a worker process for large batches.
+    """
+    rng = np.random.default_rng(seed_sequence)
+    outcomes = draw(rng, num_simulations)
+
+    equity_curves = np.empty((num_simulations, outcomes.shape[1] + 1))
+    equity_curves[:, 0] = start_equity
+    if compounding:
+        # outcomes are returns relative to the current equity
+        equity_curves[:, 1:] = start_equity * np.cumprod(1 + outcomes, axis=1)
+    else:
+        # outcomes are absolute profits
+        equity_curves[:, 1:] = start_equity + np.cumsum(outcomes, axis=1)
+
+    return equity_curves
+
+
+def _run_monte_carlo(draw, start_equity, num_simulations, compounding, seed, processes):
+    """
+    Run all simulations, chunked across processes if processes > 1.
+    """
+    chunks = max(1, min(processes, num_simulations))
+    sizes = [len(c) for c in np.array_split(np.arange(num_simulations), chunks)]
+    seeds = np.random.SeedSequence(seed).spawn(chunks)
+
+    if chunks == 1:
+        return _monte_carlo_chunk(draw, sizes[0], seeds[0], start_equity, compounding)
+
+    with ProcessPoolExecutor(max_workers=chunks) as executor:
+        parts = executor.map(_monte_carlo_chunk, [draw] * chunks, sizes, seeds,
+                             [start_equity] * chunks, [compounding] * chunks)
+        return np.vstack(list(parts))
+
+
+def monte_carlo_statistics(equity_curves, start_equity, ruin_level=0, percentiles=(5, 25, 50, 75, 95)):
+    """
+    Summary statistics of simulated equity curves.
+    Parameters:
+        equity_curves (numpy.ndarray): Array of shape (num_simulations, num_steps + 1).
+        start_equity (float): Initial equity value, drawdowns are expressed in % of it.
+        ruin_level (float): Equity level at or below which a simulation counts as ruined (default: 0).
+        percentiles (tuple): Percentiles to report for the final equity and the max drawdown.
+    Returns:
+        dict: equity_curves, final_equity, max_drawdowns, average_drawdowns (arrays, one value per simulation),
+              probability_of_ruin, final_equity_percentiles, max_drawdown_percentiles.
+    """
+    equity_curves = np.asarray(equity_curves, dtype=float)
+    drawdowns = np.maximum.accumulate(equity_curves, axis=1) - equity_curves
+
+    final_equity = equity_curves[:, -1]
+    max_drawdowns = np.max(drawdowns, axis=1) / start_equity * 100
+    average_drawdowns = np.mean(drawdowns, axis=1) / start_equity * 100
+
+    return {
+        "equity_curves": equity_curves,
+        "final_equity": final_equity,
+        "max_drawdowns": max_drawdowns,
+        "average_drawdowns": average_drawdowns,
+        "probability_of_ruin": float(np.mean(np.any(equity_curves <= ruin_level, axis=1))),
+        "final_equity_percentiles": dict(zip(percentiles, np.percentile(final_equity, percentiles))),
+        "max_drawdown_percentiles": dict(zip(percentiles, np.percentile(max_drawdowns, percentiles)))
+    }
+
+
+def plot_monte_carlo(result, title='Monte Carlo Simulation', max_curves=100):
+    """
+    Plot the equity curves of a Monte Carlo simulation result.
+    Parameters:
+        result (dict): Result of monte_carlo_simulation() or monte_carlo_bootstrap().
+        title (str): Plot title.
+        max_curves (int): Maximum number of equity curves to draw.
+    """
+    plt.figure(figsize=(10, 6))
+    for curve in result["equity_curves"][:max_curves]:
+        plt.plot(curve)
+
+    # Display statistics in legend
+    plt.legend([f'Max Drawdown: {np.max(result["max_drawdowns"]):.2f}%',
+                f'Average Drawdown: {np.mean(result["average_drawdowns"]):.2f}%',
+                f'Probability of Ruin: {result["probability_of_ruin"] * 100:.2f}%'])
+
+    plt.xlabel('Steps')
+    plt.ylabel('Equity')
+    plt.title(title)
+    plt.grid(True)
+    plt.show()
+
+
+def monte_carlo_simulation(start_equity, profit_to_loss_ratio, num_simulations, win_rate, num_steps, risk_per_trade_input, 
+                           randomize_winrate=0, compounding=False, ruin_level=0, seed=None, processes=1, plot=False):
     """
     Perform Monte Carlo simulation for equity growth.
+    All trade outcomes are drawn at once as a (num_simulations x num_steps) matrix.
     Parameters:
         start_equity (float): Initial equity value.
         profit_to_loss_ratio (float): Ratio of profit to loss per trade.
@@ -1116,63 +1737,81 @@ def monte_carlo_simulation(start_equity, profit_to_loss_ratio, num_simulations,
         num_steps (int): Number of steps in each simulation.
         risk_per_trade_input (float): Risk per trade as a percentage of equity. (0.01 is 1% etc.)
         randomize_winrate (float): Percentage of winrate to randomize (default: 0). (0.1 is 10% etc.)
-        compounding (bool): Whether to apply compounding (default: False).
+        compounding (bool): Whether to apply compounding (default: False), 
+            risk is taken from the current equity instead of the start equity.
+        ruin_level (float): Equity at or below which a simulation counts as ruined (default: 0).
+        seed (int): Seed for reproducible results (default: None).
+        processes (int): Number of processes to split the simulations across (default: 1).
+        plot (bool): Plot the equity curves (default: False).
+    Returns:
+        dict: See monte_carlo_statistics().
     """
-    equity_curves = []
+    if compounding:
+        win, loss = profit_to_loss_ratio * risk_per_trade_input, -risk_per_trade_input
+    else:
+        risk_per_trade = start_equity * risk_per_trade_input
+        win, loss = profit_to_loss_ratio * risk_per_trade, -risk_per_trade
 
-    for _ in range(num_simulations):
-        equity_curve = [start_equity]
-        equity = start_equity
+    draw = partial(_draw_fixed_odds, num_steps=num_steps, win_rate=win_rate, 
+                   randomize_winrate=randomize_winrate, win=win, loss=loss)
+    equity_curves = _run_monte_carlo(draw, start_equity, num_simulations, compounding, seed, processes)
+    result = monte_carlo_statistics(equity_curves, start_equity, ruin_level)
 
-        for _ in range(num_steps):
-            # Randomize winrate if specified
-            if randomize_winrate:
-                random_factor = np.random.uniform(1 - randomize_winrate, 1 + randomize_winrate)
-                randomized_win_rate = win_rate * random_factor
-            else:
-                randomized_win_rate = win_rate
-            
-            # Calculate risk per trade as a percentage of equity
-            risk_per_trade = start_equity * risk_per_trade_input
+    if plot:
+        plot_monte_carlo(result)
 
-            # Simulate profit/loss based on winrate
-            if np.random.rand() < randomized_win_rate:
-                profit = profit_to_loss_ratio * risk_per_trade
-            else:
-                profit = -risk_per_trade
+    return result
 
-            # Update equity based on compounding or non-compounding logic
-            if compounding:
-                equity = equity + equity * profit
-            else:
-                equity = equity + profit #if equity + profit >= 0 else 0
-
-            equity_curve.append(equity)
 
-        equity_curves.append(equity_curve)
+def load_trade_ledger(file="orders.csv"):
+    """
+    Read the closed trades from the order log written by the backtest and paper trading classes.
+    Parameters:
+        file (str): Path of the order log (default: orders.csv).
+    Returns:
+        pandas.DataFrame: One row per closed trade with its pnl and return relative to the balance before the trade.
+    """
+    ledger = pd.read_csv(file)
+    ledger = ledger[ledger["pnl"] != "-"].astype({"pnl": float, "balance": float})
+    ledger["return"] = ledger["pnl"] / (ledger["balance"] - ledger["pnl"])
+    return ledger[["time", "id", "pnl", "balance", "return"]].reset_index(drop=True)
 
-    # Plotting the equity curves
-    plt.figure(figsize=(10, 6))
-    for i, curve in enumerate(equity_curves):
-        plt.plot(curve, label=f'Simulation {i+1}')
 
-    # Calculate drawdowns
-    max_drawdowns = [np.max(np.maximum.accumulate(curve) - curve) / start_equity * 100 for curve in equity_curves]
-    average_drawdowns = [np.mean(np.maximum.accumulate(curve) - curve) / start_equity * 100 for curve in equity_curves]
+def monte_carlo_bootstrap(trades, start_equity, num_simulations, num_steps=None, compounding=False, 
+                          ruin_level=0, seed=None, processes=1, plot=False):
+    """
+    Monte Carlo simulation by bootstrap resampling the trades of a backtest.
+    Parameters:
+        trades: Trade ledger - path of the order log, DataFrame returned by load_trade_ledger()
+            or array of trade outcomes (profits, or returns when compounding).
+        start_equity (float): Initial equity value.
+        num_simulations (int): Number of simulations to run.
+        num_steps (int): Number of trades in each simulation (default: number of trades in the ledger).
+        compounding (bool): Resample trade returns instead of absolute profits (default: False).
+        ruin_level (float): Equity at or below which a simulation counts as ruined (default: 0).
+        seed (int): Seed for reproducible results (default: None).
+        processes (int): Number of processes to split the simulations across (default: 1).
+        plot (bool): Plot the equity curves (default: False).
+    Returns:
+        dict: See monte_carlo_statistics().
+    """
+    if isinstance(trades, str):
+        trades = load_trade_ledger(trades)
+    if isinstance(trades, pd.DataFrame):
+        trades = trades["return" if compounding else "pnl"].values
 
+    outcomes = np.asarray(trades, dtype=float)
+    if len(outcomes) == 0:
+        raise ValueError("Trade ledger is empty")
 
-    # Display statistics in legend
-    win_rate_text = f'Win Rate: {randomized_win_rate * 100:.2f}%'
-    max_drawdown_text = f'Max Drawdown: {np.max(max_drawdowns):.2f}%'
-    average_drawdown_text = f'Average Drawdown: {np.mean(average_drawdowns):.2f}%'
+    draw = partial(_draw_bootstrap, num_steps=num_steps or len(outcomes), outcomes=outcomes)
+    equity_curves = _run_monte_carlo(draw, start_equity, num_simulations, compounding, seed, processes)
+    result = monte_carlo_statistics(equity_curves, start_equity, ruin_level)
 
-    plt.legend([win_rate_text, max_drawdown_text, average_drawdown_text])
+    if plot:
+        plot_monte_carlo(result, title='Monte Carlo Bootstrap')
 
-    plt.xlabel('Steps')
-    plt.ylabel('Equity')
-    plt.title('Monte Carlo Simulation')
-    plt.grid(True)
-    plt.show()
+    return result
 
 
 def is_under(src, value, p):
@@ -84,7 +84,7 @@ class TV(Bot):
 
         notify(f"Starting Bot\n"
                f"Strategy : {type(self).__name__}\n"
-               f"Balance : {self.exchange.get_balance()/100000000} XBT")
+               f"Balance : {self.exchange.get_balance()/100000000} XBT", account=self.account)
 
         self.subscriber.on_message(self.__on_message)
 
@@ -0,0 +1,94 @@
+# coding: UTF-8
+
+import traceback
+from argparse import Namespace
+
+from src import logger, notify
+from src.config import config as conf
+from src.factory import BotFactory
+
+
+class Supervisor:
+    """
+    Runs many bots (strategy, exchange, account, pair) in one process.
+    The websockets of every bot run on the shared websocket runtime, the exchanges of one account
+    share their REST clients and, on Binance, one websocket with the user data stream of the account
+    and the market streams of every pair, so threads and connections grow with the accounts, not with the bots.
+    Notifications and metrics go to the account of each bot, never to the one of the command line.
+    A bot failing to start or to stop is logged and the others keep running.
+    """
+
+    def __init__(self, jobs, defaults=None):
+        """
+        :param jobs: list of args profile names or dicts of bot args (see "bots" in config.py)
+        :param defaults: argparse.Namespace with the values of the args missing in a job
+        """
+        self.jobs = jobs
+        self.defaults = defaults
+        # Running bots by name
+        self.bots = {}
+        # Exceptions of the bots which failed to start by name
+        self.failed = {}
+
+    def job_args(self, job):
+        """
+        args of a job, the same as the ones of main.py
+        :param job: args profile name or dict of args
+        :return: argparse.Namespace
+        """
+        if isinstance(job, str):
+            job = conf["args_profile"][job]
+        args = Namespace(**vars(self.defaults)) if self.defaults is not None else Namespace()
+        for k, v in job.items():
+            setattr(args, k.lstrip("-"), v)
+        return args
+
+    @staticmethod
+    def job_name(args):
+        return f"{args.account}_{args.exchange}_{args.pair}_{args.strategy}"
+
+    def start(self):
+        """
+        create and run every bot, a failing bot does not stop the others
+        :return: running bots by name
+        """
+        for job in self.jobs:
+            try:
+                args = self.job_args(job)
+            except Exception as e:
+                logger.error(f"Invalid bot {job} : {e}")
+                self.failed[str(job)] = e
+                continue
+            name = self.job_name(args)
+            if name in self.bots:
+                logger.info(f"Bot {name} is already running")
+                continue
+            bot = None
+            try:
+                bot = BotFactory.create(args)
+                bot.run()
+                self.bots[name] = bot
+            except Exception as e:
+                logger.error(f"Bot {name} failed to start : {e}")
+                logger.error(traceback.format_exc())
+                notify(f"Bot {name} failed to start : {e}", account=args.account)
+                self.failed[name] = e
+                # the streams and the strategy may be running already
+                if getattr(bot, "exchange", None) is not None:
+                    try:
+                        bot.exchange.stop()
+                    except Exception as e:
+                        logger.error(f"Bot {name} failed to stop : {e}")
+        logger.info(f"Supervisor : {len(self.bots)} bots running, {len(self.failed)} failed")
+        return self.bots
+
+    def stop(self):
+        """
+        stop every bot
+        """
+        for name, bot in list(self.bots.items()):
+            try:
+                bot.shutdown()
+            except Exception as e:
+                logger.error(f"Bot {name} failed to stop : {e}")
+            self.bots.pop(name, None)
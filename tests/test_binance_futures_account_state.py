@@ -0,0 +1,132 @@
+# coding: UTF-8
+import time
+import types
+import unittest
+from unittest import mock
+
+from src.exchange.binance_futures.binance_futures import BinanceFutures
+from src.exchange.binance_futures.binance_futures_account_state import BinanceFuturesAccountState
+from src.exchange.websocket_runtime import WebsocketRuntime
+from tests.test_websocket_runtime import wait_for
+
+
+def positions(amount="0.000", entry="0.0", leverage="10"):
+    return [{"symbol": "BTCUSDT", "positionAmt": amount, "entryPrice": entry, "leverage": leverage,
+             "marginType": "cross", "unRealizedProfit": "0.0", "positionSide": "BOTH"},
+            {"symbol": "ETHUSDT", "positionAmt": "0.000", "entryPrice": "0.0", "leverage": "20",
+             "marginType": "cross", "unRealizedProfit": "0.0", "positionSide": "BOTH"}]
+
+
+def balances(balance="1000.0"):
+    return [{"asset": "USDT", "balance": balance, "crossWalletBalance": balance, "availableBalance": balance}]
+
+
+def account_update(event_time, amount, entry, balance):
+    return {"e": "ACCOUNT_UPDATE", "E": event_time, "T": event_time,
+            "a": {"m": "ORDER",
+                  "B": [{"a": "USDT", "wb": balance, "cw": balance, "bc": "0"}],
+                  "P": [{"s": "BTCUSDT", "pa": amount, "ep": entry, "bep": entry, "cr": "0", "up": "0",
+                         "mt": "cross", "iw": "0", "ps": "BOTH"}]}}
+
+
+class TestBinanceFuturesAccountState(unittest.TestCase):
+
+    def test_events(self):
+        state = BinanceFuturesAccountState()
+        assert state.needs_reconcile("BTCUSDT")
+        state.reconcile(positions(), balances())
+        assert not state.needs_reconcile("BTCUSDT")
+
+        state.on_account_update(account_update(1000, "0.010", "30000.0", "999.5"))
+        position = state.position("BTCUSDT")
+        # merged into the REST format, fields missing in the event are kept
+        assert position["positionAmt"] == "0.010" and position["entryPrice"] == "30000.0"
+        assert position["leverage"] == "10"
+        assert state.balance_list()[0]["balance"] == "999.5"
+        assert state.balance_list()[0]["availableBalance"] == "1000.0"
+
+        state.on_leverage("BTCUSDT", 5)
+        assert state.position("BTCUSDT")["leverage"] == "5"
+
+        # an older event means the stream can't be trusted
+        state.on_account_update(account_update(900, "0.000", "0.0", "999.5"))
+        assert state.needs_reconcile() and state.position("BTCUSDT")["positionAmt"] == "0.010"
+
+    def test_missing_account_update(self):
+        state = BinanceFuturesAccountState(fill_timeout=0.05)
+        state.reconcile(positions(), balances())
+        state.on_order_update({"s": "BTCUSDT", "x": "TRADE", "X": "FILLED"})
+        assert not state.needs_reconcile("BTCUSDT")
+        time.sleep(0.1)
+        assert state.needs_reconcile("BTCUSDT") and not state.needs_reconcile("ETHUSDT")
+
+        state.on_account_update(account_update(1000, "0.010", "30000.0", "999.5"))
+        assert not state.needs_reconcile("BTCUSDT")
+
+    def test_reconcile_drift(self):
+        state = BinanceFuturesAccountState()
+        state.reconcile(positions(), balances())
+        state.on_account_update(account_update(1000, "0.010", "30000.0", "999.5"))
+
+        assert state.reconcile(positions("0.010", "30000.0"), balances("999.5")) == []
+        assert state.drifts == 0
+
+        with self.assertLogs("src", level="WARNING") as logs:
+            drift = state.reconcile(positions("0.020", "30100.0", "10"), balances("999.0"))
+        assert drift == ["BTCUSDT BOTH positionAmt 0.010 => 0.020", "BTCUSDT BOTH entryPrice 30000.0 => 30100.0",
+                         "USDT balance 999.5 => 999.0"]
+        assert state.drifts == 1 and "drift" in logs.output[0]
+        assert state.position("BTCUSDT")["positionAmt"] == "0.020"
+
+    def test_reconcile_older_than_events(self):
+        state = BinanceFuturesAccountState()
+        state.reconcile(positions(), balances())
+        version = state.version
+        # applied while the snapshots were requested
+        state.on_account_update(account_update(1000, "0.010", "30000.0", "999.5"))
+        assert state.reconcile(positions(), balances(), version) == []
+        assert state.position("BTCUSDT")["positionAmt"] == "0.010" and state.needs_reconcile()
+
+    def test_user_data_handlers_off_the_loop(self):
+        runtime = WebsocketRuntime()
+        exchange = BinanceFutures(account="binanceaccount1", pair="BTCUSDT")
+        exchange.quote_asset = "USDT"
+        exchange.market_price = 31000
+        exchange.position = [positions()[0]]
+        exchange.position_size = 0.0
+        # REST calls and notifications with whether they ran on the loop thread
+        calls = []
+
+        def record(name, result=None):
+            calls.append((name, runtime.in_loop()))
+            return result
+        exchange.client = mock.Mock()
+        exchange.client.futures_position_information.side_effect = lambda: record("rest", positions())
+        exchange.client.futures_account_balance_v2.side_effect = lambda: record("rest", balances())
+        exchange.account_state.reconcile(positions(), balances())
+        # a reconnect left the state stale, its reconciliation did not finish yet
+        exchange.account_state.invalidate("websocket reconnected")
+
+        handlers = {}
+        exchange._BinanceFutures__bind_user_data(types.SimpleNamespace(bind=handlers.__setitem__))
+        data = account_update(1000, "0.010", "30000.0", "999.5")
+
+        def emit():
+            # in the order of BinanceFuturesWs
+            handlers['account']('', data)
+            handlers['position']('', data['a']['P'])
+            handlers['wallet']('', data['a']['B'][0])
+            handlers['margin']('', data['a']['B'][0])
+        with mock.patch("src.exchange.binance_futures.binance_futures.notify",
+                        side_effect=lambda *args, **kwargs: record("notify")), \
+                mock.patch("src.exchange.binance_futures.binance_futures.log_metrics"):
+            runtime.call_soon(emit)
+            wait_for(lambda: exchange.position_size == 0.01)
+            assert exchange.callback_executor.join(timeout=5)
+        runtime.stop()
+        exchange.callback_executor.stop()
+
+        # the handlers read the account state as the events left it, no REST snapshot is requested
+        assert [name for name, in_loop in calls] == ["notify", "notify"]
+        assert not any(in_loop for name, in_loop in calls)
+        assert exchange.entry_price == 30000.0 and exchange.margin[0]["balance"] == "999.5"
@@ -0,0 +1,71 @@
+# coding: UTF-8
+import unittest
+
+from src.exchange.binance_futures.binance_futures_order_registry import BinanceFuturesOrderRegistry
+
+
+def rest_order(id, status="NEW", executed="0", update_time=1000):
+    return {"clientOrderId": id, "orderId": 1, "symbol": "BTCUSDT", "type": "LIMIT", "side": "SELL",
+            "status": status, "origQty": "0.010", "executedQty": executed, "price": "31000",
+            "stopPrice": "0", "reduceOnly": True, "updateTime": update_time}
+
+
+def event(id, status, executed="0", trade_time=1000, symbol="BTCUSDT"):
+    return {"s": symbol, "c": id, "S": "SELL", "o": "LIMIT", "f": "GTC", "q": "0.010", "p": "31000", "ap": "0",
+            "sp": "0", "x": "TRADE" if status.endswith("FILLED") else status, "X": status, "i": 1,
+            "z": executed, "T": trade_time, "R": True, "wt": "CONTRACT_PRICE", "ot": "LIMIT", "ps": "BOTH"}
+
+
+class TestBinanceFuturesOrderRegistry(unittest.TestCase):
+
+    def test_prefix_lookup(self):
+        registry = BinanceFuturesOrderRegistry("BTCUSDT")
+        assert registry.needs_reconcile()
+        registry.reconcile([rest_order("TP"), rest_order("SL"), rest_order("TPk1")])
+        assert not registry.needs_reconcile()
+        assert [o["clientOrderId"] for o in registry.find("TP")] == ["TP", "TPk1"]
+        assert [o["clientOrderId"] for o in registry.find()] == ["TP", "SL", "TPk1"]
+        assert registry.find("Long") == []
+
+    def test_updates(self):
+        registry = BinanceFuturesOrderRegistry("BTCUSDT")
+        registry.reconcile([])
+
+        # the order response, then its websocket updates
+        registry.update(rest_order("Long", update_time=1000))
+        registry.on_order_update(event("Long", "NEW", trade_time=1000))
+        registry.on_order_update(event("Long", "PARTIALLY_FILLED", "0.005", trade_time=1001))
+        assert registry.find("Long")[0]["executedQty"] == "0.005"
+        assert registry.find("Long")[0]["timeInForce"] == "GTC"
+        # other pairs of the account are ignored
+        registry.on_order_update(event("Long", "FILLED", "0.010", trade_time=1002, symbol="ETHUSDT"))
+        assert len(registry.find("Long")) == 1
+
+        registry.on_order_update(event("Long", "FILLED", "0.010", trade_time=1002))
+        assert registry.find("Long") == []
+        # a response arriving after the fill does not bring the order back
+        registry.update(rest_order("Long", update_time=1000))
+        assert registry.find("Long") == []
+        # the id is used again by a later order
+        registry.update(rest_order("Long", update_time=2000))
+        assert len(registry.find("Long")) == 1
+
+        registry.on_cancel_all()
+        assert registry.find() == []
+
+    def test_reconcile_drift(self):
+        registry = BinanceFuturesOrderRegistry("BTCUSDT")
+        registry.reconcile([rest_order("TP"), rest_order("SL")])
+        registry.on_order_update(event("SL", "CANCELED", trade_time=1001))
+
+        with self.assertLogs("src", level="WARNING"):
+            drift = registry.reconcile([rest_order("TP", "PARTIALLY_FILLED", "0.002"), rest_order("SL"),
+                                        rest_order("Long")])
+        assert drift == ["Long open", "SL open", "TP executedQty 0 => 0.002"]
+        assert registry.drifts == 1 and len(registry.find()) == 3
+
+        version = registry.version
+        registry.on_order_update(event("TP", "FILLED", "0.010", trade_time=1002))
+        # the snapshot is older than the fill
+        assert registry.reconcile([rest_order("TP"), rest_order("SL"), rest_order("Long")], version) == []
+        assert registry.find("TP") == [] and registry.needs_reconcile()
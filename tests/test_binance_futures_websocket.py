@@ -0,0 +1,105 @@
+# coding: UTF-8
+import json
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from src import Kline, Heartbeat, klines_to_data_frame, to_data_frame
+from src.exchange.binance_futures.binance_futures_websocket import BinanceFuturesWs, BinanceFuturesStream
+
+
+class TestBinanceFuturesWs(unittest.TestCase):
+
+    def stream(self, *pairs):
+        # decoding only, without connecting
+        stream = BinanceFuturesStream.__new__(BinanceFuturesStream)
+        stream.heartbeat = Heartbeat({})
+        stream.subscribers = ()
+        for pair in pairs:
+            ws = BinanceFuturesWs.__new__(BinanceFuturesWs)
+            ws.pair = pair
+            ws.bin_size = ['1m']
+            ws.book_ticker = True
+            ws.handlers = {}
+            ws.stream = stream
+            stream.subscribers += (ws,)
+        return stream
+
+    def ws(self):
+        return self.stream("btcusdt").subscribers[0]
+
+    def test_kline_message(self):
+        ws = self.ws()
+        received = []
+        ws.bind('1m', lambda action, value: received.append((action, value)))
+
+        message = json.dumps({"stream": "btcusdt@kline_1m", "data": {
+            "e": "kline", "E": 1622030399000, "s": "BTCUSDT",
+            "k": {"t": 1621958640000, "T": 1621958699999, "s": "BTCUSDT", "i": "1m",
+                  "o": "38000.5", "c": "38010.0", "h": "38020.0", "l": "37990.1", "v": "12.5", "x": False}
+        }})
+        ws.stream._BinanceFuturesStream__on_message(None, message)
+
+        assert len(received) == 1
+        action, klines = received[0]
+        assert action == '1m'
+        assert klines == [Kline(pd.Timestamp("2021-05-25 16:05", tz="UTC"), 38000.5, 38020.0, 37990.1, 38010.0, 12.5)]
+
+        expected = to_data_frame([{"timestamp": pd.Timestamp("2021-05-25 16:05", tz="UTC"),
+                                   "high": 38020.0, "low": 37990.1, "open": 38000.5, "close": 38010.0, "volume": 12.5}])
+        pd.testing.assert_frame_equal(klines_to_data_frame(klines), expected)
+
+    def test_account_update_message(self):
+        ws = self.ws()
+        received = []
+        for key in ['account', 'position', 'wallet', 'margin', 'account_config']:
+            ws.bind(key, lambda action, value, key=key: received.append(key))
+
+        data = {"e": "ACCOUNT_UPDATE", "E": 1622030399000, "T": 1622030399000,
+                "a": {"m": "ORDER", "B": [{"a": "USDT", "wb": "999.5", "cw": "999.5", "bc": "0"}],
+                      "P": [{"s": "BTCUSDT", "pa": "0.010", "ep": "30000.0", "up": "0", "mt": "cross", "ps": "BOTH"}]}}
+        ws.stream._BinanceFuturesStream__on_message(None, json.dumps({"stream": "listenkey", "data": data}))
+        # the account state is updated before the position and margin handlers run
+        assert received == ['account', 'position', 'wallet', 'margin']
+
+        data = {"e": "ACCOUNT_CONFIG_UPDATE", "E": 1622030399000, "T": 1622030399000, "ac": {"s": "BTCUSDT", "l": 5}}
+        ws.stream._BinanceFuturesStream__on_message(None, json.dumps({"stream": "listenkey", "data": data}))
+        assert received[-1] == 'account_config'
+
+    def test_shared_connection(self):
+        stream = self.stream("btcusdt", "ethusdt", "btcusdt")
+        stream.listenKey = "listenkey"
+        stream.domain = "fstream.binance.com"
+        received = []
+        for i, ws in enumerate(stream.subscribers):
+            for key in ['1m', 'bookticker', 'order']:
+                ws.bind(key, lambda action, value, i=i, key=key: received.append((i, key)))
+
+        # one connection with the streams of every pair
+        assert stream._BinanceFuturesStream__get_wss_endpoint() == (
+            "wss://fstream.binance.com/stream?streams=listenkey/btcusdt@bookTicker/btcusdt@kline_1m/btcusdt@ticker/"
+            "ethusdt@bookTicker/ethusdt@kline_1m/ethusdt@ticker")
+
+        # market events go to the bots of the pair, user data to every bot
+        kline = {"e": "kline", "E": 1622030399000, "s": "ETHUSDT",
+                 "k": {"t": 1621958640000, "T": 1621958699999, "s": "ETHUSDT", "i": "1m",
+                       "o": "1", "c": "1", "h": "1", "l": "1", "v": "1", "x": False}}
+        bookticker = {"e": "bookTicker", "s": "BTCUSDT", "T": 1622030399000,
+                      "b": "1", "B": "1", "a": "2", "A": "1"}
+        order = {"e": "ORDER_TRADE_UPDATE", "E": 1622030399000, "o": {"s": "ETHUSDT", "c": "id"}}
+        for data in [kline, bookticker, order]:
+            stream._BinanceFuturesStream__on_message(None, json.dumps({"stream": "s", "data": data}))
+        # answers to the (un)subscriptions are no events
+        stream._BinanceFuturesStream__on_message(None, json.dumps({"result": None, "id": 1}))
+        assert received == [(1, '1m'), (0, 'bookticker'), (2, 'bookticker'), (0, 'order'), (1, 'order'), (2, 'order')]
+
+        # a bot leaving unsubscribes the streams no other bot uses, on the open connection
+        sent = []
+        stream.ws = mock.Mock(connection=object(), send=sent.append)
+        stream.ws.runtime.call_soon = lambda func: func()
+        stream.request_id = 0
+        stream.subscribers = stream.subscribers[:1] + stream.subscribers[2:]
+        stream.update()
+        assert [json.loads(message) for message in sent] == [
+            {"method": "UNSUBSCRIBE", "params": ["ethusdt@bookTicker", "ethusdt@kline_1m", "ethusdt@ticker"], "id": 1}]
@@ -0,0 +1,150 @@
+# coding: UTF-8
+import asyncio
+import json
+import threading
+import time
+import unittest
+
+import numpy as np
+import pandas as pd
+from websockets.asyncio.server import serve
+
+from src import Kline, OhlcvBuffer, resample
+from src.exchange.candle_backfill import CandleBackfill
+from src.exchange.websocket_runtime import WebsocketRuntime, WebSocketApp
+from tests.test_util import minute_candles
+from tests.test_websocket_runtime import wait_for
+
+
+def kline_candles(minutes):
+    # in the column order of the klines
+    return minute_candles(minutes)[list(Kline._fields[1:])]
+
+
+class FakeExchange:
+    """
+    kline websocket and REST klines of the same candles,
+    the websocket sends the candles [start, stop) of a connection, then drops it
+    """
+
+    def __init__(self, candles, connections):
+        """
+        :param candles: minute candles
+        :param connections: list of (start, stop) by connection
+        """
+        self.candles = candles
+        self.connections = list(connections)
+        self.fetches = []
+        self.loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        async def handler(connection):
+            start, stop = self.connections.pop(0)
+            for timestamp, candle in self.candles[start:stop].iterrows():
+                await connection.send(json.dumps([timestamp.value // 10**6, *candle.tolist()]))
+            if len(self.connections) > 0:
+                await connection.close()
+            else:
+                await connection.wait_closed()
+
+        async def main():
+            self.server = await serve(handler, "127.0.0.1", 0)
+            self.url = f"ws://127.0.0.1:{self.server.sockets[0].getsockname()[1]}"
+            started.set()
+            await self.server.serve_forever()
+
+        thread = threading.Thread(target=self.loop.run_until_complete, args=(main(),))
+        thread.daemon = True
+        thread.start()
+        started.wait(5)
+
+    def fetch_ohlcv(self, bin_size, start_time, end_time):
+        self.fetches.append((bin_size, start_time))
+        # klines opened from start_time, the one of end_time is incomplete
+        data = self.candles[(self.candles.index > start_time) &
+                            (self.candles.index <= pd.Timestamp(end_time) + pd.Timedelta("1min"))]
+        return resample(data, bin_size)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.server.close)
+
+
+class TestCandleBackfill(unittest.TestCase):
+
+    def test_reconnect_backfill(self):
+        candles = kline_candles(60)
+        # minutes 20 to 39 are sent while the bot is disconnected
+        exchange = FakeExchange(candles, [(10, 20), (40, 60)])
+        runtime = WebsocketRuntime()
+        now = candles.index[59].to_pydatetime()
+        # filled up to minute 9
+        buffers = {t: OhlcvBuffer.from_data_frame(resample(candles[:10], t), 100, t, partial=False)
+                   for t in ["1m", "5m"]}
+        backfill = CandleBackfill(lambda t, start, end: exchange.fetch_ohlcv(t, start, now), runtime=runtime)
+        applied = []
+
+        def update_ohlcv(action, klines):
+            if backfill.hold(action, klines, buffers, update_ohlcv):
+                return
+            for t, buffer in buffers.items():
+                for kline in klines:
+                    buffer.update(kline.timestamp, kline[1:])
+            applied.append(klines[0].timestamp)
+
+        def on_message(ws, message):
+            row = json.loads(message)
+            update_ohlcv("1m", [Kline(pd.Timestamp(row[0], unit="ms", tz="UTC"), *row[1:])])
+
+        opened = []
+
+        def on_open(ws):
+            # the first connection follows the initial fill
+            if len(opened) > 0:
+                backfill.invalidate()
+            opened.append(time.time())
+
+        ws = WebSocketApp(exchange.url, on_message=on_message, on_open=on_open, reconnect_delay=0.05,
+                          runtime=runtime).start()
+        wait_for(lambda: len(applied) == 30 and backfill.backfills == 1)
+        ws.close()
+        wait_for(lambda: ws.connection is None)
+        exchange.stop()
+        runtime.stop()
+
+        # the candles of the outage were fetched once, from the last closed candle of every timeframe
+        assert sorted(exchange.fetches) == [("1m", candles.index[18]), ("5m", candles.index[14])]
+        assert backfill.recovered > 0
+        # the klines of the reconnected websocket were applied after the merge, in order
+        assert applied == list(candles.index[10:20]) + list(candles.index[40:60])
+        for t, buffer in buffers.items():
+            expected = resample(candles, t)
+            n = len(buffer)
+            assert buffer.timestamps.equals(expected.index[-n:])
+            assert np.allclose(buffer.to_data_frame().values, expected.values[-n:])
+
+    def test_feed_gap(self):
+        candles = kline_candles(30)
+        buffer = OhlcvBuffer.from_data_frame(resample(candles[:10], "1m"), 100, "1m", partial=False)
+        fetched = []
+
+        def fetch(t, start, end):
+            fetched.append(start)
+            return resample(candles[(candles.index > start)], t)
+        runtime = WebsocketRuntime()
+        backfill = CandleBackfill(fetch, runtime=runtime)
+        replayed = []
+
+        def replay(action, klines):
+            replayed.append(klines)
+        klines = [Kline(t, *c) for t, c in zip(candles.index, candles.values.tolist())]
+        assert not backfill.hold("1m", [klines[10]], {"1m": buffer}, replay)
+        buffer.update(klines[10].timestamp, klines[10][1:])
+        # minutes 12 to 19 are missing from the feed
+        assert backfill.hold("1m", [klines[20]], {"1m": buffer}, replay)
+        assert backfill.hold("1m", [klines[21]], {"1m": buffer}, replay)
+        wait_for(lambda: len(replayed) == 2)
+        assert fetched == [candles.index[9]]
+        # the fetched candles replace the partial one, the held klines are older
+        assert buffer.last_timestamp == candles.index[29]
+        assert buffer.partial is None
+        runtime.stop()
@@ -0,0 +1,139 @@
+# coding: UTF-8
+import os
+import tempfile
+import threading
+import types
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from src.exchange.binance_futures.binance_futures import BinanceFutures
+from src.exchange.candle_store import CandleStore
+
+
+def hour_candles(start, hours, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(0, 1, hours))
+    return pd.DataFrame({"open": close - 0.5, "high": close + 1, "low": close - 1, "close": close,
+                         "volume": rng.uniform(1, 10, hours)},
+                        index=pd.date_range(start, periods=hours, freq="1h", tz="UTC", name="timestamp"))
+
+
+class TestCandleStore(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.store = CandleStore("binance_futures", "BTCUSDT",
+                                 filename=os.path.join(self.dir.name, "{}/{}/{}/data.csv"))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write(self, bin_size, data):
+        # a file written by the backtester
+        os.makedirs(os.path.dirname(self.store.path(bin_size)), exist_ok=True)
+        data.to_csv(self.store.path(bin_size), index_label="time")
+
+    def test_save_and_load(self):
+        assert self.store.load("1h") is None
+        candles = hour_candles("2023-01-01 01:00", 48)
+        self.store.save("1h", candles[:30])
+        # a candle that is stored already is replaced
+        self.store.save("1h", candles[29:])
+        # the backtester's layout
+        assert self.store.path("1h").endswith(os.path.join("binance_futures", "BTCUSDT", "['1h']", "data.csv"))
+
+        stored = self.store.load("1h")
+        assert stored.index.equals(candles.index)
+        assert np.allclose(stored.values, candles.values)
+        assert self.store.continuous("1h", stored)
+        assert not self.store.continuous("1h", stored.drop(stored.index[10]))
+        assert len(self.store.load("1h", start_time=candles.index[-5])) == 4
+
+    def test_load_reads_the_tail(self):
+        candles = hour_candles("2023-01-01 01:00", 500)
+        self.store.save("1h", candles)
+        # chunks shorter than a row
+        self.store.chunk_size = 16
+        for start_time in [candles.index[-5], candles.index[-300] - pd.Timedelta("30min"),
+                           candles.index[0] - pd.Timedelta("1h"), candles.index[-1], candles.index[-3].to_pydatetime()]:
+            stored = self.store.load("1h", start_time=start_time)
+            expected = candles[candles.index > start_time]
+            assert stored.index.equals(expected.index)
+            assert np.allclose(stored.values, expected.values)
+        # a naive start time is UTC
+        assert len(self.store.load("1h", start_time=candles.index[-5].tz_localize(None).to_pydatetime())) == 4
+
+        # only the header and the last chunks of rows are parsed
+        self.store.chunk_size = 1 << 10
+        tail = self.store._CandleStore__tail(self.store.path("1h"), candles.index[-5])
+        rows = tail.getvalue().splitlines()[1:]
+        assert len(rows) < 50 and pd.Timestamp(rows[0].split(b",")[0].decode()) <= candles.index[-5]
+
+    def test_concurrent_saves(self):
+        candles = hour_candles("2023-01-01 01:00", 200)
+        self.store.save("1h", candles[:10])
+        # every bot saves what it fetched, the merges run one after the other
+        threads = [threading.Thread(target=self.store.save, args=("1h", candles[:end])) for end in range(20, 201, 10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert self.store.load("1h").index.equals(candles.index)
+        assert os.path.exists(self.store.path("1h") + ".lock")
+
+    def test_warmup_fetches_missing_tail(self):
+        candles = hour_candles("2023-01-01 01:00", 200)
+        self.store.save("1h", candles[:190])
+        # the last candle is incomplete
+        end_time = candles.index[-2].to_pydatetime()
+        fetched = []
+
+        def fetch_ohlcv(bin_size, start_time, end_time):
+            fetched.append(start_time)
+            return candles[(candles.index > start_time) & (candles.index <= end_time + pd.Timedelta("1h"))]
+        exchange = types.SimpleNamespace(candle_store=self.store, ohlcv_len=100, warmup_from_store=True,
+                                         fetch_ohlcv=fetch_ohlcv)
+
+        data = BinanceFutures._BinanceFutures__warmup_data(exchange, "1h", end_time)
+        # the last stored candle is fetched again
+        assert fetched == [candles.index[188].to_pydatetime()]
+        assert data.index.equals(candles.index[-101:])
+        assert np.allclose(data.values, candles[-101:].values)
+        # only the closed candles are stored
+        assert self.store.load("1h").index[-1] == candles.index[-2]
+
+        # a gap in the stored window is fetched in full
+        self.write("1h", candles.drop(candles.index[150]))
+        fetched.clear()
+        BinanceFutures._BinanceFutures__warmup_data(exchange, "1h", end_time)
+        assert fetched == [end_time - 100 * pd.Timedelta("1h")]
+        # and the hole is filled by the fetched window
+        assert self.store.continuous("1h", self.store.load("1h"))
+
+    def test_save_keeps_backtest_data_continuous(self):
+        candles = hour_candles("2023-01-01 01:00", 200)
+        self.write("1h", candles[:50])
+        # the candles of a bot that ran later would leave a hole behind the stored ones
+        assert not self.store.save("1h", candles[100:])
+        assert self.store.load("1h").index.equals(candles.index[:50])
+        # candles with gaps are not stored
+        assert not self.store.save("1h", candles[49:60].drop(candles.index[55]))
+        assert self.store.save("1h", candles[50:60])
+        assert self.store.load("1h").index.equals(candles.index[:60])
+
+        # a backtest with minute granularity stores 1m candles under the timeframe
+        minutes = hour_candles("2023-01-01 00:01", 120)
+        minutes.index = pd.date_range("2023-01-01 00:01", periods=120, freq="1min", tz="UTC", name="timestamp")
+        self.write("1h", minutes)
+        assert not self.store.save("1h", candles[:3])
+        assert self.store.load("1h").index.equals(minutes.index)
+
+        exchange = types.SimpleNamespace(candle_store=self.store, ohlcv_len=100, warmup_from_store=True,
+                                         fetch_ohlcv=lambda bin_size, start_time, end_time:
+                                         candles[(candles.index > start_time) & (candles.index <= end_time)])
+        data = BinanceFutures._BinanceFutures__warmup_data(exchange, "1h", candles.index[-1].to_pydatetime())
+        # warmed up from the exchange, the 1m file is left alone
+        assert data.index.equals(candles.index[-100:])
+        assert self.store.load("1h").index.equals(minutes.index)
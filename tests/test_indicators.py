@@ -0,0 +1,257 @@
+# coding: UTF-8
+
+import os
+import tempfile
+import threading
+import unittest
+from collections.abc import Iterable
+
+import numpy as np
+import pandas as pd
+
+from src.indicators import (delay_embedding, lyapunov_exponent,
+                            rolling_lyapunov_exponent, monte_carlo_simulation,
+                            monte_carlo_bootstrap, load_trade_ledger,
+                            brownian_motion, bessel_process, ornstein_uhlenbeck_process,
+                            cir_process, heston_model, jump_diffusion_model, path_to_ohlcv,
+                            indicator_cache, cached_indicator, ema, sma, triple_ema,
+                            wma, stdev, atr, rsi, batch_sma, batch_ema, batch_wma,
+                            batch_stdev, batch_atr, batch_rsi)
+
+
+def lyapunov_exponent_loop(data, dt):
+    """
+    reference implementation, the original per-element loop
+    """
+    data = data if isinstance(data[0], Iterable) else [data]
+    n = len(data)
+    d = len(data[0])
+    epsilon = 1e-8
+    sum_lyapunov = 0.0
+    for i in range(n):
+        x = data[i]
+        v = np.zeros(d)
+        v[0] = 1.0
+        for j in range(d):
+            forward_difference = data[(i + j) % n] - x
+            backward_difference = x - data[(i - j) % n]
+            norm_forward = np.linalg.norm(forward_difference) + epsilon
+            norm_backward = np.linalg.norm(backward_difference) + epsilon
+            v += np.log(norm_forward / norm_backward) * backward_difference / norm_backward
+            v -= np.dot(v, x) * x / np.dot(x, x)
+        sum_lyapunov += np.log(np.linalg.norm(v) + epsilon) / dt
+    return sum_lyapunov / n
+
+
+class TestIndicators(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        self.close = 100 + np.cumsum(rng.normal(size=300))
+
+    def test_delay_embedding(self):
+        embedded = delay_embedding(np.arange(10), 3, 2)
+        assert embedded.shape == (6, 3)
+        assert list(embedded[0]) == [0, 2, 4]
+        assert list(embedded[-1]) == [5, 7, 9]
+
+    def test_lyapunov_exponent(self):
+        for dimension in (2, 3, 5):
+            states = delay_embedding(self.close, dimension)
+            expected = lyapunov_exponent_loop(list(states), 0.5)
+            assert np.isclose(lyapunov_exponent(states, 0.5), expected)
+
+        # a single 1-D series is treated as one state vector
+        assert np.isclose(lyapunov_exponent(self.close[:50], 1), lyapunov_exponent_loop(self.close[:50], 1))
+
+    def test_rolling_lyapunov_exponent(self):
+        window = 40
+        result = rolling_lyapunov_exponent(self.close, window, dt=1, dimension=3, delay=2)
+        assert len(result) == len(self.close)
+        assert np.isnan(result[:window - 1]).all()
+        for i in (window - 1, 150, len(self.close) - 1):
+            states = delay_embedding(self.close[i - window + 1:i + 1], 3, 2)
+            assert np.isclose(result[i], lyapunov_exponent_loop(list(states), 1))
+
+    def test_monte_carlo_simulation(self):
+        result = monte_carlo_simulation(1000, 2, 500, 0.4, 50, 0.01, randomize_winrate=0.1, seed=1)
+        assert result["equity_curves"].shape == (500, 51)
+        assert (result["equity_curves"][:, 0] == 1000).all()
+        # every step is either a win of 20 or a loss of 10
+        steps = np.unique(np.diff(result["equity_curves"], axis=1).round(8))
+        assert set(steps) <= {-10, 20}
+        assert 0 <= result["probability_of_ruin"] <= 1
+
+        again = monte_carlo_simulation(1000, 2, 500, 0.4, 50, 0.01, randomize_winrate=0.1, seed=1)
+        assert np.array_equal(result["equity_curves"], again["equity_curves"])
+
+        compounded = monte_carlo_simulation(1000, 2, 10, 1.0, 5, 0.01, compounding=True, seed=1)
+        assert np.allclose(compounded["final_equity"], 1000 * 1.02 ** 5)
+
+        parallel = monte_carlo_simulation(1000, 2, 101, 0.4, 20, 0.01, seed=3, processes=2)
+        assert parallel["equity_curves"].shape == (101, 21)
+
+    def test_monte_carlo_bootstrap(self):
+        with tempfile.TemporaryDirectory() as dir:
+            file = os.path.join(dir, "orders.csv")
+            with open(file, "w") as f:
+                f.write("time,type,id,price,quantity,av_price,position,pnl,balance,drawdown\n")
+                f.write("2023-01-01 00:00:00,BUY,Long,100,1,100,1,-,1000.00,0.00\n")
+                f.write("2023-01-01 01:00:00,SELL,Close,110,-1,100,0,10.00,1010.00,0.00\n")
+                f.write("2023-01-01 02:00:00,SELL,Short,110,-1,110,-1,-,1010.00,0.00\n")
+                f.write("2023-01-01 03:00:00,BUY,Close,120,1,110,0,-10.00,1000.00,0.99\n")
+            ledger = load_trade_ledger(file)
+            assert list(ledger["pnl"]) == [10, -10]
+            assert np.isclose(ledger["return"][0], 0.01)
+
+            result = monte_carlo_bootstrap(file, 1000, 200, num_steps=30, seed=5)
+            assert result["equity_curves"].shape == (200, 31)
+            assert set(np.unique(np.diff(result["equity_curves"], axis=1))) <= {-10, 10}
+
+        result = monte_carlo_bootstrap([5.0], 100, 3, num_steps=4)
+        assert (result["final_equity"] == 120).all()
+        assert result["probability_of_ruin"] == 0
+
+    def test_stochastic_processes(self):
+        generators = [
+            (brownian_motion, (10, 0.1), 0),
+            (bessel_process, (10, 0.1, 1.0), 1.0),
+            (ornstein_uhlenbeck_process, (10, 0.1, 0.5, 0.2, 1.0), 1.0),
+            (cir_process, (10, 0.1, 0.5, 0.2, 1.0, 1.0), 1.0),
+            (heston_model, (10, 0.1, 100, 1.0, 0.04, 0.3, -0.5, 0.04), 100),
+            (jump_diffusion_model, (10, 0.1, 100, 0.01, 0.2, 0.5, 0, 1), 100),
+        ]
+        for generator, args, initial_value in generators:
+            paths = generator(*args, n_paths=8, seed=42)
+            assert paths.shape == (8, 101), generator.__name__
+            assert np.array_equal(paths, generator(*args, n_paths=8, seed=42)), generator.__name__
+            assert not np.array_equal(paths[0], paths[1]), generator.__name__
+            assert np.allclose(paths[:, 0], initial_value), generator.__name__
+
+        assert (cir_process(10, 0.1, 0.5, 2.0, 0.1, 0.1, n_paths=50, seed=1) >= 0).all()
+        assert (bessel_process(10, 0.1, 0.0, dimension=3, n_paths=50, seed=1) >= 0).all()
+
+        # without noise the exact OU step decays geometrically towards the long-term mean
+        decay = ornstein_uhlenbeck_process(5, 1, 0.5, 0, 2.0, long_term_mean=1.0)
+        assert np.allclose(decay[0], 1.0 + np.exp(-0.5 * np.arange(6)))
+
+        # drift accumulates over time
+        assert np.allclose(brownian_motion(5, 1, 1, drift=2, volatility=0)[0], 1 + 2 * np.arange(6))
+
+    def test_path_to_ohlcv(self):
+        path = np.arange(1, 121, dtype=float)
+        ohlcv = path_to_ohlcv(path, "1h", tick_interval="1m")
+        assert list(ohlcv.columns) == ["high", "low", "open", "close", "volume"]
+        assert len(ohlcv) == 2
+        assert str(ohlcv.index[0]) == "2020-01-01 01:00:00+00:00"
+        assert list(ohlcv.iloc[0]) == [60, 1, 1, 60, 60]
+        assert list(ohlcv.iloc[1]) == [120, 61, 61, 120, 60]
+
+        paths = heston_model(1440, 1, 100, 0.01, 0.0001, 0.001, -0.5, 0.0001, n_paths=2, seed=3)
+        ohlcv = path_to_ohlcv(paths[1], "4h")
+        assert len(ohlcv) == 7
+        assert (ohlcv["high"] >= ohlcv[["open", "close", "low"]].max(axis=1)).all()
+        assert (ohlcv["low"] <= ohlcv[["open", "close", "high"]].min(axis=1)).all()
+
+    def test_indicator_cache(self):
+        calls = []
+
+        @cached_indicator
+        def counted(source, period):
+            calls.append(period)
+            return sma(source, period)
+
+        close = np.arange(100, dtype=float)
+        indicator_cache.clear()
+        indicator_cache.next_bar(1)
+
+        first = counted(close, 10)
+        assert counted(close, 10) is first
+        assert len(calls) == 1
+        counted(close, 20)
+        counted(close.copy(), 10)
+        assert len(calls) == 3
+
+        # same bar, e.g. another timeframe of the same update
+        indicator_cache.next_bar(0)
+        counted(close, 10)
+        assert len(calls) == 3
+
+        indicator_cache.next_bar(2)
+        assert len(indicator_cache) == 0
+        counted(close, 10)
+        assert len(calls) == 4
+
+        expected = triple_ema.__wrapped__(close, 5)
+        assert np.allclose(triple_ema(close, 5), expected, equal_nan=True)
+        assert np.allclose(ema(close, 5), ema.__wrapped__(close, 5), equal_nan=True)
+
+        indicator_cache.enabled = False
+        try:
+            counted(close, 10)
+            assert len(calls) == 5
+        finally:
+            indicator_cache.enabled = True
+
+    def test_indicator_cache_results(self):
+        @cached_indicator
+        def series(source):
+            return pd.Series(source)
+
+        @cached_indicator
+        def identity(source):
+            return source
+
+        close = np.arange(100, dtype=float)
+        indicator_cache.clear()
+        indicator_cache.next_bar(1)
+        # a caller can not change the result of the others
+        with self.assertRaises(ValueError):
+            sma(close, 10)[-1] = 0
+        result = series(close)
+        result.iloc[-1] = 0
+        assert series(close).iloc[-1] == 99
+        # an input returned as is stays writable
+        assert identity(close) is not close and close.flags.writeable
+
+        # counters by thread
+        hits = indicator_cache.hits
+        sma(close, 10)
+        assert indicator_cache.hits == hits + 1
+        counts = []
+        thread = threading.Thread(target=lambda: counts.append((indicator_cache.hits, indicator_cache.misses)))
+        thread.start()
+        thread.join()
+        assert counts == [(0, 0)]
+
+    def test_batch_indicators(self):
+        rng = np.random.default_rng(0)
+        close = 30000 + np.cumsum(rng.normal(0, 50, (4, 300)), axis=1)
+        high = close + rng.uniform(0, 30, close.shape)
+        low = close - rng.uniform(0, 30, close.shape)
+        # a shorter series padded with leading NaNs
+        close[1, :40] = high[1, :40] = low[1, :40] = np.nan
+        periods = np.array([2, 5, 14, 50])
+
+        cases = [
+            (batch_sma, sma, (close,)),
+            (batch_ema, ema, (close,)),
+            (batch_wma, wma, (close,)),
+            (batch_stdev, stdev, (close,)),
+            (batch_atr, atr, (high, low, close)),
+            (batch_rsi, rsi, (close,)),
+        ]
+        for batch, single, inputs in cases:
+            result = batch(*inputs, periods)
+            assert result.shape == (4, 4, 300), batch.__name__
+            for i in range(4):
+                for k, period in enumerate(periods):
+                    expected = single.__wrapped__(*[x[i] for x in inputs], period)
+                    assert np.allclose(result[i, k], expected, equal_nan=True, atol=1e-4), (batch.__name__, i, period)
+
+            # a single period drops the periods axis, 1-D input the symbols axis
+            assert batch(*inputs, 14).shape == (4, 300)
+            assert batch(*[x[0] for x in inputs], periods).shape == (4, 300)
+            assert np.allclose(batch(*[x[0] for x in inputs], 14), result[0, 2], equal_nan=True)
+
+        assert np.isnan(batch_sma(close[0], 500)).all()
@@ -0,0 +1,123 @@
+# coding: UTF-8
+import multiprocessing
+import time
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from src import Kline
+from src.exchange.market_data_bus import MarketDataBus, SharedRing, ring_name
+from src.exchange.websocket_runtime import WebsocketRuntime
+from tests.test_websocket_runtime import wait_for
+
+
+def read_last(name, queue):
+    ring = SharedRing(name)
+    queue.put(ring.last().tolist())
+    ring.close()
+
+
+class TestMarketDataBus(unittest.TestCase):
+
+    def test_shared_ring(self):
+        ring = SharedRing(ring_name('binance', 'TESTUSDT', 'ring'), 2, 4, create=True)
+        reader = SharedRing(ring.name)
+        assert reader.capacity == 4 and reader.fields == 2 and reader.read(0)[0] == 0 and reader.last() is None
+
+        for i in range(6):
+            ring.write([i, i * 10])
+        ring.write([5, 55], replace_last=True)
+        count, rows = reader.read(0)
+        # the two oldest rows were overwritten
+        assert count == 6 and rows.tolist() == [[2, 20], [3, 30], [4, 40], [5, 55]]
+        assert reader.read(5)[1].tolist() == [[5, 55]]
+        assert reader.read(-2)[1].tolist() == [[4, 40], [5, 55]]
+
+        # attached from another process
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=read_last, args=(ring.name, queue))
+        process.start()
+        assert queue.get(timeout=10) == [5, 55]
+        process.join(10)
+        # the reader process did not remove the memory
+        assert SharedRing(ring.name).count == 6
+
+        reader.close()
+        ring.close()
+
+    def test_market_data_bus(self):
+        kline = SharedRing(ring_name('binance', 'TESTUSDT', '1m'), len(MarketDataBus.kline_fields), 10, create=True)
+        book = SharedRing(ring_name('binance', 'TESTUSDT', 'bookticker'), len(MarketDataBus.bookticker_fields), 10, create=True)
+        start = pd.Timestamp("2023-01-01 00:01", tz="UTC")
+        minute = 60 * 1000
+        kline.write([start.value // 10**6, 1, 2, 0.5, 1.5, 10])
+
+        runtime = WebsocketRuntime()
+        bus = MarketDataBus('binance', 'TESTUSDT', ['1m'], interval=0.01, runtime=runtime)
+        klines = []
+        books = []
+        bus.bind('1m', lambda action, value: klines.extend(value))
+        bus.bind('bookticker', lambda action, value: books.append(value))
+
+        # the open candle is emitted on attach
+        wait_for(lambda: len(klines) == 1)
+        assert klines[0] == Kline(start, 1, 2, 0.5, 1.5, 10)
+
+        kline.write([start.value // 10**6, 1, 3, 0.5, 2.5, 20], replace_last=True)
+        wait_for(lambda: len(klines) == 2)
+        kline.write([start.value // 10**6 + minute, 2.5, 2.5, 2.5, 2.5, 1])
+        wait_for(lambda: len(klines) == 3)
+        assert klines[1:] == [Kline(start, 1, 3, 0.5, 2.5, 20),
+                              Kline(start + pd.Timedelta(minutes=1), 2.5, 2.5, 2.5, 2.5, 1)]
+
+        book.write([start.value // 10**6, 100, 1, 101, 2])
+        wait_for(lambda: len(books) == 1)
+        assert books[0] == {'b': 100, 'B': 1, 'a': 101, 'A': 2}
+
+        bus.close()
+        runtime.stop()
+        kline.close()
+        book.close()
+
+    def test_stale_daemon(self):
+        name = ring_name('binance', 'STALEUSDT', '1m')
+        kline = SharedRing(name, len(MarketDataBus.kline_fields), 10, create=True)
+        book = SharedRing(ring_name('binance', 'STALEUSDT', 'bookticker'), len(MarketDataBus.bookticker_fields), 10,
+                          create=True)
+        start = pd.Timestamp("2023-01-01 00:01", tz="UTC")
+        kline.write([start.value // 10**6, 1, 2, 0.5, 1.5, 10])
+
+        runtime = WebsocketRuntime()
+        heartbeat = mock.Mock()
+        # stale after 0.3s without a change of the 1m ring
+        bus = MarketDataBus('binance', 'STALEUSDT', ['1m'], interval=0.01, runtime=runtime, heartbeat=heartbeat,
+                            stale_after=0.005)
+        klines = []
+        stale = []
+        bus.bind('1m', lambda action, value: klines.extend(value))
+        bus.bind('stale', lambda: stale.append(True))
+        wait_for(lambda: len(klines) == 1)
+        heartbeat.beat.assert_called_with('websocket_heartbeat')
+
+        # a restarted daemon creates the ring again, the bus attaches to the new one
+        kline.close()
+        kline = SharedRing(name, len(MarketDataBus.kline_fields), 10, create=True)
+        kline.write([start.value // 10**6 + 60 * 1000, 2, 2, 2, 2, 1])
+        wait_for(lambda: len(klines) == 2)
+        assert klines[1].timestamp == start + pd.Timedelta(minutes=1) and stale == []
+
+        # the daemon is gone, the handler is called once
+        kline.close()
+        wait_for(lambda: stale == [True])
+        assert bus.rings is None
+        time.sleep(0.4)
+        assert stale == [True]
+
+        bus.close()
+        runtime.stop()
+        book.close()
+
+    def test_missing_pair(self):
+        with self.assertRaises(FileNotFoundError):
+            MarketDataBus('binance', 'MISSINGUSDT', ['1m'])
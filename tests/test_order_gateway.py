@@ -0,0 +1,279 @@
+# coding: UTF-8
+import hashlib
+import hmac
+import http.server
+import json
+import threading
+import time
+import unittest
+from urllib.parse import urlparse, parse_qsl
+
+import requests
+
+from src.exchange.binance_futures.binance_futures import BinanceFutures
+from src.exchange.binance_futures.binance_futures_api import Client
+from src.exchange.order_gateway import OrderGateway
+
+
+class StubExchange(http.server.ThreadingHTTPServer):
+    """
+    Binance futures order endpoints answering after `delay` seconds on kept-alive connections,
+    records the client ports to count the connections
+    """
+
+    daemon_threads = True
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.ports = set()
+        self.requests = []
+        # whether the signature of every request matched its query string
+        self.signed = []
+        # clientOrderIds of the open orders
+        self.open_orders = set()
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                server.ports.add(self.client_address[1])
+                url = urlparse(self.path)
+                params = dict(parse_qsl(url.query))
+                server.requests.append((self.command, params))
+                query, signature = url.query.rsplit("&signature=", 1)
+                server.signed.append(hmac.new(b"secret", query.encode(), hashlib.sha256).hexdigest() == signature)
+                time.sleep(server.delay)
+                if url.path.endswith("batchOrders"):
+                    body = json.dumps(server.batch(self.command, params)).encode()
+                else:
+                    body = json.dumps(server.order(self.command, params.get("newClientOrderId",
+                                                                            params.get("origClientOrderId")))).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_DELETE = do_POST
+
+            def log_message(self, *args):
+                pass
+
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server_port}/fapi"
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+
+    def order(self, method, id):
+        order = {"clientOrderId": id, "type": "LIMIT", "side": "BUY", "origQty": "0.01", "executedQty": "0",
+                 "price": "100", "stopPrice": "0"}
+        if method == "POST":
+            self.open_orders.add(id)
+            return {**order, "status": "NEW", "updateTime": 1}
+        self.open_orders.discard(id)
+        return {**order, "status": "CANCELED", "updateTime": 2}
+
+    def batch(self, method, params):
+        if method == "POST":
+            orders = json.loads(params["batchOrders"])
+            assert len(orders) <= 5
+            return [self.order(method, o["newClientOrderId"]) if float(o["quantity"]) <= 1 else
+                    {"code": -2019, "msg": "Margin is insufficient."} for o in orders]
+        ids = json.loads(params["origClientOrderIdList"])
+        assert len(ids) <= 10
+        return [self.order(method, id) if id in self.open_orders else {"code": -2011, "msg": "Unknown order sent."}
+                for id in ids]
+
+
+def stub_client(server, **kwargs):
+    client = Client(api_key="key", api_secret="secret", **kwargs)
+    client.FUTURES_URL = server.url
+    return client
+
+
+class TestOrderGateway(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubExchange(delay=0.1)
+        self.client = stub_client(self.server, pool_size=4)
+        self.gateway = OrderGateway(workers=4)
+
+    def tearDown(self):
+        self.gateway.stop()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def cancel_replace(self):
+        # cancel the take profit and stop loss and place the new ones
+        return [lambda: self.client.futures_cancel_order(symbol="BTCUSDT", origClientOrderId="TP_old"),
+                lambda: self.client.futures_create_order(symbol="BTCUSDT", newClientOrderId="TP_new", side="SELL",
+                                                         type="LIMIT", quantity=1, price=30000, timeInForce="GTC"),
+                lambda: self.client.futures_cancel_order(symbol="BTCUSDT", origClientOrderId="SL_old"),
+                lambda: self.client.futures_create_order(symbol="BTCUSDT", newClientOrderId="SL_new", side="SELL",
+                                                         type="STOP_MARKET", quantity=1, stopPrice=20000)]
+
+    def test_signature(self):
+        params = {"symbol": "BTCUSDT", "timestamp": 1, "side": "BUY"}
+        expected = hmac.new(b"secret", b"side=BUY&symbol=BTCUSDT&timestamp=1", hashlib.sha256).hexdigest()
+        assert self.client._generate_signature(params) == expected
+        # the keyed signer is not consumed
+        assert self.client._generate_signature(params) == expected
+
+    def test_parallel_cancel_replace(self):
+        start = time.time()
+        for call in self.cancel_replace():
+            call()
+        sequential = time.time() - start
+        assert sequential >= 0.4
+
+        # SLA: the four requests take about one round trip
+        for i in range(3):
+            start = time.time()
+            results = self.gateway.gather(*self.cancel_replace())
+            elapsed = time.time() - start
+            assert elapsed < 0.2, elapsed
+        assert [r[0]["clientOrderId"] for r in results] == ["TP_old", "TP_new", "SL_old", "SL_new"]
+        assert [r[0]["status"] for r in results] == ["CANCELED", "NEW", "CANCELED", "NEW"]
+        # the connections are kept alive and reused
+        assert len(self.server.ports) <= 4
+
+    def test_request_deadline(self):
+        self.server.delay = 1
+        client = stub_client(self.server, timeout=(1, 0.2))
+        start = time.time()
+        with self.assertRaises(requests.exceptions.Timeout):
+            client.futures_create_order(symbol="BTCUSDT", newClientOrderId="TP", side="SELL", type="MARKET",
+                                        quantity=1)
+        # an order is not resent by the transport after a read timeout
+        assert time.time() - start < 0.5
+        assert len(self.server.requests) == 1
+
+    def test_gather(self):
+        def fail():
+            time.sleep(0.05)
+            raise ValueError("rejected")
+        finished = []
+
+        def slow():
+            time.sleep(0.1)
+            finished.append(True)
+        with self.assertRaises(ValueError):
+            self.gateway.gather(fail, slow)
+        # every request finished before the error is raised
+        assert finished == [True]
+        assert self.gateway.gather() == []
+        assert self.gateway.gather(lambda: 1, lambda: 2) == [1, 2]
+        with self.assertRaises(TimeoutError):
+            self.gateway.gather(lambda: None, slow, timeout=0.01)
+
+        # a gather on a gateway thread does not wait for calls no worker is free for
+        gateway = OrderGateway(workers=1)
+        assert gateway.gather(lambda: gateway.gather(lambda: 1, lambda: 2), lambda: gateway.gather(lambda: 3, lambda: 4),
+                              timeout=1) == [[1, 2], [3, 4]]
+        gateway.stop()
+
+    def test_gather_timeout(self):
+        sent = []
+
+        def slow(name, error=None):
+            def call():
+                sent.append(name)
+                time.sleep(0.2)
+                if error is not None:
+                    raise error
+            return call
+        # the outcome of a request still in flight is logged when it finishes
+        with self.assertLogs("src", "ERROR") as logs:
+            with self.assertRaises(TimeoutError):
+                self.gateway.gather(lambda: None, slow("late", ValueError("rejected")), timeout=0.05)
+            time.sleep(0.3)
+        assert sent == ["late"] and "rejected" in logs.output[-1]
+
+        # no call is sent inline after the deadline
+        sent.clear()
+        gateway = OrderGateway(workers=1)
+        # the only worker is busy
+        gateway.submit(time.sleep, 0.3)
+        with self.assertRaises(TimeoutError):
+            gateway.gather(slow("first"), slow("second"), timeout=0.1)
+        time.sleep(0.5)
+        assert sent == ["first"]
+        gateway.stop()
+
+
+class TestBatchOrders(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubExchange(delay=0.1)
+        self.exchange = BinanceFutures(account="binanceaccount1", pair="BTCUSDT")
+        self.exchange.client = stub_client(self.server)
+        self.exchange.asset_rounding = 3
+        self.exchange.enable_trade_log = False
+        self.exchange.order_registry.reconcile([])
+
+    def tearDown(self):
+        self.exchange.order_gateway.stop()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_ladder(self):
+        callbacks = [lambda: None for i in range(7)]
+        ladder = [{"id": f"L{i}", "long": True, "qty": 0.0101, "limit": 100 - i, "callback": callbacks[i]}
+                  for i in range(7)]
+        # rejected by the exchange
+        ladder[6]["qty"] = 5
+        start = time.time()
+        responses = self.exchange.batch_order(ladder + [{"id": "skipped", "long": True, "qty": 1, "when": False}])
+        # two batches of at most 5 orders, sent in parallel
+        assert time.time() - start < 0.2
+        assert len(self.server.requests) == 2 and all(self.server.signed)
+        assert len(responses) == 7 and responses[6]["code"] == -2019
+        orders = json.loads(self.server.requests[0][1]["batchOrders"]) + \
+            json.loads(self.server.requests[1][1]["batchOrders"])
+        assert sorted(o["price"] for o in orders) == sorted(str(o["limit"]) for o in ladder)
+        assert sorted(o["quantity"] for o in orders) == ["0.01"] * 6 + ["5"]
+
+        # the callbacks of the placed orders are kept by clientOrderId
+        ids = [r["clientOrderId"] for r in responses[:6]]
+        assert [self.exchange.callbacks[id] for id in ids] == callbacks[:6]
+        assert len(self.exchange.callbacks) == 6
+        assert sorted(o["clientOrderId"] for o in self.exchange.get_open_orders("L")) == sorted(ids)
+
+        self.server.requests.clear()
+        canceled = self.exchange.batch_cancel([f"L{i}" for i in range(6)] + ["L0", "unknown"])
+        assert canceled == 6 and len(self.server.requests) == 1
+        assert self.exchange.get_open_orders("L") is None
+
+    def test_failed_orders_resync_the_registry(self):
+        self.exchange.order_gateway = OrderGateway(workers=1, timeout=0.05)
+        # the second batch waits for the busy worker until the deadline passed
+        self.exchange.order_gateway.submit(time.sleep, 0.5)
+        self.server.delay = 0.2
+        with self.assertRaises(TimeoutError):
+            self.exchange.batch_order([{"id": f"TP{i}", "long": False, "qty": 0.01, "limit": 200}
+                                       for i in range(10)])
+        # the orders may have been placed, the open orders are read again before the next take profit
+        assert self.exchange.order_registry.needs_reconcile()
+        self.exchange.order_gateway.stop()
+
+    def test_best_bid_ask_callbacks(self):
+        release = threading.Event()
+        calls = []
+
+        def callback(best_bid_changed, best_ask_changed):
+            calls.append((threading.current_thread().name, best_bid_changed, best_ask_changed))
+            release.wait(5)
+        self.exchange.add_ob_callback("chaser", callback)
+        on_bookticker = self.exchange._BinanceFutures__on_update_bookticker
+        on_bookticker("", {"b": "100", "B": "1", "a": "101", "A": "1"})
+        time.sleep(0.05)
+        # the callback is busy, the changes are merged into one call
+        on_bookticker("", {"b": "100", "B": "2", "a": "102", "A": "1"})
+        on_bookticker("", {"b": "99", "B": "2", "a": "102", "A": "1"})
+        release.set()
+        assert self.exchange.callback_executor.join(timeout=5)
+        assert calls == [("callbacks", True, True), ("callbacks", True, True)]
+        self.exchange.callback_executor.stop()
@@ -0,0 +1,92 @@
+# coding: UTF-8
+import unittest
+from argparse import Namespace
+from unittest import mock
+
+from src import shared_client, default_account
+from src.bot import Bot
+from src.config import config as conf
+from src.supervisor import Supervisor
+
+
+class FakeBot:
+
+    def __init__(self, args):
+        self.args = args
+        self.running = False
+        self.exchange = None
+
+    def run(self):
+        # the streams start before the balance is read
+        self.exchange = mock.Mock()
+        if self.args.pair == "BADUSDT":
+            raise Exception("exchange error")
+        self.running = True
+
+    def stop(self):
+        raise SystemExit(0)
+
+    def shutdown(self):
+        self.running = False
+
+
+class TestSupervisor(unittest.TestCase):
+
+    def test_isolated_bots(self):
+        defaults = Namespace(test=False, stub=True, demo=False, hyperopt=False, spot=False, account="binanceaccount1",
+                             exchange="binance", pair="BTCUSDT", strategy="Doten", session=None)
+        jobs = [{"--pair": "ETHUSDT", "--strategy": "Sample"},
+                {"pair": "BADUSDT"},
+                {"pair": "XRPUSDT", "exchange": "bybit", "account": "bybitaccount1"}]
+        supervisor = Supervisor(jobs, defaults=defaults)
+
+        created = []
+
+        def create(args):
+            created.append(FakeBot(args))
+            return created[-1]
+        with mock.patch("src.supervisor.BotFactory.create", side_effect=create), \
+                mock.patch("src.supervisor.notify") as notify:
+            bots = supervisor.start()
+
+        assert sorted(bots) == ["binanceaccount1_binance_ETHUSDT_Sample", "bybitaccount1_bybit_XRPUSDT_Doten"]
+        assert list(supervisor.failed) == ["binanceaccount1_binance_BADUSDT_Doten"]
+        # the failed bot is stopped and notified to its account
+        assert created[1].exchange.stop.call_count == 1
+        assert created[0].exchange.stop.call_count == 0
+        assert notify.call_count == 1 and notify.call_args.kwargs["account"] == "binanceaccount1"
+        assert all(bot.running and bot.args.stub for bot in bots.values())
+
+        running = list(bots.values())
+        supervisor.stop()
+        assert supervisor.bots == {} and not any(bot.running for bot in running)
+
+    def test_shared_client(self):
+        created = []
+
+        def create():
+            created.append(object())
+            return created[-1]
+
+        a = shared_client(("test", "key1"), create)
+        b = shared_client(("test", "key1"), create)
+        c = shared_client(("test", "key2"), create)
+        assert a is b and a is not c and len(created) == 2
+
+    def test_bot_shutdown(self):
+        bot = Bot('1h')
+        bot.exchange = mock.Mock()
+        # a bot of the supervisor stops without exiting the process, once
+        bot.shutdown()
+        bot.shutdown()
+        assert bot.exchange.stop.call_count == 1 and bot.exchange.cancel_all.call_count == 1
+        with self.assertRaises(SystemExit):
+            bot.stop()
+        del bot
+
+    def test_default_account(self):
+        with mock.patch.dict(conf, {"args": Namespace(account="binanceaccount1", supervisor=False)}):
+            assert default_account() == "binanceaccount1"
+        # every bot of the supervisor names its own account
+        with mock.patch.dict(conf, {"args": Namespace(account="binanceaccount1", supervisor=True)}):
+            assert default_account() is None
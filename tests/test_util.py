@@ -1,10 +1,75 @@
 # coding: UTF-8
 
+import atexit
 import datetime
+import http.server
+import json
 import os
+import tempfile
+import threading
+import time
 import unittest
 
-from src import to_data_frame, validate_continuous, load_data, ord_suffix
+import numpy as np
+import pandas as pd
+import requests
+from urllib3.util.retry import Retry
+
+from src import (to_data_frame, validate_continuous, load_data, ord_suffix, resample,
+                 CandleAggregator, OhlcvBuffer, ResampleCache, Heartbeat, Notifier, notify,
+                 MetricsWriter, StrategyExecutor, RateLimiter, RateLimitTimeout, rate_limited,
+                 attempt_binance_futures,
+                 RetryableError, backoff_delay, retry_with, retry_async, LatencyHistogram, LatencyRecorder)
+from src.exchange.websocket_runtime import WebsocketRuntime
+
+
+def minute_candles(minutes, start="2023-01-01 00:01", seed=0):
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(0, 1, minutes))
+    open = np.concatenate([[100], close[:-1]])
+    return pd.DataFrame({
+        "high": np.maximum(open, close) + rng.uniform(0, 1, minutes),
+        "low": np.minimum(open, close) - rng.uniform(0, 1, minutes),
+        "open": open,
+        "close": close,
+        "volume": rng.uniform(1, 10, minutes),
+    }, index=pd.date_range(start, periods=minutes, freq="1min", tz="UTC", name="timestamp"))
+
+
+class LocalServer(http.server.HTTPServer):
+    """
+    HTTP stand-in that records the paths and bodies it got, a request takes `delay` seconds
+    and is answered with `status` and `headers`
+    """
+
+    def __init__(self, delay=0, status=200, headers=None):
+        self.requests = []
+        self.bodies = []
+        self.delay = delay
+        self.status = status
+        self.headers = headers or {}
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append(self.path)
+                server.bodies.append(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                time.sleep(server.delay)
+                self.send_response(server.status)
+                for key, value in server.headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+
+            do_POST = do_GET
+
+            def log_message(self, *args):
+                pass
+
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server_port}"
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
 
 
 class TestUtil(unittest.TestCase):
@@ -27,4 +92,454 @@ class TestUtil(unittest.TestCase):
     def test_order_suffix(self):
         suffix = ord_suffix()
         print(suffix)
-        assert len(suffix) > 0
\ No newline at end of file
+        assert len(suffix) > 0
+
+    def test_ohlcv_buffer(self):
+        minutes = minute_candles(300)
+        expected = resample(minutes, "15m", minute_granularity=True)
+
+        buffer = OhlcvBuffer(8, CandleAggregator("15m", minute_granularity=True))
+        for timestamp, candle in zip(minutes.index, minutes[OhlcvBuffer.columns].to_numpy()):
+            # the feed sends a few updates of every candle before it closes
+            for fraction in (0.3, 0.7):
+                update = candle.copy()
+                update[1] = max(candle[2], min(candle[1], candle[0] + fraction))
+                update[3] = (candle[0] + candle[3]) / 2
+                update[4] = candle[4] * fraction
+                buffer.update(timestamp, update)
+            buffer.update(timestamp, candle)
+
+        assert len(buffer) == 8
+        assert buffer.count == len(expected) - 1
+        assert buffer.last_timestamp == expected.index[-2]
+        assert np.allclose(buffer.close, expected["close"].values[-9:-1])
+        assert np.allclose(buffer.volume, expected["volume"].values[-9:-1])
+        assert np.allclose(buffer.partial, expected.iloc[-1][OhlcvBuffer.columns].values)
+        assert buffer.close.flags.c_contiguous and not buffer.close.flags.writeable
+        assert not buffer.close.flags.owndata
+
+        frame = buffer.to_data_frame(partial=True)
+        assert frame.index.equals(expected.index[-9:])
+        assert np.allclose(frame[OhlcvBuffer.columns].values, expected[OhlcvBuffer.columns].values[-9:])
+
+        buffer = OhlcvBuffer.from_data_frame(expected, 100, "15m", minute_granularity=True)
+        assert len(buffer) == len(expected) - 1
+        assert buffer.partial_time == expected.index[-1]
+
+    def test_candle_aggregator(self):
+        minutes = minute_candles(3 * 1440, start="2023-01-01 07:13")
+        # gaps in the feed
+        minutes = minutes.drop(minutes.index[100:190]).drop(minutes.index[2000:2003])
+
+        for bin_size in ["1m", "7m", "15m", "45m", "1h", "4h", "1d", "3d"]:
+            expected = resample(minutes, bin_size, minute_granularity=True).dropna()
+            aggregator = CandleAggregator(bin_size, minute_granularity=True)
+            closed = [aggregator.update(timestamp, candle)
+                      for timestamp, candle in zip(minutes.index, minutes[OhlcvBuffer.columns].to_numpy())]
+            closed = [candle for candle in closed if candle is not None] + [(aggregator.partial_time, aggregator.partial)]
+
+            assert [timestamp for timestamp, _ in closed] == list(expected.index), bin_size
+            assert np.allclose([candle for _, candle in closed], expected[OhlcvBuffer.columns].values), bin_size
+
+        aggregator = CandleAggregator("1h")
+        assert aggregator.label(pd.Timestamp("2023-01-01 10:00", tz="UTC")) == pd.Timestamp("2023-01-01 10:00", tz="UTC")
+        assert aggregator.label(pd.Timestamp("2023-01-01 10:00:01", tz="UTC")) == pd.Timestamp("2023-01-01 11:00", tz="UTC")
+
+    def test_resample_cache(self):
+        minutes = minute_candles(2 * 1440, start="2023-01-01 07:13")
+        minutes = minutes.drop(minutes.index[500:590])
+        source = OhlcvBuffer(300, CandleAggregator("5m", minute_granularity=True))
+        cache = ResampleCache("1h", 24)
+
+        for i, (timestamp, candle) in enumerate(zip(minutes.index, minutes[OhlcvBuffer.columns].to_numpy())):
+            source.update(timestamp, candle)
+            # security() is not called on every candle
+            if i % 37 != 0 or source.count < 36:
+                continue
+            # the first candle of the resampled buffer can be cut off
+            expected = resample(source.to_data_frame(partial=True), "1h")[:-1].dropna()[1:]
+            # the strategy reads a snapshot taken with its candle
+            data_frame = cache.data_frame(source.snapshot() if i % 2 == 0 else source)
+            n = min(len(expected), len(data_frame))
+
+            assert data_frame.index[-n:].equals(expected.index[-n:])
+            assert np.allclose(data_frame[OhlcvBuffer.columns].values[-n:],
+                               expected[OhlcvBuffer.columns].values[-n:])
+        assert len(data_frame) == 24
+
+        # the feed does not change a snapshot
+        snapshot = source.snapshot()
+        closed, partial = snapshot.to_data_frame(partial=True), snapshot.partial.copy()
+        for minute in range(1, 121):
+            source.update(minutes.index[-1] + pd.Timedelta(minutes=minute), [1, 2, 0.5, 1.5, 1])
+        assert source.count > snapshot.count and snapshot.key is source.key
+        assert snapshot.to_data_frame(partial=True).equals(closed) and np.array_equal(snapshot.partial, partial)
+        # an older snapshot than the cache folded in is not resampled with newer candles
+        for buffer in [source, snapshot]:
+            expected = resample(buffer.to_data_frame(partial=True), "1h")[:-1].dropna()
+            assert cache.data_frame(buffer).index[-1] == expected.index[-1]
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter(10, window=0.5, shares={RateLimiter.ORDER: 1, RateLimiter.QUERY: 0.5})
+        for _ in range(5):
+            assert limiter.acquire(1, RateLimiter.QUERY, timeout=0)
+        # the queries are out of budget, the orders are not
+        assert not limiter.acquire(1, RateLimiter.QUERY, timeout=0)
+        assert limiter.rejected == 1
+        for _ in range(5):
+            assert limiter.acquire(1, RateLimiter.ORDER, timeout=0)
+        assert not limiter.acquire(1, RateLimiter.ORDER, timeout=0)
+
+        # a waiting order goes before a waiting query
+        limiter = RateLimiter(2, window=0.3, shares={RateLimiter.ORDER: 1, RateLimiter.QUERY: 1})
+        limiter.acquire(2, RateLimiter.QUERY)
+        acquired = []
+        query = threading.Thread(target=lambda: acquired.append(limiter.acquire(2, RateLimiter.QUERY) and "query"))
+        query.start()
+        time.sleep(0.05)
+        order = threading.Thread(target=lambda: acquired.append(limiter.acquire(2, RateLimiter.ORDER) and "order"))
+        order.start()
+        order.join(2)
+        query.join(2)
+        assert acquired == ["order", "query"]
+        assert limiter.waits == 2
+
+        # the weight reported by the server counts, e.g. used by another process
+        limiter = RateLimiter(100, window=60)
+        limiter.update(79)
+        assert limiter.acquire(1, RateLimiter.QUERY, timeout=0)
+        assert not limiter.acquire(1, RateLimiter.QUERY, timeout=0)
+        assert limiter.acquire(1, RateLimiter.ORDER, timeout=0)
+
+    def test_rate_limited_session(self):
+        server = LocalServer(status=429, headers={"Retry-After": "0.3"})
+        limiter = RateLimiter(100, window=60)
+        session = rate_limited(requests.Session(), limiter,
+                               usage=lambda limiter, response: limiter.update(int(response.headers.get("Used", 0))))
+        assert session.post(server.url + "/order").status_code == 429
+        assert limiter.metrics()["used"] == 1
+        # blocked for Retry-After
+        start = time.time()
+        server.status = 200
+        server.headers = {"Used": "50"}
+        assert session.get(server.url + "/position").status_code == 200
+        assert time.time() - start >= 0.25
+        assert limiter.metrics()["used"] == 50
+        assert server.requests == ["/order", "/position"]
+
+        # a blocked request waits at most its own timeout and fails retryable
+        server.status = 429
+        server.headers = {"Retry-After": "60"}
+        assert session.get(server.url + "/position").status_code == 429
+        start = time.time()
+        with self.assertRaises(RateLimitTimeout):
+            session.get(server.url + "/position", timeout=5)
+        assert time.time() - start < 1
+        with self.assertRaises(RetryableError):
+            attempt_binance_futures(lambda: (session.get(server.url + "/position", timeout=5), None))
+        assert server.requests == ["/order", "/position", "/position"]
+
+        # urllib3 leaves the Retry-After wait to the limiter
+        limiter = RateLimiter(100, window=60)
+        session = rate_limited(requests.Session(), limiter,
+                               max_retries=Retry(total=2, status_forcelist=[500]))
+        server.headers = {"Retry-After": "5"}
+        start = time.time()
+        assert session.get(server.url + "/position", timeout=5).status_code == 429
+        assert time.time() - start < 1
+
+        # waiting for the budget on the websocket loop is reported
+        errors = []
+
+        def on_loop():
+            try:
+                session.get(server.url + "/position", timeout=0.1)
+            except RateLimitTimeout as error:
+                errors.append(error)
+
+        with self.assertLogs("src", "WARNING") as logs:
+            WebsocketRuntime.shared().call_soon(on_loop)
+            for _ in range(50):
+                if errors:
+                    break
+                time.sleep(0.1)
+        assert len(errors) == 1
+        assert any("waits on the websocket loop" in line for line in logs.output)
+        server.shutdown()
+
+    def test_retry(self):
+        for attempt in range(10):
+            delay = min(60, 2 * 2 ** attempt)
+            assert delay / 2 <= backoff_delay(attempt) <= delay
+
+        calls = []
+
+        def attempt(func):
+            calls.append(time.time())
+            return func()
+
+        def flaky():
+            if len(calls) < 3:
+                raise RetryableError(ValueError("5xx"), backoff=False)
+            return "ok"
+        assert retry_with(attempt, flaky) == "ok"
+        assert len(calls) == 3
+
+        # no attempt is started when the backoff ends after the deadline
+        calls.clear()
+        def failing():
+            raise RetryableError(ValueError("5xx"))
+        with self.assertRaises(ValueError):
+            retry_with(attempt, failing, deadline=time.time() + 0.5)
+        assert len(calls) == 1
+
+    def test_retry_async(self):
+        calls = []
+
+        def attempt(func):
+            calls.append(threading.current_thread())
+            return func()
+
+        def flaky():
+            if len(calls) < 3:
+                raise RetryableError(ValueError("5xx"), backoff=False)
+            return "ok"
+        future = retry_async(attempt, flaky)
+        assert future.result(timeout=5) == "ok"
+        # attempts run on the runtime's thread pool
+        assert threading.current_thread() not in calls
+
+        # the caller does not wait for the backoff, cancel() stops the retries
+        calls.clear()
+        def failing():
+            raise RetryableError(ValueError("5xx"))
+        start = time.time()
+        future = retry_async(attempt, failing)
+        assert time.time() - start < 0.1
+        time.sleep(0.1)
+        future.cancel()
+        time.sleep(2.1)
+        assert len(calls) == 1
+        assert future.cancelled()
+
+        # a call hanging past its deadline fails
+        future = retry_async(attempt, lambda: time.sleep(1), deadline=time.time() + 0.2)
+        with self.assertRaises(TimeoutError):
+            future.result(timeout=5)
+
+    def test_heartbeat(self):
+        server = LocalServer()
+        heartbeat = Heartbeat({"websocket_heartbeat": server.url + "/ws", "listenkey_heartbeat": ""},
+                              interval=0.1, timeout=1, jitter=0.02)
+        heartbeat.beat("listenkey_heartbeat")
+        assert heartbeat.pings == 0
+
+        heartbeat.beat("websocket_heartbeat")
+        time.sleep(0.05)
+        assert server.requests == ["/ws"]
+        # no beats, no pings
+        time.sleep(0.3)
+        assert server.requests == ["/ws"]
+        heartbeat.beat("websocket_heartbeat")
+        time.sleep(0.2)
+        assert server.requests == ["/ws", "/ws"]
+        heartbeat.stop()
+        server.shutdown()
+
+        # a hanging endpoint never blocks the thread that beats
+        server = LocalServer(delay=1)
+        heartbeat = Heartbeat({"websocket_heartbeat": server.url + "/ws"}, interval=0.05, timeout=0.2, jitter=0)
+        start = time.time()
+        for _ in range(1000):
+            heartbeat.beat("websocket_heartbeat")
+        assert time.time() - start < 0.1
+        time.sleep(0.5)
+        assert heartbeat.failures >= 1
+        heartbeat.stop()
+        server.shutdown()
+
+    def test_notifier(self):
+        server = LocalServer(delay=0.2)
+        notifier = Notifier(line_api_key="token", line_url=server.url + "/line", line_interval=0.3, max_pending=5)
+
+        notifier.send("message 0")
+        assert notifier.flush(timeout=5)
+        start = time.time()
+        for i in range(1, 20):
+            notifier.send(f"message {i}")
+        # callers never wait for the endpoint
+        assert time.time() - start < 0.1
+
+        assert notifier.flush(timeout=5)
+        channel = notifier.channels["line"]
+        assert channel["dropped"] == 14
+        assert channel["failed"] == 0
+        # the burst waits for the rate limit and is coalesced into one message
+        assert len(server.requests) == 2
+        assert b"message+0" in server.bodies[0]
+        assert b"14+notifications+dropped" in server.bodies[1]
+        assert all(f"message+{i}".encode() in server.bodies[1] for i in range(15, 20))
+        notifier.stop()
+        server.shutdown()
+
+        # an unreachable endpoint is only counted
+        notifier = Notifier(line_api_key="token", line_url="http://127.0.0.1:9/line", timeout=0.5)
+        notifier.send("lost")
+        assert notifier.flush(timeout=5)
+        assert notifier.channels["line"]["failed"] == 1
+        notifier.stop()
+
+        # flushed at exit
+        registered = atexit._ncallbacks()
+        notifier = Notifier(line_api_key="token", line_url=server.url + "/line")
+        assert atexit._ncallbacks() == registered + 1
+        atexit.unregister(notifier.flush)
+
+        # notify() creates one instance by account, for the webhook of the bot's account
+        created = []
+
+        def from_config(account):
+            time.sleep(0.05)
+            created.append(account)
+            return Notifier()
+        instances, Notifier.instances = Notifier.instances, {}
+        original = Notifier.__dict__["from_config"]
+        Notifier.from_config = from_config
+        try:
+            threads = [threading.Thread(target=notify, args=("message",), kwargs={"account": account})
+                       for account in ["account1", "account2"] * 3]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert sorted(created) == ["account1", "account2"]
+            assert sorted(Notifier.instances) == ["account1", "account2"]
+        finally:
+            Notifier.from_config = original
+            Notifier.instances = instances
+
+    def test_metrics_writer(self):
+        written = []
+        down = [True]
+
+        def write(records):
+            if down[0]:
+                raise ConnectionError("database unreachable")
+            written.extend(records)
+
+        spill_file = os.path.join(tempfile.mkdtemp(), "metrics.jsonl")
+        metrics = MetricsWriter(write, batch_size=10, flush_interval=0.05, max_buffer=50,
+                                max_retries=2, backoff=0.01, spill_file=spill_file)
+
+        start = time.time()
+        for i in range(25):
+            metrics.add({"time": datetime.datetime(2023, 1, 1, 0, i), "measurement": "margin", "fields": {"i": i}})
+        assert time.time() - start < 0.05
+
+        time.sleep(0.5)
+        assert written == [] and metrics.spilled == 25 and len(metrics) == 0
+        assert os.path.exists(spill_file)
+
+        # the spilled records are written back after the next successful write
+        down[0] = False
+        metrics.add({"time": datetime.datetime(2023, 1, 1, 1), "measurement": "margin", "fields": {"i": 25}})
+        time.sleep(0.3)
+        assert [record["fields"]["i"] for record in written] == [25] + list(range(25))
+        assert written[1]["time"] == "2023-01-01T00:00:00"
+        assert not os.path.exists(spill_file)
+
+        # a replay file left by a stopped process is written back with the records spilled since
+        with open(spill_file + ".replay", "w") as file:
+            file.write(json.dumps({"measurement": "margin", "fields": {"i": 26}}) + "\n")
+        with open(spill_file, "w") as file:
+            file.write(json.dumps({"measurement": "margin", "fields": {"i": 27}}) + "\n")
+        written.clear()
+        metrics.add({"measurement": "margin", "fields": {"i": 28}})
+        # flushed from here and from the worker, one at a time
+        threads = [threading.Thread(target=metrics.flush) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        time.sleep(0.1)
+        assert [record["fields"]["i"] for record in written] == [28, 26, 27]
+        assert not os.path.exists(spill_file) and not os.path.exists(spill_file + ".replay")
+
+        # bounded buffer
+        metrics.close()
+        for i in range(60):
+            metrics.add({"measurement": "margin", "fields": {"i": i}})
+        assert len(metrics) == 50 and metrics.dropped == 10
+
+    def test_strategy_executor(self):
+        executor = StrategyExecutor()
+        calls = []
+
+        def strategy(timeframe, candle):
+            time.sleep(0.1)
+            calls.append((timeframe, candle))
+
+        start = time.time()
+        executor.submit("1m", strategy, "1m", 1)
+        time.sleep(0.02)
+        # the strategy is busy with the first candle, these wait and the stale 1m candles are skipped
+        for candle in range(2, 6):
+            executor.submit("1m", strategy, "1m", candle)
+        executor.submit("1h", strategy, "1h", 1)
+        assert time.time() - start < 0.05
+
+        assert executor.join(timeout=5)
+        assert calls == [("1m", 1), ("1m", 5), ("1h", 1)]
+        metrics = executor.metrics()
+        assert metrics["executed"] == 3 and metrics["coalesced"] == 3 and metrics["pending"] == 0
+        assert 0.05 < metrics["max_lag"] < 0.5
+
+        # calls are run in order and never replaced
+        calls.clear()
+        executor.submit("1m", strategy, "1m", 6)
+        for candle in range(7, 10):
+            executor.call(strategy, "callback", candle)
+        assert executor.join(timeout=5)
+        assert calls == [("1m", 6), ("callback", 7), ("callback", 8), ("callback", 9)]
+
+        executor.stop()
+        executor.submit("1m", strategy, "1m", 10)
+        assert executor.join(timeout=1) and len(calls) == 4
+
+    def test_latency_histogram(self):
+        histogram = LatencyHistogram()
+        for ms in range(1, 1001):
+            histogram.record(ms * 1000000)
+        summary = histogram.summary()
+        assert summary["count"] == 1000 and summary["mean"] == 500.5 and summary["max"] == 1000
+        # buckets are at most 25% wide
+        for percent in [50, 90, 99]:
+            assert percent * 10 <= summary[f"p{percent}"] <= percent * 10 * 1.25
+        for ns in [0, 7, 8, 1000, 123456789, 2**40 + 1]:
+            bucket = LatencyHistogram.bucket(ns)
+            assert ns <= LatencyHistogram.upper_bound(bucket)
+            assert bucket == 0 or LatencyHistogram.upper_bound(bucket - 1) < ns
+
+    def test_latency_recorder(self):
+        recorder = LatencyRecorder()
+        assert not recorder.enabled and recorder.snapshot() == {}
+        start = recorder.now()
+        time.sleep(0.01)
+        recorder.record("strategy", start)
+        recorder.record_since("receive", time.time() * 1000 - 20)
+
+        recorder.start("order1")
+        time.sleep(0.01)
+        recorder.end("ack", "order1")
+        # recorded once per order
+        recorder.end("ack", "order1")
+        recorder.end("ack", "unknown")
+
+        snapshot = recorder.snapshot()
+        assert snapshot["strategy"]["count"] == 1 and snapshot["strategy"]["max"] >= 10
+        assert snapshot["receive"]["max"] >= 19
+        assert snapshot["ack"]["count"] == 1 and snapshot["ack"]["max"] >= 10
+
+        for i in range(recorder.max_pending + 1):
+            recorder.start(i)
+        assert len(recorder.pending) == recorder.max_pending and 0 not in recorder.pending
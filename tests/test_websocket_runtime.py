@@ -0,0 +1,130 @@
+# coding: UTF-8
+import asyncio
+import threading
+import time
+import unittest
+
+from websockets.asyncio.server import serve
+
+from src.exchange.websocket_runtime import WebsocketRuntime, WebSocketApp
+
+
+class LocalWebsocketServer:
+    """
+    websocket server on its own loop, answers "subscribe <topic>" with three "<topic> <i>" messages
+    and closes the connection on "drop"
+    """
+
+    def __init__(self):
+        self.received = []
+        self.headers = []
+        self.loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        async def handler(connection):
+            self.headers.append(connection.request.headers)
+            async for message in connection:
+                self.received.append(message)
+                if message == "drop":
+                    await connection.close()
+                elif message.startswith("subscribe "):
+                    for i in range(3):
+                        await connection.send(f"{message[len('subscribe '):]} {i}")
+
+        async def main():
+            self.server = await serve(handler, "127.0.0.1", 0)
+            self.url = f"ws://127.0.0.1:{self.server.sockets[0].getsockname()[1]}"
+            started.set()
+            await self.server.serve_forever()
+
+        thread = threading.Thread(target=self.loop.run_until_complete, args=(main(),))
+        thread.daemon = True
+        thread.start()
+        started.wait(5)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.server.close)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise Exception("waiting timeout")
+        time.sleep(0.01)
+
+
+class TestWebsocketRuntime(unittest.TestCase):
+
+    def test_many_connections_on_one_loop(self):
+        server = LocalWebsocketServer()
+        runtime = WebsocketRuntime()
+        threads = threading.active_count()
+        messages = {}
+        threads_seen = set()
+
+        def on_message(ws, message):
+            threads_seen.add(threading.current_thread())
+            messages.setdefault(ws.pair, []).append(message)
+
+        apps = []
+        for i in range(20):
+            pair = f"PAIR{i}"
+            app = WebSocketApp(server.url, on_message=on_message,
+                               on_open=lambda ws: ws.send(f"subscribe {ws.pair}"), runtime=runtime)
+            app.pair = pair
+            apps.append(app.start())
+
+        wait_for(lambda: all(len(messages.get(app.pair, [])) == 3 for app in apps))
+        assert messages["PAIR7"] == ["PAIR7 0", "PAIR7 1", "PAIR7 2"]
+        assert threads_seen == {runtime.thread}
+        # no thread per connection
+        assert threading.active_count() <= threads
+
+        for app in apps:
+            app.close()
+        wait_for(lambda: all(app.connection is None for app in apps))
+        runtime.stop()
+        server.stop()
+
+    def test_reconnect(self):
+        server = LocalWebsocketServer()
+        runtime = WebsocketRuntime()
+        urls = []
+        events = []
+
+        def url():
+            urls.append(server.url)
+            return server.url
+
+        app = WebSocketApp(url, header=lambda: [f"api-nonce: {len(urls)}"],
+                           on_open=lambda ws: (events.append("open"), ws.send("subscribe kline")),
+                           on_message=lambda ws, message: events.append(message),
+                           on_close=lambda ws: events.append("close"),
+                           reconnect_delay=0.05, ping_payload='{"op": "ping"}', ping_interval=0.1, runtime=runtime)
+        app.start()
+        wait_for(lambda: events.count("kline 2") == 1)
+        app.send("drop")
+        # reopened with a fresh url and header, subscriptions are sent again
+        wait_for(lambda: events.count("kline 2") == 2)
+        assert events == ["open", "kline 0", "kline 1", "kline 2", "close", "open", "kline 0", "kline 1", "kline 2"]
+        assert len(urls) == 2 and app.connections == 2
+        assert [h["api-nonce"] for h in server.headers] == ["1", "2"]
+
+        wait_for(lambda: '{"op": "ping"}' in server.received)
+        app.close()
+        wait_for(lambda: events[-1] == "close")
+        time.sleep(0.2)
+        assert app.connections == 2 and app.connection is None
+
+        runtime.stop()
+        server.stop()
+
+    def test_call_every(self):
+        runtime = WebsocketRuntime()
+        calls = []
+        job = runtime.call_every(0.05, lambda: calls.append(threading.current_thread()), delay=0, blocking=True)
+        wait_for(lambda: len(calls) >= 3)
+        job.cancel()
+        assert runtime.thread not in calls
+        runtime.stop()